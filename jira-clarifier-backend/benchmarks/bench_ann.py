@@ -0,0 +1,70 @@
+# bench_ann.py - Recall and latency of the embedded IVF index vs brute-force cosine
+#
+# Run with: python -m benchmarks.bench_ann [vectors] [queries]
+# Uses synthetic clustered 384-d vectors (all-MiniLM-L6-v2 sized).
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from jira_clarifier_backend.ann import IVFVectorIndex
+
+DIM = 384
+TOP_K = 10
+
+
+def clustered(n: int, seed: int, clusters: int = 200) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = np.random.default_rng(0).normal(size=(clusters, DIM))
+    vectors = centers[rng.integers(clusters, size=n)] + 1.0 * rng.normal(size=(n, DIM))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def timed(fn, queries):
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(fn(query))
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies) * 1e6
+
+
+def report(label: str, latencies: np.ndarray, recall: float):
+    print(f"{label:<28} p50 {np.percentile(latencies, 50):8.1f} µs   p99 {np.percentile(latencies, 99):8.1f} µs   recall@{TOP_K} {recall:.3f}")
+
+
+def main(n: int, n_queries: int):
+    vectors = clustered(n, seed=1)
+    queries = clustered(n_queries, seed=2)
+    ids = [f"t{i}" for i in range(n)]
+
+    def brute_force(query):
+        scores = vectors @ query
+        return {ids[i] for i in np.argpartition(-scores, TOP_K)[:TOP_K]}
+
+    truth, latencies = timed(brute_force, queries)
+    report("brute force (float32)", latencies, 1.0)
+
+    with tempfile.TemporaryDirectory() as path:
+        for use_int8 in (False, True):
+            index = IVFVectorIndex(f"{path}/{use_int8}", use_int8=use_int8, exact_below=0)
+            index.upsert([{"id": id_, "values": v} for id_, v in zip(ids, vectors)], namespace="org")
+            start = time.perf_counter()
+            index.compact()
+            print(f"built {'int8' if use_int8 else 'float32'} segment in {time.perf_counter() - start:.1f}s")
+
+            for nprobe in (4, 8, 16):
+                index.nprobe = nprobe
+                found, latencies = timed(
+                    lambda query: {m["id"] for m in index.query(query, TOP_K, namespace="org")}, queries
+                )
+                recall = np.mean([len(f & t) / TOP_K for f, t in zip(found, truth)])
+                report(f"IVF {'int8' if use_int8 else 'float32'} nprobe={nprobe}", latencies, recall)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    )
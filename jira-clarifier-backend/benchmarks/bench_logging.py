@@ -0,0 +1,77 @@
+# bench_logging.py - Request-path cost of logging: emoji print() vs queued JSON logging
+#
+# Run with: python -m benchmarks.bench_logging [iterations]
+# Replays the lines one routed, paid /clarify writes (routing decision,
+# Claude call, usage) and times them on the calling thread, once with the
+# old synchronous print()s and once through the queue handler, against a
+# fast sink and a stdout that stalls on each write like a backed-up pipe.
+import io
+import logging
+import sys
+import time
+
+from jira_clarifier_backend.logs import bind_log_context, sampled, setup_logging
+
+MODEL = "claude-sonnet-4-20250514"
+LICENSE_KEY = "JIRA-ABCD-EFGH-IJKL-MNOP"
+TITLE = "Fix login bug when SSO session expires"
+
+
+class SlowStream(io.TextIOBase):
+    """Discards writes after blocking for `delay` seconds each"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return len(text)
+
+
+class NullStream(io.TextIOBase):
+    def write(self, text):
+        return len(text)
+
+
+def print_request(stream):
+    print(f"🔀 Routed '{TITLE[:40]}' to strong ({MODEL}), complexity 3: long description, bug", file=stream)
+    print(f"⏱️  {MODEL}: {3214}ms, {320} in (+{1400} cached) / {410} out", file=stream)
+    print(f"📊 Usage: {17}/{500} for {LICENSE_KEY}", file=stream)
+
+
+def log_request(logger, sample_rate):
+    if sampled(sample_rate):
+        logger.info("Routed ticket", extra={"tier": "strong", "model": MODEL, "complexity": 3, "reasons": ["long description", "bug"]})
+    if sampled(sample_rate):
+        logger.info("Claude call", extra={"model": MODEL, "latencyMs": 3214, "inputTokens": 320, "cachedTokens": 1400, "outputTokens": 410})
+    if sampled(sample_rate):
+        logger.info("Usage reserved", extra={"used": 17, "limit": 500})
+
+
+def per_request_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main(iterations: int):
+    logger = logging.getLogger("bench")
+    bind_log_context(requestId="0" * 32, key="JIRA-ABCD…")
+    sinks = (("fast sink", NullStream, iterations), ("stalled stdout", lambda: SlowStream(0.0002), max(iterations // 20, 50)))
+
+    for label, make_stream, count in sinks:
+        stream = make_stream()
+        before = per_request_us(lambda: print_request(stream), count)
+
+        results = []
+        for sample_rate in (1.0, 0.1):
+            listener = setup_logging("INFO", "json", queue_size=count * 3 + 1, stream=make_stream())
+            results.append(per_request_us(lambda: log_request(logger, sample_rate), count))
+            listener.stop()
+
+        print(f"{label:15s}  print() {before:8.2f} µs   queued JSON {results[0]:6.2f} µs   sampled 10% {results[1]:6.2f} µs   ({count} requests)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,58 @@
+# bench_metrics.py - Per-request overhead of the /clarify metrics instrumentation
+#
+# Run with: python -m benchmarks.bench_metrics [iterations]
+# Replays the metric calls one uncached /clarify makes (every stage timer,
+# token counters, cache lookup, request histogram) against a fresh registry.
+import sys
+import time
+
+from jira_clarifier_backend.metrics import Registry
+
+BUDGET_US = 50.0
+MODEL = "claude-sonnet-4-20250514"
+TOKENS = {"input_tokens": 320, "output_tokens": 410, "cache_read_input_tokens": 1400, "cache_creation_input_tokens": 0}
+
+
+def instrumented_request(stage_seconds, request_seconds, claude_tokens, cache_lookups):
+    start = time.perf_counter()
+    cache_lookups.inc("miss")
+    for stage in ("usage", "rag", "prompt_build", "parse", "analytics_write"):
+        with stage_seconds.time(stage):
+            pass
+    stage_seconds.observe(0.4, "llm_first_token")
+    stage_seconds.observe(3.2, "llm")
+    for kind, count in TOKENS.items():
+        if count:
+            claude_tokens.inc(MODEL, kind.removesuffix("_tokens"), amount=count)
+    request_seconds.observe(time.perf_counter() - start, "clarify")
+
+
+def main(iterations: int):
+    registry = Registry()
+    metrics = (
+        registry.histogram("clarify_stage_seconds", "stages", ["stage"]),
+        registry.histogram("clarify_request_seconds", "requests", ["endpoint"]),
+        registry.counter("claude_tokens_total", "tokens", ["model", "kind"]),
+        registry.counter("clarify_cache_lookups_total", "lookups", ["result"])
+    )
+    for _ in range(1000):
+        instrumented_request(*metrics)
+
+    samples = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            instrumented_request(*metrics)
+        samples.append((time.perf_counter() - start) / iterations * 1e6)
+
+    best, worst = min(samples), max(samples)
+    print(f"instrumentation per request  best {best:6.2f} µs   worst {worst:6.2f} µs  ({iterations} requests x 5)")
+
+    start = time.perf_counter()
+    registry.render()
+    print(f"/metrics render              {(time.perf_counter() - start) * 1e3:6.2f} ms")
+    print(f"budget {BUDGET_US:.0f} µs/request: {'OK' if worst < BUDGET_US else 'OVER'}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,56 @@
+# bench_ratelimit.py - Per-request overhead of the rate limiter
+#
+# Run with: python -m benchmarks.bench_ratelimit [iterations]
+# Uses REDIS_URL when reachable, otherwise fakeredis if installed.
+import asyncio
+import os
+import sys
+import time
+
+import redis.asyncio
+
+from jira_clarifier_backend.ratelimit import RateLimiter
+
+
+async def bench(label: str, limiter: RateLimiter, iterations: int):
+    limits = [("key:bench", 10**9), ("ip:127.0.0.1", 10**9)]
+    for _ in range(100):
+        await limiter.hit(limits)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await limiter.hit(limits)
+    elapsed = time.perf_counter() - start
+
+    print(f"{label:<28} {elapsed / iterations * 1e6:8.1f} µs/request  ({iterations} requests)")
+
+
+async def redis_client():
+    url = os.getenv("REDIS_URL", "redis://localhost:6379")
+    client = redis.asyncio.from_url(url, decode_responses=True)
+    try:
+        await client.ping()
+        return "redis (" + url + ")", client
+    except Exception:
+        await client.aclose()
+
+    try:
+        import fakeredis
+        return "fakeredis (in-process)", fakeredis.FakeAsyncRedis(decode_responses=True)
+    except ImportError:
+        return None, None
+
+
+async def main(iterations: int):
+    await bench("local token bucket", RateLimiter(None), iterations)
+
+    label, client = await redis_client()
+    if client is None:
+        print("redis: unavailable, skipped")
+        return
+    await bench(label, RateLimiter(client), iterations)
+    await client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000))
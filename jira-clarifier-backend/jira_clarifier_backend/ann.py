@@ -0,0 +1,339 @@
+# ann.py - Embedded IVF vector index on memory-mapped NumPy files (Pinecone-free RAG backend)
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def quantize(vectors: np.ndarray):
+    """Symmetric per-vector int8 quantization: vector ≈ codes * scale"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means (Lloyd's) on at most 256 samples per list"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > nlist * 256:
+        vectors = vectors[rng.choice(len(vectors), nlist * 256, replace=False)]
+
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for list_no in range(nlist):
+            members = vectors[assignment == list_no]
+            if len(members):
+                centroids[list_no] = members.sum(axis=0)
+        centroids = normalize(centroids)
+    return centroids.astype(np.float32)
+
+
+class Segment:
+    """
+    Immutable, compacted part of the index (one generation directory)
+
+    Rows are sorted by inverted list, so each list is a contiguous slice
+    [offsets[i], offsets[i + 1]) of the memory-mapped vector file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.centroids = np.load(path / "centroids.npy")
+        self.offsets = np.load(path / "offsets.npy")
+        self.vectors = np.load(path / "vectors.npy", mmap_mode="r")
+        self.scales = np.load(path / "scales.npy") if (path / "scales.npy").exists() else None
+        self.namespace_codes = np.load(path / "namespaces.npy")
+
+        records = json.loads((path / "records.json").read_text())
+        self.ids: List[str] = records["ids"]
+        self.metadata: List[Dict[str, Any]] = records["metadata"]
+        self.namespaces: Dict[str, int] = {name: code for code, name in enumerate(records["namespaces"])}
+        self.row_of = {id_: row for row, id_ in enumerate(self.ids)}
+        self.rows_by_namespace = {
+            code: np.flatnonzero(self.namespace_codes == code) for code in self.namespaces.values()
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def score(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        scores = vectors @ query
+        return scores * self.scales[rows] if self.scales is not None else scores
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        return vectors * self.scales[rows, None] if self.scales is not None else vectors
+
+    @staticmethod
+    def write(path: Path, vectors: np.ndarray, ids: List[str], namespaces: List[str],
+              metadata: List[Dict[str, Any]], nlist: int, use_int8: bool):
+        nlist = max(1, min(nlist, len(vectors)))
+        centroids = train_centroids(vectors, nlist)
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+
+        names = sorted(set(namespaces))
+        codes = {name: code for code, name in enumerate(names)}
+
+        path.mkdir(parents=True)
+        np.save(path / "centroids.npy", centroids)
+        np.save(path / "offsets.npy", offsets)
+        np.save(path / "namespaces.npy", np.array([codes[namespaces[i]] for i in order], dtype=np.int32))
+        if use_int8:
+            vector_codes, scales = quantize(vectors[order])
+            np.save(path / "vectors.npy", vector_codes)
+            np.save(path / "scales.npy", scales)
+        else:
+            np.save(path / "vectors.npy", vectors[order].astype(np.float32))
+        (path / "records.json").write_text(json.dumps({
+            "ids": [ids[i] for i in order],
+            "metadata": [metadata[i] for i in order],
+            "namespaces": names
+        }))
+
+
+class IVFVectorIndex:
+    """
+    In-process approximate nearest-neighbour index with the VectorStore interface
+
+    Vectors live in an inverted-file (IVF) segment: a query scores the
+    k-means centroids, then only the `nprobe` closest lists. Segment vectors
+    are int8 (or float32) in a memory-mapped .npy file. Namespaces (orgs)
+    small enough to scan are searched exactly instead.
+
+    Upserts go to an in-memory buffer, appended to pending.jsonl so they
+    survive restarts, and are searched by brute force. `compact` merges the
+    buffer into a new segment generation and atomically switches CURRENT.
+
+    Several processes (uvicorn workers, the ingest CLI) may share a
+    directory: appends and switches hold an flock on .lock and first
+    re-read CURRENT and pending.jsonl, and only one process compacts at a
+    time (.compact.lock). Other processes' writes become visible on their
+    next upsert, `refresh` or `maybe_compact`.
+    """
+
+    def __init__(self, path, nprobe: int = 8, use_int8: bool = True, exact_below: int = 2048, compact_after: int = 1000):
+        self.path = Path(path)
+        self.nprobe = nprobe
+        self.use_int8 = use_int8
+        self.exact_below = exact_below
+        self.compact_after = compact_after
+
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._segment: Optional[Segment] = None
+        self._deleted = np.zeros(0, dtype=bool)
+        self._pending: List[Dict[str, Any]] = []
+        self._pending_offset = 0  # bytes of pending.jsonl already buffered
+        self._seq = 0
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.refresh()
+
+    def __len__(self) -> int:
+        with self._lock:
+            live = len(self._segment) - int(self._deleted.sum()) if self._segment else 0
+            return live + len(self._pending)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    @contextmanager
+    def _locked(self, name: str = ".lock"):
+        """Exclusive flock on the index directory, shared with other processes"""
+        with (self.path / name).open("w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def refresh(self):
+        """Pick up upserts and compactions made by other processes"""
+        with self._locked(), self._lock:
+            self._sync()
+
+    def _sync(self):
+        """Catch up with CURRENT and pending.jsonl on disk (caller holds .lock and _lock)"""
+        current = self.path / "CURRENT"
+        name = current.read_text().strip() if current.exists() else None
+        if name != (self._segment.path.name if self._segment else None):
+            # Compacted elsewhere: pending.jsonl was rewritten to what that merge left out
+            self._segment = Segment(self.path / name)
+            self._deleted = np.zeros(len(self._segment), dtype=bool)
+            self._pending = []
+            self._pending_offset = 0
+
+        pending_log = self.path / "pending.jsonl"
+        if not pending_log.exists():
+            return
+        with pending_log.open("rb") as f:
+            f.seek(self._pending_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        self._pending_offset += end
+        entries = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        if entries:
+            self._add_pending(entries)
+
+    def _add_pending(self, entries: List[Dict[str, Any]]):
+        """Buffer entries, replacing any with the same id (caller holds _lock)"""
+        replaced = {entry["id"] for entry in entries}
+        pending = [entry for entry in self._pending if entry["id"] not in replaced]
+        for entry in entries:
+            self._seq += 1
+            pending.append({**entry, "seq": self._seq, "values": normalize(np.asarray(entry["values"], dtype=np.float32))})
+            row = self._segment.row_of.get(entry["id"]) if self._segment else None
+            if row is not None:
+                self._deleted[row] = True
+        # Readers take the list reference without copying, so never mutate it in place
+        self._pending = pending
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str):
+        entries = [
+            {
+                "id": vector["id"],
+                "namespace": namespace,
+                "values": [float(x) for x in vector["values"]],
+                "metadata": vector.get("metadata") or {}
+            }
+            for vector in vectors
+        ]
+        with self._locked(), self._lock:
+            with (self.path / "pending.jsonl").open("a") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+            self._sync()  # buffers these entries along with any other process's
+
+    def query(self, vector: List[float], top_k: int, namespace: str) -> List[Dict[str, Any]]:
+        query = normalize(np.asarray(vector, dtype=np.float32))
+        with self._lock:
+            segment, deleted, pending = self._segment, self._deleted, self._pending
+
+        candidates = []
+        code = segment.namespaces.get(namespace) if segment else None
+        if code is not None:
+            rows = segment.rows_by_namespace[code]
+            if len(rows) > self.exact_below:
+                probe = np.argsort(-(segment.centroids @ query))[:self.nprobe]
+                rows = np.concatenate([np.arange(segment.offsets[i], segment.offsets[i + 1]) for i in probe])
+                rows = rows[segment.namespace_codes[rows] == code]
+            rows = rows[~deleted[rows]]
+
+            if len(rows):
+                scores = segment.score(rows, query)
+                best = np.argpartition(-scores, top_k - 1)[:top_k] if len(rows) > top_k else np.arange(len(rows))
+                candidates += [
+                    {"id": segment.ids[rows[i]], "score": float(scores[i]), "metadata": segment.metadata[rows[i]]}
+                    for i in best
+                ]
+
+        candidates += [
+            {"id": entry["id"], "score": float(entry["values"] @ query), "metadata": entry["metadata"]}
+            for entry in pending
+            if entry["namespace"] == namespace
+        ]
+
+        candidates.sort(key=lambda match: match["score"], reverse=True)
+        return candidates[:top_k]
+
+    def compact(self) -> bool:
+        """Merge pending vectors into a new segment generation; False if there was nothing to merge"""
+        with self._compact_lock, self._locked(".compact.lock"):
+            with self._locked(), self._lock:
+                self._sync()
+                segment, deleted, pending = self._segment, self._deleted.copy(), list(self._pending)
+            if not pending and not deleted.any():
+                return False
+
+            vectors, ids, namespaces, metadata = [], [], [], []
+            if segment:
+                names = {code: name for name, code in segment.namespaces.items()}
+                live = np.flatnonzero(~deleted)
+                vectors.append(segment.decode(live))
+                ids += [segment.ids[row] for row in live]
+                namespaces += [names[segment.namespace_codes[row]] for row in live]
+                metadata += [segment.metadata[row] for row in live]
+            if pending:
+                vectors.append(np.stack([entry["values"] for entry in pending]))
+                ids += [entry["id"] for entry in pending]
+                namespaces += [entry["namespace"] for entry in pending]
+                metadata += [entry["metadata"] for entry in pending]
+
+            vectors = normalize(np.concatenate(vectors))
+            generation = int(segment.path.name.split("-")[1]) + 1 if segment else 1
+            new_path = self.path / f"gen-{generation:06d}"
+            if new_path.exists():
+                shutil.rmtree(new_path)  # left by a crashed compaction; never CURRENT
+            Segment.write(new_path, vectors, ids, namespaces, metadata,
+                          nlist=int(np.sqrt(len(vectors))), use_int8=self.use_int8)
+            new_segment = Segment(new_path)
+
+            with self._locked(), self._lock:
+                # CURRENT can't have moved (we hold .compact.lock); upserts from
+                # any process that arrived during compaction stay pending
+                self._sync()
+                merged_seq = max((entry["seq"] for entry in pending), default=0)
+                remaining = [entry for entry in self._pending if entry["seq"] > merged_seq]
+                pending_log = "".join(
+                    json.dumps({
+                        "id": entry["id"],
+                        "namespace": entry["namespace"],
+                        "values": entry["values"].tolist(),
+                        "metadata": entry["metadata"]
+                    }) + "\n"
+                    for entry in remaining
+                )
+                self._replace_file("CURRENT", new_path.name)
+                self._replace_file("pending.jsonl", pending_log)
+                self._pending_offset = len(pending_log.encode())
+                self._segment = new_segment
+                self._deleted = np.zeros(len(new_segment), dtype=bool)
+                self._pending = remaining
+                for entry in remaining:
+                    row = new_segment.row_of.get(entry["id"])
+                    if row is not None:
+                        self._deleted[row] = True
+
+            if segment:
+                # Processes still on the old generation keep their mmap (unlinked files stay
+                # readable) and switch to the new CURRENT on their next sync
+                shutil.rmtree(segment.path, ignore_errors=True)
+            logger.info("Vector index compacted", extra={"vectors": len(new_segment), "segment": new_path.name})
+            return True
+
+    def maybe_compact(self) -> bool:
+        self.refresh()
+        if len(self._pending) < self.compact_after:
+            return False
+        return self.compact()
+
+    def _replace_file(self, name: str, content: str):
+        tmp = self.path / (name + ".tmp")
+        tmp.write_text(content)
+        os.replace(tmp, self.path / name)
+
+    async def run_forever(self, interval: float = 300.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.maybe_compact)
+            except Exception as e:
+                logger.warning("Vector index compaction failed", extra={"error": str(e)})
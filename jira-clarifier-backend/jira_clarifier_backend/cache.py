@@ -0,0 +1,199 @@
+# cache.py - Two-tier caches (in-process LRU + Redis)
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(value: Optional[str]) -> str:
+    """Collapse whitespace so cosmetic edits don't change a cache key"""
+    return " ".join((value or "").split())
+
+
+def content_hash(*parts: Optional[str]) -> str:
+    """SHA-256 over normalized parts, separated so ("ab", "c") != ("a", "bc")"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(normalize_text(part).encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class TTLCache:
+    """In-process LRU cache whose entries expire after `ttl` seconds"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (self._clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ClarificationCache:
+    """
+    Clarification results keyed by content hash
+
+    Reads check the in-process LRU first, then Redis (shared by all workers).
+    Redis failures degrade to the local tier instead of failing the request.
+    """
+
+    def __init__(self, local: TTLCache, redis=None, ttl: int = 86400, prefix: str = "clarify:"):
+        self.local = local
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Return (value, tier) where tier is "memory", "redis" or None on a miss"""
+        value = self.local.get(key)
+        if value is not None:
+            return value, "memory"
+
+        if self.redis is None:
+            return None, None
+
+        try:
+            raw = await self.redis.get(self.prefix + key)
+        except Exception as e:
+            logger.warning("Cache read error", extra={"error": str(e)})
+            return None, None
+
+        if raw is None:
+            return None, None
+
+        value = json.loads(raw)
+        self.local.set(key, value)
+        return value, "redis"
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        self.local.set(key, value)
+
+        if self.redis is None:
+            return
+
+        try:
+            await self.redis.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        except Exception as e:
+            logger.warning("Cache write error", extra={"error": str(e)})
+
+    async def delete(self, key: str):
+        self.local.delete(key)
+
+        if self.redis is None:
+            return
+
+        try:
+            await self.redis.delete(self.prefix + key)
+        except Exception as e:
+            logger.warning("Cache delete error", extra={"error": str(e)})
+
+
+# Channel on which every worker hears about changed license keys
+LICENSE_INVALIDATION_CHANNEL = "license:invalidate"
+LICENSE_CACHE_PREFIX = "license:key:"
+
+
+class LicenseKeyCache(ClarificationCache):
+    """
+    Validated license key records, shared by all workers
+
+    Entries live briefly in both tiers. When a key changes (Stripe webhook,
+    monthly reset) its Redis entry is deleted and the key code is published
+    on LICENSE_INVALIDATION_CHANNEL; `listen` drops it from this worker's
+    local tier.
+    """
+
+    def __init__(self, local: TTLCache, redis=None, ttl: int = 60, prefix: str = LICENSE_CACHE_PREFIX):
+        super().__init__(local, redis=redis, ttl=ttl, prefix=prefix)
+        try:
+            self._loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+
+    async def invalidate(self, key_codes: Iterable[str]):
+        key_codes = list(key_codes)
+        for key_code in key_codes:
+            await self.delete(key_code)
+
+        if self.redis is None or not key_codes:
+            return
+
+        try:
+            await self.redis.publish(LICENSE_INVALIDATION_CHANNEL, json.dumps(key_codes))
+        except Exception as e:
+            logger.warning("Cache invalidation publish error", extra={"error": str(e)})
+
+    def handle_invalidation(self, data: str):
+        for key_code in json.loads(data):
+            self.local.delete(key_code)
+
+    def discard_threadsafe(self, key_codes: Iterable[str]):
+        """
+        Drop key codes from the local tier from any thread
+
+        The local tier isn't thread-safe, so calls from outside the loop
+        that created this cache (webhook worker threads) are handed to it.
+        """
+        data = json.dumps(list(key_codes))
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+
+        if self._loop is None or on_loop:
+            self.handle_invalidation(data)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self.handle_invalidation, data)
+        except RuntimeError:  # loop closed
+            pass
+
+    async def listen(self, retry_delay: float = 1.0):
+        """Apply invalidations published by any worker until cancelled"""
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(LICENSE_INVALIDATION_CHANNEL)
+                    # Anything published while we weren't subscribed is lost
+                    self.local.clear()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.handle_invalidation(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("License cache listener error, resubscribing", extra={"error": str(e)})
+                await asyncio.sleep(retry_delay)
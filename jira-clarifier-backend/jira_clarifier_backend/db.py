@@ -0,0 +1,165 @@
+# db.py - Pooled PostgreSQL connections for Jira Clarifier
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+
+from jira_clarifier_backend.tracing import sql_attributes, trace_span
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection frees up within the checkout timeout"""
+
+
+class TracedCursor(RealDictCursor):
+    """RealDictCursor that runs every statement in a tracing span"""
+
+    def execute(self, query, vars=None):
+        attributes = sql_attributes(query)
+        with trace_span(f"db {attributes['db.operation']}", "client", attributes):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        attributes = sql_attributes(query)
+        with trace_span(f"db {attributes['db.operation']}", "client", attributes):
+            return super().executemany(query, vars_list)
+
+
+def open_connection(dsn: Optional[str]):
+    """Open a traced PostgreSQL connection returning dict rows"""
+    with trace_span("db connect", "client", {"db.system": "postgresql"}):
+        return psycopg2.connect(dsn, cursor_factory=TracedCursor)
+
+
+class ConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool
+
+    Connections are opened once and reused, so requests skip the TCP/TLS
+    handshake to Postgres. Blocking DB work is expected to run in worker
+    threads (sync FastAPI endpoints or asyncio.to_thread), never directly
+    on the event loop. `on_wait`, if given, is called with every checkout's
+    wait in seconds and whether it timed out (for metrics).
+    """
+
+    def __init__(
+        self,
+        dsn: Optional[str],
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 5.0,
+        connect: Optional[Callable[[], Any]] = None,
+        on_wait: Optional[Callable[[float, bool], None]] = None
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._connect = connect or (lambda: open_connection(dsn))
+        self._on_wait = on_wait
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle: List[Any] = []
+        self._in_use = 0
+        self._closed = False
+
+        # Metrics
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        for _ in range(min_size):
+            self._idle.append(self._connect())
+
+    def getconn(self):
+        """Check out a connection, waiting up to `timeout` seconds for a free slot"""
+        if self._closed:
+            raise PoolTimeout("Connection pool is closed")
+
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            if self._on_wait:
+                self._on_wait(time.monotonic() - start, True)
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        waited = time.monotonic() - start
+
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        if self._on_wait:
+            self._on_wait(waited, False)
+
+        if conn is None or conn.closed:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._release_slot()
+                raise
+
+        return conn
+
+    def putconn(self, conn, discard: bool = False):
+        """Return a connection to the pool, rolling back any open transaction"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._lock:
+            keep = not discard and not conn.closed and not self._closed
+            if keep:
+                self._idle.append(conn)
+
+        if not keep and not conn.closed:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+        self._release_slot()
+
+    def closeall(self):
+        """Close all idle connections and refuse further checkouts"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of pool size and checkout wait metrics"""
+        with self._lock:
+            return {
+                "minSize": self.min_size,
+                "maxSize": self.max_size,
+                "inUse": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "waitTotalSeconds": self._wait_total,
+                "waitAvgSeconds": self._wait_total / self._checkouts if self._checkouts else 0.0,
+                "waitMaxSeconds": self._wait_max
+            }
+
+    def _release_slot(self):
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
@@ -0,0 +1,191 @@
+# embedding_cache.py - Persistent float16 embedding cache keyed by ticket text hash
+import fcntl
+import json
+import logging
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from jira_clarifier_backend.cache import content_hash
+
+logger = logging.getLogger(__name__)
+
+DIGEST_BYTES = 32  # SHA-256
+
+
+class EmbeddingCache:
+    """
+    Disk-backed LRU cache of text embeddings with an in-memory LRU front
+
+    Entries are keyed by SHA-256 of the model name and normalized ticket
+    text. Storage is three memory-mapped arrays with one row per slot:
+    vectors.npy (float16), keys.npy (the digest that owns the slot) and
+    ticks.npy (last use, for LRU eviction across restarts). The key→slot
+    offset index is rebuilt from keys.npy on open.
+
+    Reads hold a shared file lock and check keys.npy, so a slot that
+    another process reused is a miss rather than a wrong vector, and no
+    slot is rewritten mid-copy. Writes hold the lock exclusively and pick
+    slots from keys.npy and ticks.npy themselves (free first, then least
+    recently used), so processes sharing the cache never hand out the
+    same slot.
+    """
+
+    def __init__(self, path, model_name: str, capacity: int = 100_000, memory_entries: int = 2048):
+        self.path = Path(path) / model_name.replace("/", "_")
+        self.model_name = model_name
+        self.capacity = capacity
+        self.memory_entries = memory_entries
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._slots: "OrderedDict[bytes, int]" = OrderedDict()  # this process's view of keys.npy
+        self._tick = 0
+        self._vectors = self._keys = self._ticks = None
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        meta_path = self.path / "meta.json"
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            if meta == {"model": model_name, "capacity": capacity, "dim": meta.get("dim")}:
+                self._open(meta["dim"])
+            else:
+                logger.warning("Embedding cache settings changed, rebuilding", extra={"path": str(self.path)})
+                shutil.rmtree(self.path)
+                self.path.mkdir(parents=True)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def key(self, text: str) -> bytes:
+        return bytes.fromhex(content_hash(self.model_name, text))
+
+    def _open(self, dim: int):
+        self._vectors = np.load(self.path / "vectors.npy", mmap_mode="r+")
+        self._keys = np.load(self.path / "keys.npy", mmap_mode="r+")
+        self._ticks = np.load(self.path / "ticks.npy", mmap_mode="r+")
+
+        used = np.flatnonzero(self._keys.any(axis=1))
+        for slot in used[np.argsort(self._ticks[used], kind="stable")]:
+            self._slots[self._keys[slot].tobytes()] = int(slot)
+        self._tick = int(self._ticks.max()) if len(used) else 0
+
+    def _create(self, dim: int):
+        open_memmap = np.lib.format.open_memmap
+        open_memmap(self.path / "vectors.npy", mode="w+", dtype=np.float16, shape=(self.capacity, dim)).flush()
+        open_memmap(self.path / "keys.npy", mode="w+", dtype=np.uint8, shape=(self.capacity, DIGEST_BYTES)).flush()
+        open_memmap(self.path / "ticks.npy", mode="w+", dtype=np.int64, shape=(self.capacity,)).flush()
+        (self.path / "meta.json").write_text(json.dumps({"model": self.model_name, "capacity": self.capacity, "dim": dim}))
+        self._open(dim)
+
+    def _allocate(self, count: int, exclude: List[int]) -> List[int]:
+        """Up to `count` slots to overwrite: empty ones, then least recently used (caller holds the file lock)"""
+        used = self._keys.any(axis=1)
+        free = np.flatnonzero(~used)
+        if len(free) >= count:
+            return free[:count].tolist()
+
+        taken = np.setdiff1d(np.flatnonzero(used), exclude)
+        lru = taken[np.argsort(self._ticks[taken], kind="stable")]
+        return free.tolist() + lru[:count - len(free)].tolist()
+
+    @contextmanager
+    def _file_lock(self, operation: int):
+        """flock on the cache directory: LOCK_SH to read slots, LOCK_EX to write them"""
+        with (self.path / ".lock").open("a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            yield
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """float32 vectors for cached texts, None for misses"""
+        results: List[Optional[np.ndarray]] = []
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            for text in texts:
+                key = self.key(text)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                else:
+                    slot = self._slots.get(key)
+                    if slot is not None and self._keys[slot].tobytes() == key:
+                        vector = np.asarray(self._vectors[slot], dtype=np.float32)
+                        self._remember(key, vector)
+                        self._slots.move_to_end(key)
+                        self._tick += 1
+                        self._ticks[slot] = self._tick
+                    elif slot is not None:
+                        del self._slots[key]  # reused by another process
+                results.append(vector)
+        return results
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        if not texts:
+            return
+
+        # Last write wins for repeated texts, and at most `capacity` of them fit
+        entries = list(dict(zip(map(self.key, texts), vectors)).items())[-self.capacity:]
+
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            if self._vectors is None:
+                meta_path = self.path / "meta.json"
+                if meta_path.exists():  # created by another process
+                    self._open(json.loads(meta_path.read_text())["dim"])
+                else:
+                    self._create(len(entries[0][1]))
+
+            # Keys already in a slot keep it; the rest get slots chosen from the shared files
+            owned = {}
+            for key, _ in entries:
+                slot = self._slots.get(key)
+                if slot is not None and self._keys[slot].tobytes() == key:
+                    owned[key] = slot
+            new_slots = iter(self._allocate(len(entries) - len(owned), list(owned.values())))
+            self._tick = max(self._tick, int(self._ticks.max()))
+
+            for key, values in entries:
+                slot = owned[key] if key in owned else next(new_slots)
+                vector = np.asarray(values, dtype=np.float32)
+                self._remember(key, vector)
+                self._slots.pop(self._keys[slot].tobytes(), None)
+                self._slots.pop(key, None)
+
+                # Clear the owner first so a crash mid-write leaves a miss, never a mismatched vector
+                self._keys[slot] = 0
+                self._vectors[slot] = vector.astype(np.float16)
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self._tick += 1
+                self._ticks[slot] = self._tick
+                self._slots[key] = slot
+
+
+class CachedEmbedder:
+    """Embedder that only encodes texts missing from an EmbeddingCache"""
+
+    def __init__(self, embedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        cached = self.cache.get_many(texts)
+        misses = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+        if misses:
+            embedded = dict(zip(misses, self.embedder.embed(misses)))
+            self.cache.put_many(misses, [embedded[text] for text in misses])
+        else:
+            embedded = {}
+
+        return [
+            vector.tolist() if vector is not None else list(embedded[text])
+            for text, vector in zip(texts, cached)
+        ]
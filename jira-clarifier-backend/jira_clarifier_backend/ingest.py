@@ -0,0 +1,366 @@
+# ingest.py - Batched, resumable embedding ingest into the RAG vector store
+#
+# Usage:
+#   python -m jira_clarifier_backend.ingest jsonl jira_clarify_50.jsonl --namespace seed
+#   python -m jira_clarifier_backend.ingest tickets --backend local --workers 4
+#   python -m jira_clarifier_backend.ingest feedback --backend pinecone
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from jira_clarifier_backend.cache import content_hash
+from jira_clarifier_backend.embedding_cache import EmbeddingCache
+from jira_clarifier_backend.rag import DEFAULT_EMBEDDING_MODEL, SentenceTransformerEmbedder, ticket_text
+
+
+class IngestRecord(NamedTuple):
+    id: str
+    namespace: str
+    text: str
+    metadata: Dict[str, Any]
+
+    @property
+    def digest(self) -> str:
+        return content_hash(self.namespace, self.text)
+
+
+class IngestStats(NamedTuple):
+    read: int
+    skipped: int
+    upserted: int
+    failed: int
+    elapsed: float
+
+    @property
+    def rate(self) -> float:
+        """Tickets embedded and upserted per second"""
+        return self.upserted / self.elapsed if self.elapsed else 0.0
+
+
+# ============================================================================
+# Sources
+# ============================================================================
+
+def iter_jsonl(path: str, namespace: str = "") -> Iterator[IngestRecord]:
+    """Stream tickets from a JSONL file (raw_title/raw_description, or title/description)"""
+    with open(path) as f:
+        for line_no, line in enumerate(f):
+            if not line.strip():
+                continue
+            ticket = json.loads(line)
+            # ticket-<n> matches the ids the old pinecone_training.py script wrote
+            title = ticket.get("raw_title", ticket.get("title", ""))
+            description = ticket.get("raw_description", ticket.get("description", ""))
+            yield IngestRecord(
+                id=str(ticket.get("id", f"ticket-{line_no}")),
+                namespace=ticket.get("orgId", namespace),
+                text=ticket_text(title, description),
+                metadata={"title": title, "desc": description}
+            )
+
+
+TABLE_QUERIES = {
+    "tickets": "SELECT org_id, ticket_title, ticket_description FROM tickets WHERE org_id IS NOT NULL ORDER BY id",
+    "feedback": (
+        "SELECT org_id, ticket_title, ticket_description FROM feedback "
+        "WHERE org_id IS NOT NULL AND feedback_type = 'upvote' ORDER BY id"
+    )
+}
+
+
+def iter_table(dsn: str, table: str, fetch_size: int = 1000) -> Iterator[IngestRecord]:
+    """
+    Stream rows from the tickets or feedback table through a server-side cursor
+
+    Ids are the same content hash `index_tickets` uses for live upserts, so a
+    backfill and the running API never index a ticket twice.
+    """
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    conn = psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+    try:
+        with conn.cursor(name=f"ingest_{table}") as cur:
+            cur.itersize = fetch_size
+            cur.execute(TABLE_QUERIES[table])
+            for row in cur:
+                title, description = row["ticket_title"] or "", row["ticket_description"] or ""
+                text = ticket_text(title, description)
+                yield IngestRecord(
+                    id=content_hash(row["org_id"], text),
+                    namespace=row["org_id"],
+                    text=text,
+                    metadata={"title": title, "desc": description}
+                )
+    finally:
+        conn.close()
+
+
+# ============================================================================
+# Checkpointing
+# ============================================================================
+
+class Checkpoint:
+    """
+    Content hash of every record already upserted, appended to a JSONL file
+
+    A record is skipped when its id was upserted with the same hash, so a
+    restart resumes where it stopped and unchanged tickets are never
+    re-embedded.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = Path(path) if path else None
+        self.done: Dict[str, str] = {}
+        if self.path and self.path.exists():
+            with self.path.open() as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.done[entry["id"]] = entry["hash"]
+
+    def is_done(self, record: IngestRecord) -> bool:
+        return self.done.get(record.id) == record.digest
+
+    def mark(self, records: List[IngestRecord]):
+        for record in records:
+            self.done[record.id] = record.digest
+        if not self.path:
+            return
+        with self.path.open("a") as f:
+            for record in records:
+                f.write(json.dumps({"id": record.id, "hash": record.digest}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# ============================================================================
+# Embedding
+# ============================================================================
+
+_worker_embedder = None
+
+
+def _init_worker(factory: Callable[[], Any]):
+    global _worker_embedder
+    _worker_embedder = factory()
+
+
+def _embed_in_worker(texts: List[str]) -> List[List[float]]:
+    return _worker_embedder.embed(texts)
+
+
+def embed_batches(
+    batches: Iterable[List[IngestRecord]],
+    embedder_factory: Callable[[], Any],
+    workers: int = 0,
+    cache: Optional[EmbeddingCache] = None
+) -> Iterator[tuple]:
+    """
+    Yield (batch, vectors) in order
+
+    Texts already in the embedding cache are not re-encoded; the cache is
+    only touched from this process. With workers > 0 each process loads its
+    own model once and up to two batches per worker are in flight, so
+    memory stays bounded.
+    """
+    def split(batch):
+        texts = [record.text for record in batch]
+        cached = cache.get_many(texts) if cache is not None else [None] * len(texts)
+        return cached, [text for text, vector in zip(texts, cached) if vector is None]
+
+    def merge(batch, cached, misses, embedded):
+        if cache is not None and misses:
+            cache.put_many(misses, embedded)
+        fresh = iter(embedded)
+        return batch, [vector.tolist() if vector is not None else next(fresh) for vector in cached]
+
+    if workers <= 0:
+        embedder = embedder_factory()
+        for batch in batches:
+            cached, misses = split(batch)
+            yield merge(batch, cached, misses, embedder.embed(misses) if misses else [])
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(embedder_factory,)) as pool:
+        in_flight = []
+        for batch in batches:
+            cached, misses = split(batch)
+            in_flight.append((batch, cached, misses, pool.submit(_embed_in_worker, misses) if misses else None))
+            if len(in_flight) >= workers * 2:
+                done_batch, done_cached, done_misses, future = in_flight.pop(0)
+                yield merge(done_batch, done_cached, done_misses, future.result() if future else [])
+        for done_batch, done_cached, done_misses, future in in_flight:
+            yield merge(done_batch, done_cached, done_misses, future.result() if future else [])
+
+
+class ModelFactory:
+    """Picklable embedder factory for worker processes"""
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL):
+        self.model_name = model_name
+
+    def __call__(self):
+        return SentenceTransformerEmbedder(self.model_name)
+
+
+# ============================================================================
+# Upserting
+# ============================================================================
+
+def chunk_vectors(vectors: List[Dict[str, Any]], max_vectors: int = 100, max_bytes: int = 2 * 1024 * 1024):
+    """Split an upsert so no request exceeds max_vectors or ~max_bytes of JSON"""
+    chunk, size = [], 0
+    for vector in vectors:
+        vector_size = len(json.dumps(vector))
+        if chunk and (len(chunk) >= max_vectors or size + vector_size > max_bytes):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(vector)
+        size += vector_size
+    if chunk:
+        yield chunk
+
+
+def upsert_with_retry(store, vectors: List[Dict[str, Any]], namespace: str, attempts: int = 4, backoff: float = 0.5):
+    for attempt in range(attempts):
+        try:
+            store.upsert(vectors, namespace=namespace)
+            return
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"⚠️  Upsert of {len(vectors)} vectors failed ({e}), retrying in {delay:g}s")
+            time.sleep(delay)
+
+
+def ingest(
+    records: Iterable[IngestRecord],
+    store,
+    embedder_factory: Callable[[], Any],
+    checkpoint: Checkpoint,
+    batch_size: int = 64,
+    workers: int = 0,
+    max_vectors: int = 100,
+    progress_every: int = 1000,
+    cache: Optional[EmbeddingCache] = None
+) -> IngestStats:
+    """Embed records not yet in the checkpoint and upsert them in size-capped chunks"""
+    start = time.perf_counter()
+    counts = {"read": 0, "skipped": 0, "upserted": 0, "failed": 0}
+
+    def pending_batches():
+        batch = []
+        for record in records:
+            counts["read"] += 1
+            if checkpoint.is_done(record):
+                counts["skipped"] += 1
+                continue
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    next_report = progress_every
+    for batch, embeddings in embed_batches(pending_batches(), embedder_factory, workers, cache):
+        by_namespace: Dict[str, List[tuple]] = {}
+        for record, values in zip(batch, embeddings):
+            by_namespace.setdefault(record.namespace, []).append((record, values))
+
+        for namespace, items in by_namespace.items():
+            vectors = [{"id": record.id, "values": list(values), "metadata": record.metadata} for record, values in items]
+            records_by_id = {record.id: record for record, _ in items}
+            for chunk in chunk_vectors(vectors, max_vectors=max_vectors):
+                chunk_records = [records_by_id[vector["id"]] for vector in chunk]
+                try:
+                    upsert_with_retry(store, chunk, namespace)
+                except Exception as e:
+                    print(f"❌ Giving up on {len(chunk)} vectors in namespace '{namespace}': {e}")
+                    counts["failed"] += len(chunk)
+                    continue
+                checkpoint.mark(chunk_records)
+                counts["upserted"] += len(chunk)
+
+        if counts["upserted"] >= next_report:
+            elapsed = time.perf_counter() - start
+            print(f"📈 {counts['upserted']} upserted ({counts['upserted'] / elapsed:.1f} tickets/s)")
+            next_report += progress_every
+
+    return IngestStats(elapsed=time.perf_counter() - start, **counts)
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def open_store(backend: str, index_path: str):
+    if backend == "local":
+        from jira_clarifier_backend.ann import IVFVectorIndex
+        return IVFVectorIndex(index_path)
+
+    from pinecone import Pinecone
+    from jira_clarifier_backend.rag import PineconeVectorStore
+    return PineconeVectorStore(Pinecone(api_key=os.environ["PINECONE_API_KEY"]).Index("jira-vectors"))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Embed tickets into the RAG vector store")
+    parser.add_argument("source", choices=["jsonl", "tickets", "feedback"])
+    parser.add_argument("path", nargs="?", help="JSONL file (for the jsonl source)")
+    parser.add_argument("--namespace", default="", help="namespace for JSONL tickets without an orgId")
+    parser.add_argument("--backend", choices=["pinecone", "local"], default=os.getenv("RAG_BACKEND", "pinecone"))
+    parser.add_argument("--index-path", default=os.getenv("RAG_INDEX_PATH", "data/vector_index"))
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL))
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=0, help="embedding processes (0 = in-process)")
+    parser.add_argument("--max-vectors", type=int, default=100, help="vectors per upsert request")
+    parser.add_argument("--checkpoint", help="progress file (default: .ingest-<source>.jsonl)")
+    parser.add_argument("--embedding-cache", default=os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache"),
+                        help="persistent embedding cache directory ('' to disable)")
+    parser.add_argument("--embedding-cache-size", type=int, default=int(os.getenv("EMBEDDING_CACHE_SIZE", "100000")))
+    args = parser.parse_args(argv)
+
+    if args.source == "jsonl":
+        if not args.path:
+            parser.error("the jsonl source needs a path")
+        records = iter_jsonl(args.path, args.namespace)
+    else:
+        records = iter_table(os.environ["DATABASE_URL"], args.source)
+
+    store = open_store(args.backend, args.index_path)
+    checkpoint = Checkpoint(args.checkpoint or f".ingest-{args.source}.jsonl")
+    cache = EmbeddingCache(args.embedding_cache, args.model, args.embedding_cache_size) if args.embedding_cache else None
+    stats = ingest(
+        records,
+        store,
+        ModelFactory(args.model),
+        checkpoint,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        max_vectors=args.max_vectors,
+        cache=cache
+    )
+
+    if args.backend == "local":
+        store.compact()
+
+    print(
+        f"✅ Read {stats.read}, skipped {stats.skipped} unchanged, upserted {stats.upserted}, "
+        f"failed {stats.failed} in {stats.elapsed:.1f}s ({stats.rate:.1f} tickets/s)"
+    )
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
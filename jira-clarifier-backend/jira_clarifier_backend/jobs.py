@@ -0,0 +1,318 @@
+# jobs.py - Offline bulk clarification through the Anthropic Message Batches API
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Protocol, Tuple
+
+from psycopg2.extras import execute_values
+
+from jira_clarifier_backend.structured import response_content
+
+logger = logging.getLogger(__name__)
+
+
+# (custom_id, tool input JSON / response text or None, error or None)
+BatchResult = Tuple[str, Optional[str], Optional[str]]
+
+
+class BatchClient(Protocol):
+    """Upstream that runs message batches; swap in a fake for tests"""
+
+    async def submit(self, requests: List[Dict[str, Any]]) -> str: ...
+
+    async def status(self, batch_id: str) -> Dict[str, Any]: ...
+
+    async def results(self, batch_id: str) -> List[BatchResult]: ...
+
+
+class AnthropicBatchClient:
+    """BatchClient backed by client.messages.batches"""
+
+    def __init__(self, claude):
+        self.claude = claude
+
+    async def submit(self, requests: List[Dict[str, Any]]) -> str:
+        batch = await self.claude.messages.batches.create(requests=requests)
+        return batch.id
+
+    async def status(self, batch_id: str) -> Dict[str, Any]:
+        batch = await self.claude.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {
+            "ended": batch.processing_status == "ended",
+            "processed": counts.succeeded + counts.errored + counts.canceled + counts.expired
+        }
+
+    async def results(self, batch_id: str) -> List[BatchResult]:
+        results = []
+        async for entry in await self.claude.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                results.append((entry.custom_id, response_content(entry.result.message)[0], None))
+            elif entry.result.type == "errored":
+                results.append((entry.custom_id, None, entry.result.error.error.message))
+            else:
+                results.append((entry.custom_id, None, f"Request {entry.result.type}"))
+        return results
+
+
+class JobStore:
+    """Postgres persistence for clarify_jobs / clarify_job_items (sync, run in threads)"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _run(self, work: Callable):
+        conn = self.pool.getconn()
+        try:
+            result = work(conn.cursor())
+            conn.commit()
+            return result
+        finally:
+            self.pool.putconn(conn)
+
+    def create_job(self, org_id: Optional[str], tickets: List[Dict[str, Any]]) -> int:
+        def work(cur):
+            cur.execute("""
+                INSERT INTO clarify_jobs (org_id, status, total)
+                VALUES (%s, 'pending', %s)
+                RETURNING id
+            """, (org_id, len(tickets)))
+            job_id = cur.fetchone()['id']
+
+            execute_values(cur, """
+                INSERT INTO clarify_job_items (job_id, custom_id, ticket)
+                VALUES %s
+            """, [(job_id, f"job{job_id}-{i}", json.dumps(ticket)) for i, ticket in enumerate(tickets)])
+            return job_id
+
+        return self._run(work)
+
+    def claim_pending_jobs(self, limit: int = 5, stale_after_minutes: int = 10) -> List[Dict[str, Any]]:
+        """
+        Atomically move pending jobs to 'submitting' so only one worker picks each up
+
+        Jobs left in 'submitting' by a worker that crashed mid-submit are
+        reclaimed after `stale_after_minutes`.
+        """
+        def work(cur):
+            cur.execute("""
+                UPDATE clarify_jobs
+                SET status = 'submitting', updated_at = NOW()
+                WHERE id IN (
+                    SELECT id FROM clarify_jobs
+                    WHERE status = 'pending'
+                    OR (status = 'submitting' AND updated_at < NOW() - make_interval(mins => %s))
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, org_id
+            """, (stale_after_minutes, limit))
+            jobs = [dict(row) for row in cur.fetchall()]
+
+            for job in jobs:
+                cur.execute("""
+                    SELECT custom_id, ticket FROM clarify_job_items
+                    WHERE job_id = %s
+                    ORDER BY id
+                """, (job['id'],))
+                job['items'] = [dict(row) for row in cur.fetchall()]
+            return jobs
+
+        return self._run(work)
+
+    def mark_submitted(self, job_id: int, batch_id: str):
+        def work(cur):
+            cur.execute("""
+                UPDATE clarify_jobs
+                SET status = 'submitted', batch_id = %s, updated_at = NOW()
+                WHERE id = %s
+            """, (batch_id, job_id))
+
+        self._run(work)
+
+    def submitted_jobs(self) -> List[Dict[str, Any]]:
+        def work(cur):
+            cur.execute("""
+                SELECT id, org_id, batch_id FROM clarify_jobs
+                WHERE status = 'submitted'
+                ORDER BY id
+            """)
+            return [dict(row) for row in cur.fetchall()]
+
+        return self._run(work)
+
+    def record_progress(self, job_id: int, processed: int):
+        def work(cur):
+            cur.execute("""
+                UPDATE clarify_jobs
+                SET processed = %s, updated_at = NOW()
+                WHERE id = %s
+            """, (processed, job_id))
+
+        self._run(work)
+
+    def complete_job(self, job_id: int, results: List[Tuple[str, Optional[Dict[str, Any]], Optional[str]]]) -> Optional[int]:
+        """
+        Store parsed results and copy successes into tickets
+
+        Returns the number of failed items, or None if another worker
+        already completed the job.
+        """
+        def work(cur):
+            cur.execute("""
+                UPDATE clarify_jobs
+                SET status = 'completed', updated_at = NOW(), completed_at = NOW()
+                WHERE id = %s AND status = 'submitted'
+                RETURNING org_id
+            """, (job_id,))
+            job = cur.fetchone()
+            if not job:
+                return None
+
+            if results:
+                execute_values(cur, """
+                    UPDATE clarify_job_items AS i
+                    SET status = v.status, clarified_output = v.output::jsonb, error = v.error
+                    FROM (VALUES %s) AS v (job_id, custom_id, status, output, error)
+                    WHERE i.job_id = v.job_id AND i.custom_id = v.custom_id
+                """, [
+                    (job_id, custom_id, 'succeeded' if output else 'failed', json.dumps(output) if output else None, error)
+                    for custom_id, output, error in results
+                ])
+
+            cur.execute("""
+                UPDATE clarify_job_items SET status = 'failed', error = 'Missing from batch results'
+                WHERE job_id = %s AND status = 'pending'
+            """, (job_id,))
+
+            cur.execute("""
+                INSERT INTO tickets
+                (org_id, ticket_title, ticket_description, issue_type, priority, clarified_output, processing_time)
+                SELECT COALESCE(ticket->>'orgId', %s, 'unknown'), ticket->>'title', ticket->>'description',
+                       ticket->>'issueType', ticket->>'priority', clarified_output, NULL
+                FROM clarify_job_items
+                WHERE job_id = %s AND status = 'succeeded'
+            """, (job['org_id'], job_id))
+            succeeded = cur.rowcount
+
+            cur.execute("""
+                UPDATE clarify_jobs
+                SET succeeded = %s, failed = total - %s, processed = total
+                WHERE id = %s
+            """, (succeeded, succeeded, job_id))
+
+            cur.execute("SELECT total FROM clarify_jobs WHERE id = %s", (job_id,))
+            return cur.fetchone()['total'] - succeeded
+
+        return self._run(work)
+
+    def fail_job(self, job_id: int, error: str) -> Optional[int]:
+        """Mark a job failed; returns its size, or None if it had already finished"""
+        def work(cur):
+            cur.execute("""
+                UPDATE clarify_jobs
+                SET status = 'failed', error = %s, updated_at = NOW(), completed_at = NOW()
+                WHERE id = %s AND status NOT IN ('completed', 'failed')
+                RETURNING total
+            """, (error, job_id))
+            job = cur.fetchone()
+            return job['total'] if job else None
+
+        return self._run(work)
+
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        def work(cur):
+            cur.execute("""
+                SELECT id, org_id, status, batch_id, total, processed, succeeded, failed,
+                       error, created_at, completed_at
+                FROM clarify_jobs
+                WHERE id = %s
+            """, (job_id,))
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+        return self._run(work)
+
+
+class JobRunner:
+    """
+    Background worker that drives clarify jobs through the batch upstream
+
+    Each pass submits pending jobs as one message batch apiece, polls
+    submitted batches, and once a batch has ended parses every result with
+    `parse` and stores it. Usage is reserved when a job is queued, so
+    failed tickets are given back through `refund(org_id, count)`.
+    """
+
+    def __init__(
+        self,
+        store,
+        client: BatchClient,
+        build_request: Callable[[Dict[str, Any]], Dict[str, Any]],
+        parse: Callable[[str], Dict[str, Any]],
+        refund: Optional[Callable[[str, int], Awaitable[None]]] = None,
+        poll_interval: float = 30.0
+    ):
+        self.store = store
+        self.client = client
+        self.build_request = build_request
+        self.parse = parse
+        self.refund = refund
+        self.poll_interval = poll_interval
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.warning("Job runner error", extra={"error": str(e)})
+            await asyncio.sleep(self.poll_interval)
+
+    async def run_once(self):
+        await self.submit_pending()
+        await self.collect_submitted()
+
+    async def submit_pending(self):
+        for job in await asyncio.to_thread(self.store.claim_pending_jobs):
+            requests = [
+                {"custom_id": item['custom_id'], "params": self.build_request(item['ticket'])}
+                for item in job['items']
+            ]
+            try:
+                batch_id = await self.client.submit(requests)
+            except Exception as e:
+                logger.error("Failed to submit job", extra={"jobId": job['id'], "error": str(e)})
+                failed = await asyncio.to_thread(self.store.fail_job, job['id'], str(e))
+                await self._refund(job['org_id'], failed)
+                continue
+
+            await asyncio.to_thread(self.store.mark_submitted, job['id'], batch_id)
+            logger.info("Job submitted", extra={"jobId": job['id'], "batchId": batch_id, "tickets": len(requests)})
+
+    async def collect_submitted(self):
+        for job in await asyncio.to_thread(self.store.submitted_jobs):
+            status = await self.client.status(job['batch_id'])
+            await asyncio.to_thread(self.store.record_progress, job['id'], status['processed'])
+            if not status['ended']:
+                continue
+
+            parsed = []
+            for custom_id, text, error in await self.client.results(job['batch_id']):
+                if text is None:
+                    parsed.append((custom_id, None, error))
+                    continue
+                try:
+                    parsed.append((custom_id, self.parse(text), None))
+                except Exception as e:
+                    parsed.append((custom_id, None, f"Failed to parse AI response: {e}"))
+
+            failed = await asyncio.to_thread(self.store.complete_job, job['id'], parsed)
+            if failed is not None:
+                succeeded = sum(1 for _, output, _ in parsed if output)
+                logger.info("Job completed", extra={"jobId": job['id'], "clarified": succeeded, "tickets": len(parsed)})
+                await self._refund(job['org_id'], failed)
+
+    async def _refund(self, org_id: Optional[str], count: Optional[int]):
+        if self.refund and org_id and count:
+            await self.refund(org_id, count)
@@ -0,0 +1,203 @@
+# logs.py - Structured JSON logging through a non-blocking queue handler
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, TextIO
+
+from jira_clarifier_backend.tracing import current_trace_id
+
+REQUEST_ID_HEADER = "X-Request-Id"
+
+_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+_request_scope: ContextVar[Optional[Dict[str, Any]]] = ContextVar("log_request_scope", default=None)
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "context", "taskName"}
+
+
+def bind_log_context(**fields: Any):
+    """Add fields (e.g. key=...) to every log line for the rest of the current request or task"""
+    _context.set({**_context.get(), **fields})
+
+
+def sampled(rate: float) -> bool:
+    """
+    True for about `rate` of calls
+
+    Guards high-volume info lines (`if sampled(LOG_SAMPLE_RATE): logger.info(...)`)
+    so the ones skipped never build a LogRecord.
+    """
+    return rate >= 1 or random.random() < rate
+
+
+def mask_key(license_key: Optional[str]) -> Optional[str]:
+    """Enough of a license key to correlate log lines without leaking it"""
+    if not license_key or license_key == "free_user" or len(license_key) <= 9:
+        return license_key
+    return license_key[:9] + "…"
+
+
+def record_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    """Request context and `extra` fields attached to a record"""
+    fields = dict(getattr(record, "context", {}))
+    for key, value in vars(record).items():
+        if key not in _RECORD_ATTRIBUTES:
+            fields[key] = value
+    return fields
+
+
+class ContextFilter(logging.Filter):
+    """
+    Stamps records with the request context, trace ID and matched route
+
+    Runs in the calling thread before the record is queued, so the context
+    seen is the request's.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _context.get()
+        scope = _request_scope.get()
+        route = getattr(scope.get("route"), "path", None) if scope else None
+        trace_id = current_trace_id()
+        if route or trace_id:
+            context = {**context, **({"route": route} if route else {}), **({"traceId": trace_id} if trace_id else {})}
+        record.context = context
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, then context and extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development, fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the event loop
+
+    Records are queued with put_nowait and formatted and written by a
+    QueueListener thread; when the queue is full they are dropped and
+    counted instead of stalling the request.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # queue.Queue is thread-safe, so skip the per-handler lock
+        if not self.filter(record):
+            return False
+        self.emit(record)
+        return True
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args now (they may change after the call returns), but keep
+        # extra fields and leave JSON formatting to the listener thread. The
+        # record is updated in place: this is the root logger's only handler.
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level: str = "INFO", fmt: str = "json", queue_size: int = 10000, stream: Optional[TextIO] = None):
+    """
+    Route the root logger through a bounded queue to a writer thread
+
+    Returns the started QueueListener; stop() it on shutdown to flush.
+    """
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware binding a request ID (the caller's X-Request-Id or a
+    new one) and the matched route to every log line of the request
+
+    The request ID is echoed in the X-Request-Id response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope.get("headers", []):
+            if key == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [(REQUEST_ID_HEADER.lower().encode(), request_id.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        context_token = _context.set({"requestId": request_id, "method": scope["method"]})
+        scope_token = _request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            _request_scope.reset(scope_token)
+            _context.reset(context_token)
@@ -2,23 +2,74 @@
 import os
 import json
 import asyncio
+import logging
+import hashlib
+import math
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
 from dotenv import load_dotenv
 
 
-from fastapi import FastAPI, HTTPException, Depends, Request, Header
+from fastapi import FastAPI, HTTPException, Depends, Request, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 import anthropic
+import httpx
 from pinecone import Pinecone
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import redis
+import redis.asyncio
 import stripe
 from contextlib import asynccontextmanager
 
+from jira_clarifier_backend.cache import (
+    LICENSE_CACHE_PREFIX,
+    LICENSE_INVALIDATION_CHANNEL,
+    ClarificationCache,
+    LicenseKeyCache,
+    TTLCache,
+    content_hash
+)
+from jira_clarifier_backend.db import ConnectionPool
+from jira_clarifier_backend.jobs import AnthropicBatchClient, JobRunner, JobStore
+from jira_clarifier_backend.logs import RequestContextMiddleware, bind_log_context, mask_key, sampled, setup_logging
+from jira_clarifier_backend.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from jira_clarifier_backend.prompts import CLARIFY_SYSTEM_PROMPT, TokenUsage, build_user_prompt, system_blocks
+from jira_clarifier_backend.rag import PineconeVectorStore, SentenceTransformerEmbedder, SimilarTicketRetriever, ticket_text
+from jira_clarifier_backend.ratelimit import RateLimiter
+from jira_clarifier_backend.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    ResilientCaller,
+    deadline_scope,
+    is_retryable
+)
+from jira_clarifier_backend.routing import ModelRouter, ModelTier, RoutingDecision, RoutingStats
+from jira_clarifier_backend.singleflight import SingleFlight
+from jira_clarifier_backend.streaming import CLARIFICATION_SECTIONS, IncrementalSectionParser, sse_event
+from jira_clarifier_backend.stripe_cache import StripeObjectCache, StripeObjectStore, key_livemode
+from jira_clarifier_backend.structured import (
+    CLARIFICATION_TOOL_NAME,
+    CLARIFICATION_TOOLS,
+    SECTION_TOOL_NAME,
+    ClarificationParseError,
+    ParseMetrics,
+    parse_section_items,
+    parse_sections,
+    response_content,
+    section_request,
+    tool_choice
+)
+from jira_clarifier_backend.usage import UsageCounter, UsageDelta
+from jira_clarifier_backend.webhooks import StripeEventStore, StripeEventWorker
+from jira_clarifier_backend.tracing import TracingMiddleware, instrument_redis, setup_tracing, trace_span
+from jira_clarifier_backend.writer import BatchWriter
+
 import bcrypt
 import jwt
 from datetime import datetime, timedelta
@@ -35,6 +86,8 @@ from datetime import datetime, timedelta
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # ============================================================================
 # Configuration
 # ============================================================================
@@ -52,11 +105,112 @@ ENABLE_RAG = os.getenv("ENABLE_RAG", "false").lower() == "true"
 ENABLE_RATE_LIMITING = os.getenv("ENABLE_RATE_LIMITING", "true").lower() == "true"
 ENABLE_PAYMENTS = os.getenv("ENABLE_PAYMENTS", "false").lower() == "true"
 ENABLE_ANALYTICS = os.getenv("ENABLE_ANALYTICS", "true").lower() == "true"
+ENABLE_CACHE = os.getenv("ENABLE_CACHE", "true").lower() == "true"
+ENABLE_JOBS = os.getenv("ENABLE_JOBS", "true").lower() == "true"
+ENABLE_USAGE_WRITE_BEHIND = os.getenv("ENABLE_USAGE_WRITE_BEHIND", "true").lower() == "true"
+ENABLE_MODEL_ROUTING = os.getenv("ENABLE_MODEL_ROUTING", "false").lower() == "true"
+ENABLE_COALESCING = os.getenv("ENABLE_COALESCING", "true").lower() == "true"
+ENABLE_BACKGROUND_WRITES = os.getenv("ENABLE_BACKGROUND_WRITES", "true").lower() == "true"
+ENABLE_TRACING = os.getenv("ENABLE_TRACING", "false").lower() == "true"
 
 # Rate limiting config
 RATE_LIMIT_FREE = int(os.getenv("RATE_LIMIT_FREE", "5"))  # per month
 RATE_LIMIT_PRO = int(os.getenv("RATE_LIMIT_PRO", "999999"))  # unlimited
 RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))  # seconds
+RATE_LIMIT_IP = int(os.getenv("RATE_LIMIT_IP", "120"))  # per client IP for paid keys
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))  # reverse proxies in front of the app (Railway's edge is one)
+
+# Database pool config
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))  # seconds to wait for a free connection
+
+# Clarification cache config
+CACHE_TTL = int(os.getenv("CACHE_TTL", "86400"))  # seconds in Redis
+CACHE_LOCAL_TTL = int(os.getenv("CACHE_LOCAL_TTL", "300"))  # seconds in-process
+CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", "1024"))
+LICENSE_CACHE_TTL = int(os.getenv("LICENSE_CACHE_TTL", "60"))  # seconds in Redis
+LICENSE_CACHE_LOCAL_TTL = int(os.getenv("LICENSE_CACHE_LOCAL_TTL", "15"))  # seconds in-process
+
+# Request coalescing config (identical in-flight clarifications share one Claude call)
+COALESCE_LOCK_TTL = float(os.getenv("COALESCE_LOCK_TTL", "120"))  # seconds; keep above CLAUDE_DEADLINE
+COALESCE_RESULT_TTL = int(os.getenv("COALESCE_RESULT_TTL", "30"))  # seconds other workers can pick up a result
+
+# Batch clarification config
+CLARIFY_BATCH_CONCURRENCY = int(os.getenv("CLARIFY_BATCH_CONCURRENCY", "8"))
+CLARIFY_BATCH_MAX_TICKETS = int(os.getenv("CLARIFY_BATCH_MAX_TICKETS", "300"))
+
+# RAG config
+RAG_BACKEND = os.getenv("RAG_BACKEND", "pinecone")  # "pinecone" or "local" (embedded IVF index)
+RAG_INDEX_PATH = os.getenv("RAG_INDEX_PATH", "data/vector_index")
+RAG_INDEX_NPROBE = int(os.getenv("RAG_INDEX_NPROBE", "8"))
+RAG_COMPACT_INTERVAL = float(os.getenv("RAG_COMPACT_INTERVAL", "300"))  # seconds between compaction checks
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "3"))
+RAG_TIMEOUT = float(os.getenv("RAG_TIMEOUT", "0.5"))  # seconds before /clarify gives up on context
+RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.3"))  # cosine similarity
+RAG_WORKERS = int(os.getenv("RAG_WORKERS", "4"))  # retrieval threads; lookups are skipped when all are busy
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache")  # "" disables the cache
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "100000"))  # float16 vectors on disk
+EMBEDDING_CACHE_MEMORY = int(os.getenv("EMBEDDING_CACHE_MEMORY", "2048"))  # vectors in the in-process LRU
+
+# Background analytics/feedback writer config
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", "10000"))  # rows held in memory
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "500"))  # rows per INSERT
+WRITE_FLUSH_INTERVAL_MS = int(os.getenv("WRITE_FLUSH_INTERVAL_MS", "500"))  # max wait after a batch's first row
+WRITE_OVERFLOW = os.getenv("WRITE_OVERFLOW", "block")  # full queue: "block" (backpressure) or "spill" (to disk)
+WRITE_SPILL_PATH = os.getenv("WRITE_SPILL_PATH", "data/analytics_spill.jsonl")
+
+# Logging config (JSON lines written by a background thread)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records buffered before new ones are dropped
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))  # share of per-request info lines (usage, routing, Claude calls) kept
+LOG_CONTENT_MAX_CHARS = int(os.getenv("LOG_CONTENT_MAX_CHARS", "2000"))  # of unparsable AI content, at debug level
+
+# Tracing config (OpenTelemetry, exported to a local OTLP/HTTP collector)
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "0.1"))  # new traces kept; a sampled caller's trace is always kept
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "jira-clarifier-backend")
+
+# Write-behind usage counter config
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))  # seconds between flushes to Postgres
+
+# Offline job runner config
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "30"))  # seconds between batch status checks
+
+# Stripe webhook queue config (events are acknowledged once stored, then applied by a worker)
+STRIPE_EVENT_CONCURRENCY = int(os.getenv("STRIPE_EVENT_CONCURRENCY", "4"))  # customers processed at once
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.getenv("STRIPE_EVENT_MAX_ATTEMPTS", "8"))  # before an event is marked failed
+STRIPE_EVENT_RETRY_DELAY = float(os.getenv("STRIPE_EVENT_RETRY_DELAY", "30"))  # seconds, doubled per attempt
+STRIPE_EVENT_POLL_INTERVAL = float(os.getenv("STRIPE_EVENT_POLL_INTERVAL", "5"))  # seconds; new events wake the worker sooner
+
+# Stripe object cache config (subscriptions and invoices from webhook payloads)
+STRIPE_CACHE_MAX_AGE = int(os.getenv("STRIPE_CACHE_MAX_AGE", "86400"))  # seconds before a snapshot is refetched
+STRIPE_CACHE_LOCAL_TTL = int(os.getenv("STRIPE_CACHE_LOCAL_TTL", "300"))  # seconds in-process
+STRIPE_CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("STRIPE_CACHE_LOCAL_MAX_ENTRIES", "1024"))
+
+# Model routing config (simple tickets try the fast model first)
+CLAUDE_FAST_MODEL = os.getenv("CLAUDE_FAST_MODEL", "claude-3-5-haiku-20241022")
+CLAUDE_FAST_MAX_TOKENS = int(os.getenv("CLAUDE_FAST_MAX_TOKENS", "1200"))
+ROUTING_COMPLEXITY_THRESHOLD = int(os.getenv("ROUTING_COMPLEXITY_THRESHOLD", "2"))  # at or above goes to Sonnet
+ROUTING_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTING_CONFIDENCE_THRESHOLD", "0.6"))  # below escalates to Sonnet
+
+# Claude client config
+CLAUDE_TIMEOUT = float(os.getenv("CLAUDE_TIMEOUT", "60"))  # seconds
+CLAUDE_MAX_CONNECTIONS = int(os.getenv("CLAUDE_MAX_CONNECTIONS", "100"))
+CLAUDE_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("CLAUDE_MAX_KEEPALIVE_CONNECTIONS", "20"))
+
+# Upstream resilience config (CLAUDE_TIMEOUT still bounds each attempt)
+CLAUDE_DEADLINE = float(os.getenv("CLAUDE_DEADLINE", "90"))  # seconds for a whole clarification, retries and re-asks included
+CLAUDE_MAX_RETRIES = int(os.getenv("CLAUDE_MAX_RETRIES", "3"))  # on 429/5xx/529 and connection errors
+CLAUDE_RETRY_BASE_DELAY = float(os.getenv("CLAUDE_RETRY_BASE_DELAY", "0.5"))  # seconds, doubled per attempt with full jitter
+CLAUDE_RETRY_MAX_DELAY = float(os.getenv("CLAUDE_RETRY_MAX_DELAY", "8"))
+ENABLE_HEDGING = os.getenv("ENABLE_HEDGING", "false").lower() == "true"  # a second request after the p95 latency
+CLAUDE_HEDGE_PERCENTILE = float(os.getenv("CLAUDE_HEDGE_PERCENTILE", "0.95"))
+CLAUDE_HEDGE_MIN_DELAY = float(os.getenv("CLAUDE_HEDGE_MIN_DELAY", "2"))  # seconds, never hedge sooner than this
+CLAUDE_BREAKER_THRESHOLD = int(os.getenv("CLAUDE_BREAKER_THRESHOLD", "5"))  # consecutive failures that open the circuit
+CLAUDE_BREAKER_RESET = float(os.getenv("CLAUDE_BREAKER_RESET", "30"))  # seconds before a probe request is let through
 
 JWT_SECRET = os.getenv("JWT_SECRET", secrets.token_urlsafe(32))
 JWT_ALGORITHM = "HS256"
@@ -66,44 +220,250 @@ JWT_EXPIRATION_HOURS = 24 * 30  # 30 days
 # Initialize Services
 # ============================================================================
 
+def create_claude_client(api_key: Optional[str], transport: Optional[httpx.AsyncBaseTransport] = None):
+    """
+    Build the async Claude client on a shared, bounded HTTP connection pool
+    
+    Every request reuses the same pool, so concurrent clarifications overlap
+    instead of blocking the event loop.
+    """
+    if not api_key:
+        return None
+    
+    http_client = anthropic.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=CLAUDE_MAX_CONNECTIONS,
+            max_keepalive_connections=CLAUDE_MAX_KEEPALIVE_CONNECTIONS
+        ),
+        transport=transport
+    )
+    return anthropic.AsyncAnthropic(api_key=api_key, http_client=http_client, timeout=CLAUDE_TIMEOUT)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize services on startup"""
     # Startup
-    print("🚀 Initializing services...")
+    app.state.log_listener = setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE)
+    logger.info("Initializing services")
+    
+    # Initialize tracing first so startup connections are traced (optional)
+    app.state.tracer_provider = None
+    if ENABLE_TRACING:
+        app.state.tracer_provider = setup_tracing(OTEL_SERVICE_NAME, OTEL_EXPORTER_OTLP_ENDPOINT, TRACE_SAMPLE_RATIO)
+        if app.state.tracer_provider:
+            logger.info(f"Tracing initialized (sampling {TRACE_SAMPLE_RATIO:g} to {OTEL_EXPORTER_OTLP_ENDPOINT})")
     
     # Initialize Claude
-    app.state.claude = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
+    app.state.claude = create_claude_client(ANTHROPIC_API_KEY)
+    
+    # Initialize PostgreSQL pool (optional)
+    app.state.db_pool = None
+    if DATABASE_URL:
+        try:
+            app.state.db_pool = await asyncio.to_thread(
+                ConnectionPool,
+                DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                timeout=DB_POOL_TIMEOUT,
+                on_wait=observe_pool_wait
+            )
+            await asyncio.to_thread(init_database)
+            logger.info(f"Database pool initialized ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} connections)")
+        except Exception as e:
+            logger.warning("Database unavailable", extra={"error": str(e)})
     
-    # Initialize Pinecone (optional)
-    if ENABLE_RAG and PINECONE_API_KEY:
+    # Initialize the vector store (Pinecone or embedded index) and embedding model (optional)
+    app.state.retriever = None
+    app.state.vector_index = None
+    app.state.compaction_task = None
+    vector_store = None
+    if ENABLE_RAG and RAG_BACKEND == "local":
+        # numpy-backed, so only imported when configured (it comes with sentence-transformers)
+        from jira_clarifier_backend.ann import IVFVectorIndex
+        app.state.vector_index = await asyncio.to_thread(IVFVectorIndex, RAG_INDEX_PATH, nprobe=RAG_INDEX_NPROBE)
+        vector_store = app.state.vector_index
+        logger.info(f"Vector index loaded ({len(vector_store)} vectors from {RAG_INDEX_PATH})")
+    elif ENABLE_RAG and PINECONE_API_KEY:
         app.state.pc = Pinecone(api_key=PINECONE_API_KEY)
         app.state.index = app.state.pc.Index("jira-vectors")
-        print("✅ Pinecone initialized")
+        vector_store = PineconeVectorStore(app.state.index)
+        logger.info("Pinecone initialized")
+    
+    if vector_store is not None:
+        try:
+            embedder = await asyncio.to_thread(SentenceTransformerEmbedder, EMBEDDING_MODEL)
+            if EMBEDDING_CACHE_PATH:
+                from jira_clarifier_backend.embedding_cache import CachedEmbedder, EmbeddingCache
+                embedding_cache = await asyncio.to_thread(
+                    EmbeddingCache, EMBEDDING_CACHE_PATH, EMBEDDING_MODEL, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_MEMORY
+                )
+                embedder = CachedEmbedder(embedder, embedding_cache)
+                logger.info(f"Embedding cache loaded ({len(embedding_cache)} vectors from {EMBEDDING_CACHE_PATH})")
+            app.state.retriever = SimilarTicketRetriever(
+                embedder,
+                vector_store,
+                top_k=RAG_TOP_K,
+                timeout=RAG_TIMEOUT,
+                min_score=RAG_MIN_SCORE,
+                workers=RAG_WORKERS
+            )
+            logger.info(f"Embedding model loaded ({EMBEDDING_MODEL})")
+        except Exception as e:
+            logger.warning("RAG disabled, embedding model unavailable", extra={"error": str(e)})
+    
+    if app.state.vector_index is not None:
+        app.state.compaction_task = asyncio.create_task(app.state.vector_index.run_forever(RAG_COMPACT_INTERVAL))
     
     # Initialize Redis (optional)
-    if ENABLE_RATE_LIMITING and REDIS_URL:
+    app.state.redis = None
+    if (ENABLE_RATE_LIMITING or ENABLE_CACHE or ENABLE_USAGE_WRITE_BEHIND or ENABLE_COALESCING) and REDIS_URL:
         try:
-            app.state.redis = redis.from_url(REDIS_URL, decode_responses=True)
-            app.state.redis.ping()
-            print("✅ Redis initialized")
+            app.state.redis = instrument_redis(redis.asyncio.from_url(REDIS_URL, decode_responses=True))
+            await app.state.redis.ping()
+            logger.info("Redis initialized")
         except Exception as e:
-            print(f"⚠️  Redis unavailable: {e}")
+            logger.warning("Redis unavailable", extra={"error": str(e)})
             app.state.redis = None
     
+    # Initialize rate limiter (falls back to in-process buckets without Redis)
+    app.state.rate_limiter = None
+    if ENABLE_RATE_LIMITING:
+        app.state.rate_limiter = RateLimiter(app.state.redis, window=RATE_LIMIT_WINDOW)
+        logger.info(f"Rate limiter initialized ({'redis' if app.state.redis else 'local buckets'})")
+    
+    # Initialize clarification cache (optional)
+    app.state.clarification_cache = None
+    if ENABLE_CACHE:
+        app.state.clarification_cache = ClarificationCache(
+            TTLCache(max_entries=CACHE_LOCAL_MAX_ENTRIES, ttl=CACHE_LOCAL_TTL),
+            redis=app.state.redis,
+            ttl=CACHE_TTL
+        )
+        logger.info(f"Clarification cache initialized ({'memory + redis' if app.state.redis else 'memory only'})")
+    
+    # Initialize request coalescing, coordinated across workers through Redis when available
+    app.state.single_flight = None
+    if ENABLE_COALESCING:
+        app.state.single_flight = SingleFlight(app.state.redis, lock_ttl=COALESCE_LOCK_TTL, result_ttl=COALESCE_RESULT_TTL)
+        logger.info(f"Request coalescing initialized ({'redis' if app.state.redis else 'per worker'})")
+    
+    # Initialize license key cache, invalidated over Redis pub/sub (optional)
+    app.state.license_cache = None
+    app.state.license_cache_task = None
+    if ENABLE_CACHE:
+        app.state.license_cache = LicenseKeyCache(
+            TTLCache(max_entries=CACHE_LOCAL_MAX_ENTRIES, ttl=LICENSE_CACHE_LOCAL_TTL),
+            redis=app.state.redis,
+            ttl=LICENSE_CACHE_TTL
+        )
+        if app.state.redis:
+            app.state.license_cache_task = asyncio.create_task(app.state.license_cache.listen())
+        logger.info("License key cache initialized")
+    
+    # Initialize write-behind usage counter (needs Redis and the database)
+    app.state.usage_counter = None
+    app.state.usage_task = None
+    if ENABLE_USAGE_WRITE_BEHIND and app.state.redis and app.state.db_pool:
+        app.state.usage_counter = UsageCounter(app.state.redis)
+        app.state.usage_task = asyncio.create_task(
+            app.state.usage_counter.run_forever(apply_usage_flush, USAGE_FLUSH_INTERVAL)
+        )
+        logger.info(f"Usage counter initialized (flushing every {USAGE_FLUSH_INTERVAL:g}s)")
+    
     # Initialize Stripe (optional)
     if ENABLE_PAYMENTS and STRIPE_SECRET_KEY:
         stripe.api_key = STRIPE_SECRET_KEY
-        print("✅ Stripe initialized")
+        logger.info("Stripe initialized")
     
-    print("✅ All services ready")
+    # Initialize Stripe object cache (read-through, fed by webhook payloads)
+    app.state.stripe_objects = None
+    if ENABLE_PAYMENTS and ENABLE_CACHE and app.state.db_pool:
+        app.state.stripe_objects = StripeObjectCache(
+            StripeObjectStore(app.state.db_pool),
+            TTLCache(max_entries=STRIPE_CACHE_LOCAL_MAX_ENTRIES, ttl=STRIPE_CACHE_LOCAL_TTL),
+            livemode=key_livemode(STRIPE_SECRET_KEY),
+            max_age=STRIPE_CACHE_MAX_AGE
+        )
+        logger.info("Stripe object cache initialized")
+    
+    # Initialize Stripe event worker (webhooks are queued in Postgres)
+    app.state.stripe_events = None
+    app.state.stripe_worker = None
+    app.state.stripe_task = None
+    if ENABLE_PAYMENTS and app.state.db_pool:
+        app.state.stripe_events = StripeEventStore(app.state.db_pool)
+        app.state.stripe_worker = StripeEventWorker(
+            app.state.stripe_events,
+            process_stripe_event,
+            batch_size=STRIPE_EVENT_CONCURRENCY,
+            max_attempts=STRIPE_EVENT_MAX_ATTEMPTS,
+            retry_delay=STRIPE_EVENT_RETRY_DELAY,
+            poll_interval=STRIPE_EVENT_POLL_INTERVAL
+        )
+        app.state.stripe_task = asyncio.create_task(app.state.stripe_worker.run_forever())
+        logger.info("Stripe event worker started")
+    
+    # Initialize offline job runner (optional)
+    app.state.job_store = None
+    app.state.job_task = None
+    if ENABLE_JOBS and app.state.db_pool:
+        app.state.job_store = JobStore(app.state.db_pool)
+        if app.state.claude:
+            runner = create_job_runner(app.state.job_store, AnthropicBatchClient(app.state.claude))
+            app.state.job_task = asyncio.create_task(runner.run_forever())
+            logger.info("Job runner started")
+    
+    # Initialize background writer for analytics and feedback rows
+    app.state.batch_writer = None
+    app.state.writer_task = None
+    if ENABLE_BACKGROUND_WRITES:
+        app.state.batch_writer = BatchWriter(
+            write_analytics_rows,
+            max_queue=WRITE_QUEUE_SIZE,
+            batch_size=WRITE_BATCH_SIZE,
+            flush_interval=WRITE_FLUSH_INTERVAL_MS / 1000,
+            overflow=WRITE_OVERFLOW,
+            spill_path=WRITE_SPILL_PATH or None
+        )
+        app.state.writer_task = asyncio.create_task(app.state.batch_writer.run_forever())
+        logger.info(f"Background writer started (batches of {WRITE_BATCH_SIZE}, {WRITE_OVERFLOW} when full)")
+    
+    logger.info("All services ready")
     
     yield
     
     # Shutdown
-    print("👋 Shutting down...")
+    logger.info("Shutting down")
+    if app.state.batch_writer:
+        await app.state.batch_writer.close(app.state.writer_task)
+    if app.state.job_task:
+        app.state.job_task.cancel()
+    if app.state.stripe_task:
+        app.state.stripe_task.cancel()
+    if app.state.license_cache_task:
+        app.state.license_cache_task.cancel()
+    if app.state.compaction_task:
+        app.state.compaction_task.cancel()
+    if app.state.retriever:
+        app.state.retriever.close()
+    if app.state.usage_task:
+        app.state.usage_task.cancel()
+        try:
+            await app.state.usage_counter.flush(apply_usage_flush)
+        except Exception as e:
+            logger.warning("Final usage flush failed, kept in Redis", extra={"error": str(e)})
+    if app.state.claude:
+        await app.state.claude.close()
     if hasattr(app.state, 'redis') and app.state.redis:
-        app.state.redis.close()
+        await app.state.redis.aclose()
+    if getattr(app.state, 'sync_redis', None):
+        app.state.sync_redis.close()
+    if app.state.db_pool:
+        await asyncio.to_thread(app.state.db_pool.closeall)
+    if app.state.tracer_provider:
+        await asyncio.to_thread(app.state.tracer_provider.shutdown)
+    app.state.log_listener.stop()
 
 app = FastAPI(
     title="Jira Clarifier API",
@@ -121,6 +481,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request IDs and routes on every log line
+app.add_middleware(RequestContextMiddleware)
+
+# Tracing (outermost, so the server span covers every other middleware)
+app.add_middleware(TracingMiddleware)
+
 # ============================================================================
 # Models
 # ============================================================================
@@ -141,6 +507,10 @@ class ClarifiedOutput(BaseModel):
     confidence: Optional[float] = Field(default=None, description="AI confidence score")
     processingTime: Optional[float] = Field(default=None, description="Processing time in seconds")
 
+class BatchTicketInput(BaseModel):
+    tickets: List[TicketInput] = Field(..., min_length=1, max_length=CLARIFY_BATCH_MAX_TICKETS)
+    orgId: Optional[str] = Field(default=None, description="License key charged for the whole batch")
+
 class UsageStats(BaseModel):
     clarificationsUsed: int
     clarificationsRemaining: int
@@ -190,16 +560,24 @@ class CreatePaymentIntentInput(BaseModel):
 # ============================================================================
 
 def get_db_connection():
-    """Get PostgreSQL connection"""
-    if not DATABASE_URL:
+    """Check out a pooled PostgreSQL connection (return it with release_db_connection)"""
+    pool = getattr(app.state, 'db_pool', None)
+    if not pool:
         return None
     try:
-        conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-        return conn
+        return pool.getconn()
     except Exception as e:
-        print(f"Database connection error: {e}")
+        logger.error("Database connection error", extra={"error": str(e)})
         return None
 
+def release_db_connection(conn):
+    """Return a connection to the pool"""
+    pool = getattr(app.state, 'db_pool', None)
+    if pool:
+        pool.putconn(conn)
+    else:
+        conn.close()
+
 def init_database():
     """Initialize database schema"""
     conn = get_db_connection()
@@ -288,20 +666,116 @@ def init_database():
         cur.execute("CREATE INDEX IF NOT EXISTS idx_feedback_type ON feedback(feedback_type)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_license_keys ON license_keys(key_code)")
 
-        # Create indexes
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_org_id ON organizations(org_id)")
+        # Create indexes (organizations only exists in databases from before license keys)
+        cur.execute("SELECT to_regclass('organizations') AS name")
+        if cur.fetchone()['name']:
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_org_id ON organizations(org_id)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_org ON tickets(org_id)")
         
         conn.commit()
-        print("✅ Database initialized")
     except Exception as e:
-        print(f"Database init error: {e}")
+        conn.rollback()
+        logger.error("Database init error", extra={"error": str(e)})
+    
+    # Job, usage and Stripe tables commit on their own, so a failure in
+    # either part can't roll back the other
+    try:
+        cur = conn.cursor()
+        
+        # Offline clarification jobs (Message Batches API)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS clarify_jobs (
+                id SERIAL PRIMARY KEY,
+                org_id VARCHAR(255),
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                batch_id VARCHAR(255),
+                total INTEGER NOT NULL DEFAULT 0,
+                processed INTEGER NOT NULL DEFAULT 0,
+                succeeded INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                completed_at TIMESTAMP
+            )
+        """)
+        
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS clarify_job_items (
+                id SERIAL PRIMARY KEY,
+                job_id INTEGER NOT NULL REFERENCES clarify_jobs(id) ON DELETE CASCADE,
+                custom_id VARCHAR(64) NOT NULL,
+                ticket JSONB NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                clarified_output JSONB,
+                error TEXT,
+                UNIQUE (job_id, custom_id)
+            )
+        """)
+        
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_clarify_jobs_status ON clarify_jobs(status)")
+        
+        # Usage flushes already applied (makes write-behind flushes idempotent)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS usage_flushes (
+                flush_id VARCHAR(64) PRIMARY KEY,
+                flushed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Verified Stripe webhook events, applied in order per customer by StripeEventWorker
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS stripe_events (
+                id SERIAL PRIMARY KEY,
+                event_id VARCHAR(255) UNIQUE NOT NULL,
+                event_type VARCHAR(100) NOT NULL,
+                ordering_key VARCHAR(255) NOT NULL,
+                payload JSONB NOT NULL,
+                livemode BOOLEAN NOT NULL DEFAULT false,
+                stripe_created TIMESTAMP NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                error TEXT,
+                result JSONB,
+                received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                processed_at TIMESTAMP
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_stripe_events_queue ON stripe_events(ordering_key, stripe_created, id) WHERE status IN ('pending', 'processing')")
+        
+        # Latest known snapshot of Stripe subscriptions and invoices (StripeObjectCache)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS stripe_objects (
+                id VARCHAR(255) PRIMARY KEY,
+                object_type VARCHAR(50) NOT NULL,
+                livemode BOOLEAN NOT NULL DEFAULT false,
+                created TIMESTAMP,
+                version BIGINT NOT NULL,
+                data JSONB NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Creation time of the last Stripe event applied to a key (stale replays are skipped)
+        cur.execute("ALTER TABLE license_keys ADD COLUMN IF NOT EXISTS stripe_event_at TIMESTAMP")
+        # Payment that issued the key (looked up by /license-key/payment-intent)
+        cur.execute("ALTER TABLE license_keys ADD COLUMN IF NOT EXISTS stripe_payment_intent_id VARCHAR(255)")
+        
+        # One key per subscription, so a replayed first payment can't issue a second one
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_license_subscription_unique ON license_keys(stripe_subscription_id)
+            WHERE stripe_subscription_id IS NOT NULL
+        """)
+        
+        conn.commit()
+        logger.info("Database initialized")
+    except Exception as e:
+        conn.rollback()
+        logger.error("Database init error", extra={"error": str(e)})
     finally:
-        conn.close()
-
-# Initialize on startup
-if DATABASE_URL:
-    init_database()
+        release_db_connection(conn)
 
 # ============================================================================
 # User & Auth Helpers
@@ -326,9 +800,9 @@ def increment_usage(org_id: str):
         """, (org_id,))
         conn.commit()
     except Exception as e:
-        print(f"Error incrementing usage: {e}")
+        logger.error("Error incrementing usage", extra={"error": str(e)})
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 
 def validate_access_key(key_code: str) -> Optional[Dict]:
@@ -394,41 +868,53 @@ def validate_access_key(key_code: str) -> Optional[Dict]:
         return dict(org_data) if org_data else None
         
     except Exception as e:
-        print(f"Error validating access key: {e}")
+        logger.error("Error validating access key", extra={"error": str(e)})
         return None
     finally:
-        conn.close()
-
-
-def store_feedback(feedback: FeedbackInput):
-    """Store user feedback for model fine-tuning"""
-    if not DATABASE_URL:
+        release_db_connection(conn)
+
+
+def feedback_row(feedback: FeedbackInput) -> List[Any]:
+    """Column values for one feedback row (JSON-serializable, so it can be queued or spilled)"""
+    return [
+        feedback.orgId,
+        feedback.ticketData.get('title'),
+        feedback.ticketData.get('description'),
+        feedback.clarifiedOutput,
+        feedback.feedbackType,
+        feedback.comment
+    ]
+
+def insert_feedback_rows(rows: List[List[Any]]):
+    """Insert feedback rows with a single multi-row INSERT (raises on failure)"""
+    if not DATABASE_URL or not rows:
         return
     
     conn = get_db_connection()
     if not conn:
-        return
+        raise RuntimeError("Database unavailable")
     
     try:
         cur = conn.cursor()
-        cur.execute("""
+        execute_values(cur, """
             INSERT INTO feedback 
             (org_id, ticket_title, ticket_description, clarified_output, feedback_type, comment)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (
-            feedback.orgId,
-            feedback.ticketData.get('title'),
-            feedback.ticketData.get('description'),
-            json.dumps(feedback.clarifiedOutput),
-            feedback.feedbackType,
-            feedback.comment
-        ))
+            VALUES %s
+        """, [
+            (org_id, title, description, json.dumps(output), feedback_type, comment)
+            for org_id, title, description, output, feedback_type, comment in rows
+        ])
         conn.commit()
-        print(f"✅ Stored {feedback.feedbackType} feedback from {feedback.orgId}")
-    except Exception as e:
-        print(f"Error storing feedback: {e}")
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+def store_feedback(feedback: FeedbackInput):
+    """Store user feedback for model fine-tuning"""
+    try:
+        insert_feedback_rows([feedback_row(feedback)])
+        logger.info("Stored feedback", extra={"feedbackType": feedback.feedbackType, "key": mask_key(feedback.orgId)})
+    except Exception as e:
+        logger.error("Error storing feedback", extra={"error": str(e)})
 
 def get_plan_limits(plan_id: str) -> int:
     """Get clarification limit based on plan"""
@@ -460,17 +946,19 @@ def reset_monthly_usage():
             WHERE is_active = true
             AND subscription_status = 'active'
             AND usage_resets_at <= NOW()
+            RETURNING key_code
         """)
         
-        rows_updated = cur.rowcount
+        reset_keys = [row['key_code'] for row in cur.fetchall()]
         conn.commit()
+        invalidate_license_keys(reset_keys)
         
-        print(f"✅ Reset usage for {rows_updated} subscriptions")
+        logger.info("Reset usage", extra={"subscriptions": len(reset_keys)})
         
     except Exception as e:
-        print(f"Error resetting usage: {e}")
+        logger.error("Error resetting usage", extra={"error": str(e)})
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def generate_license_key() -> str:
     """Generate a unique license key in format JIRA-XXXX-XXXX-XXXX"""
@@ -488,8 +976,10 @@ def generate_license_key() -> str:
 def send_license_key_email(email: str, license_key: str, plan_name: str, clarifications_limit: int):
     """
     Send license key via email
+    
+    No mail provider is wired up yet, so the email body is logged at debug level.
     """
-    print(f"""
+    logger.debug(f"""
     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     📧 SEND EMAIL
     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -531,134 +1021,837 @@ def send_license_key_email(email: str, license_key: str, plan_name: str, clarifi
     """)
 
 # ============================================================================
-# AI Processing
+# Rate Limiting
 # ============================================================================
 
-async def get_similar_tickets(description: str, org_id: str) -> List[Dict]:
-    """Get similar tickets using RAG (Pinecone)"""
-    if not ENABLE_RAG or not hasattr(app.state, 'index'):
-        return []
+def client_address(request: Request) -> str:
+    """
+    The caller's IP, as recorded by the outermost trusted proxy
     
+    Each proxy appends the address it received the request from to
+    X-Forwarded-For, so the entry TRUSTED_PROXY_HOPS from the right is the
+    first one a client can't forge. Without the header (local runs, tests)
+    the socket peer is used.
+    """
+    if TRUSTED_PROXY_HOPS:
+        forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+async def has_active_license(license_key: str) -> bool:
+    """Whether a key is a real, active license; anything else gets free limits"""
+    if license_key == "free_user":
+        return False
     try:
-        # Get embedding from Claude (or use OpenAI if preferred)
-        # For now, return empty - you'd implement actual embedding here
-        # This would require an embedding model
-        return []
+        record = await get_license_record(license_key)
     except Exception as e:
-        print(f"RAG error: {e}")
-        return []
+        logger.warning("License lookup failed, applying free rate limits", extra={"error": str(e)})
+        return False
+    return bool(record and record['is_active'])
 
-async def generate_clarification(ticket: TicketInput) -> ClarifiedOutput:
-    """Generate clarification using Claude AI"""
-    start_time = datetime.now()
+async def enforce_rate_limit(request: Request, license_key: str, cost: int = 1) -> Dict[str, str]:
+    """
+    Charge a request against its per-key and per-IP limits
     
-    if not app.state.claude:
-        raise HTTPException(status_code=500, detail="AI service not configured")
+    Returns RateLimit-* headers for the response, or raises 429 with
+    Retry-After once a limit is exhausted. The paid tier applies only to
+    active license keys; free users, and any unknown or inactive orgId,
+    are limited by IP alone at RATE_LIMIT_FREE. A cost that exceeds the
+    tightest limit could never fit in one window, so it is rejected with
+    413 instead.
+    """
+    limiter = getattr(app.state, 'rate_limiter', None)
+    if not limiter:
+        return {}
     
-    # Get similar tickets for context (optional)
-    similar_tickets = await get_similar_tickets(ticket.description, ticket.orgId or "unknown")
+    client_ip = client_address(request)
+    paid = await has_active_license(license_key)
+    if paid:
+        limits = [(f"key:{license_key}", RATE_LIMIT_PRO), (f"ip:{client_ip}", RATE_LIMIT_IP)]
+    else:
+        limits = [(f"free:{client_ip}", RATE_LIMIT_FREE)]  # not "ip:", whose paid limit is higher
+    
+    limit = min(limit for _, limit in limits)
+    if cost > limit:
+        raise HTTPException(
+            status_code=413,
+            detail=f"{cost} tickets exceed the rate limit of {limit} per {RATE_LIMIT_WINDOW}s. "
+                   + ("Split the batch." if paid else "Split the batch or use a license key.")
+        )
     
-    # Build prompt
-    prompt = f"""You are a senior software engineer helping to clarify Jira tickets. Given the following ticket information, provide clear, actionable acceptance criteria and additional details.
+    result = await limiter.hit(limits, cost)
+    if not result.allowed:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded. Try again in {result.headers()['Retry-After']}s.",
+            headers=result.headers()
+        )
+    return result.headers()
+
+# ============================================================================
+# AI Processing
+# ============================================================================
+
+async def get_similar_tickets(ticket: TicketInput) -> List[Dict]:
+    """
+    Get similar past tickets from the org's namespace using RAG
+    
+    Bounded by RAG_TIMEOUT; returns [] rather than slowing /clarify down.
+    """
+    retriever = getattr(app.state, 'retriever', None)
+    if not ENABLE_RAG or not retriever or not ticket.orgId:
+        return []
+    
+    with stage_seconds.time("rag"):
+        return await retriever.retrieve(ticket_text(ticket.title, ticket.description), namespace=ticket.orgId)
+
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
+CLAUDE_MAX_TOKENS = 2000
+CLARIFY_SECTION_MAX_TOKENS = 600  # budget for re-asking a single malformed section
+
+STRONG_TIER = ModelTier("strong", CLAUDE_MODEL, CLAUDE_MAX_TOKENS)
+FAST_TIER = ModelTier("fast", CLAUDE_FAST_MODEL, CLAUDE_FAST_MAX_TOKENS)
+model_router = ModelRouter(
+    FAST_TIER,
+    STRONG_TIER,
+    complexity_threshold=ROUTING_COMPLEXITY_THRESHOLD,
+    confidence_threshold=ROUTING_CONFIDENCE_THRESHOLD
+)
 
-Ticket Title: {ticket.title}
-Description: {ticket.description or 'No description provided'}
-Issue Type: {ticket.issueType}
-Priority: {ticket.priority}
+# Tickets per tier, escalations, and per-model latency and token spend (reported by /health)
+routing_stats = RoutingStats()
 
-{"Similar past tickets for context:" + json.dumps(similar_tickets, indent=2) if similar_tickets else ""}
+# Prometheus metrics (served by /metrics); all timings are perf_counter seconds
+metrics_registry = Registry()
+stage_seconds = metrics_registry.histogram(
+    "clarify_stage_seconds",
+    "Time spent in each clarification stage (usage, rag, prompt_build, llm_first_token, llm, parse, analytics_write)",
+    ["stage"]
+)
+request_seconds = metrics_registry.histogram("clarify_request_seconds", "Successful clarification requests end to end", ["endpoint"])
+claude_tokens = metrics_registry.counter("claude_tokens_total", "Claude tokens by model and kind", ["model", "kind"])
+cache_lookups = metrics_registry.counter("clarify_cache_lookups_total", "Clarification cache lookups by result", ["result"])
+clarify_errors = metrics_registry.counter("clarify_errors_total", "Failed clarifications by error type", ["type"])
+stripe_cache_lookups = metrics_registry.counter("stripe_object_cache_lookups_total", "Stripe object lookups by type and result", ["type", "result"])
+db_pool_wait_seconds = metrics_registry.histogram("db_pool_wait_seconds", "Database connection checkout wait by outcome (acquired, timeout)", ["outcome"])
+db_pool_connections = metrics_registry.gauge("db_pool_connections", "Database pool connections by state (in_use, idle, max)", ["state"])
+
+parse_outcomes = metrics_registry.counter("clarify_parse_outcomes_total", "Clarification responses by how they were parsed", ["outcome"])
+coalescing_requests = metrics_registry.counter("clarify_coalescing_requests_total", "Coalescing-eligible requests by role (requests, leaders, coalesced, coalesced_remote)", ["role"])
+coalescing_rate = metrics_registry.gauge("clarify_coalescing_rate", "Share of requests served by another request's Claude call")
+
+def observe_pool_wait(waited: float, timed_out: bool):
+    db_pool_wait_seconds.observe(waited, "timeout" if timed_out else "acquired")
+
+def snake_case(name: str) -> str:
+    return "".join(f"_{c.lower()}" if c.isupper() else c for c in name)
+
+# Deadline, retries, hedging and circuit breaker around every messages.create call
+claude_breaker = CircuitBreaker(failure_threshold=CLAUDE_BREAKER_THRESHOLD, reset_timeout=CLAUDE_BREAKER_RESET)
+claude_caller = ResilientCaller(
+    claude_breaker,
+    max_retries=CLAUDE_MAX_RETRIES,
+    base_delay=CLAUDE_RETRY_BASE_DELAY,
+    max_delay=CLAUDE_RETRY_MAX_DELAY,
+    default_deadline=CLAUDE_DEADLINE,
+    hedge=ENABLE_HEDGING,
+    hedge_percentile=CLAUDE_HEDGE_PERCENTILE,
+    hedge_min_delay=CLAUDE_HEDGE_MIN_DELAY
+)
 
-Please provide a structured response with:
-1. Acceptance Criteria (specific, testable conditions using Given-When-Then format where appropriate)
-2. Edge Cases to Consider (potential issues, boundary conditions)
-3. Success Metrics (measurable outcomes, KPIs)
-4. Test Scenarios (specific test cases for QA)
+# Changes whenever the prompt or model changes, so stale cached clarifications are never served
+PROMPT_VERSION = hashlib.sha256("\n".join([
+    CLAUDE_MODEL,
+    str(CLAUDE_MAX_TOKENS),
+    CLAUDE_FAST_MODEL if ENABLE_MODEL_ROUTING else "",
+    CLARIFY_SYSTEM_PROMPT,
+    json.dumps(CLARIFICATION_TOOLS, sort_keys=True),
+    build_user_prompt("{title}", "{description}", "{issue_type}", "{priority}", [])
+]).encode("utf-8")).hexdigest()[:16]
 
-Format your response as valid JSON with these exact keys:
-{{
-  "acceptanceCriteria": ["criterion 1", "criterion 2", ...],
-  "edgeCases": ["edge case 1", "edge case 2", ...],
-  "successMetrics": ["metric 1", "metric 2", ...],
-  "testScenarios": ["scenario 1", "scenario 2", ...]
-}}
+# Input/output and prompt cache token totals for live Claude calls (reported by /health)
+token_usage = TokenUsage()
 
-Focus on being practical and actionable. Provide at least 3-5 items for each category."""
+# How responses parsed: tool use vs. text, repairs, failures and section re-asks (reported by /health)
+parse_metrics = ParseMetrics()
 
-    try:
-        # Call Claude API
-        message = app.state.claude.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000,
-            messages=[
+def build_prompt(ticket: TicketInput, similar_tickets: List[Dict]) -> str:
+    """Render the per-ticket user message (the instructions live in the cached system prompt)"""
+    return build_user_prompt(ticket.title, ticket.description, ticket.issueType, ticket.priority, similar_tickets)
+
+def build_message_params(ticket: TicketInput, similar_tickets: List[Dict], tier: ModelTier = STRONG_TIER) -> Dict[str, Any]:
+    """
+    Messages API params for clarifying a ticket
+    
+    The system block (instructions, schema, few-shot examples) is identical
+    for every ticket and marked for prompt caching, so repeat calls within
+    the cache TTL only pay full price for the short per-ticket message.
+    Output is forced through the record_clarification tool schema.
+    """
+    with stage_seconds.time("prompt_build"):
+        return {
+            "model": tier.model,
+            "max_tokens": tier.max_tokens,
+            "tools": CLARIFICATION_TOOLS,
+            "tool_choice": tool_choice(CLARIFICATION_TOOL_NAME),
+            "system": system_blocks(),
+            "messages": [
                 {
                     "role": "user",
-                    "content": prompt
+                    "content": build_prompt(ticket, similar_tickets)
                 }
             ]
+        }
+
+def clarification_cache_key(ticket: TicketInput) -> str:
+    """
+    Content-addressed key over the normalized ticket fields and prompt version
+    
+    With RAG on, prompts include the org's own past tickets, so results
+    are cached per org.
+    """
+    parts = [
+        ticket.title,
+        ticket.description,
+        (ticket.issueType or "").lower(),
+        (ticket.priority or "").lower(),
+        PROMPT_VERSION
+    ]
+    if ENABLE_RAG:
+        parts.append(ticket.orgId)
+    return content_hash(*parts)
+
+def parse_clarification(content: str, processing_time: Optional[float] = None) -> ClarifiedOutput:
+    """
+    Parse a response into a ClarifiedOutput without re-asking
+    
+    Malformed sections come back empty; raises ClarificationParseError if
+    nothing is usable. Used for offline batch results.
+    """
+    used_tool = content.lstrip().startswith("{")  # tool input is bare JSON; text replies are fenced or prose
+    try:
+        parsed = parse_sections(content)
+    except ClarificationParseError:
+        parse_metrics.record_response(used_tool, None)
+        raise
+    parse_metrics.record_response(used_tool, parsed)
+    return ClarifiedOutput(**parsed.sections, processingTime=processing_time)
+
+def route_ticket(ticket: TicketInput) -> RoutingDecision:
+    """Pick the model tier for a ticket (always Sonnet unless routing is enabled)"""
+    if not ENABLE_MODEL_ROUTING:
+        return RoutingDecision(STRONG_TIER, 0, [])
+    
+    decision = model_router.route(ticket.title, ticket.description, ticket.issueType, ticket.priority)
+    routing_stats.record_route(decision.tier)
+    if sampled(LOG_SAMPLE_RATE):
+        logger.info("Routed ticket", extra={
+            "tier": decision.tier.name,
+            "model": decision.tier.model,
+            "complexity": decision.complexity,
+            "reasons": decision.reasons
+        })
+    return decision
+
+def record_claude_call(model: str, latency: float, usage):
+    """Add a response's token usage to the totals and metrics, and log its latency and spend"""
+    tokens = token_usage.record(usage)
+    routing_stats.record_call(model, latency, tokens)
+    stage_seconds.observe(latency, "llm")
+    for kind, count in tokens.items():
+        if count:
+            claude_tokens.inc(model, kind.removesuffix("_tokens"), amount=count)
+    if sampled(LOG_SAMPLE_RATE):
+        logger.info("Claude call", extra={
+            "model": model,
+            "latencyMs": round(latency * 1000),
+            "inputTokens": tokens['input_tokens'],
+            "cachedTokens": tokens['cache_read_input_tokens'],
+            "outputTokens": tokens['output_tokens']
+        })
+
+def claude_span_attributes(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "gen_ai.system": "anthropic",
+        "gen_ai.request.model": params["model"],
+        "gen_ai.request.max_tokens": params.get("max_tokens")
+    }
+
+def record_usage_on_span(span, usage):
+    if span is not None and usage is not None:
+        span.set_attribute("gen_ai.usage.input_tokens", usage.input_tokens)
+        span.set_attribute("gen_ai.usage.output_tokens", usage.output_tokens)
+
+async def create_message(client, params: Dict[str, Any]):
+    """One messages.create attempt in its own span (retries and hedges each get one)"""
+    with trace_span("anthropic messages.create", "client", claude_span_attributes(params)) as span:
+        message = await client.messages.create(**params)
+        record_usage_on_span(span, message.usage)
+        return message
+
+async def call_claude(params: Dict[str, Any]):
+    """
+    messages.create under the current deadline, with retries, optional
+    hedging and the circuit breaker, plus latency and token accounting
+    """
+    client = app.state.claude.with_options(max_retries=0)  # claude_caller owns retries
+    start = time.perf_counter()
+    message = await claude_caller.call(lambda: create_message(client, params), key=params["model"])
+    record_claude_call(params["model"], time.perf_counter() - start, message.usage)
+    return message
+
+async def reask_section(ticket: TicketInput, similar_tickets: List[Dict], section: str) -> List[str]:
+    """
+    Ask Claude for a single section that came back malformed
+    
+    Reuses the cached system prefix and tool list, so the call costs the
+    short ticket message plus at most CLARIFY_SECTION_MAX_TOKENS of output
+    instead of a full regeneration. Returns [] if the re-ask fails too.
+    """
+    params = build_message_params(ticket, similar_tickets)
+    params["max_tokens"] = CLARIFY_SECTION_MAX_TOKENS
+    params["tool_choice"] = tool_choice(SECTION_TOOL_NAME)
+    params["messages"][0]["content"] += section_request(section)
+    
+    parse_metrics.increment("sectionReasks")
+    try:
+        message = await call_claude(params)
+        return parse_section_items(response_content(message)[0], section)
+    except Exception as e:
+        logger.warning("Section re-ask failed", extra={"section": section, "error": str(e)})
+        parse_metrics.increment("sectionReaskFailures")
+        return []
+
+async def complete_clarification(
+    ticket: TicketInput,
+    similar_tickets: List[Dict],
+    content: str,
+    used_tool: bool,
+    reask: bool = True
+) -> Tuple[Dict[str, List[str]], List[str]]:
+    """
+    Parse a response and re-ask for any malformed sections
+    
+    Returns the sections and the names of the malformed ones (re-asked
+    unless reask=False, in which case they are left empty).
+    Raises ClarificationParseError if no section was usable, since a full
+    regeneration is then no more expensive than per-section re-asks.
+    """
+    try:
+        with stage_seconds.time("parse"):
+            parsed = parse_sections(content)
+    except ClarificationParseError:
+        parse_metrics.record_response(used_tool, None)
+        raise
+    parse_metrics.record_response(used_tool, parsed)
+    if parsed.repaired:
+        logger.info("Repaired truncated clarification", extra={"malformed": parsed.malformed})
+    
+    sections = dict(parsed.sections)
+    if not reask:
+        return sections, parsed.malformed
+    reasked = await asyncio.gather(*(reask_section(ticket, similar_tickets, section) for section in parsed.malformed))
+    sections.update(zip(parsed.malformed, reasked))
+    return sections, parsed.malformed
+
+def error_type(e: Exception) -> str:
+    """Label for clarify_errors_total"""
+    if isinstance(e, ClarificationParseError):
+        return "parse"
+    if isinstance(e, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(e, DeadlineExceeded):
+        return "deadline"
+    if isinstance(e, anthropic.APIStatusError):
+        return f"upstream_{e.status_code}"
+    if isinstance(e, anthropic.APIConnectionError):
+        return "upstream_connection"
+    return type(e).__name__
+
+def upstream_unavailable(e: Exception) -> HTTPException:
+    """503 while the circuit is open, 504 when the deadline ran out"""
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(
+            status_code=503,
+            detail="AI service temporarily unavailable",
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
         )
+    return HTTPException(status_code=504, detail="AI service timed out")
+
+async def generate_clarification(ticket: TicketInput) -> ClarifiedOutput:
+    """Generate clarification using Claude AI, all within CLAUDE_DEADLINE"""
+    if not getattr(app.state, 'claude', None):
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    
+    with deadline_scope(CLAUDE_DEADLINE):
+        return await clarify_within_deadline(ticket)
+
+async def clarify_within_deadline(ticket: TicketInput) -> ClarifiedOutput:
+    start_time = time.perf_counter()
+    
+    # Get similar tickets for context (optional)
+    similar_tickets = await get_similar_tickets(ticket)
+    
+    # Simple tickets try the fast model first; a weak or invalid answer escalates to Sonnet
+    decision = route_ticket(ticket)
+    if decision.tier is FAST_TIER:
+        try:
+            message = await call_claude(build_message_params(ticket, similar_tickets, FAST_TIER))
+            content, used_tool = response_content(message)
+            sections, malformed = await complete_clarification(ticket, similar_tickets, content, used_tool, reask=False)
+            reason = model_router.escalation_reason(sections, malformed)
+        except Exception as e:
+            reason = f"fast model failed: {e}"
         
-        # Parse response
-        content = message.content[0].text
-        
-        # Handle potential markdown code blocks
-        if '```json' in content:
-            content = content.split('```json')[1].split('```')[0].strip()
-        elif '```' in content:
-            content = content.split('```')[1].split('```')[0].strip()
+        if not reason:
+            return ClarifiedOutput(**sections, processingTime=time.perf_counter() - start_time)
+        routing_stats.record_escalation()
+        logger.info("Escalating ticket", extra={"model": STRONG_TIER.model, "reason": reason})
+    
+    content = ""
+    try:
+        # Call Claude API
+        message = await call_claude(build_message_params(ticket, similar_tickets))
         
-        parsed = json.loads(content)
+        # Parse the tool call (or text), repairing truncation and re-asking for malformed sections
+        content, used_tool = response_content(message)
+        sections, _ = await complete_clarification(ticket, similar_tickets, content, used_tool)
         
         # Calculate processing time
-        processing_time = (datetime.now() - start_time).total_seconds()
-        
-        # Build output
-        output = ClarifiedOutput(
-            acceptanceCriteria=parsed.get('acceptanceCriteria', []),
-            edgeCases=parsed.get('edgeCases', []),
-            successMetrics=parsed.get('successMetrics', []),
-            testScenarios=parsed.get('testScenarios', []),
-            processingTime=processing_time
-        )
+        processing_time = time.perf_counter() - start_time
         
-        return output
+        return ClarifiedOutput(**sections, processingTime=processing_time)
         
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing error: {e}")
-        print(f"Content: {content}")
+    except ClarificationParseError as e:
+        logger.error("Clarification parsing error", extra={"error": str(e)})
+        logger.debug("Unparsed clarification content", extra={"content": content[:LOG_CONTENT_MAX_CHARS]})
+        clarify_errors.inc(error_type(e))
         raise HTTPException(status_code=500, detail="Failed to parse AI response")
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        logger.warning("AI service unavailable", extra={"error": str(e)})
+        clarify_errors.inc(error_type(e))
+        raise upstream_unavailable(e)
     except Exception as e:
-        print(f"AI generation error: {e}")
+        logger.error("AI generation error", extra={"error": str(e)})
+        clarify_errors.inc(error_type(e))
         raise HTTPException(status_code=500, detail=f"AI processing failed: {str(e)}")
 
-def store_ticket(ticket: TicketInput, output: ClarifiedOutput):
-    """Store ticket for analytics and future training"""
-    if not ENABLE_ANALYTICS or not DATABASE_URL:
+async def clarify_coalesced(ticket: TicketInput, cache_key: str) -> Tuple[ClarifiedOutput, bool]:
+    """
+    generate_clarification, shared by all concurrent requests for the same cache key
+    
+    Returns the output and whether another request produced it (that
+    request caches and stores it). Each caller still reserves and, on
+    failure, refunds its own usage.
+    """
+    flight = getattr(app.state, 'single_flight', None)
+    if flight is None:
+        return await generate_clarification(ticket), False
+    
+    async def generate() -> Dict[str, Any]:
+        return (await generate_clarification(ticket)).model_dump()
+    
+    value, shared = await flight.do(cache_key, generate)
+    return ClarifiedOutput(**value), shared
+
+def build_batch_request(ticket: Dict[str, Any]) -> Dict[str, Any]:
+    """Message params for one ticket in an offline batch (same prompt as /clarify)"""
+    return build_message_params(TicketInput(**ticket), [])
+
+def create_job_runner(store, client) -> JobRunner:
+    """Wire a job runner to the same prompt and parser as generate_clarification"""
+    return JobRunner(
+        store,
+        client,
+        build_request=build_batch_request,
+        parse=lambda content: parse_clarification(content).model_dump(),
+        refund=refund_usage,
+        poll_interval=JOBS_POLL_INTERVAL
+    )
+
+def index_tickets(tickets: List[TicketInput]):
+    """Add clarified tickets to the embedded vector index so later clarifications can retrieve them"""
+    index = getattr(app.state, 'vector_index', None)
+    retriever = getattr(app.state, 'retriever', None)
+    tickets = [ticket for ticket in tickets if ticket.orgId]
+    if index is None or not retriever or not tickets:
+        return
+    
+    try:
+        texts = [ticket_text(ticket.title, ticket.description) for ticket in tickets]
+        by_org: Dict[str, List[Dict[str, Any]]] = {}
+        for ticket, text, values in zip(tickets, texts, retriever.embedder.embed(texts)):
+            by_org.setdefault(ticket.orgId, []).append({
+                "id": content_hash(ticket.orgId, text),
+                "values": values,
+                "metadata": {"title": ticket.title, "desc": ticket.description}
+            })
+        for org_id, vectors in by_org.items():
+            index.upsert(vectors, namespace=org_id)
+    except Exception as e:
+        logger.error("Error indexing tickets", extra={"error": str(e)})
+
+def ticket_row(ticket: TicketInput, output: ClarifiedOutput) -> List[Any]:
+    """Column values for one tickets row (JSON-serializable, so it can be queued or spilled)"""
+    return [
+        ticket.orgId,
+        ticket.title,
+        ticket.description,
+        ticket.issueType,
+        ticket.priority,
+        output.model_dump(),
+        output.processingTime
+    ]
+
+def insert_ticket_rows(rows: List[List[Any]]):
+    """Insert analytics rows with a single multi-row INSERT (raises on failure)"""
+    if not ENABLE_ANALYTICS or not DATABASE_URL or not rows:
         return
     
     conn = get_db_connection()
     if not conn:
-        return
+        raise RuntimeError("Database unavailable")
     
     try:
         cur = conn.cursor()
-        cur.execute("""
+        execute_values(cur, """
             INSERT INTO tickets 
             (org_id, ticket_title, ticket_description, issue_type, priority, clarified_output, processing_time)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (
-            ticket.orgId or 'unknown',
-            ticket.title,
-            ticket.description,
-            ticket.issueType,
-            ticket.priority,
-            json.dumps(output.dict()),
-            output.processingTime
-        ))
+            VALUES %s
+        """, [
+            (org_id or 'unknown', title, description, issue_type, priority, json.dumps(output), processing_time)
+            for org_id, title, description, issue_type, priority, output, processing_time in rows
+        ])
         conn.commit()
+    finally:
+        release_db_connection(conn)
+
+def store_tickets(results: List[Tuple[TicketInput, ClarifiedOutput]]):
+    """Store clarified tickets for analytics with a single multi-row INSERT"""
+    index_tickets([ticket for ticket, _ in results])
+    try:
+        insert_ticket_rows([ticket_row(ticket, output) for ticket, output in results])
     except Exception as e:
-        print(f"Error storing ticket: {e}")
+        logger.error("Error storing tickets", extra={"error": str(e)})
+
+def write_analytics_rows(kind: str, rows: List[List[Any]]):
+    """BatchWriter sink: index and insert a batch of tickets, or insert a batch of feedback"""
+    if kind == "tickets":
+        index_tickets([TicketInput(orgId=row[0], title=row[1], description=row[2]) for row in rows])
+        insert_ticket_rows(rows)
+    elif kind == "feedback":
+        insert_feedback_rows(rows)
+    else:
+        raise ValueError(f"Unknown analytics row kind: {kind}")
+
+async def save_tickets(results: List[Tuple[TicketInput, ClarifiedOutput]]):
+    """Queue clarified tickets for the background writer, or store them inline without one"""
+    writer = getattr(app.state, 'batch_writer', None)
+    with stage_seconds.time("analytics_write"):
+        if writer is None:
+            await asyncio.to_thread(store_tickets, results)
+            return
+        for ticket, output in results:
+            await writer.put("tickets", ticket_row(ticket, output))
+
+def license_record(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Cacheable (JSON-safe) view of a license_keys row"""
+    record = {
+        column: row[column]
+        for column in ('plan', 'is_active', 'subscription_status', 'clarifications_limit', 'clarifications_used')
+    }
+    for column in ('usage_resets_at', 'activated_at'):
+        record[column] = row[column].isoformat() if row[column] else None
+    return record
+
+def usage_epoch(key_data: Dict[str, Any]) -> str:
+    """Billing period a usage count belongs to (changes whenever usage is reset)"""
+    return key_data['usage_resets_at'] or ""
+
+def format_reset_date(key_data: Dict[str, Any]) -> str:
+    if not key_data['usage_resets_at']:
+        return 'soon'
+    return datetime.fromisoformat(key_data['usage_resets_at']).strftime('%B %d')
+
+def merged_usage(key_data: Dict[str, Any], counted: Optional[Tuple[int, str]]) -> int:
+    """Usage including increments the usage counter hasn't flushed yet"""
+    if counted and counted[1] == usage_epoch(key_data):
+        return counted[0]
+    return key_data['clarifications_used']
+
+def usage_limit_error(key_data: Dict[str, Any], used: int, count: int) -> HTTPException:
+    remaining = max(0, key_data['clarifications_limit'] - used)
+    return HTTPException(
+        status_code=429,
+        detail=f"Monthly limit of {key_data['clarifications_limit']} clarifications reached "
+               f"({remaining} remaining, {count} requested). Resets on {format_reset_date(key_data)}."
+    )
+
+def fetch_license_record(key_code: str) -> Optional[Dict[str, Any]]:
+    """Read a license key from Postgres as a license_record (None if it doesn't exist)"""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database unavailable")
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT 
+                plan,
+                is_active,
+                subscription_status,
+                clarifications_limit,
+                clarifications_used,
+                usage_resets_at,
+                activated_at
+            FROM license_keys
+            WHERE key_code = %s
+        """, (key_code,))
+        row = cur.fetchone()
+        return license_record(row) if row else None
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+async def get_license_record(key_code: str) -> Optional[Dict[str, Any]]:
+    """License key record, from the license key cache when possible"""
+    cache = getattr(app.state, 'license_cache', None)
+    if cache:
+        record, _ = await cache.get(key_code)
+        if record is not None:
+            return record
+    
+    record = await asyncio.to_thread(fetch_license_record, key_code)
+    if record and cache:
+        await cache.set(key_code, record)
+    return record
+
+async def invalidate_license_cache(key_codes: List[str]):
+    cache = getattr(app.state, 'license_cache', None)
+    if cache:
+        await cache.invalidate(key_codes)
+
+_sync_redis_lock = threading.Lock()
+
+def get_sync_redis() -> redis.Redis:
+    """Blocking Redis client shared by worker threads (redis-py pools its connections)"""
+    client = getattr(app.state, 'sync_redis', None)
+    if client is None:
+        with _sync_redis_lock:
+            client = getattr(app.state, 'sync_redis', None)
+            if client is None:
+                client = instrument_redis(redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=2))
+                app.state.sync_redis = client
+    return client
+
+def invalidate_license_keys(key_codes: List[str]):
+    """
+    Drop cached records for changed license keys in every worker
+    
+    Synchronous so webhook threads and cron jobs can call it; deletes the
+    Redis entries and publishes the key codes for each worker's listener.
+    """
+    key_codes = [key_code for key_code in key_codes if key_code]
+    if not key_codes:
+        return
+    
+    cache = getattr(app.state, 'license_cache', None)
+    if cache:
+        cache.discard_threadsafe(key_codes)
+    
+    if not ENABLE_CACHE or not REDIS_URL:
+        return
+    
+    try:
+        with get_sync_redis().pipeline() as pipe:
+            pipe.delete(*[LICENSE_CACHE_PREFIX + key_code for key_code in key_codes])
+            pipe.publish(LICENSE_INVALIDATION_CHANNEL, json.dumps(key_codes))
+            pipe.execute()
+    except Exception as e:
+        logger.warning("License cache invalidation error", extra={"error": str(e)})
+
+async def counted_usage(license_key: str) -> Optional[Tuple[int, str]]:
+    """Snapshot from the usage counter for merged_usage (None without one)"""
+    counter = getattr(app.state, 'usage_counter', None)
+    if not counter:
+        return None
+    try:
+        return await counter.snapshot(license_key)
+    except Exception as e:
+        logger.warning("Usage counter unavailable", extra={"error": str(e)})
+        return None
+
+async def reserve_usage(license_key: str, count: int = 1) -> int:
+    """
+    Atomically reserve `count` clarifications against a license key
+    
+    With the usage counter, the check and increment happen in Redis and
+    reach license_keys on the next flush; otherwise they are one
+    conditional UPDATE. Either way concurrent requests can never push a
+    key past its limit. Raises 429 when the key has too few clarifications
+    left and 403 when it is inactive. Returns the number reserved, which
+    is 0 for keys we don't meter (unknown keys, or the database is
+    unavailable); pass it to refund_usage on failure.
+    """
+    counter = getattr(app.state, 'usage_counter', None)
+    if not counter:
+        return await asyncio.to_thread(reserve_usage_in_db, license_key, count)
+    
+    try:
+        key_data = await get_license_record(license_key)
+    except Exception as e:
+        logger.error("Error reserving usage", extra={"error": str(e)})
+        return 0
+    if not key_data:
+        return 0
+    if not key_data['is_active']:
+        raise HTTPException(status_code=403, detail="This license key has been deactivated. Please contact support.")
+    
+    try:
+        allowed, used = await counter.reserve(
+            license_key,
+            count,
+            key_data['clarifications_limit'],
+            key_data['clarifications_used'],
+            usage_epoch(key_data)
+        )
+    except Exception as e:
+        logger.warning("Usage counter unavailable, reserving in database", extra={"error": str(e)})
+        return await asyncio.to_thread(reserve_usage_in_db, license_key, count)
+    
+    if not allowed:
+        raise usage_limit_error(key_data, used, count)
+    
+    if sampled(LOG_SAMPLE_RATE):
+        logger.info("Usage reserved", extra={"used": used, "limit": key_data['clarifications_limit']})
+    return count
+
+async def refund_usage(license_key: str, count: int):
+    """Give back reserved clarifications whose generation failed"""
+    if count <= 0:
+        return
+    
+    counter = getattr(app.state, 'usage_counter', None)
+    if counter:
+        try:
+            if await counter.refund(license_key, count):
+                logger.info("Refunded usage", extra={"refunded": count})
+                return
+        except Exception as e:
+            logger.warning("Usage counter unavailable, refunding in database", extra={"error": str(e)})
+    
+    await asyncio.to_thread(refund_usage_in_db, license_key, count)
+
+def reserve_usage_in_db(license_key: str, count: int = 1) -> int:
+    """reserve_usage as a single conditional UPDATE on license_keys"""
+    conn = get_db_connection()
+    if not conn:
+        return 0
+    
+    try:
+        cur = conn.cursor()
+        
+        cur.execute("""
+            UPDATE license_keys
+            SET clarifications_used = clarifications_used + %s,
+                updated_at = NOW()
+            WHERE key_code = %s
+            AND is_active = true
+            AND clarifications_used + %s <= clarifications_limit
+            RETURNING clarifications_used, clarifications_limit
+        """, (count, license_key, count))
+        
+        result = cur.fetchone()
+        conn.commit()
+        
+        if result:
+            if sampled(LOG_SAMPLE_RATE):
+                logger.info("Usage reserved", extra={"used": result['clarifications_used'], "limit": result['clarifications_limit']})
+            return count
+        
+        # Nothing reserved: find out why
+        cur.execute("""
+            SELECT plan, is_active, subscription_status, clarifications_limit,
+                   clarifications_used, usage_resets_at, activated_at
+            FROM license_keys
+            WHERE key_code = %s
+        """, (license_key,))
+        key_data = cur.fetchone()
+        
+    except Exception as e:
+        logger.error("Error reserving usage", extra={"error": str(e)})
+        return 0
+    finally:
+        release_db_connection(conn)
+    
+    if not key_data:
+        return 0
+    
+    if not key_data['is_active']:
+        raise HTTPException(status_code=403, detail="This license key has been deactivated. Please contact support.")
+    
+    key_data = license_record(key_data)
+    raise usage_limit_error(key_data, key_data['clarifications_used'], count)
+
+def refund_usage_in_db(license_key: str, count: int):
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE license_keys
+            SET clarifications_used = GREATEST(clarifications_used - %s, 0),
+                updated_at = NOW()
+            WHERE key_code = %s
+        """, (count, license_key))
+        conn.commit()
+        logger.info("Refunded usage", extra={"refunded": count})
+    except Exception as e:
+        logger.error("Error refunding usage", extra={"error": str(e)})
+    finally:
+        release_db_connection(conn)
+
+def apply_usage_deltas(flush_id: str, deltas: List[UsageDelta]):
+    """
+    Add flushed usage deltas to license_keys in one batched UPDATE
+    
+    The flush id is recorded in the same transaction, so a flush retried
+    after a crash is skipped instead of counted twice. Deltas from a
+    billing period that has since been reset are dropped.
+    """
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database unavailable")
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO usage_flushes (flush_id) VALUES (%s)
+            ON CONFLICT (flush_id) DO NOTHING
+        """, (flush_id,))
+        if cur.rowcount == 0:
+            conn.rollback()
+            return
+        
+        execute_values(cur, """
+            UPDATE license_keys AS k
+            SET clarifications_used = GREATEST(k.clarifications_used + v.delta, 0),
+                updated_at = NOW()
+            FROM (VALUES %s) AS v (key_code, epoch, delta)
+            WHERE k.key_code = v.key_code
+            AND k.usage_resets_at IS NOT DISTINCT FROM v.epoch::timestamp
+        """, [(key_code, epoch or None, delta) for key_code, epoch, delta in deltas])
+        
+        cur.execute("DELETE FROM usage_flushes WHERE flushed_at < NOW() - INTERVAL '1 day'")
+        conn.commit()
+        logger.info("Flushed usage", extra={"keys": len(deltas)})
+    finally:
+        release_db_connection(conn)
+
+async def apply_usage_flush(flush_id: str, deltas: List[UsageDelta]):
+    await asyncio.to_thread(apply_usage_deltas, flush_id, deltas)
 
 # ============================================================================
 # API Endpoints
@@ -675,10 +1868,36 @@ async def root():
             "rag": ENABLE_RAG,
             "rateLimiting": ENABLE_RATE_LIMITING,
             "payments": ENABLE_PAYMENTS,
-            "analytics": ENABLE_ANALYTICS
+            "analytics": ENABLE_ANALYTICS,
+            "cache": ENABLE_CACHE
         }
     }
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics: per-stage latency histograms, token counts, cache
+    lookups, errors, parse outcomes, request coalescing and DB pool usage
+    """
+    pool = getattr(app.state, 'db_pool', None)
+    if pool:
+        stats = pool.stats()
+        db_pool_connections.set(stats["inUse"], "in_use")
+        db_pool_connections.set(stats["idle"], "idle")
+        db_pool_connections.set(stats["maxSize"], "max")
+    
+    counts = parse_metrics.snapshot()
+    for field in ParseMetrics.FIELDS:
+        parse_outcomes.set(counts[field], snake_case(field))
+    
+    flight = getattr(app.state, 'single_flight', None)
+    if flight:
+        stats = flight.snapshot()
+        for role in ("requests", "leaders", "coalesced", "coalescedRemote"):
+            coalescing_requests.set(stats[role], snake_case(role))
+        coalescing_rate.set(stats["coalescingRate"])
+    return PlainTextResponse(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -686,68 +1905,509 @@ async def health_check():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "services": {
-            "claude": app.state.claude is not None,
+            "claude": getattr(app.state, 'claude', None) is not None,
             "redis": hasattr(app.state, 'redis') and app.state.redis is not None,
             "database": DATABASE_URL is not None,
-            "pinecone": hasattr(app.state, 'index')
+            "pinecone": hasattr(app.state, 'index'),
+            "rag": getattr(app.state, 'retriever', None) is not None,
+            "vectorIndex": getattr(app.state, 'vector_index', None) is not None
         }
     }
+    
+    # Prompt cache reads vs. writes show whether the static prefix is being reused
+    health["claudeUsage"] = token_usage.snapshot()
+    
+    # Tickets per model tier, escalations, per-model latency and token spend
+    health["routing"] = routing_stats.snapshot()
+    
+    # Tool-use vs. text responses, truncation repairs and section re-asks
+    health["clarificationParsing"] = parse_metrics.snapshot()
+    
+    # Retries, hedges, deadline misses and circuit state for Claude calls
+    health["upstream"] = claude_caller.snapshot()
+    
+    # Whether spans are exported, and the share of new traces kept
+    health["tracing"] = {
+        "enabled": getattr(app.state, 'tracer_provider', None) is not None,
+        "sampleRatio": TRACE_SAMPLE_RATIO
+    }
+    
+    # Queued, written, spilled and dropped analytics/feedback rows
+    writer = getattr(app.state, 'batch_writer', None)
+    if writer:
+        health["backgroundWrites"] = writer.snapshot()
+    
+    # Identical in-flight clarifications that shared one Claude call
+    flight = getattr(app.state, 'single_flight', None)
+    if flight:
+        health["coalescing"] = flight.snapshot()
+    
+    # Stripe webhook events applied, retried and given up on
+    stripe_worker = getattr(app.state, 'stripe_worker', None)
+    if stripe_worker:
+        health["stripeEvents"] = stripe_worker.snapshot()
+    
+    # Stripe object lookups answered locally instead of by the API
+    stripe_objects = getattr(app.state, 'stripe_objects', None)
+    if stripe_objects:
+        health["stripeObjectCache"] = stripe_objects.snapshot()
+    
+    # Pool checkout wait time and in-use connections
+    pool = getattr(app.state, 'db_pool', None)
+    if pool:
+        health["databasePool"] = pool.stats()
+    
     return health
 
 @app.post("/clarify", response_model=ClarifiedOutput)
-async def clarify_ticket(ticket: TicketInput):
+async def clarify_ticket(ticket: TicketInput, request: Request, response: Response):
     """
     Clarify ticket and increment usage counter
+    
+    Identical tickets are served from the clarification cache without
+    calling Claude or consuming usage.
     """
+    start = time.perf_counter()
     license_key = ticket.orgId or "free_user"
+    bind_log_context(key=mask_key(license_key))
+    response.headers.update(await enforce_rate_limit(request, license_key))
+    
+    cache = getattr(app.state, 'clarification_cache', None)
+    cache_key = clarification_cache_key(ticket)
+    if cache:
+        cached, tier = await cache.get(cache_key)
+        cache_lookups.inc(tier or "miss")
+        if cached is not None:
+            response.headers["X-Cache"] = "HIT"
+            response.headers["X-Cache-Tier"] = tier
+            request_seconds.observe(time.perf_counter() - start, "clarify")
+            return ClarifiedOutput(**cached)
     
-    # For paid users, check and increment usage
+    # For paid users, reserve usage before spending anything on Claude
+    reserved = 0
     if license_key != "free_user":
-        conn = get_db_connection()
-        if conn:
-            try:
-                cur = conn.cursor()
-                
-                # Increment usage counter
-                cur.execute("""
-                    UPDATE license_keys
-                    SET clarifications_used = clarifications_used + 1,
-                        updated_at = NOW()
-                    WHERE key_code = %s
-                    AND is_active = true
-                    RETURNING clarifications_used, clarifications_limit
-                """, (license_key,))
-                
-                result = cur.fetchone()
-                conn.commit()
-                
-                if result:
-                    print(f"📊 Usage: {result['clarifications_used']}/{result['clarifications_limit']} for {license_key}")
-                
-            except Exception as e:
-                print(f"Error tracking usage: {e}")
-            finally:
-                conn.close()
+        with stage_seconds.time("usage"):
+            reserved = await reserve_usage(license_key)
+    
+    # Generate clarification, sharing the Claude call with identical in-flight requests
+    try:
+        output, shared = await clarify_coalesced(ticket, cache_key)
+    except Exception as e:
+        logger.error("Clarification error", extra={"error": str(e)})
+        await refund_usage(license_key, reserved)
+        if isinstance(e, HTTPException) and e.status_code in (503, 504):
+            raise  # let clients back off or retry
+        raise HTTPException(status_code=500, detail="Failed to clarify ticket")
+    
+    response.headers["X-Cache"] = "MISS"
+    if shared:
+        response.headers["X-Coalesced"] = "true"
+        request_seconds.observe(time.perf_counter() - start, "clarify")
+        return output
+    
+    if cache:
+        await cache.set(cache_key, output.model_dump())
+    
+    # Store for analytics
+    if ENABLE_ANALYTICS:
+        await save_tickets([(ticket, output)])
+    
+    request_seconds.observe(time.perf_counter() - start, "clarify")
+    return output
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"  # Stop proxies from buffering the stream
+}
+
+async def stream_tier_items(
+    ticket: TicketInput,
+    similar_tickets: List[Dict],
+    tier: ModelTier,
+    result: Dict[str, Any]
+) -> AsyncIterator[str]:
+    """Stream one model's items as SSE events, leaving the raw content and used_tool in `result`"""
+    parser = IncrementalSectionParser()
+    chunks = []
+    result["used_tool"] = False
+    # Streams are not retried or hedged, but an open circuit still fails them fast
+    probing = claude_breaker.check()
+    start = time.perf_counter()
+    
+    params = build_message_params(ticket, similar_tickets, tier)
+    
+    try:
+        with trace_span("anthropic messages.stream", "client", claude_span_attributes(params), current=False) as span:
+            async with app.state.claude.messages.stream(**params) as stream:
+                async for event in stream:
+                    if event.type != "content_block_delta":
+                        continue
+                    # Tool input arrives as partial JSON; a plain text reply is parsed the same way
+                    if event.delta.type == "input_json_delta":
+                        result["used_tool"] = True
+                        chunk = event.delta.partial_json
+                    elif event.delta.type == "text_delta":
+                        chunk = event.delta.text
+                    else:
+                        continue
+                    if not chunks:
+                        stage_seconds.observe(time.perf_counter() - start, "llm_first_token")
+                    chunks.append(chunk)
+                    for section, item in parser.feed(chunk):
+                        yield sse_event("item", {"section": section, "item": item})
+                usage = (await stream.get_final_message()).usage
+                record_claude_call(tier.model, time.perf_counter() - start, usage)
+                record_usage_on_span(span, usage)
+    except Exception as e:
+        if is_retryable(e):
+            claude_breaker.record_failure()
+        elif isinstance(e, anthropic.APIStatusError):
+            claude_breaker.record_success()  # the upstream answered, so it is reachable
+        raise
+    else:
+        claude_breaker.record_success()
+    finally:
+        # The client may close the stream mid-probe; let the next call probe instead
+        if probing:
+            claude_breaker.release_probe()
+    
+    result["content"] = "".join(chunks)
+
+async def stream_clarification(
+    ticket: TicketInput,
+    cache_key: str,
+    license_key: str = "free_user"
+) -> AsyncIterator[str]:
+    """
+    Stream each finished item as an SSE event, then the full ClarifiedOutput
+    
+    If a fast-model answer is escalated, an "escalated" event tells the
+    client to discard the items so far before Sonnet's items arrive.
+    Paid usage is reserved once the body starts streaming (so a client
+    that disconnects before then is never charged) and refunded unless a
+    clarification is produced, including on a disconnect mid-stream.
+    """
+    start_time = time.perf_counter()
+    output = None
+    reserved = 0
     
-    # Generate clarification (existing logic)
     try:
-        output = await generate_clarification(ticket)
+        # For paid users, reserve usage before spending anything on Claude
+        if license_key != "free_user":
+            with stage_seconds.time("usage"):
+                reserved = await reserve_usage(license_key)
         
-        # Store for analytics
-        if ENABLE_ANALYTICS:
-            store_ticket(ticket, output)
+        similar_tickets = await get_similar_tickets(ticket)
+        decision = route_ticket(ticket)
         
-        return output
+        if decision.tier is FAST_TIER:
+            result: Dict[str, Any] = {}
+            try:
+                async for event in stream_tier_items(ticket, similar_tickets, FAST_TIER, result):
+                    yield event
+                sections, malformed = await complete_clarification(
+                    ticket, similar_tickets, result["content"], result["used_tool"], reask=False
+                )
+                reason = model_router.escalation_reason(sections, malformed)
+            except Exception as e:
+                reason = f"fast model failed: {e}"
+            
+            if reason:
+                routing_stats.record_escalation()
+                logger.info("Escalating ticket", extra={"model": STRONG_TIER.model, "reason": reason})
+                yield sse_event("escalated", {"reason": reason, "model": STRONG_TIER.model})
+            else:
+                output = ClarifiedOutput(**sections, processingTime=time.perf_counter() - start_time)
         
+        if output is None:
+            result = {}
+            async for event in stream_tier_items(ticket, similar_tickets, STRONG_TIER, result):
+                yield event
+            
+            sections, reasked = await complete_clarification(ticket, similar_tickets, result["content"], result["used_tool"])
+            for section in reasked:
+                for item in sections[section]:
+                    yield sse_event("item", {"section": section, "item": item})
+            
+            processing_time = time.perf_counter() - start_time
+            output = ClarifiedOutput(**sections, processingTime=processing_time)
+        
+    except HTTPException as e:
+        # Over the monthly limit (the 200 status has already gone out)
+        yield sse_event("error", {"error": e.detail, "status": e.status_code})
+        return
+    except ClarificationParseError as e:
+        logger.error("Clarification parsing error", extra={"error": str(e)})
+        clarify_errors.inc(error_type(e))
+        yield sse_event("error", {"error": "Failed to parse AI response"})
+        return
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        logger.warning("AI service unavailable", extra={"error": str(e)})
+        clarify_errors.inc(error_type(e))
+        yield sse_event("error", {"error": upstream_unavailable(e).detail})
+        return
     except Exception as e:
-        print(f"Clarification error: {e}")
-        raise HTTPException(status_code=500, detail="Failed to clarify ticket")
+        logger.error("AI generation error", extra={"error": str(e)})
+        clarify_errors.inc(error_type(e))
+        yield sse_event("error", {"error": f"AI processing failed: {str(e)}"})
+        return
+    finally:
+        # No clarification produced, including a client disconnect (CancelledError or
+        # GeneratorExit, which the handlers above don't catch); shielded for the former
+        if output is None:
+            await asyncio.shield(refund_usage(license_key, reserved))
+    
+    cache = getattr(app.state, 'clarification_cache', None)
+    if cache:
+        await cache.set(cache_key, output.model_dump())
+    
+    if ENABLE_ANALYTICS:
+        await save_tickets([(ticket, output)])
+    
+    request_seconds.observe(time.perf_counter() - start_time, "stream")
+    yield sse_event("done", output.model_dump())
+
+async def replay_clarification(output: ClarifiedOutput) -> AsyncIterator[str]:
+    """Replay a cached clarification in the same event format as a live stream"""
+    for section in CLARIFICATION_SECTIONS:
+        for item in getattr(output, section):
+            yield sse_event("item", {"section": section, "item": item})
+    yield sse_event("done", output.model_dump())
+
+@app.post("/clarify/stream")
+async def clarify_ticket_stream(ticket: TicketInput, request: Request):
+    """
+    Clarify ticket, streaming results as Server-Sent Events
+    
+    Emits an `item` event ({section, item}) as soon as each acceptance
+    criterion, edge case, metric or test scenario closes, then a `done`
+    event with the full ClarifiedOutput (including processingTime), or an
+    `error` event if generation fails.
+    """
+    license_key = ticket.orgId or "free_user"
+    bind_log_context(key=mask_key(license_key))
+    rate_limit_headers = await enforce_rate_limit(request, license_key)
+    
+    if not getattr(app.state, 'claude', None):
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    
+    cache = getattr(app.state, 'clarification_cache', None)
+    cache_key = clarification_cache_key(ticket)
+    if cache:
+        cached, tier = await cache.get(cache_key)
+        cache_lookups.inc(tier or "miss")
+        if cached is not None:
+            return StreamingResponse(
+                replay_clarification(ClarifiedOutput(**cached)),
+                media_type="text/event-stream",
+                headers={**SSE_HEADERS, **rate_limit_headers, "X-Cache": "HIT", "X-Cache-Tier": tier}
+            )
+    
+    return StreamingResponse(
+        stream_clarification(ticket, cache_key, license_key),
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, **rate_limit_headers, "X-Cache": "MISS"}
+    )
+
+
+def ndjson_line(data: Dict[str, Any]) -> str:
+    """Encode one newline-delimited JSON record"""
+    return json.dumps(data) + "\n"
+
+async def stream_batch_results(
+    tickets: List[TicketInput],
+    groups: Dict[str, List[int]],
+    cached: Dict[str, Dict[str, Any]],
+    pending_keys: List[str],
+    license_key: str = "free_user",
+    reserved: int = 0
+) -> AsyncIterator[str]:
+    """
+    Yield one NDJSON result per ticket in completion order, then a summary
+    
+    Reserved usage for unique tickets that fail (or never finish because
+    the client disconnected) is refunded at the end.
+    """
+    cache = getattr(app.state, 'clarification_cache', None)
+    semaphore = asyncio.Semaphore(CLARIFY_BATCH_CONCURRENCY)
+    succeeded = 0
+    failed = 0
+    clarified = []
+    
+    for key, result in cached.items():
+        for index in groups[key]:
+            succeeded += 1
+            yield ndjson_line({"type": "result", "index": index, "cached": True, "result": result})
+    
+    async def clarify_unique(key: str):
+        async with semaphore:
+            try:
+                return key, (await clarify_coalesced(tickets[groups[key][0]], key))[0], None
+            except HTTPException as e:
+                return key, None, e.detail
+            except Exception as e:
+                return key, None, str(e)
+    
+    tasks = [asyncio.create_task(clarify_unique(key)) for key in pending_keys]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            key, output, error = await next_done
+            
+            if output is None:
+                for index in groups[key]:
+                    failed += 1
+                    yield ndjson_line({"type": "error", "index": index, "error": error})
+                continue
+            
+            if cache:
+                await cache.set(key, output.model_dump())
+            clarified.append((tickets[groups[key][0]], output))
+            
+            for index in groups[key]:
+                succeeded += 1
+                yield ndjson_line({"type": "result", "index": index, "cached": False, "result": output.model_dump()})
+    finally:
+        # Client went away mid-stream: don't keep paying for the rest
+        for task in tasks:
+            task.cancel()
+        
+        # Shielded: this also runs when the stream is cancelled
+        unused = min(reserved, len(pending_keys) - len(clarified))
+        if unused > 0:
+            await asyncio.shield(refund_usage(license_key, unused))
+    
+    # Store for analytics in one round trip
+    if ENABLE_ANALYTICS and clarified:
+        await save_tickets(clarified)
+    
+    yield ndjson_line({
+        "type": "summary",
+        "total": len(tickets),
+        "unique": len(groups),
+        "succeeded": succeeded,
+        "failed": failed
+    })
+
+@app.post("/clarify/batch")
+async def clarify_ticket_batch(batch: BatchTicketInput, request: Request):
+    """
+    Clarify a whole sprint or backlog in one request
+    
+    Identical tickets are clarified once and cached tickets are served
+    without calling Claude. Usage for the remaining unique tickets is
+    reserved in a single statement (429 if the key can't cover them all),
+    Claude is called with bounded concurrency, and results stream back as
+    NDJSON in completion order.
+    """
+    license_key = batch.orgId or "free_user"
+    bind_log_context(key=mask_key(license_key))
+    rate_limit_headers = await enforce_rate_limit(request, license_key, cost=len(batch.tickets))
+    
+    if not getattr(app.state, 'claude', None):
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    
+    tickets = [
+        ticket if ticket.orgId else ticket.model_copy(update={"orgId": batch.orgId})
+        for ticket in batch.tickets
+    ]
+    
+    # Dedupe identical tickets
+    groups: Dict[str, List[int]] = {}
+    for index, ticket in enumerate(tickets):
+        groups.setdefault(clarification_cache_key(ticket), []).append(index)
+    
+    cache = getattr(app.state, 'clarification_cache', None)
+    cached = {}
+    pending_keys = []
+    for key in groups:
+        result, tier = await cache.get(key) if cache else (None, None)
+        if cache:
+            cache_lookups.inc(tier or "miss")
+        if result is not None:
+            cached[key] = result
+        else:
+            pending_keys.append(key)
+    
+    # For paid users, reserve the whole batch at once (all or nothing)
+    reserved = 0
+    if pending_keys and license_key != "free_user":
+        with stage_seconds.time("usage"):
+            reserved = await reserve_usage(license_key, len(pending_keys))
+    
+    return StreamingResponse(
+        stream_batch_results(tickets, groups, cached, pending_keys, license_key, reserved),
+        media_type="application/x-ndjson",
+        headers=rate_limit_headers
+    )
+
+
+@app.post("/jobs/clarify", status_code=202)
+async def create_clarify_job(batch: BatchTicketInput, request: Request, response: Response):
+    """
+    Queue tickets for offline clarification via the Message Batches API
+    
+    Cheaper than /clarify/batch but not interactive: poll GET /jobs/{id}.
+    Jobs need an active license key (403 otherwise) and are rate limited
+    per ticket like /clarify/batch. Usage for every ticket is reserved up
+    front; the runner refunds the ones that fail.
+    """
+    store = getattr(app.state, 'job_store', None)
+    if not store:
+        raise HTTPException(status_code=503, detail="Job queue not available")
+    
+    license_key = batch.orgId or "free_user"
+    bind_log_context(key=mask_key(license_key))
+    if not await has_active_license(license_key):
+        raise HTTPException(status_code=403, detail="Offline jobs need an active license key")
+    tickets = [ticket.model_dump(exclude_none=True) for ticket in batch.tickets]
+    response.headers.update(await enforce_rate_limit(request, license_key, cost=len(tickets)))
+    
+    reserved = await reserve_usage(license_key, len(tickets))
+    try:
+        job_id = await asyncio.to_thread(store.create_job, batch.orgId, tickets)
+    except Exception as e:
+        logger.error("Failed to queue job", extra={"error": str(e)})
+        await refund_usage(batch.orgId, reserved)
+        raise HTTPException(status_code=500, detail="Failed to queue job")
+    logger.info("Queued job", extra={"jobId": job_id, "tickets": len(tickets)})
+    
+    return {"jobId": job_id, "status": "pending", "total": len(tickets)}
+
+@app.get("/jobs/{job_id}")
+def get_clarify_job(job_id: int):
+    """Report progress of an offline clarification job"""
+    store = getattr(app.state, 'job_store', None)
+    if not store:
+        raise HTTPException(status_code=503, detail="Job queue not available")
+    
+    job = store.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return {
+        "jobId": job['id'],
+        "status": job['status'],
+        "batchId": job['batch_id'],
+        "total": job['total'],
+        "processed": job['processed'],
+        "succeeded": job['succeeded'],
+        "failed": job['failed'],
+        "progress": job['processed'] / job['total'] if job['total'] else 1.0,
+        "error": job['error'],
+        "createdAt": job['created_at'].isoformat() if job['created_at'] else None,
+        "completedAt": job['completed_at'].isoformat() if job['completed_at'] else None
+    }
 
 
 @app.post("/webhook/stripe")
 async def stripe_webhook_handler(request: Request):
     """
     Handle Stripe webhook events for embedded payment flow
+    
+    Verified events are stored in stripe_events and acknowledged right
+    away; StripeEventWorker applies them in the background. Stripe
+    redelivers an event it sent before (same ID) only once it is stored.
     """
     if not ENABLE_PAYMENTS or not STRIPE_WEBHOOK_SECRET:
         raise HTTPException(status_code=404, detail="Payments not enabled")
@@ -759,18 +2419,74 @@ async def stripe_webhook_handler(request: Request):
         raise HTTPException(status_code=400, detail="Missing signature header")
     
     try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, STRIPE_WEBHOOK_SECRET
-        )
+        with trace_span("stripe Webhook.construct_event"):
+            event = stripe.Webhook.construct_event(
+                payload, sig_header, STRIPE_WEBHOOK_SECRET
+            )
     except Exception as e:
-        print(f"❌ Webhook signature verification failed: {e}")
+        logger.warning("Webhook signature verification failed", extra={"error": str(e)})
         raise HTTPException(status_code=400, detail=str(e))
     
-    print(f"🔔 Received event: {event['type']}")
+    store = getattr(app.state, 'stripe_events', None)
+    if not store:
+        # Not acknowledged, so Stripe retries delivery later
+        raise HTTPException(status_code=503, detail="Event queue unavailable")
+    
+    try:
+        created = await asyncio.to_thread(store.record, json.loads(payload))
+    except Exception as e:
+        logger.error("Failed to store Stripe event", extra={"eventId": event['id'], "error": str(e)})
+        raise HTTPException(status_code=503, detail="Event queue unavailable")
+    
+    logger.info("Received Stripe event", extra={"eventId": event['id'], "eventType": event['type'], "duplicate": not created})
+    if created:
+        app.state.stripe_worker.notify()
+    
+    return {"status": "queued" if created else "duplicate", "eventId": event['id']}
+
+
+STRIPE_RESOURCES = {"subscription": stripe.Subscription, "invoice": stripe.Invoice}
+
+
+def retrieve_stripe_object(object_type: str, object_id: str) -> Dict[str, Any]:
+    """
+    A Stripe subscription or invoice as a dict, from the local cache when
+    a webhook or an earlier lookup already brought it in
+    """
+    resource = STRIPE_RESOURCES[object_type]
+    
+    def fetch() -> Dict[str, Any]:
+        with trace_span(f"stripe {resource.__name__}.retrieve", "client"):
+            return json.loads(str(resource.retrieve(object_id)))
+    
+    cache = getattr(app.state, 'stripe_objects', None)
+    if not cache:
+        return fetch()
+    
+    obj, tier = cache.get(object_id, fetch)
+    stripe_cache_lookups.inc(object_type, tier or "miss")
+    return obj
+
+
+def process_stripe_event(event) -> Dict[str, Any]:
+    """
+    Apply a verified Stripe event to license keys
+    
+    Runs in a worker thread since it makes blocking Stripe API calls and DB
+    writes. Safe to run again on an event already applied (a retry or a
+    replay): keys are created once per subscription, renewals only move
+    the usage reset forward, and status changes older than the last
+    applied event are skipped. Raises on failure so the worker retries.
+    """
+    # Keep the subscription/invoice snapshot this event carries
+    cache = getattr(app.state, 'stripe_objects', None)
+    if cache:
+        cache.put_event(event)
     
     conn = get_db_connection()
     if not conn:
-        return {"status": "error", "message": "Database unavailable"}
+        raise RuntimeError("Database unavailable")
+    event_created = event.get('created') or 0
     
     try:
         cur = conn.cursor()
@@ -787,58 +2503,48 @@ async def stripe_webhook_handler(request: Request):
             customer_email = charge.get('billing_details', {}).get('email') or charge.get('receipt_email')
             payment_intent_id = charge.get('payment_intent')
             
-            print(f"💳 Charge succeeded:")
-            print(f"   Customer: {customer_id}")
-            print(f"   Email: {customer_email}")
-            print(f"   Subscription: {subscription_id}")
-            print(f"   Payment Intent: {payment_intent_id}")
+            logger.info("Charge succeeded", extra={
+                "customerId": customer_id,
+                "subscriptionId": subscription_id,
+                "paymentIntentId": payment_intent_id
+            })
             
             if not subscription_id:
-                print("ℹ️  Not a subscription charge, skipping")
+                logger.info("Not a subscription charge, skipping")
                 return {"status": "success", "message": "Not a subscription charge"}
             
             # Get subscription details to find the plan and billing reason
-            subscription = stripe.Subscription.retrieve(subscription_id)
-            plan_id = subscription.metadata.get('planId', 'pro')
+            subscription = retrieve_stripe_object("subscription", subscription_id)
+            plan_id = (subscription.get('metadata') or {}).get('planId', 'pro')
             
             # Get the invoice to check billing_reason
             invoice_id = charge.get('metadata', {}).get('invoice_id')
             if invoice_id:
-                invoice = stripe.Invoice.retrieve(invoice_id)
+                invoice = retrieve_stripe_object("invoice", invoice_id)
                 billing_reason = invoice.get('billing_reason')
             else:
                 billing_reason = None
             
-            print(f"   Plan: {plan_id}")
-            print(f"   Billing reason: {billing_reason}")
+            logger.info("Charge plan", extra={"plan": plan_id, "billingReason": billing_reason})
             
             # Check if this is the first payment
             if billing_reason == 'subscription_create':
                 # Generate license key for new subscription
-                print(f"✅ New subscription payment successful!")
-                
-                # Check if key already exists (idempotency)
-                cur.execute("""
-                    SELECT key_code FROM license_keys 
-                    WHERE stripe_subscription_id = %s
-                """, (subscription_id,))
-                
-                existing = cur.fetchone()
-                if existing:
-                    print(f"ℹ️  Key already exists: {existing['key_code']}")
-                    return {"status": "success", "keyCode": existing['key_code']}
+                logger.info("New subscription payment succeeded", extra={"subscriptionId": subscription_id})
                 
                 # Generate license key
                 license_key = generate_license_key()
                 clarifications_limit = get_plan_limits(plan_id)
                 
-                # Insert license key
+                # Insert license key; a replay (or a re-claimed event racing the
+                # first attempt) hits the unique subscription index and inserts nothing
                 cur.execute("""
                     INSERT INTO license_keys 
                     (key_code, customer_email, plan, stripe_subscription_id, 
                      stripe_customer_id, stripe_payment_intent_id, clarifications_limit,
-                     clarifications_used, usage_resets_at, subscription_status)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, 0, NOW() + INTERVAL '1 month', 'active')
+                     clarifications_used, usage_resets_at, subscription_status, stripe_event_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, 0, NOW() + INTERVAL '1 month', 'active', to_timestamp(%s))
+                    ON CONFLICT (stripe_subscription_id) WHERE stripe_subscription_id IS NOT NULL DO NOTHING
                     RETURNING id
                 """, (
                     license_key,
@@ -847,33 +2553,48 @@ async def stripe_webhook_handler(request: Request):
                     subscription_id,
                     customer_id,
                     payment_intent_id,
-                    clarifications_limit
+                    clarifications_limit,
+                    event_created
                 ))
                 
+                if not cur.fetchone():
+                    conn.rollback()
+                    cur.execute("""
+                        SELECT key_code FROM license_keys 
+                        WHERE stripe_subscription_id = %s
+                    """, (subscription_id,))
+                    existing = cur.fetchone()
+                    logger.info("License key already exists", extra={"key": mask_key(existing['key_code'])})
+                    return {"status": "success", "keyCode": existing['key_code']}
+                
                 conn.commit()
-                print(f"🔑 License key generated: {license_key}")
-                print(f"📊 Limit: {clarifications_limit} clarifications/month")
+                logger.info("License key generated", extra={"key": mask_key(license_key), "limit": clarifications_limit})
                 
                 # Send email
                 send_license_key_email(customer_email, license_key, plan_id.capitalize(), clarifications_limit)
-                print(f"📧 Email sent to {customer_email}")
+                logger.info("License key email sent", extra={"customerId": customer_id})
                 
                 return {"status": "success", "keyCode": license_key}
             
             else:
-                # Renewal payment - reset usage counter
-                print(f"🔄 Renewal payment for subscription: {subscription_id}")
+                # Renewal payment - reset usage counter (once per charge:
+                # a replay finds the reset date already past this one)
+                logger.info("Renewal payment", extra={"subscriptionId": subscription_id})
                 cur.execute("""
                     UPDATE license_keys
                     SET clarifications_used = 0,
-                        usage_resets_at = NOW() + INTERVAL '1 month',
+                        usage_resets_at = to_timestamp(%s) + INTERVAL '1 month',
                         updated_at = NOW()
                     WHERE stripe_subscription_id = %s
                     AND subscription_status = 'active'
-                """, (subscription_id,))
+                    AND (usage_resets_at IS NULL OR usage_resets_at < to_timestamp(%s) + INTERVAL '1 month')
+                    RETURNING key_code
+                """, (event_created, subscription_id, event_created))
                 
+                changed_keys = [row['key_code'] for row in cur.fetchall()]
                 conn.commit()
-                print(f"✅ Usage reset for subscription: {subscription_id}")
+                invalidate_license_keys(changed_keys)
+                logger.info("Usage reset", extra={"subscriptionId": subscription_id})
         
         # ============================================
         # invoice.payment_failed - Handle failed payments
@@ -888,12 +2609,17 @@ async def stripe_webhook_handler(request: Request):
                 cur.execute("""
                     UPDATE license_keys
                     SET subscription_status = 'past_due',
+                        stripe_event_at = to_timestamp(%s),
                         updated_at = NOW()
                     WHERE stripe_subscription_id = %s
-                """, (subscription_id,))
+                    AND (stripe_event_at IS NULL OR stripe_event_at <= to_timestamp(%s))
+                    RETURNING key_code
+                """, (event_created, subscription_id, event_created))
                 
+                changed_keys = [row['key_code'] for row in cur.fetchall()]
                 conn.commit()
-                print(f"⚠️  Payment failed for subscription: {subscription_id}")
+                invalidate_license_keys(changed_keys)
+                logger.warning("Payment failed", extra={"subscriptionId": subscription_id})
                 
                 # TODO: Send payment failed email to customer
                 # send_payment_failed_email(customer_email, subscription_id)
@@ -914,12 +2640,17 @@ async def stripe_webhook_handler(request: Request):
                         WHEN %s IN ('active', 'trialing') THEN true 
                         ELSE false 
                     END,
+                    stripe_event_at = to_timestamp(%s),
                     updated_at = NOW()
                 WHERE stripe_subscription_id = %s
-            """, (status, status, subscription_id))
+                AND (stripe_event_at IS NULL OR stripe_event_at <= to_timestamp(%s))
+                RETURNING key_code
+            """, (status, status, event_created, subscription_id, event_created))
             
+            changed_keys = [row['key_code'] for row in cur.fetchall()]
             conn.commit()
-            print(f"📝 Subscription {subscription_id} status updated to: {status}")
+            invalidate_license_keys(changed_keys)
+            logger.info("Subscription status updated", extra={"subscriptionId": subscription_id, "status": status})
         
         # ============================================
         # customer.subscription.deleted - Cancellation
@@ -933,19 +2664,23 @@ async def stripe_webhook_handler(request: Request):
                 UPDATE license_keys
                 SET is_active = false,
                     subscription_status = 'canceled',
+                    stripe_event_at = to_timestamp(%s),
                     updated_at = NOW()
                 WHERE stripe_subscription_id = %s
-            """, (subscription_id,))
+                RETURNING key_code
+            """, (event_created, subscription_id))
             
+            changed_keys = [row['key_code'] for row in cur.fetchall()]
             conn.commit()
-            print(f"🔒 Subscription canceled: {subscription_id}")
+            invalidate_license_keys(changed_keys)
+            logger.info("Subscription canceled", extra={"subscriptionId": subscription_id})
         
         # ============================================
         # customer.subscription.created - Log only
         # ============================================
         elif event['type'] == 'customer.subscription.created':
             subscription = event['data']['object']
-            print(f"📝 Subscription created: {subscription.get('id')}")
+            logger.info("Subscription created", extra={"subscriptionId": subscription.get('id')})
             # Don't generate key here - wait for charge.succeeded
         
         # ============================================
@@ -953,7 +2688,7 @@ async def stripe_webhook_handler(request: Request):
         # ============================================
         elif event['type'] == 'payment_intent.succeeded':
             payment_intent = event['data']['object']
-            print(f"✅ PaymentIntent succeeded: {payment_intent.get('id')}")
+            logger.info("PaymentIntent succeeded", extra={"paymentIntentId": payment_intent.get('id')})
             # Don't generate key here - wait for charge.succeeded
         
         # ============================================
@@ -968,26 +2703,23 @@ async def stripe_webhook_handler(request: Request):
             'charge.updated',
             'payment_intent.created'
         ]:
-            print(f"ℹ️  {event['type']} - no action needed")
+            logger.info("No action needed", extra={"eventType": event['type']})
         
         else:
-            print(f"⚠️  Unhandled event type: {event['type']}")
+            logger.warning("Unhandled event type", extra={"eventType": event['type']})
         
         return {"status": "success"}
         
-    except Exception as e:
+    except Exception:
         conn.rollback()
-        print(f"❌ Webhook error: {e}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+        raise
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 
 
 @app.get("/license-key/payment-intent/{payment_intent_id}")
-async def get_license_key_by_payment_intent(payment_intent_id: str):
+def get_license_key_by_payment_intent(payment_intent_id: str):
     """
     Get license key by Stripe payment intent ID
     Used by success page after embedded checkout
@@ -1028,13 +2760,13 @@ async def get_license_key_by_payment_intent(payment_intent_id: str):
             "usageResetsAt": result['usage_resets_at'].isoformat() if result['usage_resets_at'] else None
         }
     except Exception as e:
-        print("Error getting licence key.")
+        logger.error("Error getting license key", extra={"error": str(e)})
     finally:
-        conn.close()
+        release_db_connection(conn)
         
 
 @app.get("/analytics/{org_id}")
-async def get_analytics(org_id: str):
+def get_analytics(org_id: str):
     """Get analytics for an organization"""
     if not ENABLE_ANALYTICS or not DATABASE_URL:
         raise HTTPException(status_code=404, detail="Analytics not enabled")
@@ -1076,7 +2808,7 @@ async def get_analytics(org_id: str):
         }
         
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 
 @app.post("/feedback")
@@ -1090,13 +2822,17 @@ async def submit_feedback(feedback: FeedbackInput):
         raise HTTPException(status_code=400, detail="Invalid feedback type. Must be 'upvote' or 'downvote'")
     
     try:
-        store_feedback(feedback)
+        writer = getattr(app.state, 'batch_writer', None)
+        if writer is None:
+            await asyncio.to_thread(store_feedback, feedback)
+        else:
+            await writer.put("feedback", feedback_row(feedback))
         return {
             "status": "success",
             "message": "Thank you for your feedback! This helps us improve."
         }
     except Exception as e:
-        print(f"Feedback error: {e}")
+        logger.error("Feedback error", extra={"error": str(e)})
         raise HTTPException(status_code=500, detail="Failed to store feedback")
 
 
@@ -1104,97 +2840,93 @@ async def submit_feedback(feedback: FeedbackInput):
 async def validate_license_key(key_input: AccessKeyInput):
     """
     Validate a license key and check usage limits
+    
+    Records come from the license key cache when warm, so repeat
+    validations don't touch Postgres.
     """
     key_code = key_input.accessKey.strip().upper()
     
-    conn = get_db_connection()
-    if not conn:
+    try:
+        key_data = await get_license_record(key_code)
+    except Exception as e:
+        logger.error("Error validating key", extra={"error": str(e)})
         return AccessKeyResponse(
             valid=False,
             message="Service temporarily unavailable"
         )
     
-    try:
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT 
-                key_code,
-                customer_email,
-                plan,
-                is_active,
-                subscription_status,
-                clarifications_limit,
-                clarifications_used,
-                usage_resets_at,
-                activated_at
-            FROM license_keys
-            WHERE key_code = %s
-        """, (key_code,))
-        
-        key_data = cur.fetchone()
-        
-        if not key_data:
-            return AccessKeyResponse(
-                valid=False,
-                message="Invalid license key. Please check and try again."
-            )
-        
-        # Check if active
-        if not key_data['is_active']:
-            return AccessKeyResponse(
-                valid=False,
-                message="This license key has been deactivated. Please contact support."
-            )
-        
-        # Check subscription status
-        if key_data['subscription_status'] not in ['active', 'trialing']:
-            return AccessKeyResponse(
-                valid=False,
-                message=f"Subscription is {key_data['subscription_status']}. Please update your payment method."
-            )
-        
-        # Check if usage limit exceeded
-        if key_data['clarifications_used'] >= key_data['clarifications_limit']:
-            resets_at = key_data['usage_resets_at'].strftime('%B %d') if key_data['usage_resets_at'] else 'soon'
-            return AccessKeyResponse(
-                valid=False,
-                message=f"Monthly limit of {key_data['clarifications_limit']} clarifications reached. Resets on {resets_at}."
-            )
-        
-        # Mark as activated if first use
-        if not key_data['activated_at']:
-            cur.execute("""
-                UPDATE license_keys 
-                SET activated_at = NOW(), updated_at = NOW()
-                WHERE key_code = %s
-            """, (key_code,))
-            conn.commit()
-            print(f"🎉 License key activated: {key_code}")
-        
-        # Calculate remaining
-        remaining = key_data['clarifications_limit'] - key_data['clarifications_used']
-        
+    if not key_data:
         return AccessKeyResponse(
-            valid=True,
-            orgId=key_code,
-            plan=key_data['plan'],
-            message="License key validated successfully!",
-            clarificationsRemaining=remaining
+            valid=False,
+            message="Invalid license key. Please check and try again."
         )
-        
-    except Exception as e:
-        print(f"Error validating key: {e}")
+    
+    # Check if active
+    if not key_data['is_active']:
+        return AccessKeyResponse(
+            valid=False,
+            message="This license key has been deactivated. Please contact support."
+        )
+    
+    # Check subscription status
+    if key_data['subscription_status'] not in ['active', 'trialing']:
+        return AccessKeyResponse(
+            valid=False,
+            message=f"Subscription is {key_data['subscription_status']}. Please update your payment method."
+        )
+    
+    # Check if usage limit exceeded
+    used = merged_usage(key_data, await counted_usage(key_code))
+    if used >= key_data['clarifications_limit']:
         return AccessKeyResponse(
             valid=False,
-            message="Error validating key. Please try again."
+            message=f"Monthly limit of {key_data['clarifications_limit']} clarifications reached. Resets on {format_reset_date(key_data)}."
         )
+    
+    # Mark as activated if first use
+    if not key_data['activated_at']:
+        try:
+            await asyncio.to_thread(activate_license_key, key_code)
+        except Exception as e:
+            logger.error("Error validating key", extra={"error": str(e)})
+            return AccessKeyResponse(
+                valid=False,
+                message="Error validating key. Please try again."
+            )
+        await invalidate_license_cache([key_code])
+    
+    # Calculate remaining
+    remaining = key_data['clarifications_limit'] - used
+    
+    return AccessKeyResponse(
+        valid=True,
+        orgId=key_code,
+        plan=key_data['plan'],
+        message="License key validated successfully!",
+        clarificationsRemaining=remaining
+    )
+
+def activate_license_key(key_code: str):
+    """Stamp activated_at the first time a key is validated"""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("Database unavailable")
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE license_keys 
+            SET activated_at = NOW(), updated_at = NOW()
+            WHERE key_code = %s
+        """, (key_code,))
+        conn.commit()
+        logger.info("License key activated", extra={"key": mask_key(key_code)})
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 
 @app.get("/license-key/session/{session_id}")
-async def get_license_key_by_session(session_id: str):
+def get_license_key_by_session(session_id: str):
     """
     Get license key by Stripe session ID
     Used by success page to display the key
@@ -1236,7 +2968,7 @@ async def get_license_key_by_session(session_id: str):
         }
         
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 
 @app.get("/usage/{key_code}")
@@ -1244,6 +2976,10 @@ async def get_key_usage(key_code: str):
     """
     Get usage statistics for a license key
     """
+    counted = await counted_usage(key_code)
+    return await asyncio.to_thread(lookup_key_usage, key_code, counted)
+
+def lookup_key_usage(key_code: str, counted: Optional[Tuple[int, str]]) -> Dict[str, Any]:
     conn = get_db_connection()
     if not conn:
         raise HTTPException(status_code=500, detail="Database unavailable")
@@ -1271,13 +3007,14 @@ async def get_key_usage(key_code: str):
         if not key:
             raise HTTPException(status_code=404, detail="License key not found")
         
+        used = merged_usage(license_record(key), counted)
         return {
             "keyCode": key_code,
             "plan": key['plan'],
             "email": key['customer_email'],
-            "clarificationsUsed": key['clarifications_used'],
+            "clarificationsUsed": used,
             "clarificationsLimit": key['clarifications_limit'],
-            "clarificationsRemaining": max(0, key['clarifications_limit'] - key['clarifications_used']),
+            "clarificationsRemaining": max(0, key['clarifications_limit'] - used),
             "usageResets": key['usage_resets_at'].isoformat() if key['usage_resets_at'] else None,
             "subscriptionStatus": key['subscription_status'],
             "isActive": key['is_active'],
@@ -1285,11 +3022,11 @@ async def get_key_usage(key_code: str):
         }
         
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 
 @app.get("/license-key/{payment_intent_id}")
-async def get_license_key_by_payment(payment_intent_id: str):
+def get_license_key_by_payment(payment_intent_id: str):
     """
     Get license key by Stripe payment intent ID
     Used by success page to display key
@@ -1321,10 +3058,10 @@ async def get_license_key_by_payment(payment_intent_id: str):
         }
         
     finally:
-        conn.close()
+        release_db_connection(conn)
  
 @app.get("/feedback/stats")
-async def get_feedback_stats():
+def get_feedback_stats():
     """Get feedback statistics for monitoring model performance"""
     if not DATABASE_URL:
         raise HTTPException(status_code=404, detail="Database not configured")
@@ -1354,7 +3091,7 @@ async def get_feedback_stats():
         }
         
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 @app.post("/create-payment-intent")
 async def create_payment_intent(input: CreatePaymentIntentInput):
@@ -1379,83 +3116,85 @@ async def create_payment_intent(input: CreatePaymentIntentInput):
         if not price_id:
             raise HTTPException(status_code=400, detail=f"Invalid plan: {plan_id}")
         
-        print(f"📝 Creating subscription for plan: {plan_id}")
-        print(f"💰 Using price ID: {price_id}")
+        logger.info("Creating subscription", extra={"plan": plan_id, "priceId": price_id})
         
         # Create a customer
-        customer = stripe.Customer.create(
-            metadata={
-                'planId': plan_id,
-            }
-        )
+        with trace_span("stripe Customer.create", "client"):
+            customer = stripe.Customer.create(
+                metadata={
+                    'planId': plan_id,
+                }
+            )
         
-        print(f"✅ Created Stripe customer: {customer.id}")
+        logger.info("Created Stripe customer", extra={"customerId": customer.id})
         
         # Create a subscription with payment
-        subscription = stripe.Subscription.create(
-            customer=customer.id,
-            items=[
-                {
-                    'price': price_id,
+        with trace_span("stripe Subscription.create", "client"):
+            subscription = stripe.Subscription.create(
+                customer=customer.id,
+                items=[
+                    {
+                        'price': price_id,
+                    }
+                ],
+                payment_behavior='default_incomplete',
+                payment_settings={
+                    'payment_method_types': ['card'],
+                    'save_default_payment_method': 'on_subscription',
+                },
+                expand=['latest_invoice.payment_intent'],
+                metadata={
+                    'planId': plan_id,
                 }
-            ],
-            payment_behavior='default_incomplete',
-            payment_settings={
-                'payment_method_types': ['card'],
-                'save_default_payment_method': 'on_subscription',
-            },
-            expand=['latest_invoice.payment_intent'],
-            metadata={
-                'planId': plan_id,
-            }
-        )
+            )
         
-        print(f"✅ Created subscription: {subscription.id}")
+        logger.info("Created subscription", extra={"subscriptionId": subscription.id})
         
         # Access the invoice
         latest_invoice = subscription.latest_invoice
         
         # If it's a string ID, retrieve the full invoice object
         if isinstance(latest_invoice, str):
-            invoice = stripe.Invoice.retrieve(
-                latest_invoice,
-                expand=['payment_intent']
-            )
+            with trace_span("stripe Invoice.retrieve", "client"):
+                invoice = stripe.Invoice.retrieve(
+                    latest_invoice,
+                    expand=['payment_intent']
+                )
         else:
             invoice = latest_invoice
         
-        print(f"📄 Invoice ID: {invoice.id}")
-        print(f"📊 Invoice status: {invoice.status}")
+        logger.info("Subscription invoice", extra={"invoiceId": invoice.id, "invoiceStatus": invoice.status})
         
         # Check if payment_intent exists on the invoice
         payment_intent = getattr(invoice, 'payment_intent', None)
         
         if not payment_intent:
-            print("⚠️ No payment_intent on invoice, creating one manually...")
+            logger.warning("No payment_intent on invoice, creating one manually")
             
             # Create a PaymentIntent manually
-            payment_intent = stripe.PaymentIntent.create(
-                amount=invoice.amount_due,
-                currency=invoice.currency or 'usd',
-                customer=customer.id,
-                metadata={
-                    'subscription_id': subscription.id,
-                    'invoice_id': invoice.id,
-                    'planId': plan_id,
-                },
-                setup_future_usage='off_session',
-            )
+            with trace_span("stripe PaymentIntent.create", "client"):
+                payment_intent = stripe.PaymentIntent.create(
+                    amount=invoice.amount_due,
+                    currency=invoice.currency or 'usd',
+                    customer=customer.id,
+                    metadata={
+                        'subscription_id': subscription.id,
+                        'invoice_id': invoice.id,
+                        'planId': plan_id,
+                    },
+                    setup_future_usage='off_session',
+                )
             
-            print(f"✅ Manually created PaymentIntent: {payment_intent.id}")
+            logger.info("Manually created PaymentIntent", extra={"paymentIntentId": payment_intent.id})
             
         else:
             # If payment_intent is a string ID, retrieve the full object
             if isinstance(payment_intent, str):
-                payment_intent = stripe.PaymentIntent.retrieve(payment_intent)
+                with trace_span("stripe PaymentIntent.retrieve", "client"):
+                    payment_intent = stripe.PaymentIntent.retrieve(payment_intent)
             
-            print(f"✅ Retrieved PaymentIntent from invoice: {payment_intent.id}")
+            logger.info("Retrieved PaymentIntent from invoice", extra={"paymentIntentId": payment_intent.id})
         
-        print(f"💳 Client secret ready for frontend")
         
         return {
             "clientSecret": payment_intent.client_secret,
@@ -1465,9 +3204,7 @@ async def create_payment_intent(input: CreatePaymentIntentInput):
         }
         
     except Exception as e:
-        print(f"❌ Error creating payment intent: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error creating payment intent")
         raise HTTPException(status_code=500, detail=f"Failed to create payment intent: {str(e)}")
     
 
@@ -1479,12 +3216,13 @@ async def create_payment_intent(input: CreatePaymentIntentInput):
 async def http_exception_handler(request, exc):
     return JSONResponse(
         status_code=exc.status_code,
-        content={"error": exc.detail}
+        content={"error": exc.detail},
+        headers=getattr(exc, "headers", None)
     )
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
-    print(f"Unhandled exception: {exc}")
+    logger.error("Unhandled exception", exc_info=exc)
     return JSONResponse(
         status_code=500,
         content={"error": "Internal server error"}
@@ -0,0 +1,211 @@
+# prompts.py - Clarification prompt: a static, cacheable system block plus a small per-ticket block
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+# Worked examples from the jira_clarify_50.jsonl gold set (test scenarios added)
+FEW_SHOT_EXAMPLES = [
+    {
+        "ticket": {
+            "title": "Fix login bug",
+            "description": "Users say they can't log in sometimes. Please look into it.",
+            "issueType": "Bug",
+            "priority": "High"
+        },
+        "clarification": {
+            "acceptanceCriteria": [
+                "Given a user with valid credentials, When they enter email/password and click Login, Then they are redirected to the dashboard within 3s",
+                "Given a user with an invalid password, When they attempt login, Then they see an 'Invalid credentials' error and the password field is cleared",
+                "Given a user with an unverified email, When they attempt login, Then they are prompted to verify their email and can resend the verification link",
+                "Given 5 failed attempts within 10 minutes, When the user tries again, Then the account is temporarily locked and the user is told when to retry"
+            ],
+            "edgeCases": [
+                "Network timeout during the authentication request",
+                "Special and unicode characters in the password",
+                "Concurrent login attempts from multiple devices",
+                "Session cookie blocked by browser privacy settings",
+                "Clock skew causing a freshly issued token to be rejected as expired"
+            ],
+            "successMetrics": [
+                "Login success rate above 99.5% in production",
+                "Zero P1 incidents related to login within 30 days of release",
+                "Login-related support tickets drop by at least 50% month over month"
+            ],
+            "testScenarios": [
+                "Log in with valid credentials on Chrome, Firefox and Safari and land on the dashboard",
+                "Enter a wrong password and verify the error message and cleared field",
+                "Log in with an unverified account and resend the verification email",
+                "Trigger the lockout after 5 failed attempts and verify it expires after the stated time",
+                "Throttle the network to simulate a timeout and verify a retry message is shown"
+            ]
+        }
+    },
+    {
+        "ticket": {
+            "title": "Add dark mode",
+            "description": "We need dark mode for the app. Make it switchable.",
+            "issueType": "Story",
+            "priority": "Medium"
+        },
+        "clarification": {
+            "acceptanceCriteria": [
+                "Given a user opens Settings, When they toggle 'Dark Mode', Then the UI switches theme instantly without a page reload",
+                "Given a user enables dark mode, When they reload the page or sign in on another device, Then their preference is remembered",
+                "Given the operating system theme is dark, When 'Follow system' is enabled, Then the app uses dark mode and follows later system changes",
+                "Given dark mode is active, When any page is rendered, Then all text meets WCAG AA contrast ratios"
+            ],
+            "edgeCases": [
+                "High-contrast accessibility mode overriding the app theme",
+                "Partial CSS custom property support in older browsers",
+                "User-uploaded images and charts with transparent backgrounds",
+                "Theme flash on first paint before the preference loads"
+            ],
+            "successMetrics": [
+                "At least 30% of active users enable dark mode within 7 days of launch",
+                "No increase in accessibility-related bug reports after release",
+                "Theme switch completes in under 100ms (P95)"
+            ],
+            "testScenarios": [
+                "Toggle dark mode in Settings and verify every page re-renders in the dark theme",
+                "Reload the app and sign in on a second device to confirm the preference persists",
+                "Switch the OS theme with 'Follow system' enabled and confirm the app follows",
+                "Run an automated contrast audit on the main pages in dark mode"
+            ]
+        }
+    },
+    {
+        "ticket": {
+            "title": "Export to CSV not working",
+            "description": "When I click export, nothing happens.",
+            "issueType": "Bug",
+            "priority": "High"
+        },
+        "clarification": {
+            "acceptanceCriteria": [
+                "Given a user is on the Reports page with data, When they click 'Export CSV', Then the file downloads within 2s",
+                "Given a report with more than 10k rows, When export is triggered, Then a progress indicator is shown and the file completes in under 30s",
+                "Given the export fails, When the error occurs, Then the user sees an actionable error message instead of nothing happening",
+                "Given a completed export, When the file is opened in Excel or Google Sheets, Then columns, encoding and dates match the on-screen report"
+            ],
+            "edgeCases": [
+                "Filenames and cell values with commas, quotes, newlines or unicode characters",
+                "User cancels or navigates away mid-download",
+                "Popup or download blockers in the browser",
+                "Empty report with no rows to export"
+            ],
+            "successMetrics": [
+                "Export success rate of 100% over 7 days",
+                "No unhandled export errors in Sentry",
+                "P95 export time under 5s for reports below 10k rows"
+            ],
+            "testScenarios": [
+                "Export a small report and verify the downloaded file contents",
+                "Export a 50k-row report and verify the progress indicator and completion",
+                "Export data containing commas, quotes and emoji and open it in Excel",
+                "Force a server error during export and verify the error message"
+            ]
+        }
+    }
+]
+
+
+def _format_ticket(title: str, description: Optional[str], issue_type: Optional[str], priority: Optional[str]) -> str:
+    return (
+        f"Ticket Title: {title}\n"
+        f"Description: {description or 'No description provided'}\n"
+        f"Issue Type: {issue_type}\n"
+        f"Priority: {priority}"
+    )
+
+
+CLARIFY_SYSTEM_PROMPT = """You are a senior software engineer helping to clarify Jira tickets. Given a ticket's information, provide clear, actionable acceptance criteria and additional details.
+
+Provide a structured response with:
+1. Acceptance Criteria (specific, testable conditions using Given-When-Then format where appropriate)
+2. Edge Cases to Consider (potential issues, boundary conditions)
+3. Success Metrics (measurable outcomes, KPIs)
+4. Test Scenarios (specific test cases for QA)
+
+Format your response as valid JSON with these exact keys:
+{
+  "acceptanceCriteria": ["criterion 1", "criterion 2", ...],
+  "edgeCases": ["edge case 1", "edge case 2", ...],
+  "successMetrics": ["metric 1", "metric 2", ...],
+  "testScenarios": ["scenario 1", "scenario 2", ...]
+}
+
+Focus on being practical and actionable. Provide at least 3-5 items for each category. When similar past tickets from the same team are included, use them for context on the product and conventions, but clarify only the ticket you are given.
+
+Examples:
+""" + "\n\n".join(
+    "<example>\n{ticket}\n\n{clarification}\n</example>".format(
+        ticket=_format_ticket(
+            example["ticket"]["title"],
+            example["ticket"]["description"],
+            example["ticket"]["issueType"],
+            example["ticket"]["priority"]
+        ),
+        clarification=json.dumps(example["clarification"], indent=2)
+    )
+    for example in FEW_SHOT_EXAMPLES
+)
+
+
+def system_blocks() -> List[Dict[str, Any]]:
+    """System prompt marked as an Anthropic prompt-caching breakpoint"""
+    return [{"type": "text", "text": CLARIFY_SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+
+
+def build_user_prompt(
+    title: str,
+    description: Optional[str],
+    issue_type: Optional[str],
+    priority: Optional[str],
+    similar_tickets: List[Dict[str, Any]]
+) -> str:
+    """The per-ticket part of the prompt (everything after the cached prefix)"""
+    prompt = _format_ticket(title, description, issue_type, priority)
+    if similar_tickets:
+        prompt += "\n\nSimilar past tickets for context:" + json.dumps(similar_tickets, indent=2)
+    return prompt
+
+
+class TokenUsage:
+    """
+    Running totals of Claude token usage, including prompt cache reads/writes
+
+    Cache reads are billed at a tenth of the input price and cache writes at
+    1.25x, so cacheReadRatio is the share of prompt tokens served from cache.
+    """
+
+    FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.totals = dict.fromkeys(self.FIELDS, 0)
+
+    def record(self, usage) -> Dict[str, int]:
+        """Add a response's `usage` (SDK object or dict); returns the counts it contained"""
+        counts = {
+            field: int((usage.get(field) if isinstance(usage, dict) else getattr(usage, field, None)) or 0)
+            for field in self.FIELDS
+        }
+        with self._lock:
+            self.requests += 1
+            for field, count in counts.items():
+                self.totals[field] += count
+        return counts
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            totals, requests = dict(self.totals), self.requests
+        prompt_tokens = totals["input_tokens"] + totals["cache_creation_input_tokens"] + totals["cache_read_input_tokens"]
+        return {
+            "requests": requests,
+            "inputTokens": totals["input_tokens"],
+            "outputTokens": totals["output_tokens"],
+            "cacheCreationInputTokens": totals["cache_creation_input_tokens"],
+            "cacheReadInputTokens": totals["cache_read_input_tokens"],
+            "cacheReadRatio": round(totals["cache_read_input_tokens"] / prompt_tokens, 3) if prompt_tokens else 0.0
+        }
@@ -0,0 +1,161 @@
+# rag.py - Similar-ticket retrieval: local embeddings + a pluggable vector store
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Protocol
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"  # same model pinecone_training.py indexes with
+
+
+def ticket_text(title: str, description: Optional[str]) -> str:
+    """Text that gets embedded for a ticket (matches pinecone_training.py)"""
+    return f"{title} {description or ''}".strip()
+
+
+class Embedder(Protocol):
+    def embed(self, texts: List[str]) -> List[List[float]]: ...
+
+
+class SentenceTransformerEmbedder:
+    """Embeds in-process with sentence-transformers; load once at startup"""
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError("RAG needs sentence-transformers: pip install sentence-transformers") from e
+
+        self.model = SentenceTransformer(model_name)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return self.model.encode(texts, normalize_embeddings=True).tolist()
+
+
+class VectorStore(Protocol):
+    """Nearest-neighbour search over ticket vectors, partitioned by namespace"""
+
+    def query(self, vector: List[float], top_k: int, namespace: str) -> List[Dict[str, Any]]:
+        """Return up to top_k matches as {"id", "score", "metadata"}, best first"""
+        ...
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str): ...
+
+
+class PineconeVectorStore:
+    """VectorStore backed by a Pinecone index"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def query(self, vector: List[float], top_k: int, namespace: str) -> List[Dict[str, Any]]:
+        response = self.index.query(vector=vector, top_k=top_k, namespace=namespace, include_metadata=True)
+        return [
+            {"id": match["id"], "score": match["score"], "metadata": match.get("metadata") or {}}
+            for match in response["matches"]
+        ]
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str):
+        self.index.upsert(vectors=vectors, namespace=namespace)
+
+
+class InMemoryVectorStore:
+    """Exact cosine search in numpy; stands in for Pinecone in tests and local dev"""
+
+    def __init__(self):
+        self._namespaces: Dict[str, Dict[str, Any]] = {}
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str):
+        import numpy as np
+
+        entries = self._namespaces.setdefault(namespace, {})
+        for vector in vectors:
+            values = np.asarray(vector["values"], dtype=np.float32)
+            entries[vector["id"]] = (values / (np.linalg.norm(values) or 1.0), vector.get("metadata") or {})
+
+    def query(self, vector: List[float], top_k: int, namespace: str) -> List[Dict[str, Any]]:
+        entries = self._namespaces.get(namespace)
+        if not entries:
+            return []
+
+        import numpy as np
+
+        ids = list(entries)
+        matrix = np.stack([entries[id_][0] for id_ in ids])
+        query = np.asarray(vector, dtype=np.float32)
+        scores = matrix @ (query / (np.linalg.norm(query) or 1.0))
+        best = np.argsort(-scores)[:top_k]
+        return [{"id": ids[i], "score": float(scores[i]), "metadata": entries[ids[i]][1]} for i in best]
+
+
+class SimilarTicketRetriever:
+    """
+    Embed a ticket and fetch its nearest neighbours from a VectorStore
+
+    Retrieval is best effort: it runs on its own pool of `workers` threads
+    under a time budget, and a slow or failing embedder or store yields no
+    context instead of delaying the clarification. Work that overran its
+    budget keeps its thread until it finishes, so when every thread is busy
+    the lookup is skipped rather than queued, and a stuck store can't tie
+    up the default executor that database calls run on.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        store: VectorStore,
+        top_k: int = 3,
+        timeout: float = 0.5,
+        min_score: float = 0.0,
+        workers: int = 4
+    ):
+        self.embedder = embedder
+        self.store = store
+        self.top_k = top_k
+        self.timeout = timeout
+        self.min_score = min_score
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag")
+        self._slots = threading.BoundedSemaphore(workers)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _retrieve(self, text: str, namespace: str) -> List[Dict[str, Any]]:
+        vector = self.embedder.embed([text])[0]
+        return self.store.query(vector, self.top_k, namespace)
+
+    async def retrieve(self, text: str, namespace: str) -> List[Dict[str, Any]]:
+        """Similar past tickets as {"title", "description", "score"}, or [] on timeout/error/saturation"""
+        if not self._slots.acquire(blocking=False):
+            logger.warning("RAG workers all busy, continuing without context")
+            return []
+
+        try:
+            future = self._executor.submit(self._retrieve, text, namespace)
+        except RuntimeError:  # executor shut down
+            self._slots.release()
+            return []
+        # Freed when the thread is done with it, not when the caller stops waiting
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            matches = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning("RAG retrieval exceeded its budget, continuing without context", extra={"timeout": self.timeout})
+            return []
+        except Exception as e:
+            logger.error("RAG error", extra={"error": str(e)})
+            return []
+
+        return [
+            {
+                "title": match["metadata"].get("title", ""),
+                "description": match["metadata"].get("desc", match["metadata"].get("description", "")),
+                "score": round(match["score"], 3)
+            }
+            for match in matches
+            if match["score"] >= self.min_score
+        ]
@@ -0,0 +1,148 @@
+# ratelimit.py - GCRA rate limiting in Redis with an in-process fallback
+import logging
+import math
+import time
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# GCRA over every key in one atomic call. A request is allowed only if all
+# keys have capacity; then each key's theoretical arrival time (TAT) advances.
+#   KEYS: one per limit
+#   ARGV: window_ms, cost, then one limit per key
+# Returns {allowed, limit, remaining, reset_ms, retry_after_ms} for the
+# tightest key.
+GCRA_LUA = """
+local window = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local allowed = 1
+local worst_limit, worst_remaining, worst_reset, retry_after = 0, -1, 0, 0
+local new_tats = {}
+
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i + 2])
+    local interval = window / limit
+    local tat = tonumber(redis.call('GET', key) or now)
+    if tat < now then tat = now end
+
+    local new_tat = tat + interval * cost
+    local allow_at = new_tat - window
+    new_tats[i] = new_tat
+
+    local remaining
+    if now < allow_at then
+        allowed = 0
+        retry_after = math.max(retry_after, allow_at - now)
+        remaining = 0
+    else
+        remaining = math.floor((now - allow_at) / interval)
+    end
+
+    if worst_remaining < 0 or remaining < worst_remaining then
+        worst_limit, worst_remaining, worst_reset = limit, remaining, math.ceil(new_tat - now)
+    end
+end
+
+if allowed == 1 then
+    for i, key in ipairs(KEYS) do
+        redis.call('SET', key, string.format('%.3f', new_tats[i]), 'PX', math.max(1, math.ceil(new_tats[i] - now)))
+    end
+end
+
+return {allowed, worst_limit, worst_remaining, worst_reset, math.ceil(retry_after)}
+"""
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: float  # seconds until the window fully replenishes
+    retry_after: float  # seconds until the request would be allowed (0 if allowed)
+
+    def headers(self) -> Dict[str, str]:
+        """IETF RateLimit-* headers, plus Retry-After when rejected"""
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(math.ceil(self.reset))
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+class TokenBucketLimiter:
+    """In-process token buckets used when Redis is unavailable (per worker, not shared)"""
+
+    def __init__(self, window: float, clock: Callable[[], float] = time.monotonic, max_keys: int = 100000):
+        self.window = window
+        self._clock = clock
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def hit(self, limits: List[Tuple[str, int]], cost: int = 1) -> RateLimitResult:
+        now = self._clock()
+        refilled = []
+        for key, limit in limits:
+            tokens, updated = self._buckets.get(key, (float(limit), now))
+            tokens = min(float(limit), tokens + (now - updated) * limit / self.window)
+            refilled.append((key, limit, tokens))
+
+        allowed = all(tokens >= cost for _, _, tokens in refilled)
+        retry_after = max(
+            ((cost - tokens) * self.window / limit for _, limit, tokens in refilled if tokens < cost),
+            default=0.0
+        )
+
+        if allowed:
+            refilled = [(key, limit, tokens - cost) for key, limit, tokens in refilled]
+        for key, _, tokens in refilled:
+            self._buckets[key] = (tokens, now)
+
+        if len(self._buckets) > self.max_keys:
+            self._buckets.clear()
+
+        key, limit, tokens = min(refilled, key=lambda bucket: bucket[2])
+        return RateLimitResult(
+            allowed=allowed,
+            limit=limit,
+            remaining=max(0, int(tokens)),
+            reset=(limit - tokens) * self.window / limit,
+            retry_after=0.0 if allowed else retry_after
+        )
+
+
+class RateLimiter:
+    """
+    Rate limiter shared across workers through Redis
+
+    All keys for a request are checked and charged by one Lua script, so a
+    check costs a single round trip. If Redis is missing or errors, requests
+    are limited by the in-process token bucket instead.
+    """
+
+    def __init__(self, redis=None, window: float = 60, prefix: str = "ratelimit:"):
+        self.redis = redis
+        self.window = window
+        self.prefix = prefix
+        self.fallback = TokenBucketLimiter(window)
+        self._script = redis.register_script(GCRA_LUA) if redis is not None else None
+
+    async def hit(self, limits: List[Tuple[str, int]], cost: int = 1) -> RateLimitResult:
+        """Charge `cost` against every (key, limit) pair, allowing only if all have room"""
+        if self._script is not None:
+            try:
+                allowed, limit, remaining, reset_ms, retry_ms = await self._script(
+                    keys=[self.prefix + key for key, _ in limits],
+                    args=[int(self.window * 1000), cost] + [limit for _, limit in limits]
+                )
+                return RateLimitResult(bool(allowed), int(limit), int(remaining), reset_ms / 1000, retry_ms / 1000)
+            except Exception as e:
+                logger.warning("Rate limiter falling back to local buckets", extra={"error": str(e)})
+
+        return self.fallback.hit(limits, cost)
@@ -0,0 +1,268 @@
+# resilience.py - Deadlines, retries, hedging and a circuit breaker for upstream LLM calls
+import asyncio
+import contextvars
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import anthropic
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 529 is Anthropic's "overloaded"
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("llm_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's overall deadline passed before the upstream answered"""
+
+
+class CircuitOpenError(Exception):
+    """The upstream is failing; calls are rejected until the breaker's reset timeout"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+@contextmanager
+def deadline_scope(timeout: float):
+    """
+    Bound every upstream call made inside the block (including tasks it
+    spawns) to finish within `timeout` seconds of entering it
+
+    Nested scopes can only shorten the deadline.
+    """
+    deadline = time.monotonic() + timeout
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(deadline, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, anthropic.APIConnectionError)  # includes APITimeoutError
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers["retry-after"]) if response is not None else None
+    except (KeyError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    After `failure_threshold` retryable failures in a row the circuit opens
+    and calls fail immediately. Once `reset_timeout` has passed one probe
+    call is let through (half-open); its outcome closes or re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def check(self) -> bool:
+        """
+        Raise CircuitOpenError unless a call may go through
+
+        Returns True when the caller is the half-open probe; it must call
+        release_probe() once done, whatever the outcome.
+        """
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        raise CircuitOpenError(max(self.reset_timeout - (time.monotonic() - self.opened_at), 1.0))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probing:
+                logger.warning("Circuit opened", extra={"consecutiveFailures": self.failures})
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """
+        End a probe that may not have recorded an outcome (cancelled, or a
+        stream closed early) so the next call can probe instead
+        """
+        self._probing = False
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies, for choosing the hedge delay"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, latency: float):
+        self.samples.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class ResilientCaller:
+    """
+    Runs upstream calls under a deadline with jittered retries, optional
+    hedging and a shared circuit breaker
+
+    Hedging fires a second identical request once the first has been
+    outstanding longer than the recent p-`hedge_percentile` latency for that
+    model (but at least `hedge_min_delay`), and takes whichever succeeds
+    first. Until enough latencies are recorded no hedge is sent.
+    """
+
+    def __init__(
+        self,
+        breaker: CircuitBreaker,
+        max_retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        default_deadline: float = 60.0,
+        hedge: bool = False,
+        hedge_percentile: float = 0.95,
+        hedge_min_delay: float = 1.0
+    ):
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.default_deadline = default_deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.latencies: Dict[str, LatencyTracker] = {}
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "hedgeWins": 0, "deadlineExceeded": 0, "circuitRejected": 0}
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        tracker = self.latencies.get(key)
+        percentile = tracker.percentile(self.hedge_percentile) if tracker else None
+        return max(percentile, self.hedge_min_delay) if percentile is not None else None
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after(error) or 0.0)
+
+    async def call(self, fn: Callable[[], Awaitable[T]], key: str = "default") -> T:
+        """Await fn() (a fresh request per invocation) with retries, hedging and the current deadline"""
+        deadline = _deadline.get() or time.monotonic() + self.default_deadline
+        self.stats["calls"] += 1
+        attempt = 0
+        while True:
+            try:
+                probing = self.breaker.check()
+            except CircuitOpenError:
+                self.stats["circuitRejected"] += 1
+                raise
+
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats["deadlineExceeded"] += 1
+                    raise DeadlineExceeded("Deadline passed before the upstream answered")
+                result = await asyncio.wait_for(self._hedged(fn, key), remaining)
+            except asyncio.TimeoutError:
+                self.breaker.record_failure()
+                self.stats["deadlineExceeded"] += 1
+                raise DeadlineExceeded(f"No upstream answer within the {remaining:.1f}s left")
+            except Exception as e:
+                if not is_retryable(e):
+                    if isinstance(e, anthropic.APIStatusError):
+                        self.breaker.record_success()  # the upstream answered, so it is reachable
+                    raise
+                self.breaker.record_failure()
+                error = e
+                delay = self.backoff(attempt, e)
+                attempt += 1
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline:
+                    raise
+            else:
+                self.breaker.record_success()
+                return result
+            finally:
+                # A cancelled or otherwise unrecorded probe must not leave the breaker half-open forever
+                if probing:
+                    self.breaker.release_probe()
+
+            logger.info("Retrying upstream call", extra={"error": error.__class__.__name__, "attempt": attempt, "maxRetries": self.max_retries, "delay": round(delay, 3)})
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def _timed(self, fn: Callable[[], Awaitable[T]], key: str) -> T:
+        start = time.monotonic()
+        result = await fn()
+        self.latencies.setdefault(key, LatencyTracker()).record(time.monotonic() - start)
+        return result
+
+    async def _hedged(self, fn: Callable[[], Awaitable[T]], key: str) -> T:
+        primary = asyncio.ensure_future(self._timed(fn, key))
+        delay = self.hedge_delay(key) if self.hedge else None
+        if delay is None:
+            return await primary
+
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            self.stats["hedges"] += 1
+            hedge = asyncio.ensure_future(self._timed(fn, key))
+            pending.add(hedge)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.stats["hedgeWins"] += int(task is hedge)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            **self.stats,
+            "circuit": self.breaker.state,
+            "hedgeDelayMs": {key: round(self.hedge_delay(key) * 1000) for key in self.latencies if self.hedge_delay(key)}
+        }
@@ -0,0 +1,138 @@
+# routing.py - Cheap-first model routing with escalation for clarifications
+import re
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from jira_clarifier_backend.streaming import CLARIFICATION_SECTIONS
+
+# Issue types that usually need design-level clarification rather than a quick fix
+COMPLEX_ISSUE_TYPES = {"story", "epic", "feature", "new feature", "improvement", "spike", "initiative"}
+URGENT_PRIORITIES = {"highest", "critical", "blocker", "urgent", "high"}
+MIN_ITEMS = 3  # the prompt asks for 3-5 items per section
+
+
+class ModelTier(NamedTuple):
+    name: str
+    model: str
+    max_tokens: int
+
+
+class RoutingDecision(NamedTuple):
+    tier: ModelTier
+    complexity: int
+    reasons: List[str]
+
+
+def ticket_complexity(title: str, description: Optional[str], issue_type: Optional[str], priority: Optional[str]) -> Tuple[int, List[str]]:
+    """Score a ticket from its length, structure, issue type and priority (0 = trivial)"""
+    score, reasons = 0, []
+    words = len(f"{title} {description or ''}".split())
+    if words > 120:
+        score, reasons = score + 2, reasons + [f"{words} words"]
+    elif words > 40:
+        score, reasons = score + 1, reasons + [f"{words} words"]
+
+    lines = [line for line in (description or "").splitlines() if line.strip()]
+    if len(lines) >= 3:
+        score, reasons = score + 1, reasons + [f"{len(lines)} lines"]
+    if (issue_type or "").strip().lower() in COMPLEX_ISSUE_TYPES:
+        score, reasons = score + 1, reasons + [f"type {issue_type}"]
+    if (priority or "").strip().lower() in URGENT_PRIORITIES:
+        score, reasons = score + 1, reasons + [f"priority {priority}"]
+    return score, reasons
+
+
+def clarification_confidence(sections: Dict[str, List[str]]) -> float:
+    """
+    Heuristic 0-1 quality score for a clarification
+
+    Half is section coverage (at least MIN_ITEMS items each), 30% is the
+    share of acceptance criteria in Given/When/Then form, and 20% is items
+    being more than a few words long.
+    """
+    coverage = sum(min(len(sections.get(section, [])), MIN_ITEMS) / MIN_ITEMS for section in CLARIFICATION_SECTIONS)
+    coverage /= len(CLARIFICATION_SECTIONS)
+
+    criteria = sections.get("acceptanceCriteria", [])
+    given_when_then = sum(
+        1 for item in criteria if re.search(r"\bgiven\b", item, re.I) and re.search(r"\bthen\b", item, re.I)
+    ) / len(criteria) if criteria else 0.0
+
+    items = [item for section in CLARIFICATION_SECTIONS for item in sections.get(section, [])]
+    substantive = sum(1 for item in items if len(item.split()) >= 4) / len(items) if items else 0.0
+
+    return round(0.5 * coverage + 0.3 * given_when_then + 0.2 * substantive, 3)
+
+
+class ModelRouter:
+    """
+    Sends simple tickets to a fast model and everything else to the strong one
+
+    A fast-model answer is escalated to the strong model when any section
+    failed validation or its confidence is below `confidence_threshold`.
+    """
+
+    def __init__(self, fast: ModelTier, strong: ModelTier, complexity_threshold: int = 2, confidence_threshold: float = 0.6):
+        self.fast = fast
+        self.strong = strong
+        self.complexity_threshold = complexity_threshold
+        self.confidence_threshold = confidence_threshold
+
+    def route(self, title: str, description: Optional[str], issue_type: Optional[str], priority: Optional[str]) -> RoutingDecision:
+        complexity, reasons = ticket_complexity(title, description, issue_type, priority)
+        tier = self.strong if complexity >= self.complexity_threshold else self.fast
+        return RoutingDecision(tier, complexity, reasons)
+
+    def escalation_reason(self, sections: Dict[str, List[str]], malformed: List[str]) -> Optional[str]:
+        """Why a fast-model answer needs the strong model, or None to accept it"""
+        if malformed:
+            return f"malformed {', '.join(malformed)}"
+        confidence = clarification_confidence(sections)
+        if confidence < self.confidence_threshold:
+            return f"confidence {confidence:.2f} < {self.confidence_threshold:g}"
+        return None
+
+
+class RoutingStats:
+    """Per-tier routing counts and per-model latency and token spend (reported by /health)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routed: Dict[str, int] = {}
+        self.escalations = 0
+        self.models: Dict[str, Dict[str, float]] = {}
+
+    def record_route(self, tier: ModelTier):
+        with self._lock:
+            self.routed[tier.name] = self.routed.get(tier.name, 0) + 1
+
+    def record_escalation(self):
+        with self._lock:
+            self.escalations += 1
+
+    def record_call(self, model: str, latency: float, tokens: Dict[str, int]):
+        """Add one Claude call; `tokens` is what TokenUsage.record returned"""
+        with self._lock:
+            stats = self.models.setdefault(model, {
+                "calls": 0, "latencyTotal": 0.0, "latencyMax": 0.0,
+                "inputTokens": 0, "outputTokens": 0, "cacheReadInputTokens": 0, "cacheCreationInputTokens": 0
+            })
+            stats["calls"] += 1
+            stats["latencyTotal"] += latency
+            stats["latencyMax"] = max(stats["latencyMax"], latency)
+            stats["inputTokens"] += tokens.get("input_tokens", 0)
+            stats["outputTokens"] += tokens.get("output_tokens", 0)
+            stats["cacheReadInputTokens"] += tokens.get("cache_read_input_tokens", 0)
+            stats["cacheCreationInputTokens"] += tokens.get("cache_creation_input_tokens", 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {
+                model: {
+                    **{key: value for key, value in stats.items() if not key.startswith("latency")},
+                    "avgLatencyMs": round(stats["latencyTotal"] / stats["calls"] * 1000, 1),
+                    "maxLatencyMs": round(stats["latencyMax"] * 1000, 1)
+                }
+                for model, stats in self.models.items()
+            }
+            return {"routed": dict(self.routed), "escalations": self.escalations, "models": models}
@@ -0,0 +1,118 @@
+# singleflight.py - Coalesce identical in-flight work, within a worker and across workers via Redis
+import asyncio
+import json
+import logging
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Delete the lock only if this flight still holds it (it may have expired and been retaken)
+RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time and hands its result to every caller
+
+    Within a worker, concurrent callers for a key await the same task, which
+    runs detached so a disconnecting caller doesn't cancel it for the rest.
+    With Redis, the task first takes `lock:<key>` (SET NX PX); a worker that
+    finds the lock held polls for the holder's `result:<key>` instead of
+    calling upstream. If the holder fails or its lock expires without a
+    result, a waiting worker takes the lock over. Redis errors degrade to
+    per-worker coalescing.
+
+    Results must be JSON-serializable.
+    """
+
+    def __init__(self, redis=None, lock_ttl: float = 120.0, result_ttl: int = 30, poll_interval: float = 0.05, prefix: str = "singleflight:"):
+        self.redis = redis
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self._release = redis.register_script(RELEASE_LUA) if redis is not None else None
+        self._flights: Dict[str, asyncio.Task] = {}
+        self.stats = {"requests": 0, "leaders": 0, "coalesced": 0, "coalescedRemote": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return (result, shared); shared is True if another caller's call produced it"""
+        self.stats["requests"] += 1
+        task = self._flights.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            value, _ = await asyncio.shield(task)
+            return value, True
+
+        task = asyncio.ensure_future(self._run(key, fn))
+        self._flights[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        value, remote = await asyncio.shield(task)
+        return value, remote
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so callers that went away don't leave it unreported
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        if self.redis is None:
+            self.stats["leaders"] += 1
+            return await fn(), False
+
+        lock_key, result_key = f"{self.prefix}lock:{key}", f"{self.prefix}result:{key}"
+        token = secrets.token_hex(16)
+        give_up_at = time.monotonic() + self.lock_ttl
+        try:
+            while True:
+                raw = await self.redis.get(result_key)
+                if raw is not None:
+                    self.stats["coalescedRemote"] += 1
+                    return json.loads(raw), True
+                if await self.redis.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000)):
+                    break
+                if time.monotonic() >= give_up_at:
+                    logger.warning("Single-flight wait timed out, calling upstream", extra={"coalesceKey": key[:12]})
+                    token = None
+                    break
+                # Another worker holds the lock: wait for its result or for the lock to go away
+                while time.monotonic() < give_up_at:
+                    await asyncio.sleep(self.poll_interval)
+                    raw, holder = await self.redis.mget(result_key, lock_key)
+                    if raw is not None or holder is None:
+                        break
+        except Exception as e:
+            logger.warning("Single-flight Redis error", extra={"error": str(e)})
+            self.stats["leaders"] += 1
+            return await fn(), False
+
+        self.stats["leaders"] += 1
+        try:
+            value = await fn()
+            try:
+                await self.redis.set(result_key, json.dumps(value), ex=self.result_ttl)
+            except Exception as e:
+                logger.warning("Single-flight result write error", extra={"error": str(e)})
+            return value, False
+        finally:
+            if token is not None:
+                try:
+                    await self._release(keys=[lock_key], args=[token])
+                except Exception as e:
+                    logger.warning("Single-flight lock release error", extra={"error": str(e)})
+
+    def snapshot(self) -> Dict[str, Any]:
+        coalesced = self.stats["coalesced"] + self.stats["coalescedRemote"]
+        return {
+            **self.stats,
+            "inFlight": len(self._flights),
+            "coalescingRate": round(coalesced / self.stats["requests"], 4) if self.stats["requests"] else 0.0
+        }
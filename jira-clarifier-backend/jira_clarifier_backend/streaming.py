@@ -0,0 +1,94 @@
+# streaming.py - Incremental parsing and SSE framing for streamed clarifications
+import json
+from typing import Any, List, Tuple
+
+
+CLARIFICATION_SECTIONS = ("acceptanceCriteria", "edgeCases", "successMetrics", "testScenarios")
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Frame one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class IncrementalSectionParser:
+    """
+    Streaming JSON scanner for Claude's clarification output
+
+    Feed it text deltas as they arrive; it returns each (section, item) pair
+    as soon as the item's closing quote is seen, without waiting for the rest
+    of the document. Text before the first "{" (e.g. a ```json fence) and
+    after the root object closes is ignored. Non-string list items are
+    skipped here and left to the final full parse.
+    """
+
+    def __init__(self, sections: Tuple[str, ...] = CLARIFICATION_SECTIONS):
+        self.sections = set(sections)
+        self.done = False
+        self._stack: List[str] = []
+        self._expecting_key: List[bool] = []
+        self._key = None
+        self._in_string = False
+        self._escape = False
+        self._buffer: List[str] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        items = []
+        for char in chunk:
+            if self.done:
+                break
+            item = self._consume(char)
+            if item:
+                items.append(item)
+        return items
+
+    def _consume(self, char: str):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+                self._buffer.append(char)
+            elif char == "\\":
+                self._escape = True
+                self._buffer.append(char)
+            elif char == '"':
+                self._in_string = False
+                return self._close_string(json.loads('"' + "".join(self._buffer) + '"'))
+            else:
+                self._buffer.append(char)
+            return None
+
+        if not self._stack:
+            if char == "{":
+                self._push("{")
+            return None
+
+        if char == '"':
+            self._in_string = True
+            self._buffer = []
+        elif char in "{[":
+            self._push(char)
+        elif char in "}]":
+            self._stack.pop()
+            self._expecting_key.pop()
+            if not self._stack:
+                self.done = True
+        elif char == ":" and self._stack[-1] == "{":
+            self._expecting_key[-1] = False
+        elif char == "," and self._stack[-1] == "{":
+            self._expecting_key[-1] = True
+        return None
+
+    def _push(self, container: str):
+        self._stack.append(container)
+        self._expecting_key.append(container == "{")
+
+    def _close_string(self, value: str):
+        depth = len(self._stack)
+        if self._stack[-1] == "{" and self._expecting_key[-1]:
+            if depth == 1:
+                self._key = value
+            return None
+
+        if depth == 2 and self._stack[-1] == "[" and self._key in self.sections:
+            return (self._key, value)
+        return None
@@ -0,0 +1,190 @@
+# stripe_cache.py - Read-through cache of Stripe objects, fed by webhook payloads
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from jira_clarifier_backend.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Object types whose webhook snapshots are kept (`object` field of data.object)
+CACHED_OBJECTS = ("subscription", "invoice")
+
+
+def key_livemode(api_key: Optional[str]) -> Optional[bool]:
+    """Whether a Stripe secret or restricted key is live, or None when unknown"""
+    if not api_key:
+        return None
+    return "_live_" in api_key
+
+
+class StripeObjectStore:
+    """Postgres persistence for stripe_objects (sync, run in threads)"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _run(self, work: Callable):
+        conn = self.pool.getconn()
+        try:
+            result = work(conn.cursor())
+            conn.commit()
+            return result
+        finally:
+            self.pool.putconn(conn)
+
+    def load(self, object_id: str, min_version: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """(version, object) if a snapshot at least as new as `min_version` is stored"""
+        def work(cur):
+            cur.execute("""
+                SELECT version, data FROM stripe_objects
+                WHERE id = %s AND version >= %s
+            """, (object_id, min_version))
+            row = cur.fetchone()
+            return (row['version'], row['data']) if row else None
+
+        return self._run(work)
+
+    def save(self, obj: Dict[str, Any], version: int) -> bool:
+        """Store a snapshot unless a newer one is already stored; True if it was stored"""
+        def work(cur):
+            cur.execute("""
+                INSERT INTO stripe_objects (id, object_type, livemode, created, version, data)
+                VALUES (%s, %s, %s, to_timestamp(%s), %s, %s)
+                ON CONFLICT (id) DO UPDATE
+                SET object_type = EXCLUDED.object_type, livemode = EXCLUDED.livemode,
+                    created = EXCLUDED.created, version = EXCLUDED.version,
+                    data = EXCLUDED.data, updated_at = NOW()
+                WHERE stripe_objects.version <= EXCLUDED.version
+                RETURNING id
+            """, (
+                obj['id'],
+                obj.get('object'),
+                bool(obj.get('livemode')),
+                obj.get('created') or 0,
+                version,
+                json.dumps(obj)
+            ))
+            return cur.fetchone() is not None
+
+        return self._run(work)
+
+
+class StripeObjectCache:
+    """
+    Stripe objects by ID: in-process LRU, then the stripe_objects table,
+    then the Stripe API
+
+    Webhook payloads carry full snapshots of the object they are about, so
+    `put_event` stores subscriptions and invoices as they arrive and later
+    lookups skip the API. Each snapshot is versioned by when Stripe took
+    it (the event's `created`, or the fetch time for API reads) and an
+    older snapshot never replaces a newer one, so late or replayed events
+    can't roll an object back. Objects from the other mode (test vs live)
+    than `livemode` are ignored. Snapshots older than `max_age` seconds
+    are refetched in case a webhook was missed.
+
+    Sync and thread-safe, for the webhook worker threads. Store errors
+    fall back to the API instead of failing the lookup.
+    """
+
+    def __init__(
+        self,
+        store,
+        local: TTLCache,
+        livemode: Optional[bool] = None,
+        max_age: float = 86400,
+        clock: Callable[[], float] = time.time
+    ):
+        self.store = store
+        self.local = local
+        self.livemode = livemode
+        self.max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.stats = {"memoryHits": 0, "databaseHits": 0, "misses": 0, "stored": 0, "skipped": 0}
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _cacheable(self, obj: Any) -> bool:
+        if not isinstance(obj, dict) or not obj.get('id') or obj.get('object') not in CACHED_OBJECTS:
+            return False
+        return self.livemode is None or bool(obj.get('livemode')) == self.livemode
+
+    def get(self, object_id: str, fetch: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        Return (object, tier) where tier is "memory", "database" or None
+        when it was fetched with `fetch()` (and then stored)
+        """
+        min_version = int(self._clock() - self.max_age)
+        with self._lock:
+            entry = self.local.get(object_id)
+        if entry is not None and entry[0] >= min_version:
+            self._count("memoryHits")
+            return entry[1], "memory"
+
+        try:
+            stored = self.store.load(object_id, min_version)
+        except Exception as e:
+            logger.warning("Stripe object cache read error", extra={"objectId": object_id, "error": str(e)})
+            stored = None
+        if stored is not None:
+            self._remember(object_id, *stored)
+            self._count("databaseHits")
+            return stored[1], "database"
+
+        version = int(self._clock())
+        obj = fetch()
+        self._count("misses")
+        self.put(obj, version)
+        return obj, None
+
+    def put(self, obj: Dict[str, Any], version: int) -> bool:
+        """Store a snapshot taken at `version` (unix seconds) unless a newer one is known"""
+        if not self._cacheable(obj):
+            return False
+
+        with self._lock:
+            entry = self.local.get(obj['id'])
+        if entry is not None and entry[0] > version:
+            self._count("skipped")
+            return False
+
+        try:
+            stored = self.store.save(obj, version)
+        except Exception as e:
+            logger.warning("Stripe object cache write error", extra={"objectId": obj['id'], "error": str(e)})
+            return False
+        if not stored:
+            self._count("skipped")
+            return False
+
+        self._remember(obj['id'], version, obj)
+        self._count("stored")
+        return True
+
+    def put_event(self, event: Dict[str, Any]) -> bool:
+        """Store the object snapshot a webhook event carries, versioned by the event time"""
+        obj = event.get('data', {}).get('object')
+        if not self._cacheable(obj) or bool(event.get('livemode')) != bool(obj.get('livemode')):
+            return False
+        return self.put(obj, event.get('created') or 0)
+
+    def _remember(self, object_id: str, version: int, obj: Dict[str, Any]):
+        with self._lock:
+            entry = self.local.get(object_id)
+            if entry is None or entry[0] <= version:
+                self.local.set(object_id, (version, obj))
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["memoryHits"] + self.stats["databaseHits"] + self.stats["misses"]
+        hits = lookups - self.stats["misses"]
+        return {
+            **self.stats,
+            "lookups": lookups,
+            "hitRate": round(hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,205 @@
+# structured.py - Tool-use output schema, tolerant parsing and repair for clarifications
+import json
+import re
+import threading
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from jira_clarifier_backend.streaming import CLARIFICATION_SECTIONS, IncrementalSectionParser
+
+CLARIFICATION_TOOL_NAME = "record_clarification"
+SECTION_TOOL_NAME = "record_section"
+
+_ITEMS = {"type": "array", "items": {"type": "string"}, "minItems": 1}
+
+CLARIFICATION_TOOL = {
+    "name": CLARIFICATION_TOOL_NAME,
+    "description": "Record the clarification for the ticket. Every list needs at least 3 items.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "acceptanceCriteria": {**_ITEMS, "description": "Specific, testable conditions, Given-When-Then where appropriate"},
+            "edgeCases": {**_ITEMS, "description": "Potential issues and boundary conditions"},
+            "successMetrics": {**_ITEMS, "description": "Measurable outcomes and KPIs"},
+            "testScenarios": {**_ITEMS, "description": "Specific test cases for QA"}
+        },
+        "required": list(CLARIFICATION_SECTIONS)
+    }
+}
+
+SECTION_TOOL = {
+    "name": SECTION_TOOL_NAME,
+    "description": "Record a single section of the clarification when only that section is requested.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "section": {"type": "string", "enum": list(CLARIFICATION_SECTIONS)},
+            "items": _ITEMS
+        },
+        "required": ["section", "items"]
+    }
+}
+
+# Sent with every request (including section re-asks) so the cached prefix never changes
+CLARIFICATION_TOOLS = [CLARIFICATION_TOOL, SECTION_TOOL]
+
+
+def tool_choice(name: str) -> Dict[str, str]:
+    return {"type": "tool", "name": name}
+
+
+def section_request(section: str) -> str:
+    """Suffix for the user message when re-asking for one section"""
+    return f'\n\nProvide only the "{section}" section for this ticket using the {SECTION_TOOL_NAME} tool.'
+
+
+class ClarificationParseError(ValueError):
+    """Claude's response had no usable clarification sections"""
+
+
+class ParsedClarification(NamedTuple):
+    sections: Dict[str, List[str]]
+    malformed: List[str]  # missing, empty or wrongly typed sections
+    repaired: bool  # truncated JSON had to be closed
+
+
+def response_content(message) -> Tuple[str, bool]:
+    """(JSON or text content, whether it came from a tool call) for a Messages API response"""
+    for block in message.content:
+        if block.type == "tool_use":
+            return json.dumps(block.input), True
+    return "".join(block.text for block in message.content if block.type == "text"), False
+
+
+def repair_json(text: str) -> str:
+    """
+    Close a truncated JSON document so it parses
+
+    An unterminated string is dropped (with its key, if it was a value),
+    along with dangling commas, colons and partial literals; then every
+    open object and array is closed. Complete documents come back as-is,
+    minus anything after the root value.
+    """
+    stack: List[str] = []
+    in_string = escape = False
+    string_start = last_string_start = 0
+
+    for i, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+                last_string_start = string_start
+            continue
+
+        if char == '"':
+            in_string, string_start = True, i
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+            if not stack:
+                return text[:i + 1]
+
+    repaired = (text[:string_start] if in_string else re.sub(r"[\w.+\-]+$", "", text.rstrip())).rstrip()
+    if repaired.endswith(":"):
+        repaired = repaired[:last_string_start].rstrip()
+    return repaired.rstrip(",").rstrip() + "".join(reversed(stack))
+
+
+def _section_items(value: Any) -> List[str]:
+    if isinstance(value, str):
+        # Models sometimes put a JSON-encoded list in a string field
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return []
+    if not isinstance(value, list):
+        return []
+    return [item.strip() for item in value if isinstance(item, str) and item.strip()]
+
+
+def parse_sections(content: str) -> ParsedClarification:
+    """
+    Tolerantly parse a clarification from tool input JSON or free text
+
+    Accepts code fences and surrounding prose, repairs truncated JSON, and
+    as a last resort salvages every complete list item a streaming scan can
+    find. Raises ClarificationParseError only if no section is usable.
+    """
+    start = content.find("{")
+    if start == -1:
+        raise ClarificationParseError("No JSON object in response")
+
+    body, repaired = content[start:], False
+    try:
+        data = json.JSONDecoder().raw_decode(body)[0]
+    except json.JSONDecodeError:
+        repaired = True
+        try:
+            data = json.loads(repair_json(body))
+        except json.JSONDecodeError:
+            data = {}
+            for section, item in IncrementalSectionParser().feed(body):
+                data.setdefault(section, []).append(item)
+
+    if not isinstance(data, dict):
+        raise ClarificationParseError("Response is not a JSON object")
+
+    sections = {section: _section_items(data.get(section)) for section in CLARIFICATION_SECTIONS}
+    malformed = [section for section, items in sections.items() if not items]
+    if len(malformed) == len(sections):
+        raise ClarificationParseError("No usable sections in response")
+    return ParsedClarification(sections, malformed, repaired)
+
+
+def parse_section_items(content: str, section: str) -> List[str]:
+    """Items from a record_section re-ask (raises ClarificationParseError if unusable)"""
+    start = content.find("{")
+    try:
+        data = json.loads(repair_json(content[start:])) if start != -1 else None
+    except json.JSONDecodeError:
+        data = None
+    if not isinstance(data, dict):
+        raise ClarificationParseError(f"Unusable re-ask response for {section}")
+
+    items = _section_items(data.get("items", data.get(section)))
+    if not items:
+        raise ClarificationParseError(f"Unusable re-ask response for {section}")
+    return items
+
+
+class ParseMetrics:
+    """Counters for how clarification responses were parsed (reported by /health)"""
+
+    FIELDS = (
+        "responses", "toolUse", "textFallback", "repaired", "parseFailures",
+        "malformedSections", "sectionReasks", "sectionReaskFailures"
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+
+    def increment(self, field: str, count: int = 1):
+        with self._lock:
+            self.counts[field] += count
+
+    def record_response(self, used_tool: bool, parsed: ParsedClarification = None):
+        """Count one response; pass parsed=None when it failed to parse"""
+        with self._lock:
+            self.counts["responses"] += 1
+            self.counts["toolUse" if used_tool else "textFallback"] += 1
+            if parsed is None:
+                self.counts["parseFailures"] += 1
+            else:
+                self.counts["repaired"] += int(parsed.repaired)
+                self.counts["malformedSections"] += len(parsed.malformed)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        counts["parseFailureRate"] = round(counts["parseFailures"] / counts["responses"], 4) if counts["responses"] else 0.0
+        return counts
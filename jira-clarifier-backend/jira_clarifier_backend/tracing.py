@@ -0,0 +1,209 @@
+# tracing.py - OpenTelemetry spans for endpoints, SQL, Redis, Stripe and Claude calls
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+except ImportError:  # tracing is optional; every helper below degrades to a no-op
+    trace = None
+
+TRACER_NAME = "jira_clarifier_backend"
+TRACE_ID_HEADER = "X-Trace-Id"
+
+_tracer = trace.get_tracer(TRACER_NAME) if trace else None
+
+
+def setup_tracing(service_name: str, endpoint: str, sample_ratio: float, exporter: Any = None):
+    """
+    Install a TracerProvider that samples `sample_ratio` of new traces and
+    batches spans to an OTLP/HTTP collector at `endpoint`
+
+    Incoming sampled traces (a traceparent from the Forge resolver) are
+    always kept. Returns the provider, or None when the OpenTelemetry SDK
+    or exporter is not installed.
+    """
+    if trace is None:
+        logger.warning("Tracing disabled, opentelemetry-api not installed")
+        return None
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+        if exporter is None:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            exporter = OTLPSpanExporter(endpoint=endpoint.rstrip("/") + "/v1/traces")
+    except ImportError as e:
+        logger.warning("Tracing disabled, OpenTelemetry SDK unavailable", extra={"error": str(e)})
+        return None
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio))
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return provider
+
+
+@contextmanager
+def trace_span(name: str, kind: str = "internal", attributes: Optional[Dict[str, Any]] = None, current: bool = True) -> Iterator[Any]:
+    """
+    Span around a block, e.g. with trace_span("stripe.Customer.create", "client")
+
+    Exceptions are recorded on the span and re-raised. Pass current=False
+    inside async generators, where the span must not become the current
+    context across yields. Yields None when OpenTelemetry is not installed.
+    """
+    if trace is None:
+        yield None
+        return
+
+    kind = getattr(SpanKind, kind.upper())
+    attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+    if current:
+        with _tracer.start_as_current_span(name, kind=kind, attributes=attributes) as span:
+            yield span
+        return
+
+    span = _tracer.start_span(name, kind=kind, attributes=attributes)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_exception(e)
+        span.set_status(Status(StatusCode.ERROR, f"{type(e).__name__}: {e}"))
+        raise
+    finally:
+        span.end()
+
+
+def current_trace_id() -> Optional[str]:
+    """Hex trace ID of the active span, or None outside a trace"""
+    if trace is None:
+        return None
+    context = trace.get_current_span().get_span_context()
+    return format(context.trace_id, "032x") if context.is_valid else None
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a server span per HTTP request
+
+    Continues a W3C traceparent sent by the caller, names the span after
+    the matched route template (not the raw path) and returns the trace ID
+    in an X-Trace-Id response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or trace is None:
+            await self.app(scope, receive, send)
+            return
+
+        carrier = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        method = scope["method"]
+        with _tracer.start_as_current_span(
+            f"{method} {scope['path']}",
+            context=propagate.extract(carrier),
+            kind=SpanKind.SERVER,
+            attributes={"http.request.method": method, "url.path": scope["path"]}
+        ) as span:
+            trace_id = current_trace_id()
+
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.set_status(Status(StatusCode.ERROR))
+                    if trace_id:
+                        headers = list(message.get("headers", [])) + [(TRACE_ID_HEADER.lower().encode(), trace_id.encode())]
+                        message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.update_name(f"{method} {route}")
+                    span.set_attribute("http.route", route)
+
+
+def sql_attributes(query: Any) -> Dict[str, Any]:
+    """
+    Span attributes for a SQL statement
+
+    Only str statements (placeholders, no values) are recorded in full;
+    bytes come pre-composed by execute_values with the row values inlined,
+    so only their operation is kept.
+    """
+    text = query.decode("utf-8", "replace") if isinstance(query, bytes) else str(query)
+    operation = text.split(None, 1)[0].upper() if text.strip() else ""
+    attributes = {"db.system": "postgresql", "db.operation": operation}
+    if isinstance(query, str):
+        attributes["db.statement"] = " ".join(query.split())
+    return attributes
+
+
+def instrument_redis(client):
+    """
+    Wrap each command of a redis-py client (sync or asyncio) in a client span
+
+    Pipelines get one span per round trip listing their commands. Only
+    command names are recorded, never keys, which hold license keys.
+    Pub/sub connections are not traced.
+    """
+    if trace is None:
+        return client
+
+    def command_attributes(args) -> Dict[str, Any]:
+        return {"db.system": "redis", "db.operation": str(args[0]).upper() if args else ""}
+
+    def pipeline_attributes(pipe) -> Dict[str, Any]:
+        commands = [str(args[0]).upper() for args, _ in pipe.command_stack if args]
+        return {"db.system": "redis", "db.operation": "PIPELINE", "db.redis.commands": ",".join(commands)}
+
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    if asyncio.iscoroutinefunction(execute_command):
+        async def traced_command(*args, **options):
+            with trace_span(f"redis {command_attributes(args)['db.operation']}", "client", command_attributes(args)):
+                return await execute_command(*args, **options)
+
+        def traced_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            async def traced_execute(*execute_args, **execute_kwargs):
+                with trace_span("redis PIPELINE", "client", pipeline_attributes(pipe)):
+                    return await execute(*execute_args, **execute_kwargs)
+
+            pipe.execute = traced_execute
+            return pipe
+    else:
+        def traced_command(*args, **options):
+            with trace_span(f"redis {command_attributes(args)['db.operation']}", "client", command_attributes(args)):
+                return execute_command(*args, **options)
+
+        def traced_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def traced_execute(*execute_args, **execute_kwargs):
+                with trace_span("redis PIPELINE", "client", pipeline_attributes(pipe)):
+                    return execute(*execute_args, **execute_kwargs)
+
+            pipe.execute = traced_execute
+            return pipe
+
+    client.execute_command = traced_command
+    client.pipeline = traced_pipeline
+    return client
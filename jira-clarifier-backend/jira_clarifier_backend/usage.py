@@ -0,0 +1,179 @@
+# usage.py - Write-behind usage counters in Redis, flushed to Postgres in batches
+import asyncio
+import logging
+import uuid
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Per key, a hash {used, epoch} holds the merged usage (database + unflushed)
+# for the current billing period; `epoch` is usage_resets_at, so a reset in
+# the database starts the counter over. Every increment is also added to
+# one shared hash of pending deltas, field "<key_code>\t<epoch>".
+#   KEYS: counter, pending
+#   ARGV: count, limit, used in database, epoch, pending field
+# Returns {allowed, used}
+RESERVE_LUA = """
+local count = tonumber(ARGV[1])
+local used = tonumber(ARGV[3])
+if redis.call('HGET', KEYS[1], 'epoch') == ARGV[4] then
+    used = tonumber(redis.call('HGET', KEYS[1], 'used'))
+end
+
+if used + count > tonumber(ARGV[2]) then
+    return {0, used}
+end
+
+redis.call('HSET', KEYS[1], 'used', used + count, 'epoch', ARGV[4])
+redis.call('PERSIST', KEYS[1])
+redis.call('HINCRBY', KEYS[2], ARGV[5], count)
+return {1, used + count}
+"""
+
+#   KEYS: counter, pending
+#   ARGV: count, key_code
+# Returns 0 when there is no counter to refund against
+REFUND_LUA = """
+local epoch = redis.call('HGET', KEYS[1], 'epoch')
+if not epoch then
+    return 0
+end
+
+local count = tonumber(ARGV[1])
+local used = tonumber(redis.call('HGET', KEYS[1], 'used'))
+redis.call('HSET', KEYS[1], 'used', math.max(used - count, 0))
+redis.call('HINCRBY', KEYS[2], ARGV[2] .. '\\t' .. epoch, -count)
+return 1
+"""
+
+# Move pending deltas aside under a flush id, unless an earlier flush that
+# never finished is still there; then it is retried with its original id.
+#   KEYS: pending, flushing, flush id
+#   ARGV: new flush id
+# Returns {flush_id, field, delta, field, delta, ...} or {} if nothing is pending
+TAKE_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return {}
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('SET', KEYS[3], ARGV[1])
+end
+
+local taken = {redis.call('GET', KEYS[3])}
+for _, value in ipairs(redis.call('HGETALL', KEYS[2])) do
+    table.insert(taken, value)
+end
+return taken
+"""
+
+# Drop a flushed batch. Counters with nothing left pending start to expire,
+# so idle keys are re-read from the database later.
+#   KEYS: flushing, flush id
+#   ARGV: flush id, counter prefix, pending key, idle ttl
+FINISH_LUA = """
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    return 0
+end
+
+for _, field in ipairs(redis.call('HKEYS', KEYS[1])) do
+    local key_code = string.match(field, '^(.*)\\t')
+    local counter = ARGV[2] .. key_code
+    local epoch = redis.call('HGET', counter, 'epoch')
+    if epoch and redis.call('HEXISTS', ARGV[3], key_code .. '\\t' .. epoch) == 0 then
+        redis.call('EXPIRE', counter, tonumber(ARGV[4]))
+    end
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return 1
+"""
+
+# (key_code, epoch, delta)
+UsageDelta = Tuple[str, str, int]
+
+
+class UsageCounter:
+    """
+    Write-behind clarification counters shared across workers through Redis
+
+    Reservations check and increment the Redis counter atomically instead
+    of updating the license_keys row, so a busy team key no longer
+    serializes every request on one row. `flush` periodically applies the
+    accumulated deltas in one batched UPDATE. Pending deltas stay in Redis
+    until that UPDATE has committed, and each batch carries an id so a
+    retried flush is never applied twice.
+    """
+
+    def __init__(self, redis, prefix: str = "usage:", idle_ttl: int = 300):
+        self.redis = redis
+        self.prefix = prefix
+        self.idle_ttl = idle_ttl
+        self.pending_key = prefix + "pending"
+        self.flushing_key = prefix + "flushing"
+        self.flush_id_key = prefix + "flushing:id"
+        self._reserve = redis.register_script(RESERVE_LUA)
+        self._refund = redis.register_script(REFUND_LUA)
+        self._take = redis.register_script(TAKE_LUA)
+        self._finish = redis.register_script(FINISH_LUA)
+
+    def _counter(self, key_code: str) -> str:
+        return self.prefix + "key:" + key_code
+
+    async def reserve(self, key_code: str, count: int, limit: int, db_used: int, epoch: str) -> Tuple[bool, int]:
+        """Add `count` if it fits under `limit`; returns (allowed, merged usage)"""
+        allowed, used = await self._reserve(
+            keys=[self._counter(key_code), self.pending_key],
+            args=[count, limit, db_used, epoch, f"{key_code}\t{epoch}"]
+        )
+        return bool(allowed), int(used)
+
+    async def refund(self, key_code: str, count: int) -> bool:
+        """Give back `count`; False if there is no counter (refund in the database instead)"""
+        refunded = await self._refund(keys=[self._counter(key_code), self.pending_key], args=[count, key_code])
+        return bool(refunded)
+
+    async def snapshot(self, key_code: str) -> Optional[Tuple[int, str]]:
+        """(merged usage, epoch) if Redis has a counter for the key"""
+        used, epoch = await self.redis.hmget(self._counter(key_code), "used", "epoch")
+        if used is None:
+            return None
+        return int(used), epoch
+
+    async def flush(self, apply: Callable[[str, List[UsageDelta]], Awaitable[None]]) -> int:
+        """
+        Hand pending deltas to `apply(flush_id, deltas)`, then drop them
+
+        `apply` must be idempotent per flush id. If it raises, the batch
+        stays in Redis and the next flush retries it. Returns the number
+        of keys flushed.
+        """
+        taken = await self._take(
+            keys=[self.pending_key, self.flushing_key, self.flush_id_key],
+            args=[uuid.uuid4().hex]
+        )
+        if not taken:
+            return 0
+
+        flush_id, fields = taken[0], taken[1:]
+        deltas = []
+        for field, delta in zip(fields[::2], fields[1::2]):
+            key_code, epoch = field.rsplit("\t", 1)
+            if int(delta):
+                deltas.append((key_code, epoch, int(delta)))
+
+        if deltas:
+            await apply(flush_id, deltas)
+        await self._finish(
+            keys=[self.flushing_key, self.flush_id_key],
+            args=[flush_id, self.prefix + "key:", self.pending_key, self.idle_ttl]
+        )
+        return len(deltas)
+
+    async def run_forever(self, apply: Callable[[str, List[UsageDelta]], Awaitable[None]], interval: float = 5.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush(apply)
+            except Exception as e:
+                logger.warning("Usage flush failed, will retry", extra={"error": str(e)})
@@ -0,0 +1,334 @@
+# webhooks.py - Durable, per-customer ordered processing of Stripe webhook events
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+
+def ordering_key(event: Dict[str, Any]) -> str:
+    """
+    Events sharing a key are applied one at a time, oldest first
+
+    That is the Stripe customer the event's object belongs to; events with
+    no customer are independent of each other.
+    """
+    obj = event.get('data', {}).get('object', {})
+    customer = obj.get('customer')
+    if isinstance(customer, dict):
+        customer = customer.get('id')
+    if not customer and obj.get('object') == 'customer':
+        customer = obj.get('id')
+    return customer or event['id']
+
+
+def event_row(event: Dict[str, Any]) -> tuple:
+    return (
+        event['id'],
+        event['type'],
+        ordering_key(event),
+        json.dumps(event),
+        event.get('created') or 0,
+        bool(event.get('livemode'))
+    )
+
+
+class StripeEventStore:
+    """Postgres persistence for stripe_events (sync, run in threads)"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _run(self, work: Callable):
+        conn = self.pool.getconn()
+        try:
+            result = work(conn.cursor())
+            conn.commit()
+            return result
+        finally:
+            self.pool.putconn(conn)
+
+    def record(self, event: Dict[str, Any]) -> bool:
+        """Persist a verified event; False if this event ID was already received"""
+        def work(cur):
+            cur.execute("""
+                INSERT INTO stripe_events (event_id, event_type, ordering_key, payload, stripe_created, livemode)
+                VALUES (%s, %s, %s, %s, to_timestamp(%s), %s)
+                ON CONFLICT (event_id) DO NOTHING
+                RETURNING id
+            """, event_row(event))
+            return cur.fetchone() is not None
+
+        return self._run(work)
+
+    def record_many(self, events: List[Dict[str, Any]]) -> int:
+        """Persist events fetched from the Stripe API; returns how many were new"""
+        if not events:
+            return 0
+
+        def work(cur):
+            execute_values(cur, """
+                INSERT INTO stripe_events (event_id, event_type, ordering_key, payload, stripe_created, livemode)
+                VALUES %s
+                ON CONFLICT (event_id) DO NOTHING
+            """, [event_row(event) for event in events],
+                template="(%s, %s, %s, %s, to_timestamp(%s), %s)", page_size=len(events))
+            return cur.rowcount
+
+        return self._run(work)
+
+    def claim(self, limit: int = 10, stale_after_minutes: int = 10) -> List[Dict[str, Any]]:
+        """
+        Atomically move the oldest due event of up to `limit` customers to 'processing'
+
+        An event is only due once every earlier event for its customer has
+        been processed or given up on, so a customer's events never run
+        concurrently or out of order. Events left in 'processing' by a
+        worker that crashed are reclaimed after `stale_after_minutes`.
+        """
+        def work(cur):
+            cur.execute("""
+                UPDATE stripe_events
+                SET status = 'processing', attempts = attempts + 1, updated_at = NOW()
+                WHERE id IN (
+                    SELECT e.id FROM stripe_events e
+                    WHERE (
+                        (e.status = 'pending' AND e.next_attempt_at <= NOW())
+                        OR (e.status = 'processing' AND e.updated_at < NOW() - make_interval(mins => %s))
+                    )
+                    AND NOT EXISTS (
+                        SELECT 1 FROM stripe_events earlier
+                        WHERE earlier.ordering_key = e.ordering_key
+                        AND earlier.status IN ('pending', 'processing')
+                        AND (earlier.stripe_created, earlier.id) < (e.stripe_created, e.id)
+                    )
+                    ORDER BY e.stripe_created, e.id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, event_id, event_type, ordering_key, payload, attempts
+            """, (stale_after_minutes, limit))
+            return [dict(row) for row in cur.fetchall()]
+
+        return self._run(work)
+
+    def complete(self, row_id: int, result: Optional[Dict[str, Any]]):
+        def work(cur):
+            cur.execute("""
+                UPDATE stripe_events
+                SET status = 'processed', result = %s, error = NULL,
+                    processed_at = NOW(), updated_at = NOW()
+                WHERE id = %s
+            """, (json.dumps(result, default=str), row_id))
+
+        self._run(work)
+
+    def fail(self, row_id: int, error: str, retry_in: Optional[float]):
+        """Schedule another attempt in `retry_in` seconds, or give up when it is None"""
+        def work(cur):
+            cur.execute("""
+                UPDATE stripe_events
+                SET status = %s, error = %s,
+                    next_attempt_at = NOW() + make_interval(secs => %s),
+                    updated_at = NOW()
+                WHERE id = %s
+            """, ('failed' if retry_in is None else 'pending', error, retry_in or 0, row_id))
+
+        self._run(work)
+
+    def requeue(
+        self,
+        event_ids: Optional[List[str]] = None,
+        since: Optional[datetime] = None,
+        event_types: Optional[List[str]] = None,
+        include_processed: bool = False
+    ) -> int:
+        """
+        Put failed (and with include_processed, also processed) events back
+        in the queue; returns how many were requeued
+        """
+        conditions = ["status IN %s"]
+        params: List[Any] = [('failed', 'processed') if include_processed else ('failed',)]
+        if event_ids:
+            conditions.append("event_id IN %s")
+            params.append(tuple(event_ids))
+        if since:
+            conditions.append("stripe_created >= %s")
+            params.append(since)
+        if event_types:
+            conditions.append("event_type IN %s")
+            params.append(tuple(event_types))
+
+        def work(cur):
+            cur.execute(f"""
+                UPDATE stripe_events
+                SET status = 'pending', attempts = 0, error = NULL,
+                    next_attempt_at = NOW(), updated_at = NOW()
+                WHERE {' AND '.join(conditions)}
+            """, params)
+            return cur.rowcount
+
+        return self._run(work)
+
+    def counts(self) -> Dict[str, int]:
+        """Events per status"""
+        def work(cur):
+            cur.execute("SELECT status, COUNT(*) AS count FROM stripe_events GROUP BY status")
+            return {row['status']: row['count'] for row in cur.fetchall()}
+
+        return self._run(work)
+
+
+class StripeEventWorker:
+    """
+    Background worker applying queued Stripe events with `process(event)`
+
+    Each pass claims the oldest due event of up to `batch_size` customers
+    and processes them concurrently in threads, one per customer, so each
+    customer's events apply in the order Stripe created them. A failed
+    event is retried with exponential backoff (holding back that
+    customer's later events) and marked 'failed' after `max_attempts`,
+    after which the customer's queue moves on. `process` must be safe to
+    run again on an event it has already applied.
+    """
+
+    def __init__(
+        self,
+        store,
+        process: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+        batch_size: int = 10,
+        max_attempts: int = 8,
+        retry_delay: float = 30.0,
+        poll_interval: float = 5.0,
+        stale_after_minutes: int = 10
+    ):
+        self.store = store
+        self.process = process
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.stale_after_minutes = stale_after_minutes
+        self._wake = asyncio.Event()
+
+        # Metrics
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def notify(self):
+        """Wake the worker now instead of at the next poll (a new event was recorded)"""
+        self._wake.set()
+
+    async def run_forever(self):
+        while True:
+            self._wake.clear()
+            try:
+                claimed = await self.run_once()
+            except Exception as e:
+                logger.warning("Stripe event worker error", extra={"error": str(e)})
+                claimed = 0
+            if claimed:
+                continue  # drain the backlog before waiting again
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_once(self) -> int:
+        """Process one round of due events; returns how many were claimed"""
+        events = await asyncio.to_thread(self.store.claim, self.batch_size, self.stale_after_minutes)
+        await asyncio.gather(*(self._apply(event) for event in events))
+        return len(events)
+
+    async def _apply(self, event: Dict[str, Any]):
+        try:
+            result = await asyncio.to_thread(self.process, event['payload'])
+        except Exception as e:
+            if event['attempts'] >= self.max_attempts:
+                self.failed += 1
+                logger.error("Stripe event failed, giving up", extra={
+                    "eventId": event['event_id'], "eventType": event['event_type'],
+                    "attempts": event['attempts'], "error": str(e)
+                }, exc_info=True)
+                await asyncio.to_thread(self.store.fail, event['id'], str(e), None)
+                return
+
+            delay = self.retry_delay * 2 ** (event['attempts'] - 1)
+            self.retried += 1
+            logger.warning("Stripe event failed, retrying", extra={
+                "eventId": event['event_id'], "eventType": event['event_type'],
+                "attempts": event['attempts'], "retryIn": delay, "error": str(e)
+            })
+            await asyncio.to_thread(self.store.fail, event['id'], str(e), delay)
+            return
+
+        await asyncio.to_thread(self.store.complete, event['id'], result)
+        self.processed += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"processed": self.processed, "retried": self.retried, "failed": self.failed}
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def fetch_events(since: datetime, event_types: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Events Stripe still holds (the last 30 days) created at or after `since`"""
+    import stripe
+    stripe.api_key = os.environ["STRIPE_SECRET_KEY"]
+
+    params: Dict[str, Any] = {"created": {"gte": int(since.timestamp())}, "limit": 100}
+    if event_types:
+        params["types"] = event_types
+    return [json.loads(str(event)) for event in stripe.Event.list(**params).auto_paging_iter()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Inspect and replay queued Stripe webhook events")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="events per status")
+    replay = commands.add_parser("replay", help="requeue events for the running worker")
+    replay.add_argument("event_ids", nargs="*", help="event IDs (default: every event matching the filters)")
+    replay.add_argument("--since", type=datetime.fromisoformat, help="only events created at or after this date")
+    replay.add_argument("--type", dest="event_types", action="append", help="only this event type (repeatable)")
+    replay.add_argument("--include-processed", action="store_true", help="also re-apply events that succeeded")
+    replay.add_argument("--fetch", action="store_true",
+                        help="first backfill events missing from stripe_events from the Stripe API (needs --since)")
+    args = parser.parse_args(argv)
+
+    from jira_clarifier_backend.db import ConnectionPool
+    pool = ConnectionPool(os.environ["DATABASE_URL"], min_size=1, max_size=1)
+    store = StripeEventStore(pool)
+    try:
+        if args.command == "status":
+            for status, count in sorted(store.counts().items()):
+                print(f"{status:12s} {count}")
+            return 0
+
+        if args.fetch:
+            if not args.since:
+                parser.error("--fetch needs --since")
+            fetched = fetch_events(args.since, args.event_types)
+            print(f"📥 Fetched {len(fetched)} events from Stripe, {store.record_many(fetched)} were missing")
+
+        requeued = store.requeue(args.event_ids, args.since, args.event_types, args.include_processed)
+        print(f"🔁 Requeued {requeued} events")
+        return 0
+    finally:
+        pool.closeall()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
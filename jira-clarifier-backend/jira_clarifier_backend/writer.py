@@ -0,0 +1,147 @@
+# writer.py - Background batched writer for analytics and feedback rows
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_MODES = ("block", "spill")
+
+Row = Tuple[str, List[Any]]  # (kind, column values)
+
+
+class BatchWriter:
+    """
+    Bounded in-process queue of rows, drained in batches by a background task
+
+    Rows are (kind, values) pairs; `write(kind, rows)` runs in a worker
+    thread once per kind per batch, e.g. as one multi-row INSERT. A batch
+    is flushed when it reaches `batch_size` rows or `flush_interval`
+    seconds after its first row, whichever comes first.
+
+    When the queue is full, `overflow="block"` makes producers wait
+    (backpressure) and `overflow="spill"` appends rows to a JSONL file
+    instead. Batches that fail to write are spilled too (or dropped when
+    blocking). Spilled rows are replayed whenever the queue runs dry, so
+    values must be JSON-serializable.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[str, List[List[Any]]], None],
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+        overflow: str = "block",
+        spill_path: Optional[str] = None
+    ):
+        if overflow not in OVERFLOW_MODES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_MODES}, not {overflow!r}")
+        if overflow == "spill" and not spill_path:
+            raise ValueError("overflow='spill' needs a spill_path")
+        self.write = write
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self._pending: List[Row] = []
+        self.stats = {"queued": 0, "written": 0, "batches": 0, "spilled": 0, "replayed": 0, "dropped": 0, "failedBatches": 0}
+
+    async def put(self, kind: str, values: List[Any]):
+        """Queue a row; waits for room or spills to disk when the queue is full"""
+        self.stats["queued"] += 1
+        if self.overflow == "spill" and self.queue.full():
+            await asyncio.to_thread(self._spill, [(kind, values)])
+            return
+        await self.queue.put((kind, values))
+
+    async def run_forever(self):
+        await asyncio.to_thread(self._replay_spill)
+        while True:
+            await self._collect()
+            batch, self._pending = self._pending, []
+            await asyncio.to_thread(self._write_batch, batch)
+            if self.queue.empty():
+                await asyncio.to_thread(self._replay_spill)
+
+    async def _collect(self):
+        """Fill self._pending up to batch_size, waiting at most flush_interval after the first row"""
+        self._pending.append(await self.queue.get())
+        flush_at = time.monotonic() + self.flush_interval
+        while len(self._pending) < self.batch_size:
+            if not self.queue.empty():
+                self._pending.append(self.queue.get_nowait())
+                continue
+            remaining = flush_at - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                self._pending.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                return
+
+    async def close(self, task: Optional[asyncio.Task] = None):
+        """Stop the drain task and write everything still queued (call from lifespan shutdown)"""
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        rows, self._pending = self._pending, []
+        while not self.queue.empty():
+            rows.append(self.queue.get_nowait())
+        for start in range(0, len(rows), self.batch_size):
+            await asyncio.to_thread(self._write_batch, rows[start:start + self.batch_size])
+        if rows:
+            logger.info("Flushed queued analytics rows", extra={"rows": len(rows)})
+
+    def _write_batch(self, batch: List[Row]):
+        by_kind: Dict[str, List[List[Any]]] = {}
+        for kind, values in batch:
+            by_kind.setdefault(kind, []).append(values)
+
+        for kind, rows in by_kind.items():
+            try:
+                self.write(kind, rows)
+                self.stats["written"] += len(rows)
+                self.stats["batches"] += 1
+            except Exception as e:
+                self.stats["failedBatches"] += 1
+                if self.spill_path:
+                    logger.warning("Writing rows failed, spilling to disk", extra={"rows": len(rows), "kind": kind, "error": str(e)})
+                    self._spill([(kind, values) for values in rows])
+                else:
+                    logger.warning("Writing rows failed, dropping them", extra={"rows": len(rows), "kind": kind, "error": str(e)})
+                    self.stats["dropped"] += len(rows)
+
+    def _spill(self, rows: List[Row]):
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for kind, values in rows:
+                f.write(json.dumps({"kind": kind, "values": values}) + "\n")
+        self.stats["spilled"] += len(rows)
+
+    def _replay_spill(self):
+        """Write spilled rows back in batches; ones that fail again are re-spilled"""
+        if not self.spill_path:
+            return
+        replaying = self.spill_path + ".replay"
+        if not os.path.exists(replaying):  # else a replay was interrupted; finish that first
+            if not os.path.exists(self.spill_path):
+                return
+            os.replace(self.spill_path, replaying)  # new spills go to a fresh file meanwhile
+
+        with open(replaying, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        for start in range(0, len(rows), self.batch_size):
+            self._write_batch([(row["kind"], row["values"]) for row in rows[start:start + self.batch_size]])
+        os.remove(replaying)
+        self.stats["replayed"] += len(rows)
+        if rows:
+            logger.info("Replayed spilled analytics rows", extra={"rows": len(rows)})
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "queueDepth": self.queue.qsize(), "overflow": self.overflow}
@@ -1,31 +1,10 @@
-import os, json, dotenv, openai
-from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
-dotenv.load_dotenv()
+# pinecone_training.py - Seed the Pinecone index with the 50 sample tickets
+#
+# Kept for the old workflow; equivalent to:
+#   python -m jira_clarifier_backend.ingest jsonl jira_clarify_50.jsonl
+import sys
 
-# Init
-openai.api_key = os.getenv("OPENAI_API_KEY")
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-index = pc.Index("jira-vectors")
-
-# Embed model
-model = SentenceTransformer("all-MiniLM-L6-v2")
-
-# Load 50 tickets
-with open("jira_clarify_50.jsonl") as f:
-    tickets = [json.loads(line) for line in f]
-
-vectors = []
-for i, t in enumerate(tickets):
-    text = f"{t["raw_title"]} {t["raw_description"]}"
-    emb = model.encode(text).tolist()
-    vectors.append({
-        "id": f"ticket-{i}",
-        "values": emb,
-        "metadata": {"title": t["raw_title"], "desc": t["raw_description"]}
-    })
-
-# Upsert
-index.upsert(vectors=vectors)
-print(f"Uploaded {len(vectors)} vectors to Pinecone")
+from jira_clarifier_backend.ingest import main
 
+if __name__ == "__main__":
+    sys.exit(main(["jsonl", "jira_clarify_50.jsonl", "--backend", "pinecone", *sys.argv[1:]]))
@@ -0,0 +1,45 @@
+# conftest.py - Shared fixtures: the fake Claude upstream wired into the app
+import pytest
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import app, create_claude_client
+from tests.fake_anthropic import FakeAnthropicUpstream
+
+
+@pytest.fixture
+def upstream_class():
+    """FakeAnthropicUpstream subclass to serve; override in a module for custom behaviour"""
+    return FakeAnthropicUpstream
+
+
+@pytest.fixture
+def upstream_options():
+    """Constructor arguments for the fake (delay, usage, models, ...); override per module"""
+    return {}
+
+
+@pytest.fixture
+def clarification_cache():
+    """app.state.clarification_cache while the fake is installed; None disables caching"""
+    return None
+
+
+@pytest.fixture
+def analytics():
+    """main.ENABLE_ANALYTICS while the fake is installed; override to check stored tickets"""
+    return False
+
+
+@pytest.fixture
+def upstream(request, monkeypatch, upstream_class, upstream_options, clarification_cache, analytics):
+    """
+    A fake Anthropic API behind app.state.claude
+
+    Parametrize indirectly to vary the fake per test:
+    @pytest.mark.parametrize("upstream", [{"delay": 1.0}], indirect=True)
+    """
+    upstream = upstream_class(**{**upstream_options, **getattr(request, "param", {})})
+    monkeypatch.setattr(main, "ENABLE_ANALYTICS", analytics)
+    monkeypatch.setattr(app.state, "claude", create_claude_client("test-key", transport=upstream.transport()), raising=False)
+    monkeypatch.setattr(app.state, "clarification_cache", clarification_cache, raising=False)
+    return upstream
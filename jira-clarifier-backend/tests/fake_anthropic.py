@@ -0,0 +1,221 @@
+# fake_anthropic.py - Local fake of the Anthropic Messages API for tests
+import asyncio
+import json
+import re
+
+import httpx
+
+
+DEFAULT_CLARIFICATION = {
+    "acceptanceCriteria": ["Given a user, When they log in, Then they see the dashboard"],
+    "edgeCases": ["Expired session"],
+    "successMetrics": ["Login success rate > 99%"],
+    "testScenarios": ["Log in with valid credentials"]
+}
+
+
+class FakeAnthropicUpstream:
+    """
+    httpx transport handler that answers POST /v1/messages after a fixed delay,
+    plus the Message Batches endpoints (batches end after `batch_polls` polls)
+
+    Requests that force a tool get a tool_use block holding the JSON from
+    `text()`; if that isn't a JSON object the fake answers in text instead.
+    Section re-asks are answered from `section_answers` (default: the
+    matching DEFAULT_CLARIFICATION section).
+
+    `models` simulates several models behind one endpoint: it maps a model
+    name to overrides for "clarification", "delay" and "usage".
+
+    `failures` is a queue of HTTP status codes (e.g. 529 overloaded) that the
+    next /v1/messages requests fail with, after their delay.
+
+    Plug it into the real client with create_claude_client(key, transport=upstream.transport())
+    so the whole async request path is exercised without network access.
+    """
+
+    def __init__(
+        self,
+        delay: float = 0.0,
+        clarification: dict = None,
+        chunk_size: int = 16,
+        chunk_delay: float = 0.0,
+        batch_polls: int = 1,
+        usage: dict = None,
+        models: dict = None
+    ):
+        self.delay = delay
+        self.clarification = clarification or DEFAULT_CLARIFICATION
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.batch_polls = batch_polls
+        self.batches = {}
+        self.usage = usage or {"input_tokens": 300, "output_tokens": 200}
+        self.section_answers = {}
+        self.models = models or {}
+        self.failures = []
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.startswith("/v1/messages/batches"):
+            return self.handle_batches(request)
+
+        body = json.loads(request.content)
+        self.requests.append(body)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay_for(body))
+        finally:
+            self.in_flight -= 1
+
+        if self.failures:
+            status = self.failures.pop(0)
+            return httpx.Response(status, json={"type": "error", "error": {
+                "type": "overloaded_error" if status == 529 else "api_error", "message": f"Injected {status}"
+            }})
+        if body.get("stream"):
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content=self.stream_events(body)
+            )
+        return httpx.Response(200, json=self.message(body))
+
+    def delay_for(self, body: dict) -> float:
+        """Upstream latency for a request; override to vary it per prompt"""
+        return self.models.get(body.get("model"), {}).get("delay", self.delay)
+
+    def text(self) -> str:
+        return "```json\n" + json.dumps(self.clarification, indent=2) + "\n```"
+
+    def text_for(self, body: dict) -> str:
+        override = self.models.get(body.get("model"), {})
+        if "clarification" in override:
+            return "```json\n" + json.dumps(override["clarification"], indent=2) + "\n```"
+        return self.text()
+
+    def tool_input(self, body: dict):
+        """Raw JSON passed to the forced tool, or None to answer in text"""
+        choice = body.get("tool_choice") or {}
+        if choice.get("type") != "tool":
+            return None
+        if choice["name"] == "record_section":
+            section = re.search(r'only the "(\w+)" section', body["messages"][-1]["content"]).group(1)
+            items = self.section_answers.get(section, DEFAULT_CLARIFICATION.get(section, []))
+            return json.dumps({"section": section, "items": items})
+
+        text = self.text_for(body)
+        start = text.find("{")
+        if start == -1:
+            return None
+        return text[start:].rstrip().removesuffix("```").rstrip()
+
+    def message(self, body: dict) -> dict:
+        content = [{"type": "text", "text": self.text_for(body)}]
+        stop_reason = "end_turn"
+        raw = self.tool_input(body)
+        if raw is not None:
+            try:
+                content = [{"type": "tool_use", "id": "toolu_1", "name": body["tool_choice"]["name"], "input": json.loads(raw)}]
+                stop_reason = "tool_use"
+            except json.JSONDecodeError:
+                stop_reason = "max_tokens"  # truncated tool input comes back as text here
+        return {
+            "id": f"msg_{len(self.requests)}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model"),
+            "content": content,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": dict(self.models.get(body.get("model"), {}).get("usage", self.usage))
+        }
+
+    async def stream_events(self, body: dict):
+        """Messages streaming protocol: one text_delta or input_json_delta event per chunk"""
+        message = {**self.message(body), "content": [], "stop_reason": None}
+        yield self._event("message_start", {"type": "message_start", "message": message})
+
+        raw = self.tool_input(body)
+        if raw is not None:
+            block = {"type": "tool_use", "id": "toolu_1", "name": body["tool_choice"]["name"], "input": {}}
+            text, delta_type, field = raw, "input_json_delta", "partial_json"
+        else:
+            block = {"type": "text", "text": ""}
+            text, delta_type, field = self.text_for(body), "text_delta", "text"
+        yield self._event("content_block_start", {"type": "content_block_start", "index": 0, "content_block": block})
+
+        for i in range(0, len(text), self.chunk_size):
+            await asyncio.sleep(self.chunk_delay)
+            yield self._event("content_block_delta", {
+                "type": "content_block_delta", "index": 0,
+                "delta": {"type": delta_type, field: text[i:i + self.chunk_size]}
+            })
+
+        yield self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        yield self._event("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": "tool_use" if raw is not None else "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": message["usage"]["output_tokens"]}
+        })
+        yield self._event("message_stop", {"type": "message_stop"})
+
+    @staticmethod
+    def _event(name: str, data: dict) -> bytes:
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+    def handle_batches(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.rstrip("/")
+
+        if request.method == "POST" and path == "/v1/messages/batches":
+            batch_id = f"msgbatch_{len(self.batches) + 1}"
+            requests = json.loads(request.content)["requests"]
+            self.batches[batch_id] = {"requests": requests, "polls": 0}
+            return httpx.Response(200, json=self.batch_object(batch_id))
+
+        if path.endswith("/results"):
+            batch_id = path.split("/")[-2]
+            lines = [json.dumps(self.batch_result(item)) for item in self.batches[batch_id]["requests"]]
+            return httpx.Response(200, content="\n".join(lines).encode("utf-8"))
+
+        batch_id = path.split("/")[-1]
+        self.batches[batch_id]["polls"] += 1
+        return httpx.Response(200, json=self.batch_object(batch_id))
+
+    def batch_object(self, batch_id: str) -> dict:
+        batch = self.batches[batch_id]
+        ended = batch["polls"] >= self.batch_polls
+        total = len(batch["requests"])
+        errored = sum(1 for item in batch["requests"] if self.batch_result(item)["result"]["type"] != "succeeded")
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else total,
+                "succeeded": total - errored if ended else 0,
+                "errored": errored if ended else 0,
+                "canceled": 0,
+                "expired": 0
+            },
+            "created_at": "2025-01-01T00:00:00Z",
+            "expires_at": "2025-01-02T00:00:00Z",
+            "ended_at": "2025-01-01T01:00:00Z" if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"https://api.anthropic.com/v1/messages/batches/{batch_id}/results" if ended else None
+        }
+
+    def batch_result(self, item: dict) -> dict:
+        """Per-request batch result; prompts containing "broken" come back errored"""
+        if "broken" in item["params"]["messages"][0]["content"]:
+            return {"custom_id": item["custom_id"], "result": {"type": "errored", "error": {
+                "type": "error", "error": {"type": "invalid_request_error", "message": "bad ticket"}
+            }}}
+        return {"custom_id": item["custom_id"], "result": {"type": "succeeded", "message": self.message(item["params"])}}
@@ -0,0 +1,44 @@
+# fake_stripe.py - Local fake of the Stripe API for tests
+import json
+import re
+
+from stripe._http_client import HTTPClient
+
+# API path segment for each object type the fake serves
+RESOURCE_PATHS = {"subscriptions": "subscription", "invoices": "invoice", "customers": "customer"}
+
+
+class FakeStripeAPI(HTTPClient):
+    """
+    stripe-python HTTP client answering GET /v1/<resource>/<id> from `objects`
+
+    Every request is recorded in `requests` as (method, path), so tests can
+    assert which lookups reached "the network". Unknown IDs get Stripe's
+    resource_missing 404.
+
+    Install it with monkeypatch.setattr(stripe, "default_http_client", FakeStripeAPI(...)).
+    """
+
+    name = "fake"
+
+    def __init__(self, objects=None):
+        super().__init__()
+        self.objects = {obj["id"]: obj for obj in (objects or [])}
+        self.requests = []
+
+    def add(self, obj):
+        self.objects[obj["id"]] = obj
+
+    def request(self, method, url, headers, post_data=None, *, _usage=None):
+        path = re.sub(r"^https?://[^/]+", "", url).split("?")[0]
+        self.requests.append((method.upper(), path))
+
+        match = re.fullmatch(r"/v1/(\w+)/([\w-]+)", path)
+        obj = self.objects.get(match.group(2)) if match and method.lower() == "get" else None
+        if obj is None or RESOURCE_PATHS.get(match.group(1)) != obj.get("object"):
+            error = {"error": {"type": "invalid_request_error", "code": "resource_missing", "message": f"No such object: {path}"}}
+            return json.dumps(error), 404, {}
+        return json.dumps(obj), 200, {}
+
+    def close(self):
+        pass
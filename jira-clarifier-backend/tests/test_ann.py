@@ -0,0 +1,116 @@
+# test_ann.py - Tests for the embedded IVF vector index
+import numpy as np
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.ann import IVFVectorIndex
+from jira_clarifier_backend.main import TicketInput, app
+from jira_clarifier_backend.rag import SimilarTicketRetriever
+
+
+def clustered_vectors(n, dim=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def as_upserts(vectors, prefix="v"):
+    return [{"id": f"{prefix}{i}", "values": v.tolist(), "metadata": {"title": f"t{i}"}} for i, v in enumerate(vectors)]
+
+
+def test_pending_vectors_are_searchable_and_survive_restart(tmp_path):
+    index = IVFVectorIndex(tmp_path)
+    index.upsert([{"id": "a", "values": [1, 0, 0], "metadata": {"title": "A"}}], namespace="org-1")
+    index.upsert([{"id": "b", "values": [0, 1, 0], "metadata": {"title": "B"}}], namespace="org-2")
+
+    reopened = IVFVectorIndex(tmp_path)
+    assert [m["id"] for m in reopened.query([1, 0.1, 0], top_k=5, namespace="org-1")] == ["a"]
+    assert reopened.query([1, 0, 0], top_k=5, namespace="org-3") == []
+
+
+def test_compaction_writes_a_quantized_memory_mapped_segment(tmp_path):
+    vectors = clustered_vectors(500)
+    index = IVFVectorIndex(tmp_path)
+    index.upsert(as_upserts(vectors), namespace="org-1")
+
+    assert index.compact()
+    assert index.pending_count == 0
+    segment_dir = tmp_path / (tmp_path / "CURRENT").read_text()
+    assert np.load(segment_dir / "vectors.npy", mmap_mode="r").dtype == np.int8
+
+    reopened = IVFVectorIndex(tmp_path)
+    assert len(reopened) == 500
+    match = reopened.query(vectors[42], top_k=1, namespace="org-1")[0]
+    assert match["id"] == "v42"
+    assert match["score"] > 0.99  # int8 quantization error is small
+
+
+def test_upserts_replace_compacted_vectors(tmp_path):
+    index = IVFVectorIndex(tmp_path)
+    index.upsert([{"id": "a", "values": [1, 0], "metadata": {"title": "old"}}], namespace="org")
+    index.compact()
+
+    index.upsert([{"id": "a", "values": [0, 1], "metadata": {"title": "new"}}], namespace="org")
+    matches = index.query([1, 0], top_k=5, namespace="org")
+    assert [m["metadata"]["title"] for m in matches] == ["new"]
+
+    index.compact()
+    assert len(index) == 1
+    assert index.query([0, 1], top_k=5, namespace="org")[0]["metadata"]["title"] == "new"
+
+
+def test_ivf_search_has_high_recall_with_org_filtering(tmp_path):
+    vectors = clustered_vectors(6000, seed=1)
+    index = IVFVectorIndex(tmp_path, nprobe=8, exact_below=100)
+    index.upsert(as_upserts(vectors[:5000], "a"), namespace="big-org")
+    index.upsert(as_upserts(vectors[5000:], "b"), namespace="other-org")
+    index.compact()
+
+    queries = clustered_vectors(50, seed=2)
+    exact = vectors[:5000] @ queries.T
+    hits = 0
+    for q in range(len(queries)):
+        expected = {f"a{i}" for i in np.argsort(-exact[:, q])[:10]}
+        found = index.query(queries[q], top_k=10, namespace="big-org")
+        assert all(match["id"].startswith("a") for match in found)
+        hits += len(expected & {match["id"] for match in found})
+    assert hits / (10 * len(queries)) > 0.9
+
+
+def test_store_tickets_adds_to_the_local_index(tmp_path, monkeypatch):
+    class Embedder:
+        def embed(self, texts):
+            return [[float("login" in text.lower()), 1.0] for text in texts]
+
+    monkeypatch.setattr(main, "ENABLE_ANALYTICS", False)
+    index = IVFVectorIndex(tmp_path)
+    previous = (getattr(app.state, 'vector_index', None), getattr(app.state, 'retriever', None))
+    app.state.vector_index = index
+    app.state.retriever = SimilarTicketRetriever(Embedder(), index)
+    try:
+        main.store_tickets([
+            (TicketInput(title="Login fails", orgId="org-1"), main.ClarifiedOutput()),
+            (TicketInput(title="Anonymous ticket"), main.ClarifiedOutput())
+        ])
+    finally:
+        app.state.vector_index, app.state.retriever = previous
+
+    assert len(index) == 1
+    assert index.query([1, 1], top_k=1, namespace="org-1")[0]["metadata"]["title"] == "Login fails"
+
+
+def test_processes_sharing_a_directory_see_each_others_writes(tmp_path):
+    worker_a, worker_b = IVFVectorIndex(tmp_path), IVFVectorIndex(tmp_path)
+    worker_a.upsert([{"id": "a", "values": [1, 0], "metadata": {"title": "A"}}], namespace="org")
+    worker_b.upsert([{"id": "b", "values": [0, 1], "metadata": {"title": "B"}}], namespace="org")
+    assert len(worker_b) == 2
+
+    assert worker_a.compact()
+    assert (tmp_path / "pending.jsonl").read_text() == ""
+    assert not worker_b.compact()  # worker_a already merged both; no generation is clobbered
+
+    worker_b.upsert([{"id": "a", "values": [0, 1], "metadata": {"title": "A2"}}], namespace="org")
+    worker_a.refresh()
+    assert len(worker_a) == 2
+    assert {m["metadata"]["title"] for m in worker_a.query([0, 1], top_k=5, namespace="org")} == {"A2", "B"}
+    assert len(IVFVectorIndex(tmp_path)) == 2
@@ -0,0 +1,159 @@
+# test_batch.py - Tests for the /clarify/batch NDJSON endpoint
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.cache import ClarificationCache, TTLCache
+from jira_clarifier_backend.main import app
+from tests.fake_anthropic import FakeAnthropicUpstream
+
+
+class SlowTitlesUpstream(FakeAnthropicUpstream):
+    """Answers tickets whose title contains "slow" last, and fails "broken" ones"""
+
+    def delay_for(self, body):
+        prompt = body["messages"][0]["content"]
+        return 0.2 if "slow" in prompt else 0.01
+
+    async def handle(self, request):
+        if "broken" in json.loads(request.content)["messages"][0]["content"]:
+            return httpx.Response(400, json={
+                "type": "error", "error": {"type": "invalid_request_error", "message": "bad ticket"}
+            })
+        return await super().handle(request)
+
+
+@pytest.fixture
+def upstream_class():
+    return SlowTitlesUpstream
+
+
+@pytest.fixture
+def clarification_cache():
+    return ClarificationCache(TTLCache())
+
+
+@pytest.fixture
+def analytics():
+    return True
+
+
+@pytest.fixture
+def upstream(upstream, monkeypatch):
+    usage = []
+    refunds = []
+    stored = []
+
+    async def reserve(key, count=1):
+        usage.append((key, count))
+        return count
+
+    async def refund(key, count):
+        refunds.append((key, count))
+
+    monkeypatch.setattr(main, "reserve_usage", reserve)
+    monkeypatch.setattr(main, "refund_usage", refund)
+    monkeypatch.setattr(main, "store_tickets", lambda results: stored.append(results))
+    upstream.usage = usage
+    upstream.refunds = refunds
+    upstream.stored = stored
+    return upstream
+
+
+def post_batch(payload):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/clarify/batch", json=payload)
+
+    response = asyncio.run(run())
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return response, lines
+
+
+def test_batch_dedupes_and_streams_in_completion_order(upstream):
+    tickets = [
+        {"title": "slow ticket"},
+        {"title": "Fast ticket"},
+        {"title": "Fast   ticket"},
+        {"title": "Other fast ticket"}
+    ]
+    response, lines = post_batch({"tickets": tickets, "orgId": "JIRA-AAAA-BBBB-CCCC"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = [line for line in lines if line["type"] == "result"]
+    assert sorted(line["index"] for line in results) == [0, 1, 2, 3]
+    assert results[-1]["index"] == 0  # slowest ticket finishes last
+    assert lines[-1] == {"type": "summary", "total": 4, "unique": 3, "succeeded": 4, "failed": 0}
+
+    assert len(upstream.requests) == 3
+    assert upstream.usage == [("JIRA-AAAA-BBBB-CCCC", 3)]
+    assert upstream.refunds == []
+    assert len(upstream.stored) == 1 and len(upstream.stored[0]) == 3
+
+
+def test_batch_bounds_upstream_concurrency(upstream, monkeypatch):
+    monkeypatch.setattr(main, "CLARIFY_BATCH_CONCURRENCY", 3)
+    tickets = [{"title": f"slow ticket {i}"} for i in range(10)]
+    _, lines = post_batch({"tickets": tickets})
+
+    assert lines[-1]["succeeded"] == 10
+    assert upstream.max_in_flight == 3
+    assert upstream.usage == []  # free users aren't metered
+
+
+def test_batch_skips_cached_tickets_and_reports_errors(upstream):
+    post_batch({"tickets": [{"title": "Cached ticket"}], "orgId": "JIRA-1"})
+    upstream.requests.clear()
+    upstream.usage.clear()
+
+    _, lines = post_batch({
+        "tickets": [{"title": "Cached ticket"}, {"title": "broken ticket"}],
+        "orgId": "JIRA-1"
+    })
+
+    by_index = {line["index"]: line for line in lines if "index" in line}
+    assert by_index[0]["type"] == "result" and by_index[0]["cached"] is True
+    assert by_index[1]["type"] == "error"
+    assert lines[-1]["failed"] == 1
+    assert upstream.usage == [("JIRA-1", 1)]
+    assert upstream.refunds == [("JIRA-1", 1)]  # the broken ticket is given back
+
+
+def test_batch_over_quota_is_rejected_before_calling_claude(upstream, monkeypatch):
+    async def over_limit(key, count=1):
+        raise main.HTTPException(status_code=429, detail="Monthly limit reached")
+
+    monkeypatch.setattr(main, "reserve_usage", over_limit)
+    response, _ = post_batch({"tickets": [{"title": "Fix login bug"}], "orgId": "JIRA-1"})
+
+    assert response.status_code == 429
+    assert upstream.requests == []
+
+
+def test_batch_rejects_empty_and_oversized_batches(upstream):
+    response, _ = post_batch({"tickets": []})
+    assert response.status_code == 422
+
+    response, _ = post_batch({"tickets": [{"title": "t"}] * (main.CLARIFY_BATCH_MAX_TICKETS + 1)})
+    assert response.status_code == 422
+
+
+def test_batch_larger_than_rate_limit_is_rejected(upstream, monkeypatch):
+    monkeypatch.setattr(main, "RATE_LIMIT_FREE", 5)
+    previous = getattr(app.state, 'rate_limiter', None)
+    app.state.rate_limiter = main.RateLimiter(None, window=60)
+    try:
+        response, _ = post_batch({"tickets": [{"title": f"Ticket {i}"} for i in range(8)]})
+        fits, lines = post_batch({"tickets": [{"title": f"Ticket {i}"} for i in range(5)]})
+    finally:
+        app.state.rate_limiter = previous
+
+    assert response.status_code == 413
+    assert fits.status_code == 200
+    assert lines[-1]["succeeded"] == 5
+    assert len(upstream.requests) == 5
@@ -0,0 +1,125 @@
+# test_cache.py - Tests for the two-tier clarification cache
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.cache import ClarificationCache, TTLCache, content_hash
+from jira_clarifier_backend.main import TicketInput, app, clarification_cache_key
+
+
+TICKET = {
+    "title": "Fix login bug",
+    "description": "Users can't log in",
+    "issueType": "Bug",
+    "priority": "High"
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clarification_cache():
+    return ClarificationCache(TTLCache())
+
+
+def test_ttl_cache_expires_entries():
+    clock = FakeClock()
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set("a", 1)
+    clock.now = 9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_content_hash_ignores_whitespace_but_not_boundaries():
+    assert content_hash("Fix  login\nbug", "x") == content_hash(" Fix login bug ", "x")
+    assert content_hash("ab", "c") != content_hash("a", "bc")
+
+
+def test_cache_key_normalizes_ticket_fields():
+    a = TicketInput(title="Fix login bug ", description="Users can't  log in", issueType="Bug", priority="High")
+    b = TicketInput(title="Fix login bug", description="Users can't log in", issueType="bug", priority="HIGH", orgId="JIRA-1")
+    c = TicketInput(title="Fix logout bug", description="Users can't log in", issueType="Bug", priority="High")
+    assert clarification_cache_key(a) == clarification_cache_key(b)
+    assert clarification_cache_key(a) != clarification_cache_key(c)
+
+
+def test_cache_key_changes_with_prompt_version(monkeypatch):
+    ticket = TicketInput(**TICKET)
+    before = clarification_cache_key(ticket)
+    monkeypatch.setattr(main, "PROMPT_VERSION", "different")
+    assert clarification_cache_key(ticket) != before
+
+
+def test_redis_tier_backfills_memory():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        writer = ClarificationCache(TTLCache(), redis=redis)
+        await writer.set("k", {"edgeCases": ["x"]})
+
+        reader = ClarificationCache(TTLCache(), redis=redis)
+        first = await reader.get("k")
+        second = await reader.get("k")
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == ({"edgeCases": ["x"]}, "redis")
+    assert second == ({"edgeCases": ["x"]}, "memory")
+
+
+def test_redis_errors_degrade_to_miss():
+    class BrokenRedis:
+        async def get(self, key):
+            raise ConnectionError("down")
+
+        async def set(self, *args, **kwargs):
+            raise ConnectionError("down")
+
+    async def run():
+        cache = ClarificationCache(TTLCache(), redis=BrokenRedis())
+        await cache.set("k", {"a": 1})
+        hit = await cache.get("k")
+        miss = await cache.get("other")
+        return hit, miss
+
+    hit, miss = asyncio.run(run())
+    assert hit == ({"a": 1}, "memory")
+    assert miss == (None, None)
+
+
+def test_clarify_serves_repeat_requests_from_cache(upstream):
+    client = TestClient(app)
+
+    first = client.post("/clarify", json=TICKET)
+    second = client.post("/clarify", json={**TICKET, "title": "  Fix login bug"})
+
+    assert first.status_code == 200
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.status_code == 200
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.headers["X-Cache-Tier"] == "memory"
+    assert second.json() == first.json()
+    assert len(upstream.requests) == 1
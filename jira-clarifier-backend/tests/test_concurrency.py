@@ -0,0 +1,70 @@
+# test_concurrency.py - Load test for concurrent /clarify requests on one worker
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from jira_clarifier_backend.main import app
+
+
+UPSTREAM_DELAY = 0.5
+CONCURRENT_REQUESTS = 20
+
+TICKET = {
+    "title": "Fix login bug",
+    "description": "Users can't log in",
+    "issueType": "Bug",
+    "priority": "High"
+}
+
+
+@pytest.fixture
+def upstream_options():
+    return {"delay": UPSTREAM_DELAY}
+
+
+async def _post_clarify(client: httpx.AsyncClient, ticket: dict) -> httpx.Response:
+    return await client.post("/clarify", json=ticket)
+
+
+def test_concurrent_clarifications_overlap(upstream):
+    """N concurrent /clarify requests finish in about the time of one"""
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            start = time.monotonic()
+            responses = await asyncio.gather(*[
+                _post_clarify(client, {**TICKET, "title": f"{TICKET['title']} #{i}"})
+                for i in range(CONCURRENT_REQUESTS)
+            ])
+            return responses, time.monotonic() - start
+
+    responses, elapsed = asyncio.run(run())
+
+    assert all(r.status_code == 200 for r in responses)
+    assert all(r.json()["acceptanceCriteria"] for r in responses)
+    assert upstream.max_in_flight == CONCURRENT_REQUESTS
+    # Serialized calls would take CONCURRENT_REQUESTS * UPSTREAM_DELAY
+    assert elapsed < UPSTREAM_DELAY * 3
+
+
+def test_health_responsive_during_clarify(upstream):
+    """/health answers while a clarification is waiting on Claude"""
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            clarify = asyncio.create_task(_post_clarify(client, TICKET))
+            await asyncio.sleep(UPSTREAM_DELAY / 5)
+
+            start = time.monotonic()
+            health = await client.get("/health")
+            health_elapsed = time.monotonic() - start
+
+            return await clarify, health, health_elapsed
+
+    clarify, health, health_elapsed = asyncio.run(run())
+
+    assert clarify.status_code == 200
+    assert health.status_code == 200
+    assert health_elapsed < UPSTREAM_DELAY / 2
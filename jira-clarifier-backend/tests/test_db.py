@@ -0,0 +1,147 @@
+# test_db.py - Tests for the pooled PostgreSQL access layer
+import threading
+import time
+
+import pytest
+from psycopg2 import extensions
+
+from jira_clarifier_backend.db import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    """Minimal stand-in for a psycopg2 connection"""
+
+    def __init__(self):
+        self.closed = 0
+        self.rollbacks = 0
+        self.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.transaction_status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeConnector:
+    def __init__(self):
+        self.opened = []
+
+    def __call__(self):
+        conn = FakeConnection()
+        self.opened.append(conn)
+        return conn
+
+
+def test_pool_opens_min_size_upfront():
+    connector = FakeConnector()
+    pool = ConnectionPool(None, min_size=2, max_size=5, connect=connector)
+    assert len(connector.opened) == 2
+    assert pool.stats()["idle"] == 2
+
+
+def test_pool_reuses_connections():
+    connector = FakeConnector()
+    pool = ConnectionPool(None, min_size=1, max_size=5, connect=connector)
+
+    for _ in range(10):
+        conn = pool.getconn()
+        pool.putconn(conn)
+
+    assert len(connector.opened) == 1
+    assert pool.stats()["checkouts"] == 10
+    assert pool.stats()["inUse"] == 0
+
+
+def test_pool_rolls_back_open_transactions():
+    pool = ConnectionPool(None, min_size=0, max_size=1, connect=FakeConnector())
+    conn = pool.getconn()
+    conn.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+    assert pool.getconn() is conn
+
+
+def test_pool_replaces_closed_connections():
+    connector = FakeConnector()
+    pool = ConnectionPool(None, min_size=1, max_size=1, connect=connector)
+    conn = pool.getconn()
+    conn.close()
+    pool.putconn(conn)
+
+    fresh = pool.getconn()
+    assert fresh is not conn
+    assert len(connector.opened) == 2
+
+
+def test_pool_times_out_when_exhausted():
+    pool = ConnectionPool(None, min_size=0, max_size=1, timeout=0.05, connect=FakeConnector())
+    pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert pool.stats()["timeouts"] == 1
+    assert pool.stats()["inUse"] == 1
+
+
+def test_pool_records_checkout_wait():
+    pool = ConnectionPool(None, min_size=1, max_size=1, timeout=2, connect=FakeConnector())
+    conn = pool.getconn()
+
+    def release_later():
+        time.sleep(0.1)
+        pool.putconn(conn)
+
+    threading.Thread(target=release_later).start()
+    pool.putconn(pool.getconn())
+
+    stats = pool.stats()
+    assert stats["waitMaxSeconds"] >= 0.05
+    assert stats["inUse"] == 0
+
+
+def test_pool_reports_waits_and_timeouts():
+    waits = []
+    pool = ConnectionPool(None, min_size=0, max_size=1, timeout=0.05, connect=FakeConnector(),
+                          on_wait=lambda waited, timed_out: waits.append((waited, timed_out)))
+    pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+
+    assert [timed_out for _, timed_out in waits] == [False, True]
+    assert waits[1][0] >= 0.05
+
+
+def test_pool_never_exceeds_max_size_under_contention():
+    connector = FakeConnector()
+    pool = ConnectionPool(None, min_size=0, max_size=4, timeout=5, connect=connector)
+    peak = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(20):
+            conn = pool.getconn()
+            with lock:
+                peak.append(pool.stats()["inUse"])
+            pool.putconn(conn)
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert max(peak) <= 4
+    assert len(connector.opened) <= 4
+
+
+def test_closeall_closes_idle_connections():
+    connector = FakeConnector()
+    pool = ConnectionPool(None, min_size=3, max_size=3, connect=connector)
+    pool.closeall()
+    assert all(c.closed for c in connector.opened)
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
@@ -0,0 +1,110 @@
+# test_embedding_cache.py - Tests for the persistent float16 embedding cache
+import fcntl
+import threading
+
+import numpy as np
+
+from jira_clarifier_backend import ingest
+from jira_clarifier_backend.embedding_cache import CachedEmbedder, EmbeddingCache
+from jira_clarifier_backend.ingest import Checkpoint, IngestRecord
+from jira_clarifier_backend.rag import InMemoryVectorStore
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.encoded = []
+
+    def embed(self, texts):
+        self.encoded += texts
+        return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+
+def test_hits_skip_the_model_and_survive_restart(tmp_path):
+    model = CountingEmbedder()
+    embedder = CachedEmbedder(model, EmbeddingCache(tmp_path, "test-model"))
+
+    first = embedder.embed(["Fix login", "Add search", "Fix login"])
+    assert model.encoded == ["Fix login", "Add search"]
+    assert first[0] == first[2]
+
+    reopened = CachedEmbedder(model, EmbeddingCache(tmp_path, "test-model", memory_entries=0))
+    assert reopened.embed(["Fix   login ", "Add search"]) == first[:2]  # whitespace is normalized
+    assert model.encoded == ["Fix login", "Add search"]
+
+
+def test_vectors_are_stored_as_float16(tmp_path):
+    cache = EmbeddingCache(tmp_path, "test-model")
+    cache.put_many(["a"], [[0.1, 0.2, 0.3]])
+
+    stored = np.load(tmp_path / "test-model" / "vectors.npy", mmap_mode="r")
+    assert stored.dtype == np.float16
+    assert np.allclose(EmbeddingCache(tmp_path, "test-model").get_many(["a"])[0], [0.1, 0.2, 0.3], atol=1e-3)
+
+
+def test_keys_include_the_model_name(tmp_path):
+    EmbeddingCache(tmp_path, "model-a").put_many(["ticket"], [[1.0, 0.0]])
+    assert EmbeddingCache(tmp_path, "model-b").get_many(["ticket"]) == [None]
+
+
+def test_least_recently_used_entries_are_evicted_at_capacity(tmp_path):
+    cache = EmbeddingCache(tmp_path, "test-model", capacity=2, memory_entries=0)
+    cache.put_many(["a", "b"], [[1.0], [2.0]])
+    cache.get_many(["a"])
+    cache.put_many(["c"], [[3.0]])
+
+    reopened = EmbeddingCache(tmp_path, "test-model", capacity=2, memory_entries=0)
+    a, b, c = reopened.get_many(["a", "b", "c"])
+    assert (a[0], b, c[0]) == (1.0, None, 3.0)
+    assert len(reopened) == 2
+
+
+def test_slot_reused_by_another_process_is_a_miss(tmp_path):
+    reader = EmbeddingCache(tmp_path, "test-model", capacity=1, memory_entries=0)
+    reader.put_many(["a"], [[1.0]])
+
+    writer = EmbeddingCache(tmp_path, "test-model", capacity=1, memory_entries=0)
+    writer.put_many(["b"], [[2.0]])
+    assert reader.get_many(["a"]) == [None]
+
+
+def test_processes_sharing_a_cache_never_take_the_same_slot(tmp_path):
+    worker_a = EmbeddingCache(tmp_path, "test-model", capacity=4, memory_entries=0)
+    worker_b = EmbeddingCache(tmp_path, "test-model", capacity=4, memory_entries=0)
+    worker_a.put_many(["a", "b"], [[1.0], [2.0]])
+    worker_b.put_many(["c", "d"], [[3.0], [4.0]])
+
+    assert [v[0] for v in worker_a.get_many(["a", "b"])] == [1.0, 2.0]
+    reopened = EmbeddingCache(tmp_path, "test-model", capacity=4, memory_entries=0)
+    assert [v[0] for v in reopened.get_many(["a", "b", "c", "d"])] == [1.0, 2.0, 3.0, 4.0]
+
+    worker_b.put_many(["e"], [[5.0]])  # full: evicts the least recently used slot across both workers
+    assert worker_a.get_many(["b"])[0][0] == 2.0
+    assert [v is None for v in worker_b.get_many(["a", "e"])] == [True, False]
+
+
+def test_reads_wait_for_another_process_writing(tmp_path):
+    cache = EmbeddingCache(tmp_path, "test-model", memory_entries=0)
+    cache.put_many(["a"], [[1.0]])
+    results = []
+
+    with (tmp_path / "test-model" / ".lock").open("a") as writer:
+        fcntl.flock(writer, fcntl.LOCK_EX)  # a put_many elsewhere
+        reader = threading.Thread(target=lambda: results.append(cache.get_many(["a"])))
+        reader.start()
+        reader.join(0.1)
+        assert results == []
+
+    reader.join(1)
+    assert results[0][0][0] == 1.0
+
+
+def test_reingest_reuses_cached_embeddings(tmp_path):
+    model = CountingEmbedder()
+    records = [IngestRecord(f"t{i}", "org", f"Ticket {i}", {}) for i in range(5)]
+    cache = EmbeddingCache(tmp_path / "cache", "test-model")
+
+    ingest.ingest(records, InMemoryVectorStore(), lambda: model, Checkpoint(None), cache=cache)
+    stats = ingest.ingest(records, InMemoryVectorStore(), lambda: model, Checkpoint(None), batch_size=2, cache=cache)
+
+    assert stats.upserted == 5
+    assert len(model.encoded) == 5
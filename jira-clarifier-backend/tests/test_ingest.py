@@ -0,0 +1,127 @@
+# test_ingest.py - Tests for the batched, resumable embedding ingest CLI
+import json
+
+import pytest
+
+from jira_clarifier_backend import ingest
+from jira_clarifier_backend.ann import IVFVectorIndex
+from jira_clarifier_backend.ingest import Checkpoint, IngestRecord, chunk_vectors, iter_jsonl
+from jira_clarifier_backend.rag import InMemoryVectorStore
+
+
+class KeywordEmbedder:
+    VOCABULARY = ["login", "password", "payment", "search"]
+
+    def embed(self, texts):
+        return [[float(word in text.lower()) for word in self.VOCABULARY] + [0.01] for text in texts]
+
+
+def keyword_embedder():
+    """Module-level so worker processes can unpickle it"""
+    return KeywordEmbedder()
+
+
+class FlakyStore(InMemoryVectorStore):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.calls = []
+
+    def upsert(self, vectors, namespace):
+        self.calls.append(len(vectors))
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("429 Too Many Requests")
+        super().upsert(vectors, namespace)
+
+
+def records(n, namespace="org-1"):
+    return [
+        IngestRecord(f"t{i}", namespace, f"Ticket {i} login", {"title": f"Ticket {i}", "desc": "login"})
+        for i in range(n)
+    ]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ingest.time, "sleep", lambda seconds: None)
+
+
+def test_iter_jsonl_reads_the_seed_file_format(tmp_path):
+    path = tmp_path / "tickets.jsonl"
+    path.write_text(
+        json.dumps({"raw_title": "Fix login", "raw_description": "Can't log in", "gold": {}}) + "\n\n"
+        + json.dumps({"title": "Search", "description": "slow", "orgId": "org-2"}) + "\n"
+    )
+
+    first, second = iter_jsonl(str(path), namespace="seed")
+    assert (first.id, first.namespace, first.metadata) == ("ticket-0", "seed", {"title": "Fix login", "desc": "Can't log in"})
+    assert second.namespace == "org-2"
+
+
+def test_chunks_are_capped_by_count_and_size():
+    vectors = [{"id": str(i), "values": [0.5] * 10, "metadata": {}} for i in range(25)]
+    assert [len(chunk) for chunk in chunk_vectors(vectors, max_vectors=10)] == [10, 10, 5]
+
+    one_vector = len(json.dumps(vectors[0]))
+    assert [len(chunk) for chunk in chunk_vectors(vectors[:5], max_bytes=one_vector * 2)] == [2, 2, 1]
+
+
+def test_ingest_upserts_in_chunks_and_retries(tmp_path):
+    store = FlakyStore(failures=2)
+    stats = ingest.ingest(records(25), store, keyword_embedder, Checkpoint(None), batch_size=10, max_vectors=4)
+
+    assert (stats.read, stats.upserted, stats.failed) == (25, 25, 0)
+    assert max(store.calls) <= 4
+    assert len(store.calls) == 3 + 3 + 2 + 2  # batches of 10, 10, 5 in chunks of 4, plus 2 retries
+    assert store.query([1, 0, 0, 0, 0], top_k=1, namespace="org-1")
+
+
+def test_exhausted_retries_are_not_checkpointed(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "progress.jsonl"))
+    stats = ingest.ingest(records(3), FlakyStore(failures=100), keyword_embedder, checkpoint)
+
+    assert (stats.upserted, stats.failed) == (0, 3)
+    assert checkpoint.done == {}
+
+
+def test_restart_skips_finished_and_unchanged_tickets(tmp_path):
+    path = str(tmp_path / "progress.jsonl")
+    first = ingest.ingest(records(5), InMemoryVectorStore(), keyword_embedder, Checkpoint(path))
+    assert first.upserted == 5
+
+    changed = records(6)
+    changed[2] = changed[2]._replace(text="Ticket 2 now about payment")
+    store = FlakyStore(failures=0)
+    second = ingest.ingest(changed, store, keyword_embedder, Checkpoint(path))
+
+    assert (second.read, second.skipped, second.upserted) == (6, 4, 2)
+    assert store.calls == [2]
+
+
+def test_worker_processes_embed_into_the_local_index(tmp_path):
+    index = IVFVectorIndex(tmp_path / "index")
+    batch = records(20, "org-1") + records(5, "org-2")
+    stats = ingest.ingest(batch, index, keyword_embedder, Checkpoint(None), batch_size=4, workers=2)
+
+    assert stats.upserted == 25
+    assert stats.rate > 0
+    index.compact()
+    assert len(IVFVectorIndex(tmp_path / "index")) == 20  # ids repeat across orgs, last write wins
+
+
+def test_cli_ingests_jsonl_into_local_index(tmp_path, monkeypatch, capsys):
+    source = tmp_path / "tickets.jsonl"
+    source.write_text("".join(
+        json.dumps({"raw_title": f"Login issue {i}", "raw_description": "password"}) + "\n" for i in range(3)
+    ))
+    monkeypatch.setattr(ingest, "ModelFactory", lambda model_name: keyword_embedder)
+    argv = ["jsonl", str(source), "--namespace", "seed", "--backend", "local",
+            "--index-path", str(tmp_path / "index"), "--checkpoint", str(tmp_path / "progress.jsonl"), "--embedding-cache", ""]
+
+    assert ingest.main(argv) == 0
+    assert "upserted 3" in capsys.readouterr().out
+    assert len(IVFVectorIndex(tmp_path / "index")) == 3
+
+    assert ingest.main(argv) == 0
+    assert "skipped 3 unchanged, upserted 0" in capsys.readouterr().out
@@ -0,0 +1,199 @@
+# test_jobs.py - Tests for offline clarification jobs against a fake batch server
+import asyncio
+import itertools
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.jobs import AnthropicBatchClient
+from jira_clarifier_backend.main import app, create_claude_client, create_job_runner
+from tests.fake_anthropic import DEFAULT_CLARIFICATION, FakeAnthropicUpstream
+
+ORG_ID = "JIRA-AAAA-BBBB-CCCC"
+
+
+class InMemoryJobStore:
+    """Same interface as jobs.JobStore, kept in dicts"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.items = {}
+        self.tickets = []
+        self._ids = itertools.count(1)
+
+    def create_job(self, org_id, tickets):
+        job_id = next(self._ids)
+        self.jobs[job_id] = {
+            "id": job_id, "org_id": org_id, "status": "pending", "batch_id": None,
+            "total": len(tickets), "processed": 0, "succeeded": 0, "failed": 0,
+            "error": None, "created_at": datetime.now(), "completed_at": None
+        }
+        self.items[job_id] = [
+            {"custom_id": f"job{job_id}-{i}", "ticket": ticket, "status": "pending", "output": None}
+            for i, ticket in enumerate(tickets)
+        ]
+        return job_id
+
+    def claim_pending_jobs(self, limit=5):
+        claimed = []
+        for job in self.jobs.values():
+            if job["status"] == "pending" and len(claimed) < limit:
+                job["status"] = "submitting"
+                claimed.append({"id": job["id"], "org_id": job["org_id"], "items": [
+                    {"custom_id": item["custom_id"], "ticket": item["ticket"]} for item in self.items[job["id"]]
+                ]})
+        return claimed
+
+    def mark_submitted(self, job_id, batch_id):
+        self.jobs[job_id].update(status="submitted", batch_id=batch_id)
+
+    def submitted_jobs(self):
+        return [dict(job) for job in self.jobs.values() if job["status"] == "submitted"]
+
+    def record_progress(self, job_id, processed):
+        self.jobs[job_id]["processed"] = processed
+
+    def complete_job(self, job_id, results):
+        job = self.jobs[job_id]
+        if job["status"] != "submitted":
+            return None
+
+        by_id = {custom_id: output for custom_id, output, _ in results}
+        succeeded = 0
+        for item in self.items[job_id]:
+            item["output"] = by_id.get(item["custom_id"])
+            item["status"] = "succeeded" if item["output"] else "failed"
+            if item["output"]:
+                succeeded += 1
+                self.tickets.append((item["ticket"], item["output"]))
+
+        job.update(status="completed", succeeded=succeeded, failed=job["total"] - succeeded,
+                   processed=job["total"], completed_at=datetime.now())
+        return job["failed"]
+
+    def fail_job(self, job_id, error):
+        job = self.jobs[job_id]
+        if job["status"] in ("completed", "failed"):
+            return None
+        job.update(status="failed", error=error, completed_at=datetime.now())
+        return job["total"]
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+
+@pytest.fixture
+def harness(monkeypatch):
+    reserved = []
+    refunds = {}
+
+    async def reserve(key, count=1):
+        reserved.append((key, count))
+        return count
+
+    async def refund(key, count):
+        refunds[key] = refunds.get(key, 0) + count
+
+    async def get_record(key_code):
+        return {"is_active": True} if key_code == ORG_ID else None
+
+    monkeypatch.setattr(main, "reserve_usage", reserve)
+    monkeypatch.setattr(main, "refund_usage", refund)
+    monkeypatch.setattr(main, "get_license_record", get_record)
+
+    upstream = FakeAnthropicUpstream(batch_polls=2)
+    store = InMemoryJobStore()
+    store.reserved = reserved
+    store.refunds = refunds
+    client = AnthropicBatchClient(create_claude_client("test-key", transport=upstream.transport()))
+    runner = create_job_runner(store, client)
+
+    previous = getattr(app.state, 'job_store', None)
+    app.state.job_store = store
+    yield upstream, store, runner, TestClient(app)
+    app.state.job_store = previous
+
+
+def test_job_runs_through_message_batches(harness):
+    upstream, store, runner, client = harness
+
+    response = client.post("/jobs/clarify", json={
+        "orgId": ORG_ID,
+        "tickets": [{"title": "Fix login bug"}, {"title": "broken ticket"}, {"title": "Add dark mode"}]
+    })
+    assert response.status_code == 202
+    job_id = response.json()["jobId"]
+    assert client.get(f"/jobs/{job_id}").json()["status"] == "pending"
+
+    # Pass 1: submit + first poll (still in progress)
+    asyncio.run(runner.run_once())
+    status = client.get(f"/jobs/{job_id}").json()
+    assert status["status"] == "submitted"
+    assert status["batchId"] == "msgbatch_1"
+    assert status["progress"] == 0
+
+    submitted = upstream.batches["msgbatch_1"]["requests"]
+    assert [r["custom_id"] for r in submitted] == [f"job{job_id}-0", f"job{job_id}-1", f"job{job_id}-2"]
+    assert "Fix login bug" in submitted[0]["params"]["messages"][0]["content"]
+
+    # Pass 2: batch has ended, results are parsed and stored
+    asyncio.run(runner.run_once())
+    status = client.get(f"/jobs/{job_id}").json()
+    assert status["status"] == "completed"
+    assert status["succeeded"] == 2
+    assert status["failed"] == 1
+    assert status["progress"] == 1.0
+
+    assert len(store.tickets) == 2
+    assert store.tickets[0][1]["acceptanceCriteria"] == DEFAULT_CLARIFICATION["acceptanceCriteria"]
+    assert store.reserved == [(ORG_ID, 3)]
+    assert store.refunds == {ORG_ID: 1}
+
+
+def test_unparseable_results_are_marked_failed(harness):
+    upstream, store, runner, client = harness
+    upstream.text = lambda: "I can't answer in JSON"
+    upstream.batch_polls = 0
+
+    job_id = client.post("/jobs/clarify", json={"orgId": ORG_ID, "tickets": [{"title": "Fix login bug"}]}).json()["jobId"]
+    asyncio.run(runner.run_once())
+
+    status = client.get(f"/jobs/{job_id}").json()
+    assert status["status"] == "completed"
+    assert status["failed"] == 1
+    assert store.tickets == []
+
+
+def test_failed_insert_refunds_the_reservation(harness, monkeypatch):
+    _, store, _, client = harness
+
+    def fail(org_id, tickets):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(store, "create_job", fail)
+    response = client.post("/jobs/clarify", json={
+        "orgId": ORG_ID,
+        "tickets": [{"title": "Fix login bug"}, {"title": "Add dark mode"}]
+    })
+
+    assert response.status_code == 500
+    assert store.reserved == [(ORG_ID, 2)]
+    assert store.refunds == {ORG_ID: 2}
+
+
+def test_jobs_need_an_active_license(harness):
+    _, store, _, client = harness
+
+    orgless = client.post("/jobs/clarify", json={"tickets": [{"title": "Fix login bug"}]})
+    made_up = client.post("/jobs/clarify", json={"orgId": "made-up", "tickets": [{"title": "Fix login bug"}]})
+
+    assert (orgless.status_code, made_up.status_code) == (403, 403)
+    assert store.jobs == {}
+    assert store.reserved == []
+
+
+def test_unknown_job_returns_404(harness):
+    _, _, _, client = harness
+    assert client.get("/jobs/999").status_code == 404
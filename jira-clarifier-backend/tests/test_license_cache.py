@@ -0,0 +1,129 @@
+# test_license_cache.py - Tests for the license key cache and its pub/sub invalidation
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.cache import LicenseKeyCache, TTLCache
+from jira_clarifier_backend.main import app
+
+RECORD = {
+    "plan": "team",
+    "is_active": True,
+    "subscription_status": "active",
+    "clarifications_limit": 1000,
+    "clarifications_used": 10,
+    "usage_resets_at": "2026-11-01T00:00:00",
+    "activated_at": "2026-10-01T09:30:00"
+}
+
+
+@pytest.fixture
+def license_cache(monkeypatch):
+    reads = []
+
+    def fetch(key_code):
+        reads.append(key_code)
+        return dict(RECORD) if key_code == "JIRA-AAAA-BBBB-CCCC" else None
+
+    monkeypatch.setattr(main, "fetch_license_record", fetch)
+    previous = getattr(app.state, 'license_cache', None)
+    app.state.license_cache = LicenseKeyCache(TTLCache())
+    app.state.license_cache.reads = reads
+    yield app.state.license_cache
+    app.state.license_cache = previous
+
+
+def test_hot_validations_skip_the_database(license_cache):
+    client = TestClient(app)
+    responses = [client.post("/validate-key", json={"accessKey": " jira-aaaa-bbbb-cccc "}) for _ in range(3)]
+
+    assert all(r.json()["valid"] for r in responses)
+    assert responses[-1].json()["clarificationsRemaining"] == 990
+    assert license_cache.reads == ["JIRA-AAAA-BBBB-CCCC"]
+
+
+def test_unknown_keys_are_not_cached(license_cache):
+    client = TestClient(app)
+    for _ in range(2):
+        assert client.post("/validate-key", json={"accessKey": "JIRA-NOPE"}).json()["valid"] is False
+    assert license_cache.reads == ["JIRA-NOPE", "JIRA-NOPE"]
+
+
+def test_invalidation_reaches_other_workers():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def scenario():
+        server = fakeredis.FakeServer()
+        workers = [
+            LicenseKeyCache(TTLCache(), redis=fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+            for _ in range(2)
+        ]
+        listeners = [asyncio.create_task(worker.listen()) for worker in workers]
+        await asyncio.sleep(0.05)
+
+        for worker in workers:
+            await worker.set("JIRA-1", RECORD)
+        await workers[0].invalidate(["JIRA-1"])
+        await asyncio.sleep(0.05)
+
+        for listener in listeners:
+            listener.cancel()
+        return [worker.local.get("JIRA-1") for worker in workers], await workers[1].redis.get(workers[1].prefix + "JIRA-1")
+
+    local, shared = asyncio.run(scenario())
+    assert local == [None, None]
+    assert shared is None
+
+
+def test_webhook_invalidation_publishes_from_sync_code(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    clients = []
+
+    def from_url(*args, **kwargs):
+        clients.append(fakeredis.FakeRedis(server=server))
+        return clients[-1]
+
+    monkeypatch.setattr(main.redis.Redis, "from_url", from_url)
+    monkeypatch.setattr(main, "REDIS_URL", "redis://fake")
+    monkeypatch.setattr(app.state, "sync_redis", None, raising=False)
+
+    async def scenario():
+        worker = LicenseKeyCache(TTLCache(), redis=fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+        listener = asyncio.create_task(worker.listen())
+        await asyncio.sleep(0.05)
+        await worker.set("JIRA-1", RECORD)
+
+        # process_stripe_event runs in a worker thread
+        await asyncio.to_thread(main.invalidate_license_keys, ["JIRA-1"])
+        await asyncio.to_thread(main.invalidate_license_keys, ["JIRA-2"])
+        await asyncio.sleep(0.05)
+        listener.cancel()
+        return worker.local.get("JIRA-1"), await worker.redis.get(worker.prefix + "JIRA-1")
+
+    assert asyncio.run(scenario()) == (None, None)
+    assert len(clients) == 1  # reused across calls
+
+
+def test_thread_invalidation_runs_on_the_loop():
+    async def scenario():
+        cache = LicenseKeyCache(TTLCache())
+        cache.local.set("JIRA-1", RECORD)
+        deleted_on = []
+        delete = cache.local.delete
+
+        def tracked_delete(key):
+            deleted_on.append(threading.current_thread())
+            delete(key)
+
+        cache.local.delete = tracked_delete
+        await asyncio.to_thread(cache.discard_threadsafe, ["JIRA-1"])
+        await asyncio.sleep(0)
+        return deleted_on, cache.local.get("JIRA-1")
+
+    deleted_on, cached = asyncio.run(scenario())
+    assert deleted_on == [threading.main_thread()]
+    assert cached is None
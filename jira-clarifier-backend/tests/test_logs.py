@@ -0,0 +1,169 @@
+# test_logs.py - Tests for structured, queued logging and request log context
+import io
+import json
+import logging
+import queue
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.logs import (
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    bind_log_context,
+    mask_key,
+    sampled,
+    setup_logging
+)
+from jira_clarifier_backend.main import app, create_claude_client
+from tests.fake_anthropic import FakeAnthropicUpstream
+
+
+class SlowStream(io.StringIO):
+    """A stdout that blocks on every write, like a backed-up container log pipe"""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return super().write(text)
+
+
+@pytest.fixture
+def captured():
+    """Root logger routed through the queue into a buffer; yields a reader of the JSON lines"""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    stream = io.StringIO()
+    listener = setup_logging("INFO", "json", stream=stream)
+
+    def lines():
+        listener.stop()
+        listener.start()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    yield lines
+    listener.stop()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_lines_are_json_with_extra_fields(captured):
+    logging.getLogger("test").info("Usage reserved", extra={"used": 3, "limit": 5})
+
+    [line] = captured()
+    assert (line["level"], line["logger"], line["msg"]) == ("INFO", "test", "Usage reserved")
+    assert (line["used"], line["limit"]) == (3, 5)
+    assert line["ts"].endswith("+00:00")
+
+
+def test_exceptions_are_kept_as_a_field(captured):
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logging.getLogger("test").exception("Webhook error")
+
+    [line] = captured()
+    assert line["msg"] == "Webhook error"
+    assert "ValueError: boom" in line["exc"]
+
+
+def test_sampling_keeps_about_the_configured_rate():
+    assert 100 < sum(sampled(0.1) for _ in range(2000)) < 320
+    assert all(sampled(1.0) for _ in range(100))
+    assert not any(sampled(0.0) for _ in range(100))
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=2))
+    for i in range(5):
+        handler.handle(logging.makeLogRecord({"msg": f"line {i}"}))
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+
+def test_caller_is_not_held_up_by_a_slow_stream():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    listener = setup_logging("INFO", "json", stream=SlowStream(0.01))
+    try:
+        start = time.perf_counter()
+        for i in range(20):
+            logging.getLogger("test").info("line", extra={"i": i})
+        elapsed = time.perf_counter() - start
+    finally:
+        listener.stop()
+        root.handlers[:] = handlers
+        root.setLevel(level)
+
+    assert elapsed < 0.1  # 20 synchronous writes would take at least 0.2s
+
+
+def test_bound_fields_stay_in_their_thread_or_task(captured):
+    def worker():
+        bind_log_context(key="JIRA-AAAA…")
+        logging.getLogger("test").info("in worker")
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    logging.getLogger("test").info("outside")
+
+    worker_line, outside_line = captured()
+    assert worker_line["key"] == "JIRA-AAAA…"
+    assert "key" not in outside_line
+
+
+def test_license_keys_are_masked():
+    assert mask_key("JIRA-ABCD-EFGH-IJKL-MNOP") == "JIRA-ABCD…"
+    assert mask_key("free_user") == "free_user"
+    assert mask_key(None) is None
+
+
+def test_request_lines_carry_request_id_route_and_key(captured, monkeypatch):
+    monkeypatch.setattr(main, "ENABLE_ANALYTICS", False)
+    monkeypatch.setattr(main, "LOG_SAMPLE_RATE", 1.0)
+    upstream = FakeAnthropicUpstream()
+    previous = (getattr(app.state, 'claude', None), getattr(app.state, 'clarification_cache', None))
+    app.state.claude = create_claude_client("test-key", transport=upstream.transport())
+    app.state.clarification_cache = None
+
+    async def reserve(key, count=1):
+        main.logger.info("Usage reserved", extra={"used": 1, "limit": 5})
+        return count
+
+    monkeypatch.setattr(main, "reserve_usage", reserve)
+    try:
+        response = TestClient(app).post(
+            "/clarify",
+            json={"title": "Fix login bug", "orgId": "JIRA-ABCD-EFGH-IJKL-MNOP"},
+            headers={"X-Request-Id": "req-123"}
+        )
+    finally:
+        app.state.claude, app.state.clarification_cache = previous
+
+    assert response.status_code == 200
+    assert response.headers["X-Request-Id"] == "req-123"
+
+    lines = {line["msg"]: line for line in captured()}
+    for msg in ("Usage reserved", "Claude call"):
+        line = lines[msg]
+        assert (line["requestId"], line["route"], line["key"]) == ("req-123", "/clarify", "JIRA-ABCD…"), msg
+    assert lines["Claude call"]["model"] == main.CLAUDE_MODEL
+    assert not any("EFGH" in json.dumps(line) for line in lines.values())
+
+
+def test_request_id_is_generated_when_missing():
+    response = TestClient(app).get("/")
+    assert len(response.headers["X-Request-Id"]) == 32
+
+
+def test_formatter_serializes_unknown_types():
+    record = logging.makeLogRecord({"msg": "x", "name": "test", "levelname": "INFO", "when": object()})
+    assert "object object" in json.loads(JsonFormatter().format(record))["when"]
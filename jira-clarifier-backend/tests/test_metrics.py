@@ -0,0 +1,177 @@
+# test_metrics.py - Tests for the Prometheus histograms, counters and /metrics
+import asyncio
+import re
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.cache import ClarificationCache, TTLCache
+from jira_clarifier_backend.db import ConnectionPool
+from jira_clarifier_backend.main import TicketInput, app, stream_clarification
+from jira_clarifier_backend.metrics import Registry
+from jira_clarifier_backend.singleflight import SingleFlight
+from jira_clarifier_backend.structured import ParseMetrics
+from tests.test_db import FakeConnector
+
+
+def sample(text: str, name: str, **labels) -> float:
+    """Value of one series in an exposition, 0 if absent"""
+    selector = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf"^{re.escape(name)}{re.escape('{' + selector + '}') if labels else ''} (\S+)$", text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+@pytest.fixture
+def fresh_metrics(monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr(main, "metrics_registry", registry)
+    for name, metric in (
+        ("stage_seconds", registry.histogram("clarify_stage_seconds", "stages", ["stage"])),
+        ("request_seconds", registry.histogram("clarify_request_seconds", "requests", ["endpoint"])),
+        ("claude_tokens", registry.counter("claude_tokens_total", "tokens", ["model", "kind"])),
+        ("cache_lookups", registry.counter("clarify_cache_lookups_total", "lookups", ["result"])),
+        ("clarify_errors", registry.counter("clarify_errors_total", "errors", ["type"])),
+        ("parse_outcomes", registry.counter("clarify_parse_outcomes_total", "outcomes", ["outcome"])),
+        ("coalescing_requests", registry.counter("clarify_coalescing_requests_total", "requests", ["role"])),
+        ("coalescing_rate", registry.gauge("clarify_coalescing_rate", "rate"))
+    ):
+        monkeypatch.setattr(main, name, metric)
+    return registry
+
+
+@pytest.fixture
+def upstream_options(fresh_metrics):
+    return {"usage": {"input_tokens": 300, "output_tokens": 200, "cache_read_input_tokens": 1200}}
+
+
+@pytest.fixture
+def clarification_cache():
+    return ClarificationCache(TTLCache())
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "rag")
+
+    text = registry.render()
+    assert "# TYPE latency_seconds histogram" in text
+    assert sample(text, "latency_seconds_bucket", stage="rag", le="0.1") == 2
+    assert sample(text, "latency_seconds_bucket", stage="rag", le="1") == 3
+    assert sample(text, "latency_seconds_bucket", stage="rag", le="+Inf") == 4
+    assert sample(text, "latency_seconds_sum", stage="rag") == pytest.approx(3.65)
+    assert sample(text, "latency_seconds_count", stage="rag") == 4
+
+
+def test_counter_labels_are_escaped():
+    registry = Registry()
+    counter = registry.counter("errors_total", "Errors", ["type"])
+    counter.inc('say "hi"\n', amount=2)
+
+    assert 'errors_total{type="say \\"hi\\"\\n"} 2' in registry.render()
+
+
+def test_clarify_records_every_stage_tokens_and_cache_lookups(upstream):
+    client = TestClient(app)
+    assert client.post("/clarify", json={"title": "Fix login bug"}).status_code == 200
+    assert client.post("/clarify", json={"title": "Fix login bug"}).headers["X-Cache"] == "HIT"
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    for stage in ("prompt_build", "llm", "parse"):
+        assert sample(text, "clarify_stage_seconds_count", stage=stage) == 1, stage
+    assert sample(text, "clarify_request_seconds_count", endpoint="clarify") == 2
+
+    model = main.CLAUDE_MODEL
+    assert sample(text, "claude_tokens_total", model=model, kind="input") == 300
+    assert sample(text, "claude_tokens_total", model=model, kind="output") == 200
+    assert sample(text, "claude_tokens_total", model=model, kind="cache_read_input") == 1200
+    assert sample(text, "clarify_cache_lookups_total", result="miss") == 1
+    assert sample(text, "clarify_cache_lookups_total", result="memory") == 1
+
+
+def test_stream_records_time_to_first_token(upstream):
+    upstream.chunk_delay = 0.01
+
+    async def run():
+        return "".join([event async for event in stream_clarification(TicketInput(title="Fix login bug"), "key")])
+
+    asyncio.run(run())
+    assert main.stage_seconds.count("llm_first_token") == 1
+    assert main.stage_seconds.count("llm") == 1
+    assert main.request_seconds.count("stream") == 1
+
+
+def test_errors_are_counted_by_type(upstream):
+    upstream.text = lambda: "not json"
+    assert TestClient(app).post("/clarify", json={"title": "Fix login bug"}).status_code == 500
+
+    upstream.failures = [400]
+    assert TestClient(app).post("/clarify", json={"title": "Fix logout bug"}).status_code == 500
+
+    text = TestClient(app).get("/metrics").text
+    assert sample(text, "clarify_errors_total", type="parse") == 1
+    assert sample(text, "clarify_errors_total", type="upstream_400") == 1
+
+
+def test_usage_reservation_is_timed(upstream, monkeypatch):
+    async def reserve(key, count=1):
+        await asyncio.sleep(0.01)
+        return count
+
+    monkeypatch.setattr(main, "reserve_usage", reserve)
+    assert TestClient(app).post("/clarify", json={"title": "Fix login bug", "orgId": "JIRA-1"}).status_code == 200
+
+    text = TestClient(app).get("/metrics").text
+    assert sample(text, "clarify_stage_seconds_count", stage="usage") == 1
+    assert sample(text, "clarify_stage_seconds_sum", stage="usage") >= 0.01
+
+
+def test_metrics_export_db_pool_usage():
+    pool = ConnectionPool(None, min_size=2, max_size=5, connect=FakeConnector(), on_wait=main.observe_pool_wait)
+    before = main.db_pool_wait_seconds.count("acquired")
+    previous = getattr(app.state, 'db_pool', None)
+    app.state.db_pool = pool
+    try:
+        pool.getconn()
+        text = TestClient(app).get("/metrics").text
+    finally:
+        app.state.db_pool = previous
+
+    assert "# TYPE db_pool_connections gauge" in text
+    assert sample(text, "db_pool_connections", state="in_use") == 1
+    assert sample(text, "db_pool_connections", state="idle") == 1
+    assert sample(text, "db_pool_connections", state="max") == 5
+    assert sample(text, "db_pool_wait_seconds_count", outcome="acquired") == before + 1
+
+
+def test_metrics_export_parse_outcomes(upstream, monkeypatch):
+    monkeypatch.setattr(main, "parse_metrics", ParseMetrics())
+    assert TestClient(app).post("/clarify", json={"title": "Fix login bug"}).status_code == 200
+
+    text = TestClient(app).get("/metrics").text
+    assert "# TYPE clarify_parse_outcomes_total counter" in text
+    assert sample(text, "clarify_parse_outcomes_total", outcome="responses") == 1
+    assert sample(text, "clarify_parse_outcomes_total", outcome="tool_use") == 1
+    assert sample(text, "clarify_parse_outcomes_total", outcome="parse_failures") == 0
+
+
+def test_metrics_export_the_coalescing_rate(upstream, monkeypatch):
+    monkeypatch.setattr(app.state, "single_flight", SingleFlight(), raising=False)
+    upstream.delay = 0.1
+
+    async def post_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[client.post("/clarify", json={"title": "Fix login bug"}) for _ in range(4)])
+
+    assert all(response.status_code == 200 for response in asyncio.run(post_all()))
+
+    text = TestClient(app).get("/metrics").text
+    assert sample(text, "clarify_coalescing_requests_total", role="requests") == 4
+    assert sample(text, "clarify_coalescing_requests_total", role="coalesced") == 3
+    assert sample(text, "clarify_coalescing_rate") == 0.75
@@ -0,0 +1,73 @@
+# test_prompts.py - Tests for the cacheable prompt prefix and token usage accounting
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import TicketInput, app, build_batch_request, stream_clarification
+from jira_clarifier_backend.prompts import CLARIFY_SYSTEM_PROMPT, TokenUsage
+
+CACHED_USAGE = {
+    "input_tokens": 60,
+    "output_tokens": 200,
+    "cache_creation_input_tokens": 0,
+    "cache_read_input_tokens": 1400
+}
+
+
+@pytest.fixture
+def upstream_options(monkeypatch):
+    monkeypatch.setattr(main, "token_usage", TokenUsage())
+    return {"usage": CACHED_USAGE}
+
+
+def test_system_prefix_is_identical_across_tickets_and_marked_for_caching():
+    first = main.build_message_params(TicketInput(title="Fix login bug"), [])
+    second = main.build_message_params(TicketInput(title="Rotate API keys", description="Quarterly"), [
+        {"title": "Revoke leaked key", "description": "Past ticket", "score": 0.8}
+    ])
+
+    assert first["system"] == second["system"]
+    assert first["system"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert "Rotate API keys" not in second["system"][0]["text"]
+    assert "Similar past tickets for context" in second["messages"][0]["content"]
+    # Below ~1024 tokens Sonnet silently skips caching
+    assert len(CLARIFY_SYSTEM_PROMPT) // 4 > 1024
+
+
+def test_batch_requests_share_the_cached_prefix():
+    params = build_batch_request({"title": "Fix login bug"})
+    assert params["system"][0]["text"] == CLARIFY_SYSTEM_PROMPT
+    assert params["messages"][0]["content"].startswith("Ticket Title: Fix login bug")
+
+
+def test_clarify_records_cache_token_usage(upstream):
+    client = TestClient(app)
+    assert client.post("/clarify", json={"title": "Fix login bug"}).status_code == 200
+    assert upstream.requests[0]["system"][0]["cache_control"] == {"type": "ephemeral"}
+
+    usage = client.get("/health").json()["claudeUsage"]
+    assert usage["requests"] == 1
+    assert usage["cacheReadInputTokens"] == 1400
+    assert usage["cacheReadRatio"] == pytest.approx(1400 / 1460, abs=1e-3)
+
+
+def test_stream_records_cache_token_usage(upstream):
+    async def run():
+        return [event async for event in stream_clarification(TicketInput(title="Add dark mode"), "key")]
+
+    asyncio.run(run())
+    snapshot = main.token_usage.snapshot()
+    assert (snapshot["requests"], snapshot["cacheReadInputTokens"], snapshot["outputTokens"]) == (1, 1400, 200)
+
+
+def test_token_usage_accepts_dicts_and_missing_cache_fields():
+    usage = TokenUsage()
+    usage.record({"input_tokens": 300, "output_tokens": 100})
+    usage.record({"input_tokens": 20, "output_tokens": 100, "cache_creation_input_tokens": 1400})
+
+    snapshot = usage.snapshot()
+    assert snapshot["inputTokens"] == 320
+    assert snapshot["cacheCreationInputTokens"] == 1400
+    assert snapshot["cacheReadRatio"] == 0.0
@@ -0,0 +1,136 @@
+# test_quota.py - Tests for atomic usage reservation and refunds
+import asyncio
+import os
+import threading
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.db import ConnectionPool
+from jira_clarifier_backend.main import app
+from jira_clarifier_backend.usage import UsageCounter
+
+@pytest.fixture
+def ledger(monkeypatch):
+    """Fake license_keys row: reserve/refund update it, over-limit raises 429"""
+    ledger = {"used": 0, "limit": 2, "refunds": []}
+
+    async def reserve(key, count=1):
+        if ledger["used"] + count > ledger["limit"]:
+            raise HTTPException(status_code=429, detail="Monthly limit reached")
+        ledger["used"] += count
+        return count
+
+    async def refund(key, count):
+        ledger["used"] -= count
+        ledger["refunds"].append((key, count))
+
+    monkeypatch.setattr(main, "reserve_usage", reserve)
+    monkeypatch.setattr(main, "refund_usage", refund)
+    monkeypatch.setattr(main, "store_tickets", lambda results: None)
+    return ledger
+
+
+def test_over_limit_key_is_rejected_before_calling_claude(ledger, upstream):
+    client = TestClient(app)
+    statuses = [
+        client.post("/clarify", json={"title": f"Ticket {i}", "orgId": "JIRA-1"}).status_code
+        for i in range(3)
+    ]
+
+    assert statuses == [200, 200, 429]
+    assert len(upstream.requests) == 2
+    assert ledger["used"] == 2
+
+
+def test_failed_generation_is_refunded(ledger, upstream):
+    upstream.text = lambda: "not json"
+    response = TestClient(app).post("/clarify", json={"title": "Fix login bug", "orgId": "JIRA-1"})
+
+    assert response.status_code == 500
+    assert ledger["refunds"] == [("JIRA-1", 1)]
+    assert ledger["used"] == 0
+
+
+def test_concurrent_counter_reservations_never_exceed_limit(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+
+    record = {
+        "plan": "pro", "is_active": True, "subscription_status": "active", "clarifications_limit": 25,
+        "clarifications_used": 0, "usage_resets_at": "2026-11-01T00:00:00", "activated_at": None
+    }
+
+    async def get_record(key_code):
+        await asyncio.sleep(0)  # let the reservations interleave
+        return record
+
+    async def reserve():
+        try:
+            return await main.reserve_usage("TEST-QUOTA")
+        except HTTPException as e:
+            return e.status_code
+
+    async def scenario():
+        app.state.usage_counter = UsageCounter(fakeredis.FakeAsyncRedis(decode_responses=True))
+        return await asyncio.gather(*(reserve() for _ in range(50)))
+
+    monkeypatch.setattr(main, "get_license_record", get_record)
+    previous = getattr(app.state, 'usage_counter', None)
+    try:
+        outcomes = asyncio.run(scenario())
+    finally:
+        app.state.usage_counter = previous
+
+    assert outcomes.count(1) == 25
+    assert outcomes.count(429) == 25
+
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="needs TEST_DATABASE_URL (a disposable Postgres)")
+def test_concurrent_reservations_never_exceed_limit():
+    pool = ConnectionPool(os.environ["TEST_DATABASE_URL"], min_size=1, max_size=20, timeout=30)
+    previous = getattr(app.state, 'db_pool', None)
+    app.state.db_pool = pool
+    try:
+        main.init_database()
+        conn = pool.getconn()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM license_keys WHERE key_code = 'TEST-QUOTA'")
+        cur.execute("""
+            INSERT INTO license_keys (key_code, customer_email, plan, clarifications_limit, is_active)
+            VALUES ('TEST-QUOTA', 'quota@example.com', 'pro', 25, true)
+        """)
+        conn.commit()
+        pool.putconn(conn)
+
+        outcomes = []
+        barrier = threading.Barrier(50)
+
+        def worker():
+            barrier.wait()
+            try:
+                outcomes.append(main.reserve_usage_in_db("TEST-QUOTA"))
+            except HTTPException as e:
+                outcomes.append(e.status_code)
+
+        threads = [threading.Thread(target=worker) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert outcomes.count(1) == 25
+        assert outcomes.count(429) == 25
+
+        conn = pool.getconn()
+        cur = conn.cursor()
+        cur.execute("SELECT clarifications_used FROM license_keys WHERE key_code = 'TEST-QUOTA'")
+        assert cur.fetchone()['clarifications_used'] == 25
+        cur.execute("DELETE FROM license_keys WHERE key_code = 'TEST-QUOTA'")
+        conn.commit()
+        pool.putconn(conn)
+    finally:
+        app.state.db_pool = previous
+        pool.closeall()
@@ -0,0 +1,156 @@
+# test_rag.py - Tests for similar-ticket retrieval with an in-memory vector store
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import TicketInput, app, clarification_cache_key, create_claude_client
+from jira_clarifier_backend.rag import InMemoryVectorStore, SimilarTicketRetriever
+from tests.fake_anthropic import FakeAnthropicUpstream
+
+
+class BagOfWordsEmbedder:
+    """Deterministic stand-in for the sentence-transformers model"""
+
+    VOCABULARY = ["login", "password", "payment", "invoice", "dark", "mode", "search"]
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def embed(self, texts):
+        time.sleep(self.delay)
+        return [
+            [float(word in text.lower()) for word in self.VOCABULARY] + [0.01]
+            for text in texts
+        ]
+
+
+def indexed_store(embedder):
+    store = InMemoryVectorStore()
+    past = {
+        "org-a": [("Login fails with SSO", "password reset loop"), ("Invoice totals wrong", "payment rounding")],
+        "org-b": [("Login button misaligned", "css on login page")]
+    }
+    for namespace, tickets in past.items():
+        store.upsert([
+            {"id": f"{namespace}-{i}", "values": embedder.embed([f"{title} {desc}"])[0],
+             "metadata": {"title": title, "desc": desc}}
+            for i, (title, desc) in enumerate(tickets)
+        ], namespace=namespace)
+    return store
+
+
+def test_in_memory_store_ranks_by_cosine_within_namespace():
+    store = InMemoryVectorStore()
+    store.upsert([
+        {"id": "a", "values": [1, 0], "metadata": {"title": "a"}},
+        {"id": "b", "values": [0.6, 0.8], "metadata": {"title": "b"}},
+        {"id": "c", "values": [0, 1], "metadata": {"title": "c"}}
+    ], namespace="org")
+
+    matches = store.query([1, 0.1], top_k=2, namespace="org")
+    assert [m["id"] for m in matches] == ["a", "b"]
+    assert matches[0]["score"] == pytest.approx(1 / np.sqrt(1.01))
+    assert store.query([1, 0], top_k=2, namespace="other") == []
+
+
+def test_retriever_returns_org_scoped_context():
+    embedder = BagOfWordsEmbedder()
+    retriever = SimilarTicketRetriever(embedder, indexed_store(embedder), top_k=1)
+
+    similar = asyncio.run(retriever.retrieve("Users can't login after password change", "org-a"))
+    assert [ticket["title"] for ticket in similar] == ["Login fails with SSO"]
+    assert similar[0]["description"] == "password reset loop"
+
+    other_org = asyncio.run(retriever.retrieve("Users can't login after password change", "org-b"))
+    assert [ticket["title"] for ticket in other_org] == ["Login button misaligned"]
+
+
+def test_slow_retrieval_degrades_to_no_context():
+    embedder = BagOfWordsEmbedder()
+    store = indexed_store(embedder)
+    embedder.delay = 0.5
+    retriever = SimilarTicketRetriever(embedder, store, timeout=0.05)
+
+    async def timed():
+        start = time.perf_counter()
+        similar = await retriever.retrieve("login", "org-a")
+        return similar, time.perf_counter() - start
+
+    similar, elapsed = asyncio.run(timed())
+    assert similar == []
+    assert elapsed < 0.4
+
+
+def test_saturated_retriever_skips_instead_of_queueing():
+    embedder = BagOfWordsEmbedder()
+    store = indexed_store(embedder)
+    calls = []
+
+    class SlowEmbedder:
+        def embed(self, texts):
+            calls.append(texts)
+            return BagOfWordsEmbedder(delay=0.3).embed(texts)
+
+    retriever = SimilarTicketRetriever(SlowEmbedder(), store, timeout=0.05, workers=1)
+
+    async def run():
+        timed_out = await retriever.retrieve("login", "org-a")
+        skipped = await retriever.retrieve("login", "org-a")  # the first lookup still holds the only thread
+        await asyncio.sleep(0.4)
+        retriever.timeout = 1.0
+        return timed_out, skipped, await retriever.retrieve("login", "org-a")
+
+    timed_out, skipped, recovered = asyncio.run(run())
+    retriever.close()
+    assert (timed_out, skipped) == ([], [])
+    assert len(calls) == 2
+    assert recovered[0]["title"] == "Login fails with SSO"
+
+
+def test_failing_store_degrades_to_no_context():
+    class BrokenStore:
+        def query(self, vector, top_k, namespace):
+            raise ConnectionError("pinecone down")
+
+    retriever = SimilarTicketRetriever(BagOfWordsEmbedder(), BrokenStore())
+    assert asyncio.run(retriever.retrieve("login", "org-a")) == []
+
+
+def test_clarify_injects_similar_tickets_into_prompt(monkeypatch):
+    monkeypatch.setattr(main, "ENABLE_RAG", True)
+    embedder = BagOfWordsEmbedder()
+    upstream = FakeAnthropicUpstream()
+    previous = (getattr(app.state, 'claude', None), getattr(app.state, 'retriever', None))
+    app.state.claude = create_claude_client("test-key", transport=upstream.transport())
+    app.state.retriever = SimilarTicketRetriever(embedder, indexed_store(embedder))
+    try:
+        response = TestClient(app).post("/clarify", json={"title": "Login broken on Safari", "orgId": "org-a"})
+    finally:
+        app.state.claude, app.state.retriever = previous
+
+    assert response.status_code == 200
+    prompt = upstream.requests[0]["messages"][0]["content"]
+    assert "Similar past tickets for context" in prompt
+    assert "Login fails with SSO" in prompt
+
+
+def test_cache_key_is_per_org_only_with_rag(monkeypatch):
+    ticket_a = TicketInput(title="Fix login", orgId="org-a")
+    ticket_b = TicketInput(title="Fix login", orgId="org-b")
+    assert clarification_cache_key(ticket_a) == clarification_cache_key(ticket_b)
+
+    monkeypatch.setattr(main, "ENABLE_RAG", True)
+    assert clarification_cache_key(ticket_a) != clarification_cache_key(ticket_b)
+
+
+def test_app_imports_without_numpy():
+    # numpy arrives with sentence-transformers; a deploy without RAG must still start
+    script = "import sys; sys.modules['numpy'] = None; import jira_clarifier_backend.main"
+    subprocess.run([sys.executable, "-c", script], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
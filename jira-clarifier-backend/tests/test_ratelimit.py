@@ -0,0 +1,168 @@
+# test_ratelimit.py - Tests for the GCRA / token bucket rate limiter
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import app, create_claude_client
+from jira_clarifier_backend.ratelimit import RateLimiter, TokenBucketLimiter
+from tests.fake_anthropic import FakeAnthropicUpstream
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_allows_limit_then_rejects():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(window=60, clock=clock)
+
+    results = [limiter.hit([("ip:1", 5)]) for _ in range(6)]
+    assert [r.allowed for r in results] == [True] * 5 + [False]
+    assert [r.remaining for r in results[:5]] == [4, 3, 2, 1, 0]
+    assert results[-1].retry_after == pytest.approx(12)  # one token per 60/5 s
+
+    clock.now += 12
+    assert limiter.hit([("ip:1", 5)]).allowed
+
+
+def test_token_bucket_rejection_charges_no_key():
+    limiter = TokenBucketLimiter(window=60, clock=FakeClock())
+    limiter.hit([("ip:1", 1)])
+
+    rejected = limiter.hit([("key:a", 10), ("ip:1", 1)])
+    assert not rejected.allowed
+    assert rejected.limit == 1
+    assert limiter.hit([("key:a", 10)]).remaining == 9
+
+
+def test_headers_include_retry_after_only_when_rejected():
+    limiter = TokenBucketLimiter(window=60, clock=FakeClock())
+    allowed = limiter.hit([("ip:1", 1)])
+    rejected = limiter.hit([("ip:1", 1)])
+
+    assert "Retry-After" not in allowed.headers()
+    assert allowed.headers()["RateLimit-Limit"] == "1"
+    assert rejected.headers()["RateLimit-Remaining"] == "0"
+    assert rejected.headers()["Retry-After"] == "60"
+
+
+def test_redis_gcra_enforces_limit_across_limiters():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+
+    async def run():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        # Two limiters sharing Redis behave like two uvicorn workers
+        workers = [RateLimiter(redis, window=60), RateLimiter(redis, window=60)]
+        return [await workers[i % 2].hit([("key:a", 100), ("ip:1", 3)]) for i in range(4)]
+
+    results = asyncio.run(run())
+    assert [r.allowed for r in results] == [True, True, True, False]
+    assert [r.remaining for r in results[:3]] == [2, 1, 0]
+    assert results[-1].limit == 3
+    assert 0 < results[-1].retry_after <= 20
+
+
+def test_redis_gcra_charges_cost():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+
+    async def run():
+        limiter = RateLimiter(fakeredis.FakeAsyncRedis(decode_responses=True), window=60)
+        return await limiter.hit([("key:a", 10)], cost=4), await limiter.hit([("key:a", 10)], cost=7)
+
+    first, second = asyncio.run(run())
+    assert first.allowed and first.remaining == 6
+    assert not second.allowed
+
+
+def test_falls_back_to_local_buckets_when_redis_fails():
+    class BrokenRedis:
+        def register_script(self, script):
+            async def call(keys, args):
+                raise ConnectionError("redis down")
+            return call
+
+    limiter = RateLimiter(BrokenRedis(), window=60)
+    results = [asyncio.run(limiter.hit([("ip:1", 2)])) for _ in range(3)]
+    assert [r.allowed for r in results] == [True, True, False]
+
+
+def test_clarify_returns_429_with_headers(monkeypatch):
+    monkeypatch.setattr(main, "RATE_LIMIT_FREE", 2)
+    previous = (getattr(app.state, 'rate_limiter', None), getattr(app.state, 'claude', None))
+    app.state.rate_limiter = RateLimiter(None, window=60)
+    app.state.claude = create_claude_client("test-key", transport=FakeAnthropicUpstream().transport())
+    try:
+        client = TestClient(app)
+        responses = [client.post("/clarify", json={"title": "Fix login bug"}) for _ in range(3)]
+    finally:
+        app.state.rate_limiter, app.state.claude = previous
+
+    assert responses[0].status_code == 200
+    assert responses[0].headers["RateLimit-Remaining"] == "1"
+    assert responses[2].status_code == 429
+    assert responses[2].headers["RateLimit-Limit"] == "2"
+    assert int(responses[2].headers["Retry-After"]) > 0
+
+
+def test_redis_gcra_handles_effectively_unlimited_plans():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+
+    async def run():
+        limiter = RateLimiter(fakeredis.FakeAsyncRedis(decode_responses=True), window=60)
+        limiter.fallback = None  # fail loudly instead of silently falling back
+        return [await limiter.hit([("key:pro", 10**9)]) for _ in range(3)]
+
+    assert all(r.allowed for r in asyncio.run(run()))
+
+
+def limited_client(monkeypatch, records):
+    async def get_record(key_code):
+        return records.get(key_code)
+
+    monkeypatch.setattr(main, "RATE_LIMIT_FREE", 2)
+    monkeypatch.setattr(main, "get_license_record", get_record)
+    monkeypatch.setattr(main, "reserve_usage", lambda key, count=1: asyncio.sleep(0, result=0))
+    monkeypatch.setattr(main, "ENABLE_ANALYTICS", False)
+    previous = (getattr(app.state, 'rate_limiter', None), getattr(app.state, 'claude', None))
+    app.state.rate_limiter = RateLimiter(None, window=60)
+    app.state.claude = create_claude_client("test-key", transport=FakeAnthropicUpstream().transport())
+    return TestClient(app), previous
+
+
+def test_unknown_org_ids_get_free_limits(monkeypatch):
+    client, previous = limited_client(monkeypatch, {"JIRA-REAL": {"is_active": True}, "JIRA-OFF": {"is_active": False}})
+    try:
+        made_up = [client.post("/clarify", json={"title": f"t{i}", "orgId": f"made-up-{i}"}) for i in range(3)]
+        inactive = client.post("/clarify", json={"title": "t", "orgId": "JIRA-OFF"})
+        paid = client.post("/clarify", json={"title": "t", "orgId": "JIRA-REAL"})
+    finally:
+        app.state.rate_limiter, app.state.claude = previous
+
+    assert [r.status_code for r in made_up] == [200, 200, 429]
+    assert inactive.status_code == 429  # same free IP bucket
+    assert paid.status_code == 200
+    assert paid.headers["RateLimit-Limit"] == str(main.RATE_LIMIT_IP)
+
+
+def test_free_users_are_keyed_by_forwarded_client_ip(monkeypatch):
+    client, previous = limited_client(monkeypatch, {})
+    try:
+        statuses = [
+            client.post("/clarify", json={"title": f"t{i}"}, headers={"X-Forwarded-For": f"6.6.6.6, 10.0.0.{i}"}).status_code
+            for i in range(3)
+        ]
+        spoofed = client.post("/clarify", json={"title": "t"}, headers={"X-Forwarded-For": "6.6.6.6, 10.0.0.0"})
+    finally:
+        app.state.rate_limiter, app.state.claude = previous
+
+    assert statuses == [200, 200, 200]  # three clients behind the proxy, not one shared bucket
+    assert spoofed.status_code == 200  # 10.0.0.0 has used 1 of 2; the forged left entry is ignored
@@ -0,0 +1,216 @@
+# test_resilience.py - Tests for deadlines, retries, hedging and the circuit breaker around Claude calls
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import app
+from jira_clarifier_backend.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    LatencyTracker,
+    ResilientCaller,
+    deadline_scope
+)
+from tests.fake_anthropic import DEFAULT_CLARIFICATION
+
+TICKET = {"title": "Fix login bug"}
+
+
+def fast_caller(**options) -> ResilientCaller:
+    breaker = CircuitBreaker(
+        failure_threshold=options.pop("failure_threshold", 5),
+        reset_timeout=options.pop("reset_timeout", 30.0)
+    )
+    return ResilientCaller(breaker, **{"base_delay": 0.001, "max_delay": 0.005, **options})
+
+
+def use_caller(monkeypatch, caller: ResilientCaller):
+    monkeypatch.setattr(main, "claude_caller", caller)
+    monkeypatch.setattr(main, "claude_breaker", caller.breaker)
+
+
+@pytest.fixture
+def upstream(upstream, monkeypatch):
+    use_caller(monkeypatch, fast_caller())
+    return upstream
+
+
+def test_overloaded_upstream_is_retried(upstream):
+    upstream.failures = [529, 503]
+
+    response = TestClient(app).post("/clarify", json=TICKET)
+
+    assert response.status_code == 200
+    assert response.json()["edgeCases"] == DEFAULT_CLARIFICATION["edgeCases"]
+    assert len(upstream.requests) == 3
+    stats = TestClient(app).get("/health").json()["upstream"]
+    assert (stats["calls"], stats["retries"], stats["circuit"]) == (1, 2, "closed")
+
+
+def test_client_errors_are_not_retried(upstream):
+    upstream.failures = [400]
+
+    response = TestClient(app).post("/clarify", json=TICKET)
+
+    assert response.status_code == 500
+    assert len(upstream.requests) == 1
+    assert main.claude_breaker.failures == 0
+
+
+def test_retries_stop_after_max_retries(upstream, monkeypatch):
+    use_caller(monkeypatch, fast_caller(max_retries=2))
+    upstream.failures = [529] * 5
+
+    assert TestClient(app).post("/clarify", json=TICKET).status_code == 500
+    assert len(upstream.requests) == 3
+
+
+def test_slow_upstream_hits_the_deadline(upstream, monkeypatch):
+    monkeypatch.setattr(main, "CLAUDE_DEADLINE", 0.1)
+    upstream.delay = 1.0
+
+    start = time.monotonic()
+    response = TestClient(app).post("/clarify", json=TICKET)
+
+    assert response.status_code == 504
+    assert time.monotonic() - start < 0.8
+    assert main.claude_caller.stats["deadlineExceeded"] == 1
+
+
+def test_deadline_covers_retries():
+    caller = fast_caller(base_delay=0.05, max_delay=0.05, max_retries=10, failure_threshold=100)
+    attempts = []
+
+    async def always_overloaded():
+        attempts.append(time.monotonic())
+        await asyncio.sleep(0.02)
+        raise make_status_error(529)
+
+    async def run():
+        with deadline_scope(0.2):
+            await caller.call(always_overloaded)
+
+    with pytest.raises((DeadlineExceeded, main.anthropic.APIStatusError)):
+        asyncio.run(run())
+    assert attempts[-1] - attempts[0] < 0.2
+    assert len(attempts) < 10
+
+
+def test_open_circuit_fails_fast_with_retry_after(upstream, monkeypatch):
+    use_caller(monkeypatch, fast_caller(failure_threshold=2, max_retries=1))
+    upstream.failures = [529] * 2
+
+    assert TestClient(app).post("/clarify", json=TICKET).status_code == 500
+    assert main.claude_breaker.state == "open"
+
+    response = TestClient(app).post("/clarify", json=TICKET)
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert len(upstream.requests) == 2  # the second ticket never reached the upstream
+    assert main.claude_caller.stats["circuitRejected"] == 1
+
+
+def test_half_open_probe_closes_the_circuit(upstream, monkeypatch):
+    use_caller(monkeypatch, fast_caller(failure_threshold=1, max_retries=0, reset_timeout=0.05))
+    upstream.failures = [529]
+
+    assert TestClient(app).post("/clarify", json=TICKET).status_code == 500
+    assert main.claude_breaker.state == "open"
+
+    time.sleep(0.06)
+    assert main.claude_breaker.state == "half_open"
+    assert TestClient(app).post("/clarify", json=TICKET).status_code == 200
+    assert main.claude_breaker.state == "closed"
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.01)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.02)
+
+    breaker.check()  # the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.check()  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_rejected_probe_closes_the_circuit(upstream, monkeypatch):
+    use_caller(monkeypatch, fast_caller(failure_threshold=1, max_retries=0, reset_timeout=0.05))
+    upstream.failures = [529, 400]
+
+    assert TestClient(app).post("/clarify", json=TICKET).status_code == 500
+    assert main.claude_breaker.state == "open"
+
+    time.sleep(0.06)
+    assert TestClient(app).post("/clarify", json=TICKET).status_code == 500  # the 400 probe
+    assert main.claude_breaker.state == "closed"
+    assert TestClient(app).post("/clarify", json=TICKET).status_code == 200
+
+
+def test_cancelled_probe_releases_the_breaker():
+    caller = fast_caller(failure_threshold=1, max_retries=0, reset_timeout=0.01)
+    caller.breaker.record_failure()
+    time.sleep(0.02)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def run():
+        probe = asyncio.ensure_future(caller.call(hang))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(run())
+    assert caller.breaker.state == "half_open"
+    caller.breaker.check()  # the next call may probe again
+
+
+def test_hedge_beats_a_slow_first_request(upstream, monkeypatch):
+    caller = fast_caller(hedge=True, hedge_min_delay=0.05)
+    use_caller(monkeypatch, caller)
+    for _ in range(20):
+        caller.latencies.setdefault(main.CLAUDE_MODEL, LatencyTracker()).record(0.01)
+    upstream.delay_for = lambda body: 1.0 if len(upstream.requests) == 1 else 0.0
+
+    start = time.monotonic()
+    response = TestClient(app).post("/clarify", json=TICKET)
+
+    assert response.status_code == 200
+    assert time.monotonic() - start < 0.8
+    assert len(upstream.requests) == 2
+    assert (caller.stats["hedges"], caller.stats["hedgeWins"]) == (1, 1)
+    assert upstream.in_flight == 0  # the slow request was cancelled
+
+
+def test_no_hedge_without_latency_history():
+    caller = fast_caller(hedge=True, hedge_min_delay=0.0)
+    calls = []
+
+    async def request():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    assert asyncio.run(caller.call(request)) == "ok"
+    assert len(calls) == 1
+    assert caller.stats["hedges"] == 0
+
+
+def test_backoff_honours_retry_after():
+    caller = fast_caller()
+    assert caller.backoff(0, make_status_error(429, {"retry-after": "2"})) == 2.0
+    assert caller.backoff(3, make_status_error(529)) <= 0.005
+
+
+def make_status_error(status: int, headers: dict = None):
+    request = main.httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    response = main.httpx.Response(status, headers=headers or {}, request=request)
+    return main.anthropic.APIStatusError("injected", response=response, body=None)
@@ -0,0 +1,126 @@
+# test_routing.py - Tests for cheap-first model routing and escalation
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import FAST_TIER, STRONG_TIER, TicketInput, app, stream_clarification
+from jira_clarifier_backend.routing import RoutingStats, clarification_confidence, ticket_complexity
+from tests.test_streaming import parse_sse
+
+GOOD = {
+    "acceptanceCriteria": [
+        "Given a registered user, When they submit valid credentials, Then they land on the dashboard",
+        "Given a wrong password, When they submit the form, Then an error message is shown",
+        "Given a locked account, When they try to log in, Then they are told how to unlock it"
+    ],
+    "edgeCases": ["Session cookie blocked by the browser", "Password with unicode characters", "Login during a deploy"],
+    "successMetrics": ["Login success rate above 99.5%", "Login support tickets halve within a month", "P95 login under 2s"],
+    "testScenarios": ["Log in with valid credentials on all browsers", "Submit a wrong password twice", "Unlock a locked account"]
+}
+WEAK = {
+    "acceptanceCriteria": ["Login works"],
+    "edgeCases": ["Errors"],
+    "successMetrics": ["Users happy"],
+    "testScenarios": ["Test login"]
+}
+SIMPLE = {"title": "Fix typo on login page", "issueType": "Bug", "priority": "Low"}
+COMPLEX = {
+    "title": "Single sign-on for enterprise orgs",
+    "description": "Support SAML and OIDC.\nMap groups to roles.\nAudit every login.",
+    "issueType": "Epic",
+    "priority": "High"
+}
+
+
+@pytest.fixture
+def upstream_options(monkeypatch):
+    monkeypatch.setattr(main, "ENABLE_MODEL_ROUTING", True)
+    monkeypatch.setattr(main, "routing_stats", RoutingStats())
+    return {"clarification": GOOD, "models": {
+        FAST_TIER.model: {"clarification": GOOD, "delay": 0.0, "usage": {"input_tokens": 1500, "output_tokens": 150}},
+        STRONG_TIER.model: {"delay": 0.02, "usage": {"input_tokens": 1500, "output_tokens": 400}}
+    }}
+
+
+def test_complexity_uses_length_structure_type_and_priority():
+    assert ticket_complexity("Fix typo", "", "Bug", "Low") == (0, [])
+    score, reasons = ticket_complexity(COMPLEX["title"], COMPLEX["description"], "Epic", "High")
+    assert score == 3
+    assert reasons == ["3 lines", "type Epic", "priority High"]
+    assert ticket_complexity("Rewrite billing", "word " * 150, "Task", "Medium")[0] == 2
+
+
+def test_confidence_rewards_coverage_and_given_when_then():
+    assert clarification_confidence(GOOD) == pytest.approx(1.0)
+    assert clarification_confidence(WEAK) < main.ROUTING_CONFIDENCE_THRESHOLD
+
+
+def test_simple_ticket_is_answered_by_the_fast_model(upstream):
+    response = TestClient(app).post("/clarify", json=SIMPLE)
+
+    assert response.status_code == 200
+    assert response.json()["edgeCases"] == GOOD["edgeCases"]
+    assert [request["model"] for request in upstream.requests] == [FAST_TIER.model]
+    assert upstream.requests[0]["max_tokens"] == FAST_TIER.max_tokens
+
+    stats = TestClient(app).get("/health").json()["routing"]
+    assert stats["routed"] == {"fast": 1}
+    assert stats["models"][FAST_TIER.model]["outputTokens"] == 150
+
+
+def test_complex_ticket_goes_straight_to_sonnet(upstream):
+    response = TestClient(app).post("/clarify", json=COMPLEX)
+
+    assert response.status_code == 200
+    assert [request["model"] for request in upstream.requests] == [STRONG_TIER.model]
+    assert main.routing_stats.snapshot()["routed"] == {"strong": 1}
+
+
+def test_low_confidence_answer_escalates(upstream):
+    upstream.models[FAST_TIER.model]["clarification"] = WEAK
+
+    response = TestClient(app).post("/clarify", json=SIMPLE)
+
+    assert response.status_code == 200
+    assert response.json()["acceptanceCriteria"] == GOOD["acceptanceCriteria"]
+    assert [request["model"] for request in upstream.requests] == [FAST_TIER.model, STRONG_TIER.model]
+
+    stats = main.routing_stats.snapshot()
+    assert stats["escalations"] == 1
+    assert stats["models"][STRONG_TIER.model]["calls"] == 1
+    assert stats["models"][STRONG_TIER.model]["avgLatencyMs"] >= 20
+
+
+def test_invalid_fast_output_escalates_instead_of_reasking(upstream):
+    upstream.models[FAST_TIER.model]["clarification"] = {**GOOD, "testScenarios": "n/a"}
+
+    response = TestClient(app).post("/clarify", json=SIMPLE)
+
+    assert response.status_code == 200
+    assert response.json()["testScenarios"] == GOOD["testScenarios"]
+    assert [request["tool_choice"]["name"] for request in upstream.requests] == ["record_clarification"] * 2
+
+
+def test_stream_signals_escalation_before_sonnet_items(upstream):
+    upstream.models[FAST_TIER.model]["clarification"] = WEAK
+
+    async def run():
+        return "".join([event async for event in stream_clarification(TicketInput(**SIMPLE), "key")])
+
+    events = parse_sse(asyncio.run(run()))
+    names = [name for name, _ in events]
+    escalated_at = names.index("escalated")
+
+    assert names[:escalated_at] == ["item"] * 4  # the weak fast-model items
+    assert events[escalated_at][1]["model"] == STRONG_TIER.model
+    assert names[escalated_at + 1:] == ["item"] * 12 + ["done"]
+    assert events[-1][1]["successMetrics"] == GOOD["successMetrics"]
+
+
+def test_routing_disabled_always_uses_sonnet(upstream, monkeypatch):
+    monkeypatch.setattr(main, "ENABLE_MODEL_ROUTING", False)
+
+    assert TestClient(app).post("/clarify", json=SIMPLE).status_code == 200
+    assert [request["model"] for request in upstream.requests] == [STRONG_TIER.model]
@@ -0,0 +1,149 @@
+# test_singleflight.py - Tests for coalescing identical in-flight clarifications
+import asyncio
+
+import httpx
+import pytest
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import app
+from jira_clarifier_backend.singleflight import SingleFlight
+
+TICKET = {"title": "Fix login bug", "description": "Users can't log in", "orgId": "JIRA-1"}
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    ledger = {"reserved": 0, "refunded": 0, "stored": 0}
+
+    async def reserve(key, count=1):
+        ledger["reserved"] += count
+        return count
+
+    async def refund(key, count):
+        ledger["refunded"] += count
+
+    def store(results):
+        ledger["stored"] += len(results)
+
+    monkeypatch.setattr(main, "reserve_usage", reserve)
+    monkeypatch.setattr(main, "refund_usage", refund)
+    monkeypatch.setattr(main, "store_tickets", store)
+    return ledger
+
+
+@pytest.fixture
+def analytics():
+    return True
+
+
+@pytest.fixture
+def upstream_options(monkeypatch):
+    monkeypatch.setattr(app.state, "single_flight", SingleFlight(), raising=False)
+    return {"delay": 0.2}
+
+
+async def post_all(tickets):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await asyncio.gather(*[client.post("/clarify", json=ticket) for ticket in tickets])
+
+
+def test_identical_requests_share_one_claude_call(upstream, ledger):
+    responses = asyncio.run(post_all([TICKET] * 5 + [{**TICKET, "title": "Fix logout bug"}]))
+
+    assert all(response.status_code == 200 for response in responses)
+    assert len({response.text for response in responses[:5]}) == 1
+    assert len(upstream.requests) == 2
+    assert sum(response.headers.get("X-Coalesced") == "true" for response in responses) == 4
+
+    # Every caller is charged; only the caller that ran the clarification stores it
+    assert ledger["reserved"] == 6
+    assert ledger["stored"] == 2
+
+    stats = app.state.single_flight.snapshot()
+    assert (stats["requests"], stats["leaders"], stats["coalesced"], stats["inFlight"]) == (6, 2, 4, 0)
+    assert stats["coalescingRate"] == pytest.approx(4 / 6, abs=1e-4)
+
+
+def test_failure_is_shared_and_every_caller_refunded(upstream, ledger):
+    upstream.failures = [400]
+
+    responses = asyncio.run(post_all([TICKET] * 3))
+
+    assert [response.status_code for response in responses] == [500] * 3
+    assert len(upstream.requests) == 1
+    assert ledger["refunded"] == 3
+
+
+def test_disconnecting_caller_does_not_cancel_the_shared_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    async def run():
+        first = asyncio.create_task(flight.do("k", work))
+        second = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == ({"ok": True}, True)
+    assert len(calls) == 1
+
+
+def test_workers_coordinate_through_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return {"edgeCases": ["x"]}
+
+    async def run():
+        workers = [
+            SingleFlight(fakeredis.FakeAsyncRedis(server=server, decode_responses=True), poll_interval=0.01)
+            for _ in range(3)
+        ]
+        results = await asyncio.gather(*[worker.do("k", work) for worker in workers])
+        lock = await workers[0].redis.get("singleflight:lock:k")
+        return workers, results, lock
+
+    workers, results, lock = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(value == {"edgeCases": ["x"]} for value, _ in results)
+    assert sorted(shared for _, shared in results) == [False, True, True]
+    assert sum(worker.stats["coalescedRemote"] for worker in workers) == 2
+    assert lock is None  # released by the leader
+
+
+def test_waiting_worker_takes_over_when_the_leader_fails():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream down")
+
+    async def working():
+        return {"ok": True}
+
+    async def run():
+        leader, follower = (
+            SingleFlight(fakeredis.FakeAsyncRedis(server=server, decode_responses=True), poll_interval=0.01)
+            for _ in range(2)
+        )
+        failed = asyncio.create_task(leader.do("k", failing))
+        await asyncio.sleep(0.01)
+        value = await follower.do("k", working)
+        with pytest.raises(RuntimeError):
+            await failed
+        return value
+
+    assert asyncio.run(run()) == ({"ok": True}, False)
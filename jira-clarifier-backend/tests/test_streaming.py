@@ -0,0 +1,190 @@
+# test_streaming.py - Tests for the /clarify/stream SSE endpoint
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from fastapi import Request
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import TicketInput, app, stream_clarification
+from jira_clarifier_backend.streaming import IncrementalSectionParser
+from tests.fake_anthropic import DEFAULT_CLARIFICATION
+
+
+TICKET = {
+    "title": "Add dark mode",
+    "description": "We need dark mode for the app",
+    "issueType": "Story",
+    "priority": "Medium"
+}
+
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_parser_emits_items_as_they_close():
+    parser = IncrementalSectionParser()
+    text = '```json\n{"acceptanceCriteria": ["a \\"quoted\\" one", "b"], "edgeCases": ["c, with {braces}"]}\n```'
+
+    emitted = []
+    for i, char in enumerate(text):
+        for item in parser.feed(char):
+            emitted.append((i, item))
+
+    assert [item for _, item in emitted] == [
+        ("acceptanceCriteria", 'a "quoted" one'),
+        ("acceptanceCriteria", "b"),
+        ("edgeCases", "c, with {braces}")
+    ]
+    # First item is emitted right at its closing quote, long before the document ends
+    assert emitted[0][0] == text.index('one"') + 3
+    assert parser.done
+
+
+def test_parser_ignores_unknown_keys_and_nested_values():
+    parser = IncrementalSectionParser()
+    items = parser.feed(
+        '{"notes": ["skip"], "confidence": "high", '
+        '"testScenarios": [{"name": "nested"}, "kept\\u00e9"], "edgeCases": []}'
+    )
+    assert items == [("testScenarios", "kepté")]
+
+
+def test_parser_matches_full_parse_for_any_chunking():
+    text = json.dumps(DEFAULT_CLARIFICATION, indent=2)
+    expected = [(section, item) for section, values in DEFAULT_CLARIFICATION.items() for item in values]
+
+    for size in (1, 3, 7, len(text)):
+        parser = IncrementalSectionParser()
+        items = []
+        for i in range(0, len(text), size):
+            items.extend(parser.feed(text[i:i + size]))
+        assert items == expected
+
+
+@pytest.fixture
+def upstream_options():
+    return {"chunk_size": 8, "chunk_delay": 0.01}
+
+
+def test_stream_delivers_items_before_completion(upstream):
+    async def run():
+        start = time.monotonic()
+        arrivals = []
+        async for event in stream_clarification(TicketInput(**TICKET), "key"):
+            arrivals.append((time.monotonic() - start, event))
+        return arrivals, time.monotonic() - start
+
+    arrivals, total = asyncio.run(run())
+    events = parse_sse("".join(event for _, event in arrivals))
+
+    items = [(data["section"], data["item"]) for name, data in events if name == "item"]
+    assert items == [(section, item) for section, values in DEFAULT_CLARIFICATION.items() for item in values]
+
+    name, done = events[-1]
+    assert name == "done"
+    assert done["acceptanceCriteria"] == DEFAULT_CLARIFICATION["acceptanceCriteria"]
+    assert done["processingTime"] is not None
+
+    # The first item goes out while the rest of the completion is still streaming
+    first_item_at = arrivals[0][0]
+    assert first_item_at < total / 2
+    assert upstream.requests[0]["stream"] is True
+
+
+def test_stream_endpoint_returns_sse(upstream):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/clarify/stream", json=TICKET)
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["X-Cache"] == "MISS"
+
+    events = parse_sse(response.text)
+    assert [name for name, _ in events].count("item") == 4
+    assert events[-1][0] == "done"
+
+
+def test_stream_reports_parse_errors(upstream):
+    upstream.text = lambda: "not json at all"
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/clarify/stream", json=TICKET)
+            return response.text
+
+    events = parse_sse(asyncio.run(run()))
+    assert events == [("error", {"error": "Failed to parse AI response"})]
+
+
+@pytest.fixture
+def usage(monkeypatch):
+    usage = {"reserved": [], "refunds": []}
+
+    async def reserve(key, count=1):
+        usage["reserved"].append((key, count))
+        return count
+
+    async def refund(key, count):
+        usage["refunds"].append((key, count))
+
+    monkeypatch.setattr(main, "reserve_usage", reserve)
+    monkeypatch.setattr(main, "refund_usage", refund)
+    return usage
+
+
+def test_disconnect_mid_stream_refunds_usage(upstream, usage):
+    async def run():
+        stream = stream_clarification(TicketInput(**TICKET), "key", "JIRA-1")
+        await stream.__anext__()  # first item, then the client goes away
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert usage["reserved"] == [("JIRA-1", 1)]
+    assert usage["refunds"] == [("JIRA-1", 1)]
+
+
+def test_disconnect_before_the_body_starts_reserves_nothing(upstream, usage):
+    request = Request({"type": "http", "method": "POST", "headers": [], "client": ("10.0.0.1", 1234)})
+    ticket = TicketInput(**TICKET, orgId="JIRA-1")
+
+    # The response is returned but its body never iterated, as when the client goes away first
+    response = asyncio.run(main.clarify_ticket_stream(ticket, request))
+
+    assert response.headers["X-Cache"] == "MISS"
+    assert usage["reserved"] == []
+
+
+def test_completed_stream_keeps_usage(upstream, usage, monkeypatch):
+    monkeypatch.setattr(main, "ENABLE_ANALYTICS", False)
+
+    async def run():
+        return [event async for event in stream_clarification(TicketInput(**TICKET), "key", "JIRA-1")]
+
+    assert parse_sse("".join(asyncio.run(run())))[-1][0] == "done"
+    assert usage["reserved"] == [("JIRA-1", 1)]
+    assert usage["refunds"] == []
+
+
+def test_over_limit_stream_reports_an_error_without_calling_claude(upstream, monkeypatch):
+    async def over_limit(key, count=1):
+        raise main.HTTPException(status_code=429, detail="Monthly limit reached")
+
+    monkeypatch.setattr(main, "reserve_usage", over_limit)
+
+    async def run():
+        return [event async for event in stream_clarification(TicketInput(**TICKET), "key", "JIRA-1")]
+
+    assert parse_sse("".join(asyncio.run(run()))) == [("error", {"error": "Monthly limit reached", "status": 429})]
+    assert upstream.requests == []
@@ -0,0 +1,179 @@
+# test_stripe_cache.py - Tests for the read-through Stripe object cache against a fake Stripe API
+import pytest
+import stripe
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.cache import TTLCache
+from jira_clarifier_backend.main import app, retrieve_stripe_object
+from jira_clarifier_backend.stripe_cache import StripeObjectCache, key_livemode
+from tests.fake_stripe import FakeStripeAPI
+
+NOW = 1_700_000_000
+
+
+class InMemoryStripeObjectStore:
+    """Same interface as stripe_cache.StripeObjectStore, kept in a dict"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def load(self, object_id, min_version):
+        row = self.rows.get(object_id)
+        return row if row and row[0] >= min_version else None
+
+    def save(self, obj, version):
+        row = self.rows.get(obj['id'])
+        if row and row[0] > version:
+            return False
+        self.rows[obj['id']] = (version, obj)
+        return True
+
+
+class BrokenStore:
+    def load(self, object_id, min_version):
+        raise ConnectionError("database down")
+
+    def save(self, obj, version):
+        raise ConnectionError("database down")
+
+
+class Clock:
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def subscription(status="active", plan="pro", livemode=False):
+    return {
+        "id": "sub_1", "object": "subscription", "customer": "cus_1", "created": NOW - 86400,
+        "livemode": livemode, "status": status, "metadata": {"planId": plan}
+    }
+
+
+def invoice():
+    return {
+        "id": "in_1", "object": "invoice", "customer": "cus_1", "created": NOW - 60,
+        "livemode": False, "billing_reason": "subscription_create", "subscription": "sub_1"
+    }
+
+
+def event(obj, created, event_type="customer.subscription.updated"):
+    return {"id": f"evt_{created}", "object": "event", "type": event_type, "created": created,
+            "livemode": obj["livemode"], "data": {"object": obj}}
+
+
+def make_cache(store=None, clock=None, max_age=86400):
+    return StripeObjectCache(store or InMemoryStripeObjectStore(), TTLCache(), livemode=False,
+                             max_age=max_age, clock=clock or Clock())
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = FakeStripeAPI([subscription(), invoice()])
+    monkeypatch.setattr(stripe, "default_http_client", api)
+    monkeypatch.setattr(stripe, "api_key", "sk_test_fake")
+    return api
+
+
+@pytest.fixture
+def cache(api):
+    cache = make_cache(clock=Clock(10**10))  # fixtures are far in the past
+    previous = getattr(app.state, 'stripe_objects', None)
+    app.state.stripe_objects = cache
+    yield cache
+    app.state.stripe_objects = previous
+
+
+def test_repeat_lookups_skip_the_api(api, cache):
+    first = retrieve_stripe_object("subscription", "sub_1")
+    second = retrieve_stripe_object("subscription", "sub_1")
+
+    assert first == second
+    assert first["metadata"]["planId"] == "pro"
+    assert api.requests == [("GET", "/v1/subscriptions/sub_1")]
+    assert cache.snapshot()["hitRate"] == 0.5
+    assert main.stripe_cache_lookups.value("subscription", "memory") >= 1
+
+
+def test_webhook_payloads_fill_the_cache(api, cache):
+    cache.put_event(event(subscription(plan="team"), 10**10 - 5))
+    cache.put_event(event(invoice(), 10**10 - 5, "invoice.finalized"))
+
+    assert retrieve_stripe_object("subscription", "sub_1")["metadata"]["planId"] == "team"
+    assert retrieve_stripe_object("invoice", "in_1")["billing_reason"] == "subscription_create"
+    assert api.requests == []
+
+
+def test_without_a_cache_every_lookup_goes_to_the_api(api):
+    previous = getattr(app.state, 'stripe_objects', None)
+    app.state.stripe_objects = None
+    try:
+        retrieve_stripe_object("invoice", "in_1")
+        retrieve_stripe_object("invoice", "in_1")
+    finally:
+        app.state.stripe_objects = previous
+
+    assert len(api.requests) == 2
+
+
+def test_other_workers_read_the_shared_table():
+    store = InMemoryStripeObjectStore()
+    fetched = []
+    first, second = make_cache(store), make_cache(store)
+
+    first.get("sub_1", lambda: fetched.append(1) or subscription())
+    obj, tier = second.get("sub_1", lambda: fetched.append(1) or subscription())
+
+    assert (obj["id"], tier) == ("sub_1", "database")
+    assert fetched == [1]
+    assert second.get("sub_1", subscription)[1] == "memory"
+
+
+def test_older_snapshots_never_replace_newer_ones():
+    store = InMemoryStripeObjectStore()
+    cache = make_cache(store)
+
+    assert cache.put_event(event(subscription("past_due"), NOW - 10))
+    assert not cache.put_event(event(subscription("active"), NOW - 20))  # delivered late
+    assert cache.get("sub_1", subscription)[0]["status"] == "past_due"
+
+    # Another worker with nothing in memory is refused by the table
+    assert not make_cache(store).put_event(event(subscription("active"), NOW - 20))
+    assert store.rows["sub_1"][1]["status"] == "past_due"
+    assert cache.snapshot()["skipped"] == 1
+
+
+def test_objects_from_the_other_mode_are_ignored():
+    cache = make_cache()
+
+    assert not cache.put_event(event(subscription(livemode=True), NOW))
+    assert not cache.put_event(event({"id": "cus_1", "object": "customer", "livemode": False}, NOW, "customer.updated"))
+    assert cache.snapshot()["stored"] == 0
+
+
+def test_old_snapshots_are_refetched():
+    clock = Clock()
+    cache = make_cache(clock=clock, max_age=3600)
+    cache.put_event(event(subscription("active"), NOW - 10))
+
+    clock.now += 7200
+    obj, tier = cache.get("sub_1", lambda: subscription("canceled"))
+
+    assert (obj["status"], tier) == ("canceled", None)
+    assert cache.get("sub_1", subscription)[0]["status"] == "canceled"
+
+
+def test_store_errors_fall_back_to_the_api():
+    cache = make_cache(BrokenStore())
+
+    assert not cache.put_event(event(subscription(), NOW))
+    obj, tier = cache.get("sub_1", subscription)
+    assert (obj["id"], tier) == ("sub_1", None)
+
+
+def test_mode_comes_from_the_api_key():
+    assert key_livemode("sk_live_abc") is True
+    assert key_livemode("rk_test_abc") is False
+    assert key_livemode(None) is None
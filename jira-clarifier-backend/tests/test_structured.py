@@ -0,0 +1,134 @@
+# test_structured.py - Tests for tool-use output, JSON repair and per-section re-asks
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import TicketInput, app, stream_clarification
+from jira_clarifier_backend.structured import (
+    ClarificationParseError,
+    ParseMetrics,
+    parse_section_items,
+    parse_sections,
+    repair_json
+)
+from tests.fake_anthropic import DEFAULT_CLARIFICATION
+from tests.test_streaming import parse_sse
+
+
+@pytest.fixture
+def upstream(upstream, monkeypatch):
+    monkeypatch.setattr(main, "parse_metrics", ParseMetrics())
+    return upstream
+
+
+@pytest.mark.parametrize("truncated, expected", [
+    ('{"a": ["x", "y"], "b": ["z", "unfinish', {"a": ["x", "y"], "b": ["z"]}),
+    ('{"a": ["x"], "b": "half a val', {"a": ["x"]}),
+    ('{"a": ["x"], "bk', {"a": ["x"]}),
+    ('{"a": ["x"], "b":', {"a": ["x"]}),
+    ('{"a": ["x"], "b": tru', {"a": ["x"]}),
+    ('{"a": ["x \\" still', {"a": []}),
+    ('{"a": ["x"]}\n```', {"a": ["x"]})
+])
+def test_repair_closes_truncated_json(truncated, expected):
+    assert json.loads(repair_json(truncated)) == expected
+
+
+def test_parse_accepts_fences_prose_and_stringified_lists():
+    content = 'Here you go:\n```json\n' + json.dumps({
+        **DEFAULT_CLARIFICATION,
+        "edgeCases": json.dumps(["Expired session", "  "])
+    }) + '\n```'
+
+    parsed = parse_sections(content)
+    assert parsed.sections["edgeCases"] == ["Expired session"]
+    assert (parsed.malformed, parsed.repaired) == ([], False)
+
+
+def test_parse_repairs_truncation_and_reports_missing_sections():
+    full = json.dumps(DEFAULT_CLARIFICATION)
+    cut = full[:full.index('"successMetrics"') + 25]
+
+    parsed = parse_sections(cut)
+    assert parsed.repaired
+    assert parsed.sections["acceptanceCriteria"] == DEFAULT_CLARIFICATION["acceptanceCriteria"]
+    assert parsed.malformed == ["successMetrics", "testScenarios"]
+
+
+def test_parse_raises_only_when_nothing_is_usable():
+    with pytest.raises(ClarificationParseError):
+        parse_sections("I can't help with that")
+    with pytest.raises(ClarificationParseError):
+        parse_sections('{"acceptanceCriteria": [], "edgeCases": 3}')
+    with pytest.raises(ClarificationParseError):
+        parse_section_items('{"section": "edgeCases", "items": []}', "edgeCases")
+
+
+def test_clarify_forces_the_tool_schema(upstream):
+    response = TestClient(app).post("/clarify", json={"title": "Fix login bug"})
+
+    assert response.status_code == 200
+    assert response.json()["edgeCases"] == DEFAULT_CLARIFICATION["edgeCases"]
+    assert upstream.requests[0]["tool_choice"] == {"type": "tool", "name": "record_clarification"}
+    assert main.parse_metrics.snapshot()["toolUse"] == 1
+
+
+def test_one_malformed_section_is_reasked_cheaply(upstream):
+    upstream.clarification = {**DEFAULT_CLARIFICATION, "edgeCases": "see above"}
+    upstream.section_answers = {"edgeCases": ["Session expires mid-login"]}
+
+    response = TestClient(app).post("/clarify", json={"title": "Fix login bug"})
+
+    assert response.status_code == 200
+    assert response.json()["edgeCases"] == ["Session expires mid-login"]
+    assert response.json()["testScenarios"] == DEFAULT_CLARIFICATION["testScenarios"]
+
+    reask = upstream.requests[1]
+    assert reask["tool_choice"] == {"type": "tool", "name": "record_section"}
+    assert reask["max_tokens"] == main.CLARIFY_SECTION_MAX_TOKENS
+    assert reask["system"] == upstream.requests[0]["system"]  # same cached prefix
+    assert reask["tools"] == upstream.requests[0]["tools"]
+
+    metrics = main.parse_metrics.snapshot()
+    assert (metrics["malformedSections"], metrics["sectionReasks"], metrics["parseFailures"]) == (1, 1, 0)
+
+
+def test_failed_reask_leaves_the_section_empty(upstream):
+    upstream.clarification = {**DEFAULT_CLARIFICATION, "successMetrics": []}
+    upstream.section_answers = {"successMetrics": []}
+
+    response = TestClient(app).post("/clarify", json={"title": "Fix login bug"})
+
+    assert response.status_code == 200
+    assert response.json()["successMetrics"] == []
+    assert main.parse_metrics.snapshot()["sectionReaskFailures"] == 1
+
+
+def test_unparseable_response_counts_as_a_failure(upstream):
+    upstream.text = lambda: "not json"
+
+    response = TestClient(app).post("/clarify", json={"title": "Fix login bug"})
+
+    assert response.status_code == 500
+    metrics = TestClient(app).get("/health").json()["clarificationParsing"]
+    assert (metrics["textFallback"], metrics["parseFailures"], metrics["parseFailureRate"]) == (1, 1, 1.0)
+
+
+def test_truncated_stream_is_repaired_and_missing_sections_streamed(upstream):
+    full = json.dumps(DEFAULT_CLARIFICATION)
+    upstream.text = lambda: full[:full.index('"successMetrics"')]
+
+    async def run():
+        return "".join([event async for event in stream_clarification(TicketInput(title="Fix login bug"), "key")])
+
+    events = parse_sse(asyncio.run(run()))
+    items = [(data["section"], data["item"]) for name, data in events if name == "item"]
+    assert items == [(section, item) for section, values in DEFAULT_CLARIFICATION.items() for item in values]
+
+    name, done = events[-1]
+    assert name == "done"
+    assert done["testScenarios"] == DEFAULT_CLARIFICATION["testScenarios"]
+    assert main.parse_metrics.snapshot()["repaired"] == 1
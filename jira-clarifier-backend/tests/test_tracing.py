@@ -0,0 +1,125 @@
+# test_tracing.py - Tests for OpenTelemetry spans and trace ID propagation
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import app
+from jira_clarifier_backend.tracing import current_trace_id, instrument_redis, sql_attributes, trace_span
+
+pytest.importorskip("opentelemetry.trace")
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+TRACEPARENT = f"00-{TRACE_ID}-00f067aa0ba902b7-01"
+
+
+class Exported:
+    """Spans finished under a real SDK provider"""
+
+    def __init__(self, provider, exporter):
+        self.provider = provider
+        self.exporter = exporter
+
+    def clear(self):
+        self.provider.force_flush()
+        self.exporter.clear()
+
+    def spans(self):
+        self.provider.force_flush()
+        return self.exporter.get_finished_spans()
+
+
+@pytest.fixture(scope="module")
+def exported():
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    from jira_clarifier_backend.tracing import setup_tracing
+
+    # The global provider can only be installed once per process
+    exporter = InMemorySpanExporter()
+    return Exported(setup_tracing("test", "http://localhost:4318", 1.0, exporter=exporter), exporter)
+
+
+def test_caller_trace_id_is_returned_in_a_header(upstream):
+    response = TestClient(app).post("/clarify", json={"title": "Fix login bug"}, headers={"traceparent": TRACEPARENT})
+
+    assert response.status_code == 200
+    assert response.headers["X-Trace-Id"] == TRACE_ID
+
+
+def test_no_trace_id_outside_a_trace():
+    assert current_trace_id() is None
+    with trace_span("work") as span:
+        assert span is not None
+
+
+def test_sql_statements_keep_placeholders_but_not_inlined_values():
+    attributes = sql_attributes("SELECT *\n  FROM license_keys WHERE key_code = %s")
+    assert attributes["db.operation"] == "SELECT"
+    assert attributes["db.statement"] == "SELECT * FROM license_keys WHERE key_code = %s"
+
+    composed = sql_attributes(b"INSERT INTO tickets VALUES ('JIRA-1','secret title')")
+    assert composed["db.operation"] == "INSERT"
+    assert "db.statement" not in composed
+
+
+def test_instrumented_redis_still_runs_commands():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        client = instrument_redis(fakeredis.FakeAsyncRedis(decode_responses=True))
+        await client.set("a", "1")
+        async with client.pipeline() as pipe:
+            pipe.incr("a")
+            pipe.get("a")
+            return await pipe.execute()
+
+    assert asyncio.run(run()) == [2, "2"]
+
+    client = instrument_redis(fakeredis.FakeRedis(decode_responses=True))
+    client.set("b", "1")
+    with client.pipeline() as pipe:
+        pipe.delete("b")
+        assert pipe.execute() == [1]
+
+
+def test_clarify_spans_nest_under_the_route_span(upstream, exported):
+    exported.clear()
+    response = TestClient(app).post("/clarify", json={"title": "Fix login bug"})
+
+    spans = {span.name: span for span in exported.spans()}
+    server, claude = spans["POST /clarify"], spans["anthropic messages.create"]
+    assert response.headers["X-Trace-Id"] == format(server.context.trace_id, "032x")
+    assert claude.parent.span_id == server.context.span_id
+    assert claude.attributes["gen_ai.request.model"] == main.CLAUDE_MODEL
+    assert claude.attributes["gen_ai.usage.output_tokens"] > 0
+    assert server.attributes["http.route"] == "/clarify"
+
+
+def test_retries_get_one_span_each(upstream, exported, monkeypatch):
+    monkeypatch.setattr(main.claude_caller, "base_delay", 0)
+    exported.clear()
+    upstream.failures = [529]
+
+    assert TestClient(app).post("/clarify", json={"title": "Fix logout bug"}).status_code == 200
+    attempts = [span for span in exported.spans() if span.name == "anthropic messages.create"]
+    assert [span.status.is_ok for span in attempts] == [False, True]
+
+
+def test_redis_spans_record_command_names_not_keys(exported):
+    fakeredis = pytest.importorskip("fakeredis")
+    exported.clear()
+
+    client = instrument_redis(fakeredis.FakeRedis(decode_responses=True))
+    client.set("license:SECRET-KEY", "1")
+    with client.pipeline() as pipe:
+        pipe.get("license:SECRET-KEY")
+        pipe.delete("license:SECRET-KEY")
+        pipe.execute()
+
+    spans = exported.spans()
+    assert [span.name for span in spans] == ["redis SET", "redis PIPELINE"]
+    assert spans[1].attributes["db.redis.commands"] == "GET,DEL"
+    assert not any("SECRET" in str(value) for span in spans for value in span.attributes.values())
@@ -0,0 +1,157 @@
+# test_usage.py - Tests for the write-behind usage counter
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import app
+from jira_clarifier_backend.usage import UsageCounter
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+EPOCH = "2026-11-01T00:00:00"
+
+
+class FakeLedger:
+    """One license_keys row + usage_flushes, applied the way apply_usage_deltas does"""
+
+    def __init__(self, used=0, epoch=EPOCH, key_code="JIRA-1"):
+        self.key_code = key_code
+        self.used = used
+        self.epoch = epoch
+        self.flush_ids = set()
+        self.calls = 0
+        self.fail_next = False
+
+    async def apply(self, flush_id, deltas):
+        self.calls += 1
+        if self.fail_next:
+            self.fail_next = False
+            raise ConnectionError("database down")
+        if flush_id in self.flush_ids:
+            return
+        self.flush_ids.add(flush_id)
+        for key_code, epoch, delta in deltas:
+            if key_code == self.key_code and epoch == self.epoch:
+                self.used = max(self.used + delta, 0)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def new_counter():
+    return UsageCounter(fakeredis.FakeAsyncRedis(decode_responses=True))
+
+
+def test_reserve_enforces_limit_without_touching_the_database():
+    async def scenario():
+        counter = new_counter()
+        return [await counter.reserve("JIRA-1", 1, 3, 1, EPOCH) for _ in range(3)]
+
+    assert run(scenario()) == [(True, 2), (True, 3), (False, 3)]
+
+
+def test_flush_applies_batched_deltas_once():
+    async def scenario():
+        counter, ledger = new_counter(), FakeLedger(used=10)
+        for _ in range(4):
+            await counter.reserve("JIRA-1", 1, 100, ledger.used, EPOCH)
+        await counter.refund("JIRA-1", 1)
+        await counter.reserve("JIRA-2", 5, 100, 0, EPOCH)
+
+        flushed = await counter.flush(ledger.apply)
+        again = await counter.flush(ledger.apply)
+        return flushed, again, ledger, await counter.snapshot("JIRA-1")
+
+    flushed, again, ledger, snapshot = run(scenario())
+    assert (flushed, again) == (2, 0)
+    assert ledger.used == 13
+    assert ledger.calls == 1
+    assert snapshot == (13, EPOCH)
+
+
+def test_failed_flush_is_retried_with_the_same_id():
+    async def scenario():
+        counter, ledger = new_counter(), FakeLedger()
+        await counter.reserve("JIRA-1", 2, 100, 0, EPOCH)
+
+        ledger.fail_next = True
+        with pytest.raises(ConnectionError):
+            await counter.flush(ledger.apply)
+
+        # New usage arriving meanwhile waits for the following flush
+        await counter.reserve("JIRA-1", 1, 100, 0, EPOCH)
+        await counter.flush(ledger.apply)
+        after_retry = ledger.used
+        await counter.flush(ledger.apply)
+        return after_retry, ledger
+
+    after_retry, ledger = run(scenario())
+    assert after_retry == 2
+    assert ledger.used == 3
+    assert len(ledger.flush_ids) == 2
+
+
+def test_reset_in_database_starts_a_new_period():
+    async def scenario():
+        counter, ledger = new_counter(), FakeLedger()
+        await counter.reserve("JIRA-1", 3, 3, 0, EPOCH)
+
+        # Renewal resets usage before the old deltas were flushed
+        ledger.used, ledger.epoch = 0, "2026-12-01T00:00:00"
+        allowed = await counter.reserve("JIRA-1", 1, 3, 0, ledger.epoch)
+        await counter.flush(ledger.apply)
+        return allowed, ledger.used
+
+    allowed, used = run(scenario())
+    assert allowed == (True, 1)
+    assert used == 1  # the old period's deltas were dropped
+
+
+def test_idle_counters_expire_after_flush():
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        counter, ledger = UsageCounter(redis, idle_ttl=60), FakeLedger()
+        await counter.reserve("JIRA-1", 1, 10, 0, EPOCH)
+        before = await redis.ttl("usage:key:JIRA-1")
+        await counter.flush(ledger.apply)
+        return before, await redis.ttl("usage:key:JIRA-1")
+
+    before, after = run(scenario())
+    assert before == -1  # never expires while deltas are pending
+    assert 0 < after <= 60
+
+
+def test_reserve_usage_and_merged_reads_use_the_counter(monkeypatch):
+    key_row = main.license_record({
+        "plan": "team",
+        "is_active": True,
+        "subscription_status": "active",
+        "clarifications_used": 1,
+        "clarifications_limit": 2,
+        "usage_resets_at": datetime(2026, 11, 1),
+        "activated_at": None
+    })
+    monkeypatch.setattr(main, "fetch_license_record", lambda key: key_row)
+    monkeypatch.setattr(main, "reserve_usage_in_db", lambda *args: pytest.fail("hit the database"))
+
+    async def scenario():
+        reserved = await main.reserve_usage("JIRA-1")
+        with pytest.raises(HTTPException) as rejected:
+            await main.reserve_usage("JIRA-1")
+        return reserved, rejected.value.status_code, await main.counted_usage("JIRA-1")
+
+    previous = getattr(app.state, 'usage_counter', None)
+    app.state.usage_counter = new_counter()
+    try:
+        reserved, status, counted = run(scenario())
+    finally:
+        app.state.usage_counter = previous
+
+    assert (reserved, status) == (1, 429)
+    assert main.merged_usage(key_row, counted) == 2
+    assert main.merged_usage({**key_row, "usage_resets_at": None}, counted) == 1
@@ -0,0 +1,405 @@
+# test_webhooks.py - Tests for queued, per-customer ordered Stripe webhook processing
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.db import ConnectionPool
+from jira_clarifier_backend.main import app
+from jira_clarifier_backend.webhooks import StripeEventStore, StripeEventWorker, ordering_key
+
+SECRET = "whsec_test"
+SUBSCRIPTION = "sub_test_replay"
+needs_postgres = pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="needs TEST_DATABASE_URL (a disposable Postgres)")
+
+
+class InMemoryStripeEventStore:
+    """Same interface as webhooks.StripeEventStore, kept in a dict"""
+
+    def __init__(self):
+        self.events = {}
+        self._ids = itertools.count(1)
+
+    def record(self, event):
+        if event['id'] in self.events:
+            return False
+        self.events[event['id']] = {
+            "id": next(self._ids), "event_id": event['id'], "event_type": event['type'],
+            "ordering_key": ordering_key(event), "payload": event, "created": event.get('created') or 0,
+            "status": "pending", "attempts": 0, "next_attempt_at": 0.0, "error": None, "result": None
+        }
+        return True
+
+    def record_many(self, events):
+        return sum(self.record(event) for event in events)
+
+    def claim(self, limit=10, stale_after_minutes=10):
+        open_events = sorted(
+            (row for row in self.events.values() if row['status'] in ('pending', 'processing')),
+            key=lambda row: (row['created'], row['id'])
+        )
+        claimed, seen = [], set()
+        for row in open_events:
+            if row['ordering_key'] in seen:
+                continue
+            seen.add(row['ordering_key'])
+            if row['status'] == 'pending' and row['next_attempt_at'] <= time.time() and len(claimed) < limit:
+                row.update(status="processing", attempts=row['attempts'] + 1)
+                claimed.append({key: row[key] for key in ("id", "event_id", "event_type", "ordering_key", "payload", "attempts")})
+        return claimed
+
+    def _row(self, row_id):
+        return next(row for row in self.events.values() if row['id'] == row_id)
+
+    def complete(self, row_id, result):
+        self._row(row_id).update(status="processed", result=result, error=None)
+
+    def fail(self, row_id, error, retry_in):
+        self._row(row_id).update(
+            status="failed" if retry_in is None else "pending",
+            error=error,
+            next_attempt_at=time.time() + (retry_in or 0)
+        )
+
+    def requeue(self, event_ids=None, since=None, event_types=None, include_processed=False):
+        statuses = ('failed', 'processed') if include_processed else ('failed',)
+        requeued = 0
+        for row in self.events.values():
+            if row['status'] in statuses and (not event_ids or row['event_id'] in event_ids) \
+                    and (not event_types or row['event_type'] in event_types):
+                row.update(status="pending", attempts=0, error=None, next_attempt_at=0.0)
+                requeued += 1
+        return requeued
+
+    def counts(self):
+        counts = {}
+        for row in self.events.values():
+            counts[row['status']] = counts.get(row['status'], 0) + 1
+        return counts
+
+
+def stripe_event(event_id, event_type="customer.subscription.updated", customer="cus_A", created=1700000000):
+    return {
+        "id": event_id,
+        "object": "event",
+        "type": event_type,
+        "created": created,
+        "livemode": False,
+        "data": {"object": {"id": f"sub_{customer}", "object": "subscription", "customer": customer, "status": "active"}}
+    }
+
+
+def signed(event):
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return payload, {"stripe-signature": f"t={timestamp},v1={signature}", "content-type": "application/json"}
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    monkeypatch.setattr(main, "ENABLE_PAYMENTS", True)
+    monkeypatch.setattr(main, "STRIPE_WEBHOOK_SECRET", SECRET)
+    store = InMemoryStripeEventStore()
+    worker = StripeEventWorker(store, lambda event: {"status": "success"})
+    previous = (getattr(app.state, 'stripe_events', None), getattr(app.state, 'stripe_worker', None))
+    app.state.stripe_events, app.state.stripe_worker = store, worker
+    yield store, worker
+    app.state.stripe_events, app.state.stripe_worker = previous
+
+
+def test_webhook_is_stored_and_acknowledged_before_processing(queue):
+    store, worker = queue
+    payload, headers = signed(stripe_event("evt_1"))
+
+    response = TestClient(app).post("/webhook/stripe", content=payload, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "queued", "eventId": "evt_1"}
+    assert store.events["evt_1"]['status'] == "pending"
+    assert worker._wake.is_set()
+
+
+def test_redelivered_event_is_stored_once(queue):
+    store, _ = queue
+    payload, headers = signed(stripe_event("evt_1"))
+    client = TestClient(app)
+
+    client.post("/webhook/stripe", content=payload, headers=headers)
+    response = client.post("/webhook/stripe", content=payload, headers=headers)
+
+    assert response.json() == {"status": "duplicate", "eventId": "evt_1"}
+    assert len(store.events) == 1
+
+
+def test_bad_signature_is_rejected(queue):
+    store, _ = queue
+    payload, headers = signed(stripe_event("evt_1"))
+    headers["stripe-signature"] = headers["stripe-signature"].replace("v1=", "v1=00")
+
+    assert TestClient(app).post("/webhook/stripe", content=payload, headers=headers).status_code == 400
+    assert not store.events
+
+
+def test_webhook_is_not_acknowledged_without_a_queue(queue):
+    app.state.stripe_events = None
+    payload, headers = signed(stripe_event("evt_1"))
+
+    assert TestClient(app).post("/webhook/stripe", content=payload, headers=headers).status_code == 503
+
+
+def test_events_apply_in_order_per_customer_and_in_parallel_across_customers():
+    store = InMemoryStripeEventStore()
+    applied = []
+    worker = StripeEventWorker(store, lambda event: applied.append(event['id']))
+    # Stripe delivers out of order; creation time decides
+    store.record(stripe_event("evt_a2", customer="cus_A", created=2))
+    store.record(stripe_event("evt_a1", customer="cus_A", created=1))
+    store.record(stripe_event("evt_b1", customer="cus_B", created=3))
+
+    assert asyncio.run(worker.run_once()) == 2
+    assert sorted(applied) == ["evt_a1", "evt_b1"]
+    assert asyncio.run(worker.run_once()) == 1
+    assert applied[-1] == "evt_a2"
+    assert asyncio.run(worker.run_once()) == 0
+    assert store.counts() == {"processed": 3}
+
+
+def test_failing_event_holds_back_its_customer_until_it_gives_up():
+    store = InMemoryStripeEventStore()
+    applied = []
+
+    def process(event):
+        if event['id'] == "evt_a1":
+            raise RuntimeError("Database unavailable")
+        applied.append(event['id'])
+
+    worker = StripeEventWorker(store, process, max_attempts=2, retry_delay=0)
+    store.record(stripe_event("evt_a1", customer="cus_A", created=1))
+    store.record(stripe_event("evt_a2", customer="cus_A", created=2))
+
+    asyncio.run(worker.run_once())
+    assert store.events["evt_a1"]['status'] == "pending"
+    assert applied == []
+
+    asyncio.run(worker.run_once())
+    assert store.events["evt_a1"]['status'] == "failed"
+    assert store.events["evt_a1"]['error'] == "Database unavailable"
+
+    asyncio.run(worker.run_once())
+    assert applied == ["evt_a2"]
+    assert worker.snapshot() == {"processed": 1, "retried": 1, "failed": 1}
+
+
+def test_retries_back_off():
+    store = InMemoryStripeEventStore()
+    worker = StripeEventWorker(store, lambda event: 1 / 0, retry_delay=60)
+    store.record(stripe_event("evt_1"))
+
+    asyncio.run(worker.run_once())
+    assert store.events["evt_1"]['next_attempt_at'] > time.time() + 55
+    assert asyncio.run(worker.run_once()) == 0
+
+
+def test_replay_requeues_failed_and_optionally_processed_events():
+    store = InMemoryStripeEventStore()
+    attempts = []
+
+    def process(event):
+        attempts.append(event['id'])
+        if event["id"] == "evt_1" and attempts.count("evt_1") == 1:
+            raise RuntimeError("Stripe API unavailable")
+
+    worker = StripeEventWorker(store, process, max_attempts=1)
+    store.record(stripe_event("evt_1", customer="cus_A"))
+    store.record(stripe_event("evt_2", customer="cus_B", event_type="invoice.payment_failed"))
+
+    asyncio.run(worker.run_once())
+    assert store.counts() == {"failed": 1, "processed": 1}
+
+    assert store.requeue() == 1
+    assert store.requeue(event_types=["invoice.payment_failed"], include_processed=True) == 1
+    asyncio.run(worker.run_once())
+    assert store.counts() == {"processed": 2}
+    assert sorted(attempts) == ["evt_1", "evt_1", "evt_2", "evt_2"]
+
+
+def test_ordering_key_is_the_customer():
+    assert ordering_key(stripe_event("evt_1", customer="cus_A")) == "cus_A"
+    customer_event = {"id": "evt_2", "type": "customer.updated", "data": {"object": {"id": "cus_B", "object": "customer"}}}
+    assert ordering_key(customer_event) == "cus_B"
+    assert ordering_key({"id": "evt_3", "type": "payment_intent.created", "data": {"object": {"customer": None}}}) == "evt_3"
+
+
+def test_processing_raises_so_the_worker_retries(monkeypatch):
+    monkeypatch.setattr(main, "get_db_connection", lambda: None)
+    with pytest.raises(RuntimeError):
+        main.process_stripe_event(stripe_event("evt_1"))
+
+
+def charge_event(event_id, billing_reason, created=1700000000):
+    return {
+        "id": event_id,
+        "type": "charge.succeeded",
+        "created": created,
+        "data": {"object": {
+            "customer": "cus_test_replay",
+            "payment_intent": f"pi_{event_id}",
+            "billing_details": {"email": "replay@example.com"},
+            "metadata": {"subscription_id": SUBSCRIPTION, "invoice_id": f"in_{billing_reason}"}
+        }}
+    }
+
+
+@pytest.fixture
+def billing(monkeypatch):
+    """Stripe lookups, emails and cache invalidations process_stripe_event would make"""
+    calls = {"emails": [], "invalidated": []}
+
+    def retrieve(object_type, object_id):
+        if object_type == "subscription":
+            return {"id": object_id, "metadata": {"planId": "pro"}}
+        return {"id": object_id, "billing_reason": object_id.removeprefix("in_")}
+
+    monkeypatch.setattr(main, "retrieve_stripe_object", retrieve)
+    monkeypatch.setattr(main, "send_license_key_email", lambda email, key, *args: calls["emails"].append(key))
+    monkeypatch.setattr(main, "invalidate_license_keys", lambda keys: calls["invalidated"].extend(keys))
+    return calls
+
+
+class ScriptedConnection:
+    """Connection whose cursor answers fetchone() from `rows` in order"""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.statements = []
+        self.commits = self.rollbacks = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.statements.append(" ".join(sql.split()))
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_first_payment_that_loses_the_insert_returns_the_existing_key(billing, monkeypatch):
+    conn = ScriptedConnection([None, {"key_code": "JIRA-EXIS-TING-KEY1"}])
+    monkeypatch.setattr(main, "get_db_connection", lambda: conn)
+    monkeypatch.setattr(main, "release_db_connection", lambda conn: None)
+
+    result = main.process_stripe_event(charge_event("evt_1", "subscription_create"))
+
+    assert result == {"status": "success", "keyCode": "JIRA-EXIS-TING-KEY1"}
+    assert "ON CONFLICT (stripe_subscription_id)" in conn.statements[0]
+    assert conn.commits == 0
+    assert billing["emails"] == []
+
+
+@pytest.fixture
+def database():
+    pool = ConnectionPool(os.environ["TEST_DATABASE_URL"], min_size=1, max_size=5, timeout=30)
+    previous = getattr(app.state, 'db_pool', None)
+    app.state.db_pool = pool
+
+    def run(sql, params=()):
+        conn = pool.getconn()
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            rows = cur.fetchall() if cur.description else None
+            conn.commit()
+            return rows
+        finally:
+            pool.putconn(conn)
+
+    def clean():
+        run("DELETE FROM license_keys WHERE stripe_subscription_id = %s", (SUBSCRIPTION,))
+        run("DELETE FROM stripe_events WHERE ordering_key = 'cus_test_claim'")
+
+    try:
+        main.init_database()
+        clean()
+        yield run
+        clean()
+    finally:
+        app.state.db_pool = previous
+        pool.closeall()
+
+
+@needs_postgres
+def test_replayed_first_payment_issues_one_key(database, billing):
+    first = main.process_stripe_event(charge_event("evt_1", "subscription_create"))
+    replay = main.process_stripe_event(charge_event("evt_1", "subscription_create"))
+
+    assert replay["keyCode"] == first["keyCode"]
+    rows = database("SELECT key_code FROM license_keys WHERE stripe_subscription_id = %s", (SUBSCRIPTION,))
+    assert [row["key_code"] for row in rows] == [first["keyCode"]]
+    assert billing["emails"] == [first["keyCode"]]
+
+
+@needs_postgres
+def test_replayed_renewal_resets_usage_once(database, billing):
+    key = main.process_stripe_event(charge_event("evt_1", "subscription_create", created=int(time.time())))["keyCode"]
+    renewal = charge_event("evt_2", "subscription_cycle", created=int(time.time()) + 31 * 86400)  # next month
+
+    database("UPDATE license_keys SET clarifications_used = 40 WHERE key_code = %s", (key,))
+    main.process_stripe_event(renewal)
+    database("UPDATE license_keys SET clarifications_used = 7 WHERE key_code = %s", (key,))
+    main.process_stripe_event(renewal)
+
+    rows = database("SELECT clarifications_used FROM license_keys WHERE key_code = %s", (key,))
+    assert rows[0]["clarifications_used"] == 7
+    assert billing["invalidated"] == [key]
+
+
+@needs_postgres
+def test_older_subscription_update_is_skipped(database, billing):
+    key = main.process_stripe_event(charge_event("evt_1", "subscription_create", created=1700000000))["keyCode"]
+
+    def update(event_id, status, created):
+        event = stripe_event(event_id, created=created)
+        event["data"]["object"].update(id=SUBSCRIPTION, status=status)
+        main.process_stripe_event(event)
+
+    update("evt_2", "past_due", created=1700000200)
+    update("evt_3", "active", created=1700000100)  # delivered late
+
+    rows = database("SELECT subscription_status, is_active FROM license_keys WHERE key_code = %s", (key,))
+    assert (rows[0]["subscription_status"], rows[0]["is_active"]) == ("past_due", False)
+
+
+@needs_postgres
+def test_claim_takes_one_event_per_customer_and_reclaims_stale_ones(database):
+    store = StripeEventStore(app.state.db_pool)
+    for event_id, created in (("evt_claim_2", 2), ("evt_claim_1", 1)):
+        store.record(stripe_event(event_id, customer="cus_test_claim", created=created))
+
+    def claim():
+        return [row for row in store.claim(limit=100) if row["ordering_key"] == "cus_test_claim"]
+
+    first = claim()
+    assert [row["event_id"] for row in first] == ["evt_claim_1"]
+    assert claim() == []  # evt_claim_2 waits for evt_claim_1
+
+    database("UPDATE stripe_events SET updated_at = NOW() - INTERVAL '11 minutes' WHERE event_id = 'evt_claim_1'")
+    reclaimed = claim()
+    assert [(row["event_id"], row["attempts"]) for row in reclaimed] == [("evt_claim_1", 2)]
+
+    store.complete(reclaimed[0]["id"], {"status": "success"})
+    assert [row["event_id"] for row in claim()] == ["evt_claim_2"]
@@ -0,0 +1,211 @@
+# test_writer.py - Tests for the background batched analytics/feedback writer
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from jira_clarifier_backend import main
+from jira_clarifier_backend.main import app, create_claude_client
+from jira_clarifier_backend.writer import BatchWriter
+from tests.fake_anthropic import FakeAnthropicUpstream
+
+
+class Sink:
+    """write() target that records batches and can be told to fail or stall"""
+
+    def __init__(self, delay: float = 0.0):
+        self.batches = []
+        self.fail = False
+        self.delay = delay
+
+    def __call__(self, kind, rows):
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("database down")
+        self.batches.append((kind, [list(row) for row in rows]))
+
+
+async def settle(writer: BatchWriter, timeout: float = 1.0):
+    """Wait until the drain task has taken and written everything queued"""
+    deadline = time.monotonic() + timeout
+    while (writer.queue.qsize() or writer._pending) and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+
+
+def test_flushes_every_batch_size_rows_grouped_by_kind():
+    sink = Sink()
+
+    async def run():
+        writer = BatchWriter(sink, batch_size=3, flush_interval=5)
+        for i in range(3):
+            await writer.put("tickets" if i % 2 == 0 else "feedback", [i])
+        task = asyncio.create_task(writer.run_forever())
+        await settle(writer)
+        task.cancel()
+
+    asyncio.run(run())
+    assert sink.batches == [("tickets", [[0], [2]]), ("feedback", [[1]])]
+
+
+def test_flushes_a_partial_batch_after_the_interval():
+    sink = Sink()
+
+    async def run():
+        writer = BatchWriter(sink, batch_size=100, flush_interval=0.05)
+        task = asyncio.create_task(writer.run_forever())
+        start = time.monotonic()
+        await writer.put("tickets", ["a"])
+        while not sink.batches:
+            await asyncio.sleep(0.005)
+        task.cancel()
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(run())
+    assert sink.batches == [("tickets", [["a"]])]
+    assert 0.04 <= elapsed < 0.5
+
+
+def test_full_queue_applies_backpressure():
+    sink = Sink(delay=0.1)
+
+    async def run():
+        writer = BatchWriter(sink, max_queue=1, batch_size=1, flush_interval=0)
+        task = asyncio.create_task(writer.run_forever())
+        start = time.monotonic()
+        for i in range(4):
+            await writer.put("tickets", [i])
+        elapsed = time.monotonic() - start
+        await writer.close(task)
+        return elapsed
+
+    assert asyncio.run(run()) >= 0.1
+    assert [rows for _, rows in sink.batches] == [[[0]], [[1]], [[2]], [[3]]]
+
+
+def test_full_queue_spills_to_disk_and_replays(tmp_path):
+    sink = Sink()
+    spill = tmp_path / "spill.jsonl"
+
+    async def run():
+        writer = BatchWriter(sink, max_queue=1, batch_size=10, flush_interval=0.01, overflow="spill", spill_path=str(spill))
+        await writer.put("tickets", [1])
+        await writer.put("tickets", [2])  # queue full: spilled
+        await writer.put("feedback", [3])
+        assert [json.loads(line)["values"] for line in spill.read_text().splitlines()] == [[2], [3]]
+
+        task = asyncio.create_task(writer.run_forever())
+        await settle(writer)
+        task.cancel()
+        return writer.snapshot()
+
+    stats = asyncio.run(run())
+    rows = sorted(row for _, batch in sink.batches for row in batch)
+    assert rows == [[1], [2], [3]]
+    assert (stats["spilled"], stats["replayed"], stats["written"]) == (2, 2, 3)
+    assert not spill.exists()
+
+
+def test_failed_batches_are_spilled_and_retried(tmp_path):
+    sink = Sink()
+    sink.fail = True
+    spill = tmp_path / "spill.jsonl"
+
+    async def run():
+        writer = BatchWriter(sink, flush_interval=0.01, overflow="spill", spill_path=str(spill))
+        task = asyncio.create_task(writer.run_forever())
+        await writer.put("tickets", ["lost?"])
+        await settle(writer)
+        assert spill.exists()
+
+        sink.fail = False
+        await writer.put("tickets", ["next"])
+        await settle(writer)
+        task.cancel()
+
+    asyncio.run(run())
+    assert [row for _, batch in sink.batches for row in batch] == [["next"], ["lost?"]]
+
+
+def test_failed_batches_are_dropped_without_a_spill_file():
+    sink = Sink()
+    sink.fail = True
+
+    async def run():
+        writer = BatchWriter(sink, flush_interval=0.01)
+        await writer.put("tickets", [1])
+        await writer.close()
+        return writer.snapshot()
+
+    assert asyncio.run(run())["dropped"] == 1
+
+
+def test_close_flushes_everything_still_queued():
+    sink = Sink()
+
+    async def run():
+        writer = BatchWriter(sink, batch_size=2, flush_interval=60)
+        task = asyncio.create_task(writer.run_forever())
+        for i in range(5):
+            await writer.put("tickets", [i])
+        await asyncio.sleep(0.01)  # the drain task holds a partial batch
+        await writer.close(task)
+
+    asyncio.run(run())
+    assert sorted(row for _, batch in sink.batches for row in batch) == [[0], [1], [2], [3], [4]]
+
+
+def test_spill_mode_needs_a_path():
+    with pytest.raises(ValueError):
+        BatchWriter(Sink(), overflow="spill")
+    with pytest.raises(ValueError):
+        BatchWriter(Sink(), overflow="drop")
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    monkeypatch.setattr(main, "ENABLE_ANALYTICS", True)
+    upstream = FakeAnthropicUpstream()
+    previous = tuple(getattr(app.state, name, None) for name in ("claude", "clarification_cache", "batch_writer"))
+    app.state.claude = create_claude_client("test-key", transport=upstream.transport())
+    app.state.clarification_cache = None
+    app.state.batch_writer = BatchWriter(Sink())
+    yield app.state.batch_writer
+    app.state.claude, app.state.clarification_cache, app.state.batch_writer = previous
+
+
+def test_clarify_and_feedback_only_enqueue(queued, monkeypatch):
+    monkeypatch.setattr(main, "store_tickets", lambda results: pytest.fail("wrote inline"))
+    monkeypatch.setattr(main, "store_feedback", lambda feedback: pytest.fail("wrote inline"))
+    client = TestClient(app)
+
+    assert client.post("/clarify", json={"title": "Fix login bug", "orgId": "JIRA-1"}).status_code == 200
+    assert client.post("/feedback", json={
+        "ticketData": {"title": "Fix login bug"},
+        "clarifiedOutput": {"edgeCases": ["x"]},
+        "feedbackType": "upvote",
+        "orgId": "JIRA-1"
+    }).status_code == 200
+
+    kinds = [queued.queue.get_nowait() for _ in range(queued.queue.qsize())]
+    assert [kind for kind, _ in kinds] == ["tickets", "feedback"]
+    ticket_values, feedback_values = kinds[0][1], kinds[1][1]
+    assert ticket_values[:2] == ["JIRA-1", "Fix login bug"]
+    assert feedback_values == ["JIRA-1", "Fix login bug", None, {"edgeCases": ["x"]}, "upvote", None]
+    json.dumps(kinds)  # rows must survive a spill
+
+
+def test_analytics_sink_routes_rows_by_kind(monkeypatch):
+    inserted = []
+    monkeypatch.setattr(main, "insert_ticket_rows", lambda rows: inserted.append(("tickets", rows)))
+    monkeypatch.setattr(main, "insert_feedback_rows", lambda rows: inserted.append(("feedback", rows)))
+    monkeypatch.setattr(main, "index_tickets", lambda tickets: inserted.append(("index", [t.title for t in tickets])))
+
+    main.write_analytics_rows("tickets", [["JIRA-1", "A", "", "Bug", "Low", {}, 1.0]])
+    main.write_analytics_rows("feedback", [["JIRA-1", "A", None, {}, "upvote", None]])
+
+    assert [kind for kind, _ in inserted] == ["index", "tickets", "feedback"]
+    with pytest.raises(ValueError):
+        main.write_analytics_rows("other", [])